@@ -1,5 +1,6 @@
 import { Controller, Post, Param, Body, Logger } from "@nestjs/common";
-import { FingerprintService } from "./fingerprint.service";
+import { decimalFingerprint } from "./fingerprint.encoding";
+import { FingerprintService, NearDuplicateCandidate } from "./fingerprint.service";
 
 @Controller("ingestion")
 export class FingerprintController {
@@ -9,7 +10,9 @@ export class FingerprintController {
 
   /**
    * Receives fingerprint from the Demucs worker and checks for duplicates.
-   * Called by the worker BEFORE stem separation begins.
+   * Called by the worker BEFORE stem separation begins. The fingerprint
+   * arrives packed (`fingerprintPacked`) or, from older workers, as the
+   * decimal `fingerprint`; it is stored in the decimal form either way.
    */
   @Post("fingerprint/:releaseId/:trackId")
   async receiveFingerprint(
@@ -17,9 +20,12 @@ export class FingerprintController {
     @Param("trackId") trackId: string,
     @Body()
     body: {
-      fingerprint: string;
+      fingerprint?: string;
+      fingerprintPacked?: string;
+      fingerprintEncoding?: string;
       fingerprintHash: string;
       duration: number;
+      nearDuplicates?: NearDuplicateCandidate[];
     },
   ) {
     this.logger.log(
@@ -30,9 +36,10 @@ export class FingerprintController {
     const result = await this.fingerprintService.registerFingerprint({
       trackId,
       releaseId,
-      fingerprint: body.fingerprint,
+      fingerprint: decimalFingerprint(body),
       fingerprintHash: body.fingerprintHash,
       duration: body.duration,
+      nearDuplicates: body.nearDuplicates,
     });
 
     return result;
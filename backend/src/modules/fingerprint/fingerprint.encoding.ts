@@ -0,0 +1,36 @@
+import { BadRequestException } from "@nestjs/common";
+
+/** The Demucs worker's compact fingerprint form: base64 of little-endian uint32 values. */
+export const PACKED_FINGERPRINT_ENCODING = "chromaprint-u32le-base64";
+
+export interface FingerprintPayload {
+  fingerprint?: string;
+  fingerprintPacked?: string;
+  fingerprintEncoding?: string;
+}
+
+/**
+ * The comma-joined decimal fingerprint that is stored and hashed.
+ * Current workers send only `fingerprintPacked`; older ones (and workers
+ * with FINGERPRINT_SEND_DECIMAL=1) send the decimal `fingerprint` as-is.
+ */
+export function decimalFingerprint(payload: FingerprintPayload): string {
+  if (payload.fingerprintPacked) {
+    if (payload.fingerprintEncoding !== PACKED_FINGERPRINT_ENCODING) {
+      throw new BadRequestException(`Unsupported fingerprintEncoding: ${payload.fingerprintEncoding}`);
+    }
+    const bytes = Buffer.from(payload.fingerprintPacked, "base64");
+    if (bytes.length === 0 || bytes.length % 4 !== 0) {
+      throw new BadRequestException("fingerprintPacked must hold whole uint32 values");
+    }
+    const values: number[] = [];
+    for (let offset = 0; offset < bytes.length; offset += 4) {
+      values.push(bytes.readUInt32LE(offset));
+    }
+    return values.join(",");
+  }
+  if (typeof payload.fingerprint === "string" && payload.fingerprint.length > 0) {
+    return payload.fingerprint;
+  }
+  throw new BadRequestException("fingerprint or fingerprintPacked is required");
+}
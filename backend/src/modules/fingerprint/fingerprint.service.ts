@@ -2,6 +2,17 @@ import { Injectable, Logger } from "@nestjs/common";
 import { prisma } from "../../db/prisma";
 import { UploadRightsRoutingService } from "../rights/upload-rights-routing.service";
 
+/**
+ * A near-duplicate found by the worker's local fingerprint index
+ * (re-encodes, trimmed copies). Only `trackId` is used to decide.
+ */
+export interface NearDuplicateCandidate {
+  trackId: string;
+  similarity?: number;
+  offsetSeconds?: number;
+  overlapSeconds?: number;
+}
+
 @Injectable()
 export class FingerprintService {
   private readonly logger = new Logger(FingerprintService.name);
@@ -12,6 +23,9 @@ export class FingerprintService {
 
   /**
    * Register a fingerprint for a track and check for duplicates.
+   * Duplicates are other tracks with the same fingerprint hash plus any
+   * stored track the worker reported in `nearDuplicates`, so re-encodes
+   * are caught without scanning every fingerprint.
    * Returns { quarantined, reason } indicating whether the track should be blocked.
    */
   async registerFingerprint(input: {
@@ -20,8 +34,16 @@ export class FingerprintService {
     fingerprint: string;
     fingerprintHash: string;
     duration: number;
+    nearDuplicates?: NearDuplicateCandidate[];
   }): Promise<{ quarantined: boolean; reason?: string; duplicate?: boolean; sameWallet?: boolean }> {
     const { trackId, releaseId, fingerprint, fingerprintHash, duration } = input;
+    const nearDuplicateIds = [
+      ...new Set(
+        (input.nearDuplicates ?? [])
+          .map((candidate) => candidate?.trackId)
+          .filter((id): id is string => typeof id === "string" && id !== trackId),
+      ),
+    ];
 
     // Store the fingerprint
     await prisma.audioFingerprint.upsert({
@@ -38,10 +60,14 @@ export class FingerprintService {
 
     this.logger.log(`Fingerprint stored for track ${trackId} (hash=${fingerprintHash.slice(0, 16)}...)`);
 
-    // Check for duplicates — find other tracks with the same fingerprint hash
+    // Check for duplicates — other tracks with the same fingerprint hash,
+    // or reported by the worker's near-duplicate index
     const duplicates = await prisma.audioFingerprint.findMany({
       where: {
-        fingerprintHash,
+        OR: [
+          { fingerprintHash },
+          ...(nearDuplicateIds.length > 0 ? [{ trackId: { in: nearDuplicateIds } }] : []),
+        ],
         trackId: { not: trackId }, // Exclude self
       },
       include: {
@@ -7,13 +7,34 @@
  * can never 500 ingestion or persist garbage.
  */
 
-export const STEM_AUDIO_FEATURES_SCHEMA_VERSION = "stem-audio-features/v1";
+export const STEM_AUDIO_FEATURES_SCHEMA_VERSION = "stem-audio-features/v2";
+
+/**
+ * Versions with the same field shapes. v2 measures them on the worker's
+ * resampled analysis signal, so values can differ slightly from v1; stored v1
+ * features stay usable until the worker backfill replaces them.
+ */
+export const STEM_AUDIO_FEATURES_SCHEMA_VERSIONS = [
+  "stem-audio-features/v1",
+  STEM_AUDIO_FEATURES_SCHEMA_VERSION,
+] as const;
+
+export type StemAudioFeaturesSchemaVersion =
+  (typeof STEM_AUDIO_FEATURES_SCHEMA_VERSIONS)[number];
+
+export function isStemAudioFeaturesSchemaVersion(
+  value: unknown,
+): value is StemAudioFeaturesSchemaVersion {
+  return (STEM_AUDIO_FEATURES_SCHEMA_VERSIONS as readonly unknown[]).includes(
+    value,
+  );
+}
 
 const BPM_MIN = 30;
 const BPM_MAX = 300;
 
 export type SanitizedStemAudioFeatures = {
-  schemaVersion: typeof STEM_AUDIO_FEATURES_SCHEMA_VERSION;
+  schemaVersion: StemAudioFeaturesSchemaVersion;
   extractor: { name: string; version: string | null };
   sampleRate: number | null;
   durationSeconds: number | null;
@@ -55,14 +76,16 @@ function sanitizeKey(raw: unknown): SanitizedStemAudioFeatures["key"] {
 
 /**
  * Returns the sanitized feature object, or null when the payload is not a
- * recognizable v1 feature dict (callers log and skip persistence).
+ * recognizable feature dict of a supported version (callers log and skip
+ * persistence). The payload's own version is kept.
  */
 export function sanitizeStemAudioFeatures(
   raw: unknown,
 ): SanitizedStemAudioFeatures | null {
   if (!raw || typeof raw !== "object" || Array.isArray(raw)) return null;
   const input = raw as Record<string, unknown>;
-  if (input.schemaVersion !== STEM_AUDIO_FEATURES_SCHEMA_VERSION) return null;
+  const schemaVersion = input.schemaVersion;
+  if (!isStemAudioFeaturesSchemaVersion(schemaVersion)) return null;
 
   const extractorRaw =
     input.extractor && typeof input.extractor === "object"
@@ -83,7 +106,7 @@ export function sanitizeStemAudioFeatures(
   const beatCountRaw = nonNegative(input.beatCount);
 
   return {
-    schemaVersion: STEM_AUDIO_FEATURES_SCHEMA_VERSION,
+    schemaVersion,
     extractor: {
       name: extractorName,
       version:
@@ -1,5 +1,6 @@
 import { Injectable } from "@nestjs/common";
 import { estimateGenerationCostUsd } from "../generation/generation-cost-model";
+import { isStemAudioFeaturesSchemaVersion } from "../ingestion/stem-audio-features";
 
 /**
  * Provider boundary for AI-assisted remix draft generation (#896, backlog D1).
@@ -143,7 +144,10 @@ export function deriveSourceFeatureHints(
         }
       | null
       | undefined;
-    if (!features || features.schemaVersion !== "stem-audio-features/v1") {
+    if (
+      !features ||
+      !isStemAudioFeaturesSchemaVersion(features.schemaVersion)
+    ) {
       continue;
     }
     if (
@@ -24,6 +24,7 @@ describe("FingerprintService (integration)", () => {
   const trackId1 = `${P}track1`;
   const trackId2 = `${P}track2`;
   const trackId3 = `${P}track3`;
+  const trackId4 = `${P}track4`;
 
   beforeAll(async () => {
     service = new FingerprintService(new UploadRightsRoutingService());
@@ -67,12 +68,15 @@ describe("FingerprintService (integration)", () => {
     await prisma.track.create({
       data: { id: trackId3, title: "Track Three (different artist)", releaseId: releaseId2 },
     });
+    await prisma.track.create({
+      data: { id: trackId4, title: "Track Four (re-encode, different artist)", releaseId: releaseId2 },
+    });
   });
 
   afterAll(async () => {
     // Clean up in reverse order of creation
-    await prisma.audioFingerprint.deleteMany({ where: { trackId: { in: [trackId1, trackId2, trackId3] } } }).catch(() => {});
-    await prisma.track.deleteMany({ where: { id: { in: [trackId1, trackId2, trackId3] } } }).catch(() => {});
+    await prisma.audioFingerprint.deleteMany({ where: { trackId: { in: [trackId1, trackId2, trackId3, trackId4] } } }).catch(() => {});
+    await prisma.track.deleteMany({ where: { id: { in: [trackId1, trackId2, trackId3, trackId4] } } }).catch(() => {});
     await prisma.release.deleteMany({ where: { id: { in: [releaseId1, releaseId2] } } }).catch(() => {});
     await prisma.artist.deleteMany({ where: { id: { in: [artistId1, artistId2] } } }).catch(() => {});
     await prisma.user.deleteMany({ where: { id: { in: [userId, `${P}user2`] } } }).catch(() => {});
@@ -138,4 +142,23 @@ describe("FingerprintService (integration)", () => {
     const release = await prisma.release.findUnique({ where: { id: releaseId2 } });
     expect(release!.rightsRoute).toBe("QUARANTINED_REVIEW");
   });
+
+  it("quarantines for a cross-wallet near duplicate with a different hash", async () => {
+    // Track 4 is a re-encode: its exact hash differs, but the worker's index matched Track 1
+    const result = await service.registerFingerprint({
+      trackId: trackId4,
+      releaseId: releaseId2,
+      fingerprint: "111,222,333,445",
+      fingerprintHash: `${P}hash_reencode`,
+      duration: 180.4,
+      nearDuplicates: [{ trackId: trackId1, similarity: 0.93 }, { trackId: trackId4, similarity: 1 }],
+    });
+
+    expect(result.quarantined).toBe(true);
+    expect(result.duplicate).toBe(true);
+    expect(result.reason).toContain("Artist One");
+
+    const track = await prisma.track.findUnique({ where: { id: trackId4 } });
+    expect(track!.contentStatus).toBe("quarantined");
+  });
 });
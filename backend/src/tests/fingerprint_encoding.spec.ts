@@ -0,0 +1,34 @@
+import { BadRequestException } from "@nestjs/common";
+import {
+  decimalFingerprint,
+  PACKED_FINGERPRINT_ENCODING,
+} from "../modules/fingerprint/fingerprint.encoding";
+
+function pack(values: number[]): string {
+  const bytes = Buffer.alloc(values.length * 4);
+  values.forEach((value, index) => bytes.writeUInt32LE(value, index * 4));
+  return bytes.toString("base64");
+}
+
+describe("decimalFingerprint", () => {
+  it("decodes the worker's packed fingerprint to the stored decimal form", () => {
+    expect(
+      decimalFingerprint({
+        fingerprintPacked: pack([1, 4294967295, 42]),
+        fingerprintEncoding: PACKED_FINGERPRINT_ENCODING,
+      }),
+    ).toBe("1,4294967295,42");
+  });
+
+  it("keeps accepting the decimal field from older workers", () => {
+    expect(decimalFingerprint({ fingerprint: "111,222,333" })).toBe("111,222,333");
+  });
+
+  it.each([
+    [{ fingerprintPacked: pack([1]), fingerprintEncoding: "chromaprint-u16" }],
+    [{ fingerprintPacked: "AAAA", fingerprintEncoding: PACKED_FINGERPRINT_ENCODING }],
+    [{}],
+  ])("rejects payloads it cannot decode", (payload) => {
+    expect(() => decimalFingerprint(payload)).toThrow(BadRequestException);
+  });
+});
@@ -18,10 +18,15 @@ const validFeatures = {
 };
 
 describe("sanitizeStemAudioFeatures (#1184)", () => {
-  it("passes a valid v1 payload through intact", () => {
+  it("passes a valid payload through intact", () => {
     expect(sanitizeStemAudioFeatures(validFeatures)).toEqual(validFeatures);
   });
 
+  it("keeps accepting stored v1 payloads under their own version", () => {
+    const v1 = { ...validFeatures, schemaVersion: "stem-audio-features/v1" };
+    expect(sanitizeStemAudioFeatures(v1)).toEqual(v1);
+  });
+
   it("rejects unknown schema versions and non-objects", () => {
     expect(
       sanitizeStemAudioFeatures({ ...validFeatures, schemaVersion: "v999" }),
@@ -8,17 +8,75 @@ Build verdict per docs/rfc/remix-audio-grounding-build-vs-buy.md: in-house
 librosa, no third-party analysis APIs — the worker already holds the stem
 audio, and it never leaves our boundary.
 
-Chord progressions, full beat grids, and song structure are v2 (#1182).
+Chord progressions, full beat grids, and song structure are later slices
+(#1182).
+
+Long stems (live recordings, DJ sets) are analyzed in streaming mode: the
+audio is read from disk in blocks and only per-frame summaries are kept
+(RMS and chroma sums, the onset envelope), so memory is bounded by the
+block size rather than the stem length. Beat tracking and onset picking
+then run on the compact onset envelope, exactly as in the in-memory path;
+the tempo prior for beat tracking averages the tempogram in chunks instead
+of materializing it.
+
+Analysis runs on a mono downmix resampled to ANALYSIS_SAMPLE_RATE: tempo,
+onset and chroma estimation gain nothing from 44.1/48 kHz, and every
+spectral pass gets about twice as cheap. `sampleRate` and `durationSeconds`
+still describe the source file.
+
+Extraction has a per-stem time budget (DEADLINE_SECONDS). After decoding,
+fields are computed in stages from cheapest to costliest (energy, onsets,
+tempo and beats, key); stages that do not fit the budget are left null and
+their fields listed in `skippedFields`, so a pathological stem cannot hold
+a job hostage.
 """
 
 import logging
 import math
+import os
+import shutil
+import subprocess
+import time
 from pathlib import Path
-from typing import Optional, Union
+from typing import Callable, Iterator, Optional, Union
 
 logger = logging.getLogger(__name__)
 
-SCHEMA_VERSION = "stem-audio-features/v1"
+# v2: analysis at ANALYSIS_SAMPLE_RATE with rescaled framing (values shift
+# slightly against v1), plus `skippedFields` and the loudness fields.
+SCHEMA_VERSION = "stem-audio-features/v2"
+
+# Rate the audio is analyzed at (never upsampled); 0 analyzes at the source rate.
+ANALYSIS_SAMPLE_RATE = int(os.getenv("FEATURES_ANALYSIS_SAMPLE_RATE", "22050"))
+# soxr quality passed to soxr.resample / ResampleStream.
+RESAMPLE_QUALITY = "HQ"
+
+# librosa's analysis framing defaults at 44.1 kHz, shared by both paths.
+# Lower analysis rates scale them down (see _framing) so the frame rate,
+# and with it the tempo and onset resolution, stays the same.
+N_FFT = 2048
+HOP_LENGTH = 512
+FRAMING_REFERENCE_RATE = 44100
+# Stems at least this long are streamed when the file is seekable by
+# soundfile; shorter stems are loaded whole (faster, and small).
+STREAMING_MIN_SECONDS = float(os.getenv("FEATURES_STREAMING_MIN_SECONDS", "600"))
+# Frames per streamed block (~12 s at 44.1 kHz).
+STREAMING_BLOCK_FRAMES = 1024
+# Tempogram columns computed at once; librosa's tempo() builds all of them
+# (~1.7 GB for ten minutes at 44.1 kHz).
+TEMPOGRAM_CHUNK_FRAMES = 4096
+# librosa.feature.tempo's autocorrelation window.
+TEMPO_AC_SECONDS = 8.0
+
+# Per-stem extraction budget in seconds, decoding included; 0 disables it.
+DEADLINE_SECONDS = float(os.getenv("FEATURES_DEADLINE_SECONDS", "120"))
+# Output fields filled by each extraction stage, in the order they run.
+STAGE_FIELDS = {
+    "energy": ("energyRms",),
+    "onsets": ("onsetDensity",),
+    "tempo": ("tempoBpm", "tempoConfidence", "beatCount", "firstBeatSec"),
+    "key": ("key",),
+}
 
 # Krumhansl-Schmuckler key profiles (major/minor pitch-class weightings).
 KRUMHANSL_MAJOR = [
@@ -75,22 +133,10 @@ def _estimate_key(chroma_mean) -> Optional[dict]:
     }
 
 
-def extract_stem_features(path: Union[str, Path]) -> dict:
-    """Pure extraction: one audio file in, one JSON-safe feature dict out.
-
-    Callers own failure policy — this function may raise on unreadable
-    audio; silent or degenerate audio returns the schema with null fields
-    instead of raising.
-    """
-    import librosa
-    import numpy as np
-
-    y, sr = librosa.load(str(path), sr=None, mono=True)
-    duration = float(len(y)) / float(sr) if sr else 0.0
-
-    features: dict = {
+def _empty_features(sr: int, duration: float, extractor_version: str) -> dict:
+    return {
         "schemaVersion": SCHEMA_VERSION,
-        "extractor": {"name": "librosa", "version": str(librosa.__version__)},
+        "extractor": {"name": "librosa", "version": extractor_version},
         "sampleRate": int(sr),
         "durationSeconds": _finite(round(duration, 3)),
         "tempoBpm": None,
@@ -100,25 +146,123 @@ def extract_stem_features(path: Union[str, Path]) -> dict:
         "key": None,
         "energyRms": None,
         "onsetDensity": None,
+        # Fields left null because their stage did not fit the deadline.
+        "skippedFields": [],
+        # EBU R128 integrated loudness, loudness range and true peak. The
+        # worker fills these from its encode pass (stem_encoding); a
+        # standalone extraction leaves them null.
+        "loudnessLufs": None,
+        "loudnessRangeLu": None,
+        "truePeakDbtp": None,
     }
 
-    if len(y) == 0 or duration <= 0:
-        return features
 
-    rms = _finite(float(np.mean(librosa.feature.rms(y=y))))
-    features["energyRms"] = round(rms, 6) if rms is not None else None
+class DeadlineExceeded(Exception):
+    """An extraction stage ran past the deadline."""
+
+
+class _Deadline:
+    """Extraction time budget.
+
+    A stage starts only if the time left exceeds what the previous (cheaper)
+    stage took; long loops also call `check` so a stage that started can
+    still be cut short.
+    """
+
+    def __init__(self, seconds: Optional[float]):
+        self.end = time.monotonic() + seconds if seconds and seconds > 0 else None
+        self.last_stage_seconds = 0.0
+
+    def check(self) -> None:
+        if self.end is not None and time.monotonic() >= self.end:
+            raise DeadlineExceeded()
+
+    def fits_next_stage(self) -> bool:
+        return self.end is None or self.end - time.monotonic() > self.last_stage_seconds
+
+
+def _framing(sr: int) -> tuple:
+    """(n_fft, hop_length) at `sr`: the defaults divided by a power of two near 44.1 kHz / sr."""
+    scale = 2 ** max(0, round(math.log2(FRAMING_REFERENCE_RATE / sr)))
+    return N_FFT // scale, HOP_LENGTH // scale
+
 
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-    onset_mean = float(np.mean(onset_env)) if onset_env.size else 0.0
+def _tempo(onset_env, sr: int, deadline: Optional[_Deadline] = None) -> float:
+    """librosa.feature.tempo(onset_envelope=...) with the tempogram averaged in chunks.
 
-    if onset_mean > 0:
+    Same centred, Hann-windowed, max-normalized autocorrelation per frame
+    as librosa's tempogram; only the mean over frames is kept.
+    """
+    import librosa
+    import numpy as np
+    import scipy.fft
+    import scipy.signal
+
+    _, hop_length = _framing(sr)
+    win_length = int(librosa.time_to_frames(TEMPO_AC_SECONDS, sr=sr, hop_length=hop_length))
+    window = scipy.signal.get_window("hann", win_length, fftbins=True).astype(np.float32)[:, None]
+    # Autocorrelation through a zero-padded real FFT of a fast length, in
+    # float32: an order of magnitude quicker than librosa.autocorrelate's
+    # float64 FFT of 2 * win_length - 1 points, same argmax.
+    n_fft = scipy.fft.next_fast_len(2 * win_length - 1, real=True)
+    frames = len(onset_env)
+    padded = np.pad(onset_env.astype(np.float32), win_length // 2, mode="linear_ramp", end_values=[0, 0])
+    total = np.zeros(win_length)
+    for start in range(0, frames, TEMPOGRAM_CHUNK_FRAMES):
+        if deadline is not None:
+            deadline.check()
+        stop = min(frames, start + TEMPOGRAM_CHUNK_FRAMES)
+        odf = librosa.util.frame(padded[start: stop - 1 + win_length], frame_length=win_length, hop_length=1)
+        spectrum = scipy.fft.rfft(odf * window, n=n_fft, axis=-2)
+        autocorr = scipy.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, n=n_fft, axis=-2)[:win_length]
+        total += librosa.util.normalize(autocorr, norm=np.inf, axis=-2).sum(axis=-1)
+    tempo = librosa.feature.tempo(tg=(total / frames)[:, None], sr=sr, hop_length=hop_length)
+    return float(np.atleast_1d(tempo)[0])
+
+
+def _summarize(features: dict, sr: int, duration: float, rms_mean: Callable[[], float],
+               onset_env: Callable[[], object], chroma_mean: Callable[[], object],
+               deadline: _Deadline, timeline: Optional[dict] = None) -> dict:
+    """Fill energy, onset density, tempo/beats and key, in that order.
+
+    Each stage reads its input through a callable, so the in-memory path
+    only pays for the STFT and chroma when their stage runs. Once a stage
+    does not fit `deadline`, it and every later stage are listed in
+    `skippedFields`. Silent audio (no onsets) stops after the onset stage.
+    A `timeline` dict receives the onset envelope and tracked beat frames.
+    """
+    import librosa
+    import numpy as np
+
+    _, hop_length = _framing(sr)
+    onsets = {}
+
+    def energy():
+        rms = _finite(rms_mean())
+        features["energyRms"] = round(rms, 6) if rms is not None else None
+
+    def onset_density():
+        env = onset_env()
+        onsets["env"] = env
+        onsets["mean"] = float(np.mean(env)) if env.size else 0.0
+        if timeline is not None:
+            timeline["onsetEnvelope"] = env
+        if onsets["mean"] > 0:
+            detected = librosa.onset.onset_detect(onset_envelope=env, sr=sr, hop_length=hop_length)
+            density = _finite(float(len(detected)) / duration)
+            features["onsetDensity"] = round(density, 4) if density is not None else None
+
+    def tempo_and_beats():
+        env, onset_mean = onsets["env"], onsets["mean"]
         tempo, beat_frames = librosa.beat.beat_track(
-            onset_envelope=onset_env, sr=sr,
+            onset_envelope=env, sr=sr, hop_length=hop_length, bpm=_tempo(env, sr, deadline),
         )
+        if timeline is not None:
+            timeline["beatFrames"] = beat_frames
         tempo = _finite(float(np.atleast_1d(tempo)[0]))
         if tempo and tempo > 0:
             features["tempoBpm"] = round(tempo, 2)
-            beat_times = librosa.frames_to_time(beat_frames, sr=sr)
+            beat_times = librosa.frames_to_time(beat_frames, sr=sr, hop_length=hop_length)
             features["beatCount"] = int(len(beat_times))
             if len(beat_times):
                 features["firstBeatSec"] = round(float(beat_times[0]), 3)
@@ -126,19 +270,347 @@ def extract_stem_features(path: Union[str, Path]) -> dict:
             # confidence. Beats landing on strong onsets relative to the
             # average onset strength → ratio mapped into (0, 1).
             if len(beat_frames):
-                valid = beat_frames[beat_frames < len(onset_env)]
+                valid = beat_frames[beat_frames < len(env)]
                 if valid.size:
-                    beat_strength = float(np.mean(onset_env[valid]))
+                    beat_strength = float(np.mean(env[valid]))
                     ratio = beat_strength / (onset_mean + 1e-9)
                     confidence = _finite(ratio / (1.0 + ratio))
                     if confidence is not None:
                         features["tempoConfidence"] = round(confidence, 4)
 
-        onsets = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr)
-        density = _finite(float(len(onsets)) / duration)
-        features["onsetDensity"] = round(density, 4) if density is not None else None
+    def key():
+        features["key"] = _estimate_key(chroma_mean())
+
+    stages = (("energy", energy), ("onsets", onset_density), ("tempo", tempo_and_beats), ("key", key))
+    for index, (name, stage) in enumerate(stages):
+        if name in ("tempo", "key") and onsets.get("mean", 0.0) <= 0:
+            break
+        if deadline.fits_next_stage():
+            start = time.monotonic()
+            try:
+                stage()
+                deadline.last_stage_seconds = time.monotonic() - start
+                continue
+            except DeadlineExceeded:
+                pass
+        for skipped, _ in stages[index:]:
+            for field in STAGE_FIELDS[skipped]:
+                features[field] = None
+                features["skippedFields"].append(field)
+        logger.warning(f"[features] deadline reached, skipped {', '.join(n for n, _ in stages[index:])}")
+        break
+
+    return features
+
+
+def _analysis_rate(source_sr: int) -> int:
+    if ANALYSIS_SAMPLE_RATE <= 0:
+        return source_sr
+    return min(ANALYSIS_SAMPLE_RATE, source_sr)
+
+
+def _resample(y, source_sr: int, sr: int):
+    if sr == source_sr or not len(y):
+        return y
+    import soxr
+
+    return soxr.resample(y, source_sr, sr, quality=RESAMPLE_QUALITY)
+
+
+def _downmix(block):
+    """Mono view of a (frames, channels) float32 block; copies only to average."""
+    return block[:, 0] if block.shape[1] == 1 else block.mean(axis=1, dtype="float32")
+
+
+def _decode(path: Union[str, Path]) -> tuple:
+    """(mono float32 at the analysis rate, analysis rate, source rate, source frames).
+
+    MP3 goes through an ffmpeg pipe when ffmpeg is installed; soundfile
+    reads WAV/FLAC (and MP3 without ffmpeg); anything else falls back to
+    librosa's loader.
+    """
+    import numpy as np
+    import soundfile as sf
+
+    source = None
+    is_mp3 = Path(path).suffix.lower() == ".mp3"
+    if is_mp3 and shutil.which("ffmpeg") and shutil.which("ffprobe"):
+        rate = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "a:0",
+             "-show_entries", "stream=sample_rate", "-of", "default=nw=1:nk=1", str(path)],
+            capture_output=True, check=True, text=True,
+        ).stdout.strip()
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-i", str(path), "-f", "f32le", "-ac", "1", "-"],
+            capture_output=True, check=True,
+        )
+        source = np.frombuffer(result.stdout, dtype=np.float32), int(rate)
+    if source is None:
+        try:
+            with sf.SoundFile(str(path)) as sound_file:
+                source = _downmix(sound_file.read(dtype="float32", always_2d=True)), sound_file.samplerate
+        except Exception:
+            import librosa
+
+            y, source_sr = librosa.load(str(path), sr=None, mono=True)
+            source = y, int(source_sr)
+    y, source_sr = source
+    sr = _analysis_rate(source_sr)
+    return _resample(y, source_sr, sr), sr, source_sr, len(y)
+
+
+def _write_timeline(path: Union[str, Path], sr: int, timeline: dict) -> None:
+    """Write the frame-level arrays next to the summary (feature_timeline.py)."""
+    import numpy as np
+
+    from feature_timeline import write_timeline
+
+    _, hop_length = _framing(sr)
+    arrays = {
+        "beatFrames": np.zeros(0, dtype=np.int32),
+        "onsetEnvelope": np.zeros(0, dtype=np.float32),
+        "rms": np.zeros(0, dtype=np.float32),
+        "chroma": np.zeros((12, 0), dtype=np.float32),
+        **timeline,
+    }
+    write_timeline(path, arrays, sample_rate=sr, hop_length=hop_length, features_schema=SCHEMA_VERSION)
+
+
+def _streaming_duration(path: Union[str, Path]) -> Optional[float]:
+    """Duration when soundfile can stream the file, else None."""
+    import soundfile as sf
+
+    try:
+        info = sf.info(str(path))
+    except Exception:
+        return None
+    return info.frames / info.samplerate if info.samplerate else None
+
+
+def extract_stem_features(
+    path: Union[str, Path],
+    streaming: Optional[bool] = None,
+    timeline_path: Optional[Union[str, Path]] = None,
+    deadline_seconds: Optional[float] = None,
+) -> dict:
+    """Pure extraction: one audio file in, one JSON-safe feature dict out.
+
+    Callers own failure policy — this function may raise on unreadable
+    audio; silent or degenerate audio returns the schema with null fields
+    instead of raising.
+
+    `streaming=None` streams stems of at least STREAMING_MIN_SECONDS that
+    soundfile can read; True/False force a path (True still falls back
+    to loading when soundfile cannot read the format).
+
+    With `timeline_path`, the frame-level beat frames, onset envelope, RMS
+    curve and chroma are also written there (see feature_timeline.py).
+
+    `deadline_seconds` (default DEADLINE_SECONDS, 0 for none) bounds the
+    whole call; see _summarize for what is skipped when it runs out.
+    """
+    deadline = _Deadline(DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+    if streaming is None:
+        duration = _streaming_duration(path)
+        streaming = duration is not None and duration >= STREAMING_MIN_SECONDS
+    elif streaming:
+        streaming = _streaming_duration(path) is not None
+    if streaming:
+        return _extract_streaming(path, timeline_path=timeline_path, deadline=deadline)
+    return _extract_in_memory(path, timeline_path=timeline_path, deadline=deadline)
+
+
+def _extract_in_memory(
+    path: Union[str, Path],
+    timeline_path: Optional[Union[str, Path]] = None,
+    deadline: Optional[_Deadline] = None,
+) -> dict:
+    import librosa
+    import numpy as np
+
+    y, sr, source_sr, source_frames = _decode(path)
+    duration = float(source_frames) / float(source_sr) if source_sr else 0.0
+    features = _empty_features(source_sr, duration, str(librosa.__version__))
+    if len(y) == 0 or duration <= 0:
+        if timeline_path is not None:
+            _write_timeline(timeline_path, sr, {})
+        return features
+
+    n_fft, hop_length = _framing(sr)
+    computed = {}
+
+    def rms_mean() -> float:
+        computed["rms"] = librosa.feature.rms(y=y, frame_length=n_fft, hop_length=hop_length)[0]
+        return float(np.mean(computed["rms"]))
+
+    def onset_env():
+        # One power spectrogram feeds both the onset mel and the chroma,
+        # which would otherwise each run their own STFT.
+        computed["power"] = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length)) ** 2
+        mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=computed["power"], sr=sr))
+        return librosa.onset.onset_strength(S=mel_db, sr=sr, n_fft=n_fft, hop_length=hop_length)
+
+    def chroma_frames():
+        if "chroma" not in computed:
+            computed["chroma"] = librosa.feature.chroma_stft(S=computed["power"], sr=sr, n_fft=n_fft)
+        return computed["chroma"]
+
+    timeline = {} if timeline_path is not None else None
+    features = _summarize(
+        features, sr, duration,
+        rms_mean=rms_mean,
+        onset_env=onset_env,
+        chroma_mean=lambda: np.mean(chroma_frames(), axis=1),
+        deadline=deadline or _Deadline(None),
+        timeline=timeline,
+    )
+    if timeline is not None:
+        if "rms" in computed:
+            timeline["rms"] = computed["rms"]
+        if "power" in computed and "key" not in features["skippedFields"]:
+            timeline["chroma"] = chroma_frames()
+        _write_timeline(timeline_path, sr, timeline)
+    return features
+
+
+def _framed_blocks(sound_file, block_frames: int, sr: int) -> Iterator[tuple]:
+    """Mono float32 buffers at `sr` whose uncentred frames tile the centred framing.
+
+    Blocks are downmixed and resampled as they are read. The stream is
+    padded with n_fft // 2 zeros on both ends (librosa's `center=True` with
+    constant padding), and each buffer holds whole frames, so framing each
+    buffer with `center=False` yields exactly the frames of the whole
+    signal, in order. Yields (buffer, n_frames).
+    """
+    import numpy as np
+
+    def analysis_blocks() -> Iterator:
+        resampler = None
+        if sr != sound_file.samplerate:
+            import soxr
+
+            resampler = soxr.ResampleStream(sound_file.samplerate, sr, 1, dtype="float32", quality=RESAMPLE_QUALITY)
+        for block in sound_file.blocks(blocksize=block_frames * HOP_LENGTH, dtype="float32", always_2d=True):
+            mono = _downmix(block)
+            yield resampler.resample_chunk(mono) if resampler else mono
+        if resampler:
+            yield resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
 
-        chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-        features["key"] = _estimate_key(np.mean(chroma, axis=1))
+    n_fft, hop_length = _framing(sr)
+    half = n_fft // 2
+    carry = np.zeros(half, dtype=np.float32)
+    for block in analysis_blocks():
+        buffer = np.concatenate([carry, block])
+        if len(buffer) < n_fft:
+            carry = buffer
+            continue
+        frames = 1 + (len(buffer) - n_fft) // hop_length
+        yield buffer[: (frames - 1) * hop_length + n_fft], frames
+        carry = buffer[frames * hop_length:]
+    buffer = np.concatenate([carry, np.zeros(half, dtype=np.float32)])
+    if len(buffer) >= n_fft:
+        yield buffer, 1 + (len(buffer) - n_fft) // hop_length
+
+
+def _extract_streaming(
+    path: Union[str, Path],
+    block_frames: int = STREAMING_BLOCK_FRAMES,
+    timeline_path: Optional[Union[str, Path]] = None,
+    deadline: Optional[_Deadline] = None,
+) -> dict:
+    """Same features as the in-memory path, reading `block_frames` frames at a time.
+
+    Matches it except for two whole-signal statistics that are estimated
+    from the audio seen so far: the dB floor of the onset spectrogram
+    (running maximum - 80 dB) and the chroma tuning (from the first
+    non-silent block).
+
+    All stages come out of one pass over the file, so a deadline reached
+    during the pass skips every stage (the duration is still reported).
+    """
+    import librosa
+    import numpy as np
+    import soundfile as sf
+
+    deadline = deadline or _Deadline(None)
+    expired = False
+
+    with sf.SoundFile(str(path)) as sound_file:
+        source_sr = sound_file.samplerate
+        sr = _analysis_rate(source_sr)
+        n_fft, hop_length = _framing(sr)
+        samples = 0
+        rms_sum, rms_frames = 0.0, 0
+        chroma_sum = np.zeros(12)
+        chroma_frames = 0
+        tuning: Optional[float] = None
+        db_max = -np.inf
+        previous_mel = None
+        onset_parts = []
+        # Per-frame curves, kept only for a timeline.
+        rms_parts, chroma_parts = [], []
+        start = sound_file.tell()
+        try:
+            for buffer, frames in _framed_blocks(sound_file, block_frames, sr):
+                deadline.check()
+                rms = librosa.feature.rms(y=buffer, frame_length=n_fft, hop_length=hop_length, center=False)
+                rms_sum += float(rms.sum())
+                rms_frames += rms.shape[-1]
+                if timeline_path is not None:
+                    rms_parts.append(rms[0])
+
+                power = np.abs(librosa.stft(buffer, n_fft=n_fft, hop_length=hop_length, center=False)) ** 2
+                mel = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr), top_db=None)
+                db_max = max(db_max, float(mel.max()))
+                mel = np.maximum(mel, db_max - 80.0)
+                if previous_mel is not None:
+                    mel_with_previous = np.concatenate([previous_mel, mel], axis=1)
+                else:
+                    mel_with_previous = mel
+                onset_parts.append(np.maximum(0.0, np.diff(mel_with_previous, axis=1)).mean(axis=0))
+                previous_mel = mel[:, -1:]
+
+                if tuning is None and power.max() > 0:
+                    tuning = float(librosa.estimate_tuning(S=power, sr=sr, n_fft=n_fft))
+                chroma = librosa.feature.chroma_stft(S=power, sr=sr, tuning=tuning or 0.0)
+                chroma_sum += chroma.sum(axis=1)
+                chroma_frames += chroma.shape[-1]
+                if timeline_path is not None:
+                    chroma_parts.append(chroma.astype(np.float16))
+        except DeadlineExceeded:
+            expired = True
+        samples = sound_file.frames if expired else sound_file.tell() - start
+
+    duration = float(samples) / float(source_sr) if source_sr else 0.0
+    features = _empty_features(source_sr, duration, str(librosa.__version__))
+    if expired:
+        logger.warning("[features] deadline reached while streaming, skipped every stage")
+        for fields in STAGE_FIELDS.values():
+            features["skippedFields"].extend(fields)
+        if timeline_path is not None:
+            _write_timeline(timeline_path, sr, {})
+        return features
+    if samples == 0 or duration <= 0:
+        if timeline_path is not None:
+            _write_timeline(timeline_path, sr, {})
+        return features
 
+    # librosa's onset_strength: lag 1 plus the centring shift, trimmed to
+    # the frame count.
+    total_frames = rms_frames
+    onset_env = np.concatenate(
+        [np.zeros(1 + n_fft // (2 * hop_length), dtype=np.float32)] + onset_parts
+    )[:total_frames]
+    timeline = {} if timeline_path is not None else None
+    features = _summarize(
+        features, sr, duration,
+        rms_mean=lambda: rms_sum / max(rms_frames, 1),
+        onset_env=lambda: onset_env,
+        chroma_mean=lambda: chroma_sum / max(chroma_frames, 1),
+        deadline=deadline,
+        timeline=timeline,
+    )
+    if timeline is not None:
+        timeline.update(rms=np.concatenate(rms_parts), chroma=np.concatenate(chroma_parts, axis=1))
+        _write_timeline(timeline_path, sr, timeline)
     return features
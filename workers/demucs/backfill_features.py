@@ -0,0 +1,295 @@
+"""Recompute stem features for the stored catalog, e.g. after a schema bump.
+
+Stems are enumerated from a local output root or a bucket prefix, in the
+layout the worker stores them (`{release}/{track}/{stem}.mp3` locally,
+`stems/{release}/{track}/{stem}.mp3` in GCS, or `{stem}.{hash16}.mp3` with
+STEM_CONTENT_KEYS, where only the most recently stored version of each stem
+is listed), and run through
+`audio_features.extract_stem_features` unchanged, so backfilled features are
+exactly what a fresh separation would publish:
+
+    python backfill_features.py /outputs --out backfill/
+    python backfill_features.py gs://bucket/stems --out backfill/ --workers 8
+
+Results go to sharded JSONL under `--out`, one line per stem (successes
+carry `features`, failures `error`). The shards are the checkpoint: a rerun
+skips every stem that already has a successful line for the current
+`SCHEMA_VERSION`, so an interrupted run resumes where it stopped, failures
+are retried, and a schema bump recomputes everything. `progress.json`
+tracks counts and throughput while the run is going.
+
+The exit status is 1 if any stem failed.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from audio_features import SCHEMA_VERSION
+
+DEFAULT_SHARD_SIZE = 5000
+PROGRESS_EVERY_SECONDS = 10.0
+STEM_SUFFIX = ".mp3"
+# `vocals.mp3`, or `vocals.{first 16 hex of sha256}.mp3` (main.content_addressed_name).
+STEM_FILENAME = re.compile(r"(?P<stem>.+?)(?:\.[0-9a-f]{16})?" + re.escape(STEM_SUFFIX))
+
+
+def stem_name(filename: str) -> Optional[str]:
+    """The stem a stored file name belongs to, or None if it is not a stem MP3."""
+    match = STEM_FILENAME.fullmatch(filename)
+    return match.group("stem") if match else None
+
+
+def list_stems(source: str) -> Iterator[dict]:
+    """{uri, releaseId, trackId, stem} for every stored stem MP3 under `source`.
+
+    A stem stored under several names (content-addressed versions, or the
+    plain key from before STEM_CONTENT_KEYS) is listed once, as the most
+    recently written one.
+    """
+    if source.startswith("gs://"):
+        from google.cloud import storage
+
+        bucket_name, _, prefix = source[len("gs://"):].partition("/")
+        prefix = prefix.rstrip("/") + "/" if prefix else ""
+
+        def found() -> Iterator[tuple]:
+            for blob in storage.Client().list_blobs(bucket_name, prefix=prefix):
+                parts = blob.name[len(prefix):].split("/")
+                if len(parts) == 3:
+                    updated = blob.updated.timestamp() if blob.updated else 0.0
+                    yield f"gs://{bucket_name}/{blob.name}", *parts, updated
+
+        yield from _newest_per_stem(found())
+        return
+    root = Path(source)
+    yield from _newest_per_stem(
+        (str(path), *path.relative_to(root).parts, path.stat().st_mtime)
+        for path in sorted(root.glob(f"*/*/*{STEM_SUFFIX}"))
+        if not any(part.startswith(".") for part in path.relative_to(root).parts)
+    )
+
+
+def _newest_per_stem(found: Iterable[tuple]) -> Iterator[dict]:
+    """One stem dict per stem from (uri, release, track, filename, mtime), listed track by track."""
+    for (release_id, track_id), files in itertools.groupby(found, key=lambda entry: entry[1:3]):
+        newest: dict[str, tuple] = {}
+        for uri, _, _, filename, mtime in files:
+            stem = stem_name(filename)
+            if stem is not None and (stem not in newest or mtime > newest[stem][1]):
+                newest[stem] = (uri, mtime)
+        for stem, (uri, _) in sorted(newest.items()):
+            yield {"uri": uri, "releaseId": release_id, "trackId": track_id, "stem": stem}
+
+
+def analyze_stem(uri: str) -> dict:
+    """Features of one stored stem; runs in a pool process.
+
+    No deadline: a backfill has time to spare and its lines are never
+    redone, so every stage must run.
+    """
+    from audio_features import extract_stem_features
+
+    if not uri.startswith("gs://"):
+        return extract_stem_features(uri, deadline_seconds=0)
+    from google.cloud import storage
+
+    bucket_name, _, name = uri[len("gs://"):].partition("/")
+    with tempfile.TemporaryDirectory(prefix="backfill-") as temp_dir:
+        local = Path(temp_dir) / Path(name).name
+        storage.Client().bucket(bucket_name).blob(name).download_to_filename(str(local))
+        return extract_stem_features(local, deadline_seconds=0)
+
+
+def completed_uris(out_dir: Path, schema_version: Optional[str] = None) -> set:
+    """URIs with a successful line for `schema_version` (default: current) in any shard.
+
+    A line cut short by a crash does not parse and is simply redone.
+    """
+    schema_version = schema_version or SCHEMA_VERSION
+    done = set()
+    for shard in sorted(out_dir.glob("features-*.jsonl")):
+        with open(shard) as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("status") == "success" and record.get("schemaVersion") == schema_version:
+                    done.add(record["uri"])
+    return done
+
+
+class ShardWriter:
+    """Appends lines to `features-NNNNN.jsonl`, starting a new shard every `shard_size`.
+
+    Each run starts a fresh shard after the existing ones, so earlier
+    results are never rewritten.
+    """
+
+    def __init__(self, out_dir: Path, shard_size: int = DEFAULT_SHARD_SIZE):
+        self.out_dir = out_dir
+        self.shard_size = max(1, shard_size)
+        existing = sorted(out_dir.glob("features-*.jsonl"))
+        self.next_index = int(existing[-1].stem.split("-")[1]) + 1 if existing else 0
+        self._handle = None
+        self._lines = 0
+
+    def write(self, record: dict) -> None:
+        if self._handle is None or self._lines >= self.shard_size:
+            self.close()
+            path = self.out_dir / f"features-{self.next_index:05d}.jsonl"
+            self.next_index += 1
+            self._handle = open(path, "a")
+            self._lines = 0
+        self._handle.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._handle.flush()
+        self._lines += 1
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+class Progress:
+    """Counts and throughput; written to progress.json and logged to stderr."""
+
+    def __init__(self, out_dir: Path, total: int, skipped: int):
+        self.path = out_dir / "progress.json"
+        self.total, self.skipped = total, skipped
+        self.completed = self.failed = 0
+        self.audio_seconds = 0.0
+        self.start = time.monotonic()
+        self._last_report = 0.0
+
+    def record(self, record: dict) -> None:
+        if record["status"] == "success":
+            self.completed += 1
+            self.audio_seconds += record["features"].get("durationSeconds") or 0.0
+        else:
+            self.failed += 1
+        if time.monotonic() - self._last_report >= PROGRESS_EVERY_SECONDS:
+            self.report()
+
+    def summary(self) -> dict:
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        return {
+            "schemaVersion": SCHEMA_VERSION,
+            "total": self.total,
+            "skipped": self.skipped,
+            "completed": self.completed,
+            "failed": self.failed,
+            "remaining": self.total - self.skipped - self.completed - self.failed,
+            "elapsedSeconds": round(elapsed, 1),
+            "stemsPerSecond": round(self.completed / elapsed, 3),
+            # Audio seconds analyzed per wall second (higher is faster).
+            "audioSecondsPerSecond": round(self.audio_seconds / elapsed, 2),
+        }
+
+    def report(self) -> dict:
+        self._last_report = time.monotonic()
+        summary = self.summary()
+        tmp = self.path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(summary, indent=2) + "\n")
+        os.replace(tmp, self.path)
+        print(
+            f"[backfill] {summary['completed'] + summary['failed']}/{self.total - self.skipped} "
+            f"({summary['failed']} failed) {summary['stemsPerSecond']:.2f} stems/s "
+            f"{summary['audioSecondsPerSecond']:.1f}x realtime",
+            file=sys.stderr,
+        )
+        return summary
+
+
+def _result(stem: dict, future: Future) -> dict:
+    record = {**stem, "schemaVersion": SCHEMA_VERSION}
+    try:
+        record.update(status="success", features=future.result())
+    except Exception as exc:
+        record.update(status="failed", error=str(exc) or type(exc).__name__)
+    return record
+
+
+def backfill(
+    stems: Iterable[dict],
+    out_dir: Path,
+    workers: int = 1,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+) -> dict:
+    """Analyze every stem without a current result; returns the final progress summary.
+
+    `workers=0` analyzes in this process (debugging, tests).
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stems = list(stems)
+    done = completed_uris(out_dir)
+    pending = [stem for stem in stems if stem["uri"] not in done]
+    progress = Progress(out_dir, total=len(stems), skipped=len(stems) - len(pending))
+    writer = ShardWriter(out_dir, shard_size)
+
+    def finish(stem: dict, future: Future) -> None:
+        record = _result(stem, future)
+        writer.write(record)
+        progress.record(record)
+
+    try:
+        if workers <= 0:
+            for stem in pending:
+                future: Future = Future()
+                try:
+                    future.set_result(analyze_stem(stem["uri"]))
+                except Exception as exc:
+                    future.set_exception(exc)
+                finish(stem, future)
+        else:
+            import multiprocessing
+
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                # A bounded window of submissions keeps memory flat on
+                # catalogs of any size.
+                in_flight: dict = {}
+                queue = iter(pending)
+                while True:
+                    while len(in_flight) < 4 * workers:
+                        stem = next(queue, None)
+                        if stem is None:
+                            break
+                        in_flight[pool.submit(analyze_stem, stem["uri"])] = stem
+                    if not in_flight:
+                        break
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        finish(in_flight.pop(future), future)
+    finally:
+        writer.close()
+        summary = progress.report()
+    return summary
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("source", help="Local output root or gs://bucket/stems prefix")
+    parser.add_argument("--out", type=Path, required=True, help="Directory for JSONL shards and progress")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Analysis processes (0 = in this process)")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE, help="Lines per JSONL shard")
+    args = parser.parse_args(argv)
+
+    summary = backfill(list_stems(args.source), args.out, args.workers, args.shard_size)
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
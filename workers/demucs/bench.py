@@ -0,0 +1,445 @@
+"""Benchmark the stem separation pipeline on a synthetic corpus.
+
+Offline and CPU-only: the corpus is generated locally (seeded, so every run
+and every machine benchmarks the same audio) and nothing is uploaded.
+
+    python bench.py --out bench.json                      # full pipeline + phases
+    python bench.py --separator passthrough --out a.json  # skip Demucs itself
+    python bench.py --compare baseline.json --out b.json  # flag regressions
+
+Each track is run through `main.run_demucs_separation` (the exact worker
+path: Demucs, ffmpeg encode, features, peaks, local "upload") and then
+through each phase in isolation. Timings come from the worker's own
+`observe_phase` instrumentation, child CPU/peak RSS from child_usage.py.
+The worker's own peak RSS is reset before every run (`/proc/self/clear_refs`)
+so `processPeakRssMb` covers that run only; where the kernel does not allow
+the reset it is the process lifetime peak, `processPeakRssScope` says which,
+and `--compare` only checks RSS scoped to a run.
+
+`--separator passthrough` swaps Demucs for a stub that writes the mix as
+every stem, so the rest of the pipeline can be measured on machines without
+torch or a cached model. Phases whose tool is missing (fpcalc, ffmpeg,
+demucs) are reported as skipped rather than failing the run.
+
+`realtimeFactor` is wall seconds per second of audio (lower is faster).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+RESULTS_SCHEMA = "demucs-bench/v1"
+SAMPLE_RATE = 44100
+DEFAULT_DURATIONS = (15.0, 60.0, 180.0)
+DEFAULT_TOLERANCE = 0.15
+# Slowdowns smaller than this are timer noise, whatever the ratio.
+MIN_REGRESSION_SECONDS = 0.05
+# Same for peak RSS: allocator and page-cache jitter, not a regression.
+MIN_REGRESSION_MB = 16.0
+
+
+class BenchSkip(Exception):
+    """A mode cannot run on this machine (missing tool); reported, not fatal."""
+
+
+# ─── synthetic corpus ─────────────────────────────────────────────────
+
+
+def _envelope(length: int, curve: float = 1.5):
+    import numpy as np
+
+    return np.linspace(1.0, 0.0, length) ** curve
+
+
+def synth_track(seconds: float, seed: int = 0, bpm: float = 96.0):
+    """Deterministic stereo mix (frames, 2): bass, drums, chords, lead."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    beat = 60.0 / bpm
+    left = np.zeros(n)
+    right = np.zeros(n)
+
+    # Bass: A-minor arpeggio in eighths (the Stable Audio spike's probe).
+    bass = np.zeros(n)
+    notes = [55.0, 65.41, 82.41, 110.0]
+    step = beat / 2
+    for i in range(int(seconds / step)):
+        s, e = int(i * step * SAMPLE_RATE), min(n, int((i + 1) * step * SAMPLE_RATE))
+        freq = notes[i % len(notes)]
+        bass[s:e] += 0.5 * np.sin(2 * np.pi * freq * t[s:e]) * _envelope(e - s)
+
+    # Drums: kick on every beat, snare on 2 and 4, hats in eighths.
+    drums = np.zeros(n)
+    kick_len, snare_len, hat_len = int(0.25 * SAMPLE_RATE), int(0.18 * SAMPLE_RATE), int(0.05 * SAMPLE_RATE)
+    kick_t = np.arange(kick_len) / SAMPLE_RATE
+    kick = np.sin(2 * np.pi * (50 + 80 * np.exp(-kick_t * 30)) * kick_t) * _envelope(kick_len, 3)
+    snare = rng.standard_normal(snare_len) * _envelope(snare_len, 4) * 0.4
+    hat = np.diff(rng.standard_normal(hat_len + 1)) * _envelope(hat_len, 6) * 0.15
+    for i in range(int(seconds / step)):
+        s = int(i * step * SAMPLE_RATE)
+        for sample, on in ((kick, i % 2 == 0), (snare, i % 4 == 2), (hat, True)):
+            if on and s < n:
+                e = min(n, s + len(sample))
+                drums[s:e] += sample[: e - s]
+
+    # Chords: slow detuned triads, one per bar, panned wide.
+    chords_l = np.zeros(n)
+    chords_r = np.zeros(n)
+    progression = [(220.0, 261.63, 329.63), (174.61, 220.0, 261.63), (196.0, 246.94, 293.66)]
+    bar = beat * 4
+    for i in range(int(np.ceil(seconds / bar))):
+        s, e = int(i * bar * SAMPLE_RATE), min(n, int((i + 1) * bar * SAMPLE_RATE))
+        for freq in progression[i % len(progression)]:
+            chords_l[s:e] += 0.08 * np.sin(2 * np.pi * freq * 0.998 * t[s:e])
+            chords_r[s:e] += 0.08 * np.sin(2 * np.pi * freq * 1.002 * t[s:e])
+
+    # Lead: vibrato melody with a few harmonics (a rough vocal stand-in).
+    lead = np.zeros(n)
+    melody = rng.choice([440.0, 493.88, 523.25, 587.33, 659.25], size=int(seconds / beat) + 1)
+    for i, freq in enumerate(melody):
+        s, e = int(i * beat * SAMPLE_RATE), min(n, int((i + 1) * beat * SAMPLE_RATE))
+        if s >= n:
+            break
+        seg = t[s:e]
+        phase = 2 * np.pi * freq * seg + 0.3 * np.sin(2 * np.pi * 5.5 * seg)
+        voice = sum(np.sin(h * phase) / h for h in (1, 2, 3, 4))
+        lead[s:e] += 0.15 * voice * np.minimum(1.0, np.linspace(0, 8, e - s)) * _envelope(e - s, 0.5)
+
+    left = bass + drums + chords_l + 0.7 * lead
+    right = bass + drums + chords_r + 0.5 * lead
+    mix = np.stack([left, right], axis=1)
+    return (mix / np.max(np.abs(mix)) * 0.9).astype(np.float32)
+
+
+def write_corpus(out_dir: Path, durations=DEFAULT_DURATIONS, seed: int = 34) -> list[dict]:
+    """Write one WAV per duration; returns [{name, path, durationSeconds}]."""
+    import soundfile as sf
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    corpus = []
+    for index, seconds in enumerate(durations):
+        name = f"synth_{int(seconds)}s"
+        path = out_dir / f"{name}.wav"
+        if not path.exists():
+            sf.write(str(path), synth_track(seconds, seed=seed + index), SAMPLE_RATE, subtype="PCM_16")
+        corpus.append({"name": name, "path": str(path), "durationSeconds": float(seconds)})
+    return corpus
+
+
+# ─── runners ──────────────────────────────────────────────────────────
+
+
+def reset_peak_rss() -> bool:
+    """Reset this process's VmHWM (Linux ≥ 4.0); False when unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as handle:
+            handle.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    """This process's high-water RSS since the last reset_peak_rss (MiB).
+
+    Falls back to the lifetime ru_maxrss where /proc is unavailable.
+    """
+    try:
+        with open("/proc/self/status") as handle:
+            for line in handle:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def _passthrough_attempt(input_path, temp_dir, device, release_id, track_id, callback_url=None):
+    """Stand-in for main.run_demucs_attempt: every stem is the mix itself."""
+    import main
+
+    attempt_output_dir = Path(temp_dir) / f"demucs-{device}"
+    stem_dir = attempt_output_dir / main.DEMUCS_MODEL / Path(input_path).stem
+    stem_dir.mkdir(parents=True, exist_ok=True)
+    for stem in ("vocals", "drums", "bass", "other", "piano", "guitar"):
+        shutil.copyfile(input_path, stem_dir / f"{stem}.wav")
+    return 0, "", attempt_output_dir
+
+
+def _configure_worker(work_dir: Path, device: str, separator: str):
+    import main
+
+    main.STORAGE_MODE = "local"
+    main.OUTPUT_BASE_DIR = work_dir / "outputs"
+    main.DEMUCS_DEVICE = device
+    if separator == "passthrough":
+        main.run_demucs_attempt = _passthrough_attempt
+    return main
+
+
+def run_pipeline(main, track: dict, work_dir: Path) -> dict:
+    """Full run_demucs_separation on one track, as the worker runs it."""
+    from worker_metrics import track_job
+
+    if shutil.which("ffmpeg") is None:
+        raise BenchSkip("ffmpeg not installed")
+    with tempfile.TemporaryDirectory(dir=work_dir) as temp_dir:
+        input_path = Path(temp_dir) / Path(track["path"]).name
+        shutil.copyfile(track["path"], input_path)
+        per_run = reset_peak_rss()
+        start = time.monotonic()
+        with track_job() as timings:
+            asyncio.run(main.run_demucs_separation(input_path, temp_dir, "bench", track["name"]))
+        wall = time.monotonic() - start
+    return _result(track, "pipeline", wall, timings, per_run)
+
+
+def run_phases(main, track: dict, work_dir: Path) -> dict:
+    """Each phase in isolation on the same track (skipped when unavailable)."""
+    import audio_features
+    import waveform_peaks
+    from stem_encoding import build_encode_command
+    from worker_metrics import observe_phase, track_job
+
+    skipped = {}
+    with tempfile.TemporaryDirectory(dir=work_dir) as temp_dir, track_job() as timings:
+        input_path = Path(temp_dir) / Path(track["path"]).name
+        shutil.copyfile(track["path"], input_path)
+        per_run = reset_peak_rss()
+        start = time.monotonic()
+
+        if shutil.which("fpcalc"):
+            with observe_phase("fingerprint"):
+                main.generate_fingerprint(input_path)
+        else:
+            skipped["fingerprint"] = "fpcalc not installed"
+
+        # Timed by hand: a failed attempt (no model, no demucs) is a skip,
+        # not a data point.
+        separation_start = time.monotonic()
+        try:
+            returncode, output, _ = asyncio.run(main.run_demucs_attempt(
+                input_path, temp_dir, main.DEMUCS_DEVICE, "bench", track["name"],
+            ))
+        except FileNotFoundError as exc:
+            returncode, output = 127, str(exc)
+        if returncode == 0:
+            timings.record("separation", main.DEMUCS_DEVICE, time.monotonic() - separation_start)
+        else:
+            skipped["separation"] = output.strip().splitlines()[-1] if output.strip() else f"exit {returncode}"
+
+        if shutil.which("ffmpeg"):
+            command, report = main.with_usage_report(
+                build_encode_command(input_path, Path(temp_dir) / "bench.mp3"), temp_dir
+            )
+            with observe_phase("encode"):
+                subprocess.run(command, capture_output=True, check=True)
+            main.record_child_usage(report, "encode")
+        else:
+            skipped["encode"] = "ffmpeg not installed"
+
+        with observe_phase("features"):
+            audio_features.extract_stem_features(input_path)
+        with observe_phase("peaks"):
+            waveform_peaks.write_peaks(input_path, Path(temp_dir) / "bench.peaks")
+        wall = time.monotonic() - start
+
+    result = _result(track, "phases", wall, timings, per_run)
+    result["skipped"] = skipped
+    return result
+
+
+def _result(track: dict, mode: str, wall: float, timings, per_run: bool) -> dict:
+    usage = timings.resource_usage()
+    return {
+        "track": track["name"],
+        "mode": mode,
+        "durationSeconds": track["durationSeconds"],
+        "wallSeconds": round(wall, 3),
+        "realtimeFactor": round(wall / track["durationSeconds"], 4),
+        "phases": timings.as_dict()["phases"],
+        "childCpuSeconds": usage["childCpuSeconds"],
+        "childPeakRssMb": usage["childPeakRssMb"],
+        "processPeakRssMb": peak_rss_mb(),
+        "processPeakRssScope": "run" if per_run else "process",
+    }
+
+
+def _median_result(runs: list[dict]) -> dict:
+    """Per-field median over repeats (phases included)."""
+    merged = dict(runs[-1])
+    for key in ("wallSeconds", "realtimeFactor", "childCpuSeconds", "childPeakRssMb", "processPeakRssMb"):
+        merged[key] = round(statistics.median(run[key] for run in runs), 4)
+    phases = {name for run in runs for name in run["phases"]}
+    merged["phases"] = {
+        name: round(statistics.median(run["phases"].get(name, 0.0) for run in runs), 3)
+        for name in sorted(phases)
+    }
+    if any(run["processPeakRssScope"] != "run" for run in runs):
+        merged["processPeakRssScope"] = "process"
+    merged["repeats"] = len(runs)
+    return merged
+
+
+def warm_up(work_dir: Path) -> None:
+    """Pay librosa/numba import and JIT costs before anything is timed."""
+    import audio_features
+    import soundfile as sf
+
+    clip = work_dir / "warmup.wav"
+    sf.write(str(clip), synth_track(2.0), SAMPLE_RATE, subtype="PCM_16")
+    audio_features.extract_stem_features(clip)
+    clip.unlink()
+
+
+def run_benchmark(
+    work_dir: Path,
+    durations=DEFAULT_DURATIONS,
+    device: str = "cpu",
+    separator: str = "demucs",
+    modes=("pipeline", "phases"),
+    repeat: int = 1,
+) -> dict:
+    corpus = write_corpus(work_dir / "corpus", durations)
+    main = _configure_worker(work_dir, device, separator)
+    warm_up(work_dir)
+    runners = {"pipeline": run_pipeline, "phases": run_phases}
+    results = []
+    for track in corpus:
+        for mode in modes:
+            try:
+                runs = [runners[mode](main, track, work_dir) for _ in range(repeat)]
+            except BenchSkip as skip:
+                results.append({"track": track["name"], "mode": mode, "skipped": {mode: str(skip)}})
+                print(f"[bench] {track['name']:>10} {mode:<8} skipped: {skip}", file=sys.stderr)
+                continue
+            results.append(_median_result(runs))
+            print(
+                f"[bench] {track['name']:>10} {mode:<8} {results[-1]['wallSeconds']:8.2f}s "
+                f"rtf={results[-1]['realtimeFactor']:.3f}",
+                file=sys.stderr,
+            )
+    return {
+        "schema": RESULTS_SCHEMA,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpuCount": os.cpu_count(),
+            "device": device,
+            "separator": separator,
+        },
+        "corpus": [{k: v for k, v in track.items() if k != "path"} for track in corpus],
+        "results": results,
+    }
+
+
+# ─── comparison ───────────────────────────────────────────────────────
+
+
+def compare(current: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list[dict]:
+    """Rows for every (track, mode, metric) in both runs; `regressed` past tolerance.
+
+    Peak RSS (`rss:*`, MiB) is compared like the timings; the worker's own
+    peak only when both runs measured it per run.
+    """
+    def metrics(result: dict) -> dict:
+        values = {"wall": result["wallSeconds"]}
+        values.update({f"phase:{k}": v for k, v in result["phases"].items()})
+        if "childPeakRssMb" in result:
+            values["rss:child"] = result["childPeakRssMb"]
+        if result.get("processPeakRssScope") == "run":
+            values["rss:process"] = result["processPeakRssMb"]
+        return values
+
+    baseline_by_key = {(r["track"], r["mode"]): r for r in baseline.get("results", [])}
+    rows = []
+    for result in current.get("results", []):
+        previous = baseline_by_key.get((result["track"], result["mode"]))
+        if previous is None or "wallSeconds" not in previous or "wallSeconds" not in result:
+            continue
+        before, after = metrics(previous), metrics(result)
+        for name in sorted(set(before) & set(after)):
+            if before[name] <= 0:
+                continue
+            ratio = after[name] / before[name]
+            noise = MIN_REGRESSION_MB if name.startswith("rss:") else MIN_REGRESSION_SECONDS
+            rows.append({
+                "track": result["track"],
+                "mode": result["mode"],
+                "metric": name,
+                "baseline": before[name],
+                "current": after[name],
+                "ratio": round(ratio, 3),
+                "regressed": ratio > 1.0 + tolerance and after[name] - before[name] > noise,
+            })
+    return rows
+
+
+def format_comparison(rows: list[dict]) -> str:
+    lines = [f"{'track':>10} {'mode':<8} {'metric':<20} {'baseline':>10} {'current':>10} {'ratio':>7}"]
+    for row in rows:
+        flag = "  REGRESSED" if row["regressed"] else ""
+        lines.append(
+            f"{row['track']:>10} {row['mode']:<8} {row['metric']:<20} "
+            f"{row['baseline']:>10.3f} {row['current']:>10.3f} {row['ratio']:>7.3f}{flag}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--out", type=Path, help="Write results JSON here")
+    parser.add_argument("--work-dir", type=Path, help="Corpus/output scratch dir (default: temp)")
+    parser.add_argument("--durations", default=",".join(str(int(d)) for d in DEFAULT_DURATIONS),
+                        help="Comma-separated track lengths in seconds")
+    parser.add_argument("--device", default="cpu", choices=("cpu", "onnx", "cuda"))
+    parser.add_argument("--separator", default="demucs", choices=("demucs", "passthrough"))
+    parser.add_argument("--mode", action="append", choices=("pipeline", "phases"),
+                        help="Run only these modes (default: both)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per track; medians are reported")
+    parser.add_argument("--compare", type=Path, help="Baseline results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown ratio before a metric counts as regressed")
+    args = parser.parse_args(argv)
+
+    durations = tuple(float(d) for d in args.durations.split(",") if d.strip())
+    with tempfile.TemporaryDirectory(prefix="demucs-bench-") as scratch:
+        work_dir = args.work_dir or Path(scratch)
+        report = run_benchmark(
+            work_dir, durations, args.device, args.separator,
+            tuple(args.mode or ("pipeline", "phases")), max(1, args.repeat),
+        )
+
+    if args.out:
+        args.out.write_text(json.dumps(report, indent=2) + "\n")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        rows = compare(report, json.loads(args.compare.read_text()), args.tolerance)
+        print(format_comparison(rows), file=sys.stderr)
+        if any(row["regressed"] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Per-child CPU time and peak RSS for the worker's subprocesses.
+
+Demucs, ffmpeg and fpcalc do most of a job's work, but asyncio's child
+watcher reaps them with a plain `waitpid`, so their rusage is lost. Wrapping
+a command as
+
+    python child_usage.py --report usage.json -- demucs ...
+
+runs it as a direct child of this launcher, reaps it with `os.wait4` and
+writes the rusage as JSON before exiting with the child's status. stdio is
+inherited untouched (progress parsing keeps working), SIGTERM/SIGINT/SIGHUP
+are forwarded, and on Linux the child is killed if the launcher dies.
+
+`wrap` / `collect` are the worker-side helpers; both are stdlib-only.
+"""
+
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+FORWARDED_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+PR_SET_PDEATHSIG = 1
+
+
+def wrap(command: list[str], report_dir: Union[str, Path]) -> tuple[list[str], Path]:
+    """Return (launcher argv, report path) for `command`."""
+    fd, report = tempfile.mkstemp(prefix="usage-", suffix=".json", dir=str(report_dir))
+    os.close(fd)
+    launcher = [sys.executable, str(Path(__file__).resolve()), "--report", report, "--"]
+    return launcher + list(command), Path(report)
+
+
+def collect(report_path: Optional[Path]) -> Optional[dict]:
+    """Read and remove a launcher report; None if the child never ran."""
+    if report_path is None:
+        return None
+    try:
+        text = report_path.read_text()
+    except OSError:
+        return None
+    finally:
+        report_path.unlink(missing_ok=True)
+    try:
+        return json.loads(text) if text else None
+    except ValueError:
+        return None
+
+
+def _die_with_parent() -> None:
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        import ctypes
+
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    except (OSError, AttributeError):
+        pass
+
+
+def _spawn(command: list[str]) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            for signum in FORWARDED_SIGNALS:
+                signal.signal(signum, signal.SIG_DFL)
+            _die_with_parent()
+            os.execvp(command[0], command)
+        except OSError as exc:
+            os.write(2, f"child_usage: cannot run {command[0]}: {exc}\n".encode())
+        os._exit(127)
+    return pid
+
+
+def run(command: list[str], report: Path) -> int:
+    """Run `command`, write its rusage to `report`, return its wait status."""
+    start = time.monotonic()
+    pid = _spawn(command)
+
+    def forward(signum, _frame):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    for signum in FORWARDED_SIGNALS:
+        signal.signal(signum, forward)
+
+    _, status, usage = os.wait4(pid, 0)
+    report.write_text(json.dumps({
+        "command": Path(command[0]).name,
+        "exitCode": os.waitstatus_to_exitcode(status),
+        "wallSeconds": round(time.monotonic() - start, 3),
+        "cpuUserSeconds": round(usage.ru_utime, 3),
+        "cpuSystemSeconds": round(usage.ru_stime, 3),
+        # ru_maxrss is KiB on Linux, bytes on macOS.
+        "maxRssMb": round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+    }))
+    return status
+
+
+def main(argv: list[str]) -> None:
+    if len(argv) < 4 or argv[0] != "--report" or argv[2] != "--":
+        sys.exit("usage: child_usage.py --report PATH -- COMMAND [ARGS...]")
+    status = run(argv[3:], Path(argv[1]))
+    if os.WIFSIGNALED(status):
+        # Die of the same signal so the caller sees the child's real status.
+        signum = os.WTERMSIG(status)
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+    sys.exit(os.waitstatus_to_exitcode(status))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
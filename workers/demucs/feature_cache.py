@@ -0,0 +1,180 @@
+"""Persistent cache of stem feature dicts, keyed by audio content.
+
+Retries, re-ingests and diagnostic `/analyze` runs keep presenting the same
+audio. `feature_key` combines the file's sha256 with everything that
+changes the extractor's output (`SCHEMA_VERSION`, the librosa version, the
+analysis sample rate), so a hit is exactly what `extract_stem_features`
+would return and an upgrade misses instead of serving stale features.
+
+Entries are small JSON files in a local directory, evicted least-recently
+used once they exceed a byte budget. An optional second tier in the bucket
+shares results across worker instances; bucket hits are copied locally.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from importlib import metadata
+from pathlib import Path
+from typing import Optional, Union
+
+from audio_features import ANALYSIS_SAMPLE_RATE, SCHEMA_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Eviction trims the local store to this fraction of its budget, so a full
+# cache is not rescanned on every write.
+EVICT_TO_FRACTION = 0.9
+
+
+def feature_key(sha256: str) -> str:
+    """Cache key of an audio file's features under the current extractor."""
+    try:
+        librosa_version = metadata.version("librosa")
+    except metadata.PackageNotFoundError:
+        librosa_version = "unknown"
+    canonical = f"{sha256}:{SCHEMA_VERSION}:librosa-{librosa_version}:sr-{ANALYSIS_SAMPLE_RATE}"
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+class LocalFeatureStore:
+    """`{key}.json` files under one directory; recency is the file's mtime."""
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def lookup(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            features = json.loads(path.read_text())
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            path.unlink(missing_ok=True)
+            return None
+        return features
+
+    def save(self, key: str, features: dict) -> int:
+        """Write the entry atomically; returns its size in bytes."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        data = json.dumps(features, separators=(",", ":")).encode()
+        tmp = self._path(key).with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, self._path(key))
+        return len(data)
+
+    def entries(self) -> list[tuple[str, int, float]]:
+        """(key, bytes, last used) for every cached entry."""
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((path.stem, stat.st_size, stat.st_mtime))
+        return entries
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+
+class GcsFeatureStore:
+    """Entries as `prefix/{key}.json` objects; never evicted by the worker."""
+
+    def __init__(self, bucket, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+
+    def _name(self, key: str) -> str:
+        return f"{self.prefix}/{key}.json"
+
+    def lookup(self, key: str) -> Optional[dict]:
+        from google.api_core import exceptions as google_exceptions
+
+        try:
+            return json.loads(self.bucket.blob(self._name(key)).download_as_bytes())
+        except google_exceptions.NotFound:
+            return None
+
+    def save(self, key: str, features: dict) -> None:
+        self.bucket.blob(self._name(key)).upload_from_string(
+            json.dumps(features, separators=(",", ":")), content_type="application/json",
+        )
+
+
+class FeatureCache:
+    """Local LRU store capped at `max_bytes`, optionally backed by a remote store.
+
+    Lookups and writes never raise: a broken cache costs an extraction, not
+    a job.
+    """
+
+    def __init__(self, local: LocalFeatureStore, max_bytes: int, remote=None):
+        self.local = local
+        self.max_bytes = max_bytes
+        self.remote = remote
+        self._lock = threading.Lock()
+        self._bytes: Optional[int] = None
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            features = self.local.lookup(key)
+        except Exception as exc:
+            logger.warning(f"[features] local cache lookup failed: {exc}")
+            features = None
+        if features is not None or self.remote is None:
+            return features
+        try:
+            features = self.remote.lookup(key)
+        except Exception as exc:
+            logger.warning(f"[features] bucket cache lookup failed: {exc}")
+            return None
+        if features is not None:
+            self._save_local(key, features)
+        return features
+
+    def put(self, key: str, features: dict) -> None:
+        self._save_local(key, features)
+        if self.remote is not None:
+            try:
+                self.remote.save(key, features)
+            except Exception as exc:
+                logger.warning(f"[features] bucket cache write failed: {exc}")
+
+    def _save_local(self, key: str, features: dict) -> None:
+        try:
+            size = self.local.save(key, features)
+            with self._lock:
+                if self._bytes is None:
+                    self._bytes = sum(size for _, size, _ in self.local.entries())
+                else:
+                    self._bytes += size
+                if self._bytes > self.max_bytes:
+                    self.evict(keep=key)
+        except Exception as exc:
+            logger.warning(f"[features] local cache write failed: {exc}")
+
+    def evict(self, keep: Optional[str] = None) -> list[str]:
+        """Drop oldest entries until the store is under EVICT_TO_FRACTION of its budget."""
+        entries = sorted(self.local.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICT_TO_FRACTION
+        evicted = []
+        for key, size, _ in entries:
+            if total <= target:
+                break
+            if key == keep:
+                continue
+            self.local.delete(key)
+            total -= size
+            evicted.append(key)
+        self._bytes = total
+        if evicted:
+            logger.info(f"[features] evicted {len(evicted)} cached entries, {total} bytes remain")
+        return evicted
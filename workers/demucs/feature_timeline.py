@@ -0,0 +1,148 @@
+"""Frame-level feature timelines for stems.
+
+`extract_stem_features` reduces its onset envelope, beat frames, RMS curve
+and chroma frames to a few scalars. Render alignment and section detection
+need the curves themselves, so the worker can keep them in a small file per
+stem; consumers then read timelines instead of decoding audio again.
+
+File layout (little-endian), like the waveform peaks files:
+
+    b"RSTL"                 magic
+    uint32                  header length in bytes
+    header                  UTF-8 JSON (see `write_timeline`)
+    arrays                  raw array data, each 8-byte aligned
+
+Not `.npz`: numpy cannot memory-map members of a zip archive, and a raw
+layout lets `TimelineReader` hand out `np.memmap` views without reading
+the file.
+
+Arrays (frames at `frameRate` per second, frame i centred on
+i / frameRate seconds):
+
+    beatFrames      int32   (beats,)       frame index of each tracked beat
+    onsetEnvelope   float16 (frames,)      onset strength
+    rms             float16 (frames,)      RMS energy
+    chroma          float16 (12, frames)   pitch-class energy, C..B
+"""
+
+import json
+import struct
+from pathlib import Path
+from typing import Union
+
+MAGIC = b"RSTL"
+FORMAT_VERSION = 1
+ALIGNMENT = 8
+CONTENT_TYPE = "application/octet-stream"
+
+# Stored dtype per array; anything else is refused by write_timeline.
+ARRAY_DTYPES = {
+    "beatFrames": "<i4",
+    "onsetEnvelope": "<f2",
+    "rms": "<f2",
+    "chroma": "<f2",
+}
+
+
+def write_timeline(
+    dest: Union[str, Path],
+    arrays: dict,
+    sample_rate: int,
+    hop_length: int,
+    features_schema: str,
+) -> Path:
+    """Write `arrays` ({name: array} for every ARRAY_DTYPES name) to `dest`.
+
+    `sample_rate` and `hop_length` are the analysis framing, so frame i is
+    at i * hop_length / sample_rate seconds. Array offsets in the header
+    are relative to the end of the header.
+    """
+    import numpy as np
+
+    if set(arrays) != set(ARRAY_DTYPES):
+        raise ValueError(f"timeline needs exactly {sorted(ARRAY_DTYPES)}, got {sorted(arrays)}")
+    header = {
+        "version": FORMAT_VERSION,
+        "featuresSchema": features_schema,
+        "sampleRate": int(sample_rate),
+        "hopLength": int(hop_length),
+        "frameRate": sample_rate / hop_length,
+        "frames": int(len(arrays["onsetEnvelope"])),
+        "arrays": {},
+    }
+    encoded_arrays = []
+    offset = 0
+    for name, dtype in ARRAY_DTYPES.items():
+        data = np.ascontiguousarray(arrays[name], dtype=dtype)
+        offset += -offset % ALIGNMENT
+        header["arrays"][name] = {"dtype": dtype, "shape": list(data.shape), "offset": offset}
+        encoded_arrays.append((offset, data))
+        offset += data.nbytes
+
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # Pad the header so array offsets are aligned in the file too.
+    encoded += b" " * (-(8 + len(encoded)) % ALIGNMENT)
+    dest = Path(dest)
+    with open(dest, "wb") as handle:
+        handle.write(MAGIC)
+        handle.write(struct.pack("<I", len(encoded)))
+        handle.write(encoded)
+        position = 0
+        for array_offset, data in encoded_arrays:
+            handle.write(b"\0" * (array_offset - position))
+            handle.write(data.tobytes())
+            position = array_offset + data.nbytes
+    return dest
+
+
+class TimelineReader:
+    """Memory-mapped view of a timeline file.
+
+        timeline = TimelineReader(path)
+        timeline.header["frameRate"]
+        timeline["chroma"][:, 100:200]      # pages in only those frames
+        timeline.beat_times()
+
+    Arrays are read-only `np.memmap`s; nothing is read until indexed.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path, "rb") as handle:
+            prefix = handle.read(8)
+            if len(prefix) < 8 or prefix[:4] != MAGIC:
+                raise ValueError(f"{path} is not a timeline file")
+            (header_len,) = struct.unpack("<I", prefix[4:8])
+            self.header = json.loads(handle.read(header_len))
+        if self.header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path} has unsupported timeline version {self.header.get('version')}")
+        self._data_offset = 8 + header_len
+        self._arrays: dict = {}
+
+    def __getitem__(self, name: str):
+        import numpy as np
+
+        if name not in self._arrays:
+            spec = self.header["arrays"][name]
+            shape = tuple(spec["shape"])
+            if 0 in shape:
+                self._arrays[name] = np.zeros(shape, dtype=spec["dtype"])
+            else:
+                self._arrays[name] = np.memmap(
+                    self.path, dtype=spec["dtype"], mode="r",
+                    offset=self._data_offset + spec["offset"], shape=shape,
+                )
+        return self._arrays[name]
+
+    def names(self) -> list[str]:
+        return list(self.header["arrays"])
+
+    def frame_times(self):
+        """Seconds of every frame."""
+        import numpy as np
+
+        return np.arange(self.header["frames"]) / self.header["frameRate"]
+
+    def beat_times(self):
+        """Seconds of every tracked beat."""
+        return self["beatFrames"] / self.header["frameRate"]
@@ -0,0 +1,384 @@
+"""Compact Chromaprint fingerprints and a local near-duplicate index.
+
+`fpcalc -raw` yields one 32-bit sub-fingerprint per ~124 ms frame. Shipping
+those as comma-joined decimals is ~3x larger than the packed form, and a
+SHA-256 over them only catches byte-exact duplicates. This module provides:
+
+- `pack_fingerprint` / `unpack_fingerprint`: little-endian uint32 array,
+  base64-encoded (pure stdlib, safe to use on the request path).
+- `FingerprintIndex`: bit-sampled LSH over short frame windows. Each table
+  hashes a fixed random subset of bits from `WINDOW` consecutive frames, so
+  a re-encode (a few flipped bits) still collides on most tables and a
+  trimmed copy still collides at a shifted frame offset. Candidates are
+  ranked by (entry, offset) votes and verified by the bit error rate over
+  the aligned overlap. The index is numpy-backed and persisted as one
+  uncompressed `.npz`.
+
+`add` only hashes the new fingerprint into a small pending table that
+queries search alongside the sorted arrays. The pending table is merged in
+(a sorted insert, linear in the index size) once it holds
+PENDING_MERGE_ENTRIES fingerprints or on save, so adding and querying one
+track per job never re-sorts the whole index. `save` drops entries replaced by a re-add before writing,
+so re-processed tracks do not grow the file.
+"""
+
+import base64
+import json
+import logging
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_ENCODING = "chromaprint-u32le-base64"
+
+# Chromaprint's default config: 4096-sample frames at 11025 Hz, 1/3 overlap.
+FRAME_SECONDS = 4096 / 3 / 11025
+
+INDEX_FORMAT_VERSION = 1
+TABLES = 4
+WINDOW = 2
+BITS_PER_FRAME = 10
+# Index every STRIDE-th window; queries probe every window, so any
+# trim offset still lines up with an indexed position.
+STRIDE = 4
+# Buckets this full are silence/noise "stop words" and carry no signal.
+MAX_BUCKET = 256
+CANDIDATES_PER_QUERY = 8
+MIN_OVERLAP_FRAMES = 40
+# Fingerprints kept in the pending table before it is merged into the
+# sorted arrays.
+PENDING_MERGE_ENTRIES = 64
+
+
+def pack_fingerprint(values: Iterable[int]) -> str:
+    """Chromaprint integers → base64 of a little-endian uint32 array."""
+    values = [int(v) & 0xFFFFFFFF for v in values]
+    return base64.b64encode(struct.pack(f"<{len(values)}I", *values)).decode("ascii")
+
+
+def unpack_fingerprint(packed: str) -> list[int]:
+    raw = base64.b64decode(packed)
+    if len(raw) % 4:
+        raise ValueError("Packed fingerprint length is not a multiple of 4 bytes")
+    return list(struct.unpack(f"<{len(raw) // 4}I", raw))
+
+
+def _popcount32(values):
+    import numpy as np
+
+    as_bytes = values.astype("<u4").view(np.uint8)
+    return np.unpackbits(as_bytes).reshape(len(values), 32).sum(axis=1)
+
+
+def _table_bits(seed: int = 27):
+    """Deterministic (TABLES, WINDOW, BITS_PER_FRAME) bit positions."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    return np.stack([
+        np.stack([rng.choice(32, BITS_PER_FRAME, replace=False) for _ in range(WINDOW)])
+        for _ in range(TABLES)
+    ])
+
+
+class FingerprintIndex:
+    """Near-duplicate index over packed Chromaprint fingerprints.
+
+    Thread-safe for the worker's one-writer/many-reader use. Entries are
+    keyed by track id; re-adding a track replaces its previous entry.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None):
+        import numpy as np
+
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        # Serialises writers so an older snapshot never replaces a newer file.
+        self._save_lock = threading.Lock()
+        self._bits = _table_bits()
+        self._ids: list[str] = []
+        self._meta: list[dict] = []
+        self._live: list[bool] = []
+        self._by_id: dict[str, int] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._frames = np.zeros(0, dtype=np.uint32)
+        self._keys = [np.zeros(0, dtype=np.uint32) for _ in range(TABLES)]
+        self._postings = [np.zeros(0, dtype=np.uint64) for _ in range(TABLES)]
+        self._pending: list[tuple] = []
+        # Sorted (keys, postings) per table of the pending entries, rebuilt
+        # on the first query after an add.
+        self._pending_tables: Optional[list] = None
+        self._dirty = False
+        if self.path and self.path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return sum(self._live)
+
+    @property
+    def dirty(self) -> bool:
+        """True when entries were added since the last save or load."""
+        return self._dirty
+
+    # ─── hashing ──────────────────────────────────────────────────────
+
+    def _window_keys(self, frames):
+        """(TABLES, n_windows) uint32 keys for every window start."""
+        import numpy as np
+
+        n = len(frames) - WINDOW + 1
+        if n <= 0:
+            return np.zeros((TABLES, 0), dtype=np.uint32)
+        keys = np.zeros((TABLES, n), dtype=np.uint32)
+        for t in range(TABLES):
+            for w in range(WINDOW):
+                window = frames[w: w + n]
+                for b, bit in enumerate(self._bits[t, w]):
+                    shift = w * BITS_PER_FRAME + b
+                    keys[t] |= ((window >> np.uint32(bit)) & np.uint32(1)) << np.uint32(shift)
+        return keys
+
+    # ─── mutation ─────────────────────────────────────────────────────
+
+    def add(self, track_id: str, values: Union[list, str], meta: Optional[dict] = None) -> None:
+        """Index a fingerprint (integers or packed string) under `track_id`."""
+        import numpy as np
+
+        if isinstance(values, str):
+            values = unpack_fingerprint(values)
+        frames = np.asarray(values, dtype=np.int64).astype(np.uint32)
+        with self._lock:
+            previous = self._by_id.get(track_id)
+            if previous is not None:
+                self._live[previous] = False
+            entry = len(self._ids)
+            self._by_id[track_id] = entry
+            self._ids.append(track_id)
+            self._meta.append(dict(meta or {}))
+            self._live.append(True)
+            self._dirty = True
+
+            keys = self._window_keys(frames)[:, ::STRIDE]
+            positions = np.arange(0, keys.shape[1] * STRIDE, STRIDE, dtype=np.uint64)
+            postings = (np.uint64(entry) << np.uint64(32)) | positions
+            self._pending.append(([keys[t] for t in range(TABLES)], postings, frames))
+            self._pending_tables = None
+            if len(self._pending) >= PENDING_MERGE_ENTRIES:
+                self._merge_pending()
+
+    def _sorted_pending(self) -> list:
+        """(keys, postings) per table of the pending entries, sorted by key."""
+        import numpy as np
+
+        if self._pending_tables is None:
+            self._pending_tables = []
+            for t in range(TABLES):
+                keys = np.concatenate([np.zeros(0, dtype=np.uint32)] + [p[0][t] for p in self._pending])
+                postings = np.concatenate([np.zeros(0, dtype=np.uint64)] + [p[1] for p in self._pending])
+                order = np.argsort(keys, kind="stable")
+                self._pending_tables.append((keys[order], postings[order]))
+        return self._pending_tables
+
+    def _merge_pending(self) -> None:
+        import numpy as np
+
+        if not self._pending:
+            return
+        added = [p[2] for p in self._pending]
+        lengths = np.array([len(frames) for frames in added], dtype=np.int64)
+        self._offsets = np.concatenate([self._offsets, self._offsets[-1] + np.cumsum(lengths)])
+        self._frames = np.concatenate([self._frames] + added)
+        for t, (keys, postings) in enumerate(self._sorted_pending()):
+            # side="right" keeps older postings first among equal keys.
+            at = np.searchsorted(self._keys[t], keys, side="right")
+            self._keys[t] = np.insert(self._keys[t], at, keys)
+            self._postings[t] = np.insert(self._postings[t], at, postings)
+        self._pending = []
+        self._pending_tables = None
+
+    def _entry_frames(self, entry: int):
+        merged = len(self._offsets) - 1
+        if entry >= merged:
+            return self._pending[entry - merged][2]
+        return self._frames[self._offsets[entry]: self._offsets[entry + 1]]
+
+    # ─── query ────────────────────────────────────────────────────────
+
+    def query(
+        self,
+        values: Union[list, str],
+        min_similarity: float = 0.75,
+        exclude: Optional[str] = None,
+        limit: int = 5,
+    ) -> list[dict]:
+        """Return near-duplicate candidates, best first.
+
+        `similarity` is 1 - bit error rate over the aligned overlap (≈0.5
+        for unrelated audio, ≥0.85 for re-encodes of the same recording).
+        """
+        import numpy as np
+
+        if isinstance(values, str):
+            values = unpack_fingerprint(values)
+        query = np.asarray(values, dtype=np.int64).astype(np.uint32)
+        with self._lock:
+            if not self._ids or len(query) < WINDOW:
+                return []
+            qkeys = self._window_keys(query)
+            tables = [(t, self._keys[t], self._postings[t]) for t in range(TABLES)]
+            if self._pending:
+                tables += [(t, *table) for t, table in enumerate(self._sorted_pending())]
+
+            votes = []
+            for t, table_keys, table_postings in tables:
+                lo = np.searchsorted(table_keys, qkeys[t], side="left")
+                hi = np.searchsorted(table_keys, qkeys[t], side="right")
+                counts = hi - lo
+                keep = (counts > 0) & (counts <= MAX_BUCKET)
+                if not keep.any():
+                    continue
+                lo, counts = lo[keep], counts[keep]
+                qpos = np.nonzero(keep)[0]
+                # Expand every [lo, hi) run into flat posting indices.
+                starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+                flat = starts + np.arange(counts.sum())
+                hits = table_postings[flat]
+                entry = (hits >> np.uint64(32)).astype(np.int64)
+                offset = (hits & np.uint64(0xFFFFFFFF)).astype(np.int64) - np.repeat(qpos, counts)
+                votes.append(entry * (1 << 32) + (offset + (1 << 31)))
+            if not votes:
+                return []
+
+            combined, tally = np.unique(np.concatenate(votes), return_counts=True)
+            best = np.argsort(tally)[::-1]
+            seen_entries: set = set()
+            results = []
+            for idx in best:
+                if len(seen_entries) >= CANDIDATES_PER_QUERY:
+                    break
+                entry = int(combined[idx] >> 32)
+                offset = int(combined[idx] & 0xFFFFFFFF) - (1 << 31)
+                if entry in seen_entries or not self._live[entry]:
+                    continue
+                if exclude is not None and self._ids[entry] == exclude:
+                    continue
+                seen_entries.add(entry)
+                match = self._verify(entry, query, offset)
+                if match and match["similarity"] >= min_similarity:
+                    results.append(match)
+
+        results.sort(key=lambda m: m["similarity"], reverse=True)
+        return results[:limit]
+
+    def _verify(self, entry: int, query, offset: int) -> Optional[dict]:
+        """Bit error rate between `query` and entry frames shifted by `offset`."""
+        stored = self._entry_frames(entry)
+        q_start = max(0, -offset)
+        s_start = max(0, offset)
+        overlap = min(len(query) - q_start, len(stored) - s_start)
+        if overlap < min(MIN_OVERLAP_FRAMES, len(query), len(stored)) or overlap <= 0:
+            return None
+        diff = query[q_start: q_start + overlap] ^ stored[s_start: s_start + overlap]
+        errors = int(_popcount32(diff).sum())
+        similarity = 1.0 - errors / (32.0 * overlap)
+        return {
+            "trackId": self._ids[entry],
+            **self._meta[entry],
+            "similarity": round(similarity, 4),
+            "offsetSeconds": round(offset * FRAME_SECONDS, 2),
+            "overlapSeconds": round(overlap * FRAME_SECONDS, 2),
+        }
+
+    # ─── persistence ──────────────────────────────────────────────────
+
+    def _compact(self) -> None:
+        """Drop replaced entries and renumber the rest (pending merged first)."""
+        import numpy as np
+
+        live = np.asarray(self._live, dtype=bool)
+        if live.all():
+            return
+        kept = np.nonzero(live)[0]
+        renumber = np.full(len(live), -1, dtype=np.int64)
+        renumber[kept] = np.arange(len(kept))
+
+        starts, stops = self._offsets[:-1][kept], self._offsets[1:][kept]
+        lengths = stops - starts
+        self._frames = (
+            np.concatenate([self._frames[a:b] for a, b in zip(starts, stops)])
+            if len(kept) else np.zeros(0, dtype=np.uint32)
+        )
+        self._offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        for t in range(TABLES):
+            entries = (self._postings[t] >> np.uint64(32)).astype(np.int64)
+            keep = live[entries]
+            positions = self._postings[t][keep] & np.uint64(0xFFFFFFFF)
+            self._keys[t] = self._keys[t][keep]
+            self._postings[t] = (renumber[entries[keep]].astype(np.uint64) << np.uint64(32)) | positions
+
+        self._ids = [self._ids[i] for i in kept]
+        self._meta = [self._meta[i] for i in kept]
+        self._live = [True] * len(kept)
+        self._by_id = {track_id: i for i, track_id in enumerate(self._ids)}
+
+    def save(self, path: Optional[Union[str, Path]] = None) -> Path:
+        """Compact and atomically write the index to `path` (defaults to its own path).
+
+        Only the snapshot is taken under the lock; queries are not blocked
+        while the file is written.
+        """
+        import numpy as np
+
+        target = Path(path) if path else self.path
+        if target is None:
+            raise ValueError("FingerprintIndex has no path to save to")
+        with self._save_lock:
+            with self._lock:
+                self._merge_pending()
+                self._compact()
+                self._dirty = False
+                header = {
+                    "version": INDEX_FORMAT_VERSION,
+                    "encoding": FINGERPRINT_ENCODING,
+                    "ids": list(self._ids),
+                    "meta": list(self._meta),
+                    "live": list(self._live),
+                }
+                # Merges and compaction replace these arrays rather than
+                # mutating them, so the references stay valid after unlocking.
+                arrays = {"offsets": self._offsets, "frames": self._frames}
+                for t in range(TABLES):
+                    arrays[f"keys{t}"] = self._keys[t]
+                    arrays[f"postings{t}"] = self._postings[t]
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(target.name + ".tmp")
+            with open(tmp, "wb") as handle:
+                np.savez(handle, header=np.array(json.dumps(header)), **arrays)
+            os.replace(tmp, target)
+        return target
+
+    def _load(self) -> None:
+        import numpy as np
+
+        with np.load(self.path, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            if header.get("version") != INDEX_FORMAT_VERSION:
+                logger.warning(
+                    f"[fingerprint-index] Ignoring {self.path}: format "
+                    f"{header.get('version')} != {INDEX_FORMAT_VERSION}"
+                )
+                return
+            self._ids = list(header["ids"])
+            self._meta = list(header["meta"])
+            self._live = list(header["live"])
+            self._by_id = {
+                track_id: i for i, track_id in enumerate(self._ids) if self._live[i]
+            }
+            self._offsets = data["offsets"]
+            self._frames = data["frames"]
+            self._keys = [data[f"keys{t}"] for t in range(TABLES)]
+            self._postings = [data[f"postings{t}"] for t in range(TABLES)]
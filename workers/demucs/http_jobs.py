@@ -0,0 +1,192 @@
+"""Bounded in-process job queue for HTTP mode.
+
+`/separate` used to run Demucs inside the request, so N concurrent requests
+meant N concurrent Demucs processes. Jobs now go through a `JobQueue`: a
+fixed pool of worker tasks drains a bounded `asyncio.Queue`, and a full
+queue is rejected up front (`QueueFull`) instead of piling up uploads.
+
+Each `HttpJob` keeps its status, last Demucs progress and result, and fans
+events out to any number of subscribers; `sse_events` turns that into a
+server-sent-events stream. Finished jobs are kept (newest `retention`) so
+clients can still poll them after completion.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+TERMINAL = (COMPLETED, FAILED)
+
+
+class QueueFull(Exception):
+    """The job queue is at capacity; the caller should retry later."""
+
+
+class HttpJob:
+    """One queued separation: status, progress, result, event subscribers."""
+
+    def __init__(self, release_id: str, track_id: str, payload: Optional[dict] = None):
+        self.id = uuid.uuid4().hex
+        self.release_id = release_id
+        self.track_id = track_id
+        self.payload = payload or {}
+        self.status = QUEUED
+        self.progress = 0
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = asyncio.Event()
+        self._subscribers: list[asyncio.Queue] = []
+
+    def snapshot(self) -> dict:
+        state = {
+            "jobId": self.id,
+            "releaseId": self.release_id,
+            "trackId": self.track_id,
+            "status": self.status,
+            "progress": self.progress,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+        }
+        if self.result is not None:
+            state["result"] = self.result
+        if self.error is not None:
+            state["error"] = self.error
+        return state
+
+    def _publish(self, event: str, data: dict) -> None:
+        for subscriber in self._subscribers:
+            subscriber.put_nowait((event, data))
+
+    def set_progress(self, percentage: int) -> None:
+        if percentage != self.progress:
+            self.progress = percentage
+            self._publish("progress", {"jobId": self.id, "progress": percentage})
+
+    def set_status(self, status: str, result: Optional[dict] = None, error: Optional[str] = None) -> None:
+        self.status = status
+        if status == RUNNING:
+            self.started_at = time.time()
+        if status in TERMINAL:
+            self.finished_at = time.time()
+            self.result, self.error = result, error
+            if status == COMPLETED:
+                self.progress = 100
+        self._publish("status", self.snapshot())
+        if status in TERMINAL:
+            self.done.set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+
+class JobQueue:
+    """`workers` tasks running `runner(job)` over at most `max_queued` waiting jobs."""
+
+    def __init__(
+        self,
+        runner: Callable[[HttpJob], Awaitable[dict]],
+        workers: int = 1,
+        max_queued: int = 8,
+        retention: int = 100,
+    ):
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self.retention = retention
+        self.jobs: "OrderedDict[str, HttpJob]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        # First use, or the previous loop is gone (e.g. a new test client).
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [loop.create_task(self._work(), name=f"http-job-{i}") for i in range(self.workers)]
+
+    def submit(self, job: HttpJob) -> HttpJob:
+        """Enqueue `job` or raise QueueFull; never waits."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFull(f"{self.max_queued} jobs already waiting")
+        self.jobs[job.id] = job
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> Optional[HttpJob]:
+        return self.jobs.get(job_id)
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in TERMINAL]
+        for job_id in finished[: max(0, len(finished) - self.retention)]:
+            del self.jobs[job_id]
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                job.set_status(RUNNING)
+                result = await self.runner(job)
+                job.set_status(COMPLETED, result=result)
+            except Exception as exc:
+                logger.error(f"[jobs] {job.id} ({job.release_id}/{job.track_id}) failed: {exc}")
+                job.set_status(FAILED, error=str(exc))
+            finally:
+                self._queue.task_done()
+                self._prune()
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def sse_events(job: HttpJob, heartbeat_seconds: float = 15.0) -> AsyncIterator[str]:
+    """Current state, then every status/progress event until the job finishes.
+
+    A comment line is sent every `heartbeat_seconds` without events so
+    proxies keep the connection open during long separations.
+    """
+    queue = job.subscribe()
+    try:
+        yield format_sse("status", job.snapshot())
+        if job.status in TERMINAL:
+            return
+        while True:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event, data)
+            if event == "status" and data["status"] in TERMINAL:
+                return
+    finally:
+        job.unsubscribe(queue)
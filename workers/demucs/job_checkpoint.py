@@ -0,0 +1,163 @@
+"""Per-job checkpoint manifests for resumable Pub/Sub jobs.
+
+Pub/Sub redelivers a message whenever the worker dies before acking it, and
+everything a job produces lives in a TemporaryDirectory. The manifest
+records each completed phase (fingerprint, every stored stem, the finished
+separation, the publish) in the job's output location, keyed by `jobId` and
+the SHA-256 of the source audio, so a redelivered job picks up where the
+previous attempt stopped and re-publishes instead of separating again.
+
+A different source file under the same jobId gets a different key, so stale
+artifacts are never reused. Manifests are small JSON documents written
+after every phase; stores only need whole-object read/write, plus `prune`
+to drop manifests nobody has touched within the retention window.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: Union[str, Path], chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checkpoint_key(job_id: str, source_sha256: str) -> str:
+    safe_job = "".join(c if c.isalnum() or c in "-_." else "_" for c in job_id)
+    return f"{safe_job}-{source_sha256[:16]}"
+
+
+class LocalCheckpointStore:
+    """Manifests as files under a directory (shared volume in local mode)."""
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+
+    def read(self, key: str) -> Optional[str]:
+        try:
+            return (self.directory / f"{key}.json").read_text()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, text: str) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        target = self.directory / f"{key}.json"
+        tmp = target.with_name(target.name + ".tmp")
+        tmp.write_text(text)
+        os.replace(tmp, target)
+
+    def prune(self, max_age_seconds: float) -> int:
+        """Delete manifests not updated for `max_age_seconds`; returns the count."""
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        for path in self.directory.glob("*.json"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+
+class GcsCheckpointStore:
+    """Manifests as objects under `prefix/` in a GCS bucket."""
+
+    def __init__(self, bucket, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+
+    def read(self, key: str) -> Optional[str]:
+        from google.api_core import exceptions as google_exceptions
+
+        try:
+            return self.bucket.blob(f"{self.prefix}/{key}.json").download_as_text()
+        except google_exceptions.NotFound:
+            return None
+
+    def write(self, key: str, text: str) -> None:
+        self.bucket.blob(f"{self.prefix}/{key}.json").upload_from_string(
+            text, content_type="application/json"
+        )
+
+    def prune(self, max_age_seconds: float) -> int:
+        from google.api_core import exceptions as google_exceptions
+
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        for blob in self.bucket.list_blobs(prefix=f"{self.prefix}/"):
+            if blob.updated is None or blob.updated.timestamp() >= cutoff:
+                continue
+            try:
+                blob.delete()
+                removed += 1
+            except google_exceptions.NotFound:
+                continue
+        return removed
+
+
+class JobCheckpoint:
+    """Completed phases and stems of one job, persisted on every update."""
+
+    def __init__(self, job_id: str, source_sha256: str, store):
+        self.job_id = job_id
+        self.source_sha256 = source_sha256
+        self.key = checkpoint_key(job_id, source_sha256)
+        self.store = store
+        self.manifest = {
+            "version": MANIFEST_VERSION,
+            "jobId": job_id,
+            "sourceSha256": source_sha256,
+            "phases": {},
+            "stems": {},
+        }
+        self.resumed = False
+        self._load()
+
+    def _load(self) -> None:
+        text = self.store.read(self.key)
+        if not text:
+            return
+        try:
+            manifest = json.loads(text)
+        except ValueError:
+            logger.warning(f"[checkpoint] ignoring unreadable manifest {self.key}")
+            return
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("sourceSha256") != self.source_sha256:
+            return
+        self.manifest = manifest
+        self.resumed = bool(manifest["phases"] or manifest["stems"])
+
+    def _save(self) -> None:
+        """Persist; a failed write only costs resumability, never the job."""
+        self.manifest["updatedAt"] = time.time()
+        try:
+            self.store.write(self.key, json.dumps(self.manifest, separators=(",", ":")))
+        except Exception as exc:
+            logger.warning(f"[checkpoint] could not save manifest {self.key}: {exc}")
+
+    def get(self, phase: str) -> Optional[dict]:
+        return self.manifest["phases"].get(phase)
+
+    def complete(self, phase: str, data: Optional[dict] = None) -> None:
+        self.manifest["phases"][phase] = dict(data or {})
+        self._save()
+
+    def stem(self, name: str) -> Optional[dict]:
+        return self.manifest["stems"].get(name)
+
+    def complete_stem(self, name: str, data: dict) -> None:
+        self.manifest["stems"][name] = dict(data)
+        self._save()
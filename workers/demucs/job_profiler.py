@@ -0,0 +1,88 @@
+"""Opt-in sampling profiler for the in-process parts of a job.
+
+Feature extraction, peaks and uploads run inside the worker process, where
+child rusage cannot see them. `SamplingProfiler` samples a set of threads'
+stacks every few milliseconds (`sys._current_frames`, no tracing hooks) and
+writes the counts as folded stacks (`frame;frame;frame count`), the input
+format of flamegraph.pl and speedscope.
+
+Threads join and leave the set while the profiler runs (`sampling`), so a
+job's blocking work in worker threads is attributed to that job even when
+several jobs share one event loop.
+"""
+
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+
+MAX_DEPTH = 64
+
+
+def _folded(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{Path(code.co_filename).name}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Sample `thread_ids` (default: the calling thread) until stopped."""
+
+    def __init__(self, interval_seconds: float = 0.01, thread_ids: Optional[Iterable[int]] = None):
+        self.interval = interval_seconds
+        self.thread_ids = set(thread_ids) if thread_ids is not None else {threading.get_ident()}
+        self.samples: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="job-profiler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                thread_ids = tuple(self.thread_ids)
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.samples[_folded(frame)] += 1
+
+    @contextmanager
+    def sampling(self, thread_id: Optional[int] = None) -> Iterator[None]:
+        """Also sample `thread_id` (default: the calling thread) inside the block."""
+        thread_id = thread_id if thread_id is not None else threading.get_ident()
+        with self._lock:
+            added = thread_id not in self.thread_ids
+            self.thread_ids.add(thread_id)
+        try:
+            yield
+        finally:
+            if added:
+                with self._lock:
+                    self.thread_ids.discard(thread_id)
+
+    def start(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        self._thread.join(timeout=1)
+        return self
+
+    def __enter__(self) -> "SamplingProfiler":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def write_folded(self, dest: Union[str, Path]) -> Path:
+        dest = Path(dest)
+        with open(dest, "w") as handle:
+            for stack, count in self.samples.most_common():
+                handle.write(f"{stack} {count}\n")
+        return dest
@@ -0,0 +1,146 @@
+"""Weighted-fair scheduling of Pub/Sub jobs across several subscriptions.
+
+With one subscription read in arrival order, a bulk catalog re-ingest
+starves interactive uploads for hours. The consumer can instead read
+several subscriptions (`PUBSUB_SUBSCRIPTIONS`, e.g. interactive, bulk,
+backfill), each with a weight. Every subscription's streaming pull only
+buffers leased messages in a `JobScheduler`; one dispatcher takes them out
+and runs them one at a time, as before.
+
+`JobScheduler` is start-time fair queueing over worker time: each class has
+a virtual clock that advances by the seconds its jobs ran divided by its
+weight, and the next job comes from the busy class with the earliest clock.
+A class that was idle resumes at the current virtual time, so it gets its
+share from now on rather than a burst for the time it had no work. Over a
+busy period, interactive jobs get `weight / total weight` of the worker
+whatever the bulk backlog.
+
+With `shortest_first`, jobs within a class go shortest estimated duration
+first. The estimate shrinks by `aging` seconds per second waited, so long
+jobs are delayed, not starved.
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+@dataclass(frozen=True)
+class JobClass:
+    """One subscription and its share of the worker."""
+
+    subscription: str
+    weight: float = 1.0
+
+
+def parse_subscriptions(spec: str, default_subscription: str) -> list[JobClass]:
+    """`name:weight,name:weight` → JobClasses; empty means `default_subscription` alone.
+
+    A name without a weight gets weight 1.
+    """
+    classes = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = entry.partition(":")
+        job_class = JobClass(name.strip(), float(weight) if weight.strip() else 1.0)
+        if not job_class.subscription or job_class.weight <= 0:
+            raise ValueError(f"invalid subscription entry {entry!r}")
+        classes.append(job_class)
+    if len({job_class.subscription for job_class in classes}) != len(classes):
+        raise ValueError(f"duplicate subscription in {spec!r}")
+    return classes or [JobClass(default_subscription)]
+
+
+def lottery_order(classes: list[JobClass], rng: Optional[random.Random] = None) -> list[JobClass]:
+    """Classes in a random order where each comes first with probability weight / total.
+
+    For `pubsub-once` instances, which take a single message and keep no
+    state between runs: polling subscriptions in this order gives each
+    class its weighted share across many instances.
+    """
+    rng = rng or random.Random()
+    return sorted(classes, key=lambda job_class: rng.random() ** (1.0 / job_class.weight), reverse=True)
+
+
+class JobScheduler:
+    """Thread-safe buffer of leased jobs, handed out in weighted-fair order.
+
+        scheduler.put("interactive-sub", message, estimate_seconds=212.0)
+        subscription, message = scheduler.get(timeout=5)
+        ... run the job ...
+        scheduler.charge(subscription, elapsed_seconds)
+    """
+
+    def __init__(
+        self,
+        classes: list[JobClass],
+        shortest_first: bool = False,
+        aging: float = 1.0,
+        default_estimate_seconds: float = 240.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.classes = {job_class.subscription: job_class for job_class in classes}
+        self.shortest_first = shortest_first
+        self.aging = aging
+        self.default_estimate_seconds = default_estimate_seconds
+        self._clock = clock
+        self._queues: dict[str, list] = {name: [] for name in self.classes}
+        self._virtual: dict[str, float] = {name: 0.0 for name in self.classes}
+        self._now = 0.0
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, subscription: str, item, estimate_seconds: Optional[float] = None) -> None:
+        """Buffer `item` for `subscription`; the estimate only matters with shortest_first."""
+        if self.shortest_first:
+            estimate = self.default_estimate_seconds if estimate_seconds is None else estimate_seconds
+            # estimate - aging * waited, minus the part common to every job.
+            priority = estimate + self.aging * self._clock()
+        else:
+            priority = 0.0
+        with self._cond:
+            queue = self._queues[subscription]
+            if not queue:
+                # Idle classes rejoin at the current virtual time.
+                self._virtual[subscription] = max(self._virtual[subscription], self._now)
+            heapq.heappush(queue, (priority, next(self._sequence), item))
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[tuple]:
+        """(subscription, item) of the next job, or None on timeout or close."""
+        with self._cond:
+            busy = self._cond.wait_for(
+                lambda: self._closed or any(self._queues.values()), timeout=timeout,
+            )
+            if not busy or self._closed:
+                return None
+            subscription = min(
+                (name for name, queue in self._queues.items() if queue),
+                key=lambda name: self._virtual[name],
+            )
+            self._now = self._virtual[subscription]
+            return subscription, heapq.heappop(self._queues[subscription])[2]
+
+    def charge(self, subscription: str, seconds: float) -> None:
+        """Bill `seconds` of worker time to `subscription`."""
+        with self._cond:
+            self._virtual[subscription] += max(0.0, seconds) / self.classes[subscription].weight
+
+    def depth(self) -> dict:
+        """Buffered jobs per subscription."""
+        with self._cond:
+            return {name: len(queue) for name, queue in self._queues.items()}
+
+    def close(self) -> list[tuple]:
+        """Stop handing out jobs; returns the (subscription, item) pairs still buffered."""
+        with self._cond:
+            self._closed = True
+            left = [(name, entry[2]) for name, queue in self._queues.items() for entry in sorted(queue)]
+            for queue in self._queues.values():
+                queue.clear()
+            self._cond.notify_all()
+        return left
@@ -1,20 +1,63 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi import Body, FastAPI, UploadFile, File, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
 import os
 import shutil
 import asyncio
+import functools
 import subprocess
 import hashlib
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 import tempfile
 import logging
 import httpx
 import json
+import re
+import signal
+import sys
 import threading
 import time
-from typing import Optional, Tuple
-from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from audio_features import extract_stem_features
+import child_usage
+from feature_cache import FeatureCache, GcsFeatureStore, LocalFeatureStore, feature_key
+from fingerprint_index import FINGERPRINT_ENCODING, FingerprintIndex, pack_fingerprint, unpack_fingerprint
+from job_checkpoint import GcsCheckpointStore, JobCheckpoint, LocalCheckpointStore, file_sha256
+from stem_encoding import (
+    CONTENT_TYPES,
+    build_encode_command,
+    parse_loudness,
+    parse_renditions,
+    rendition_files,
+    rendition_paths,
+)
+import waveform_peaks
+import feature_timeline
+from http_jobs import FAILED, HttpJob, JobQueue, QueueFull, sse_events
+from stem_mixer import GcsMixStore, LocalMixStore, MixCache, decode_command, encode_command, mix_key, mix_raw, parse_mix_spec
+from job_profiler import SamplingProfiler
+from job_scheduler import JobScheduler, lottery_order, parse_subscriptions
+from storage_manager import ScratchSpace, ScratchSpaceFull, trim_outputs
+from worker_metrics import (
+    CACHE_LOOKUPS,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    CPU_FALLBACKS,
+    JOBS_IN_FLIGHT,
+    JOBS_TOTAL,
+    QUEUE_WAIT_SECONDS,
+    REGISTRY,
+    SCRATCH_REFUSALS,
+    SEPARATION_TIMEOUTS,
+    JobTimings,
+    observe_phase,
+    record_child,
+    track_job,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -33,21 +76,162 @@ GCS_BUCKET = os.getenv("GCS_BUCKET", "")
 OUTPUT_BASE_DIR = Path(os.getenv("OUTPUT_DIR", "/outputs"))
 OUTPUT_BASE_DIR.mkdir(parents=True, exist_ok=True)
 
+# Local mode: track directories under OUTPUT_DIR are deleted, least recently
+# written first, once they pass OUTPUT_MAX_MB ("0" = no cap). Checkpoints,
+# caches, mixes and the archive keep their own limits.
+OUTPUT_MAX_MB = int(os.getenv("OUTPUT_MAX_MB", "0"))
+
+# Job scratch directories (storage_manager.py) live under WORKER_SCRATCH_DIR
+# (default: the system temp dir; a tmpfs mount keeps Demucs WAVs off disk).
+# Each separation reserves WORKER_SCRATCH_JOB_RESERVE_MB, and a job is
+# refused (HTTP 503, Pub/Sub nack) if that would leave less than
+# WORKER_SCRATCH_MIN_FREE_MB free.
+WORKER_SCRATCH_DIR = os.getenv("WORKER_SCRATCH_DIR", "")
+WORKER_SCRATCH_MIN_FREE_MB = int(os.getenv("WORKER_SCRATCH_MIN_FREE_MB", "512"))
+WORKER_SCRATCH_JOB_RESERVE_MB = int(os.getenv("WORKER_SCRATCH_JOB_RESERVE_MB", "1024"))
+
 # Pub/Sub config
 PUBSUB_PROJECT = os.getenv("GCP_PROJECT_ID", "")
 SUBSCRIPTION_NAME = os.getenv("PUBSUB_SUBSCRIPTION", "stem-separate-worker")
 RESULTS_TOPIC = os.getenv("PUBSUB_RESULTS_TOPIC", "stem-results")
+# Weighted subscriptions, "name:weight,..." (job_scheduler.py); empty reads
+# PUBSUB_SUBSCRIPTION alone. Each keeps up to PUBSUB_PREFETCH messages
+# leased (for up to PUBSUB_MAX_LEASE_SECONDS) so the scheduler has a choice;
+# PUBSUB_SHORTEST_FIRST=1 orders those by track duration.
+JOB_CLASSES = parse_subscriptions(os.getenv("PUBSUB_SUBSCRIPTIONS", ""), SUBSCRIPTION_NAME)
+PUBSUB_PREFETCH = int(os.getenv("PUBSUB_PREFETCH", "1"))
+PUBSUB_MAX_LEASE_SECONDS = int(os.getenv("PUBSUB_MAX_LEASE_SECONDS", "7200"))
+PUBSUB_SHORTEST_FIRST = os.getenv("PUBSUB_SHORTEST_FIRST", "0") == "1"
+PUBSUB_SJF_AGING = float(os.getenv("PUBSUB_SJF_AGING", "1"))
 DEMUCS_MODEL = "htdemucs_6s"
 DEMUCS_DEVICE = os.getenv("DEMUCS_DEVICE", "auto").strip().lower()
 
+# Separation watchdog: an attempt is killed (then retried on CPU or failed
+# like any other failed attempt) when its progress has not moved for
+# DEMUCS_STALL_SECONDS, or when it runs longer than
+# DEMUCS_TIMEOUT_BASE_SECONDS + DEMUCS_TIMEOUT_FACTOR x the track duration.
+# "0" disables either check.
+DEMUCS_STALL_SECONDS = float(os.getenv("DEMUCS_STALL_SECONDS", "300"))
+DEMUCS_TIMEOUT_BASE_SECONDS = float(os.getenv("DEMUCS_TIMEOUT_BASE_SECONDS", "600"))
+DEMUCS_TIMEOUT_FACTOR = float(os.getenv("DEMUCS_TIMEOUT_FACTOR", "4"))
+
 # Upload ceiling for /separate and /analyze (#1184 review): librosa/demucs
 # load whole files into memory, so an unbounded upload is an OOM lever even
 # on a deployment-protected service. 200 MiB covers multi-minute lossless WAVs.
 MAX_UPLOAD_BYTES = int(os.getenv("WORKER_MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
 
+# Local near-duplicate fingerprint index (.npz). Empty disables the lookup;
+# the backend's exact-hash check still runs either way.
+FINGERPRINT_INDEX_PATH = os.getenv("FINGERPRINT_INDEX_PATH", "")
+FINGERPRINT_MATCH_SIMILARITY = float(os.getenv("FINGERPRINT_MATCH_SIMILARITY", "0.75"))
+# New entries are written out at most this often (and at shutdown); 0 saves
+# after every job.
+FINGERPRINT_INDEX_SAVE_SECONDS = float(os.getenv("FINGERPRINT_INDEX_SAVE_SECONDS", "30"))
+# "1" also sends the comma-joined decimal fingerprint, for backends that
+# predate `fingerprintPacked`. It is about twice the size of the packed form.
+FINGERPRINT_SEND_DECIMAL = os.getenv("FINGERPRINT_SEND_DECIMAL", "0") == "1"
+
+# Extra streaming renditions encoded in the same ffmpeg pass as the MP3,
+# e.g. "opus,hls" (see stem_encoding.RENDITIONS). Empty keeps MP3 only.
+STEM_RENDITIONS = parse_renditions(os.getenv("STEM_RENDITIONS", ""))
+
+# Waveform peak files written next to each stem MP3 ("0" disables).
+WAVEFORM_PEAKS = os.getenv("WAVEFORM_PEAKS", "1") != "0"
+WAVEFORM_PEAKS_BITS = int(os.getenv("WAVEFORM_PEAKS_BITS", "8"))
+
+# Frame-level feature timelines (feature_timeline.py) written next to each
+# stem MP3 ("1" enables).
+STEM_TIMELINES = os.getenv("STEM_TIMELINES", "0") == "1"
+
+# Per-child CPU seconds / peak RSS via the child_usage.py launcher ("0" disables).
+CHILD_RESOURCE_USAGE = os.getenv("CHILD_RESOURCE_USAGE", "1") != "0"
+# Opt-in sampling profile of the in-process work, written as profile.folded
+# next to the job's stems.
+JOB_PROFILE = os.getenv("JOB_PROFILE", "0") == "1"
+JOB_PROFILE_INTERVAL_MS = float(os.getenv("JOB_PROFILE_INTERVAL_MS", "10"))
+
+# Resumable Pub/Sub jobs: checkpoint manifests under OUTPUT_DIR/.checkpoints
+# (local) or gs://$GCS_BUCKET/$JOB_CHECKPOINT_PREFIX (gcs). "0" disables.
+JOB_CHECKPOINTS = os.getenv("JOB_CHECKPOINTS", "1") != "0"
+JOB_CHECKPOINT_PREFIX = os.getenv("JOB_CHECKPOINT_PREFIX", "checkpoints")
+# Manifests untouched for this long are deleted (checked at most hourly).
+JOB_CHECKPOINT_TTL_HOURS = float(os.getenv("JOB_CHECKPOINT_TTL_HOURS", "72"))
+
+# Lossless archive: content-addressed FLAC per stem, written by the encode
+# pass, so renditions/features can be rebuilt without Demucs (rebuild_stems.py).
+STEM_ARCHIVE = os.getenv("STEM_ARCHIVE", "0") == "1"
+STEM_ARCHIVE_BUCKET = os.getenv("STEM_ARCHIVE_BUCKET", "")  # defaults to GCS_BUCKET
+STEM_ARCHIVE_PREFIX = os.getenv("STEM_ARCHIVE_PREFIX", "archive")
+
+# Content-addressed stem objects (GCS mode, "1" enables): each file is stored
+# as stems/{release}/{track}/{name}.{hash}{ext}, hash being the start of its
+# sha256, with a year-long immutable Cache-Control. An object that already
+# exists is not uploaded again. HLS renditions keep their plain keys, since
+# playlists reference segments by name.
+STEM_CONTENT_KEYS = os.getenv("STEM_CONTENT_KEYS", "0") == "1"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Server-side mixdowns (/mix): rendered mixes are cached under this
+# prefix (GCS_BUCKET or OUTPUT_DIR) and evicted LRU past the size cap.
+MIX_CACHE_PREFIX = os.getenv("MIX_CACHE_PREFIX", "mixes")
+MIX_CACHE_MAX_MB = int(os.getenv("MIX_CACHE_MAX_MB", "2048"))
+
+# Feature cache (feature_cache.py): extracted features by audio content,
+# in FEATURE_CACHE_DIR capped at FEATURE_CACHE_MAX_MB ("0" disables), and
+# also under FEATURE_CACHE_PREFIX in GCS_BUCKET when FEATURE_CACHE_GCS=1.
+FEATURE_CACHE_DIR = Path(os.getenv("FEATURE_CACHE_DIR", str(OUTPUT_BASE_DIR / ".feature-cache")))
+FEATURE_CACHE_MAX_MB = int(os.getenv("FEATURE_CACHE_MAX_MB", "256"))
+FEATURE_CACHE_GCS = os.getenv("FEATURE_CACHE_GCS", "0") == "1"
+FEATURE_CACHE_PREFIX = os.getenv("FEATURE_CACHE_PREFIX", "feature-cache")
+
+# HTTP mode job queue: at most HTTP_JOB_WORKERS separations run at once and
+# HTTP_JOB_QUEUE_SIZE more may wait; further uploads get a 503.
+HTTP_JOB_WORKERS = int(os.getenv("HTTP_JOB_WORKERS", "1"))
+HTTP_JOB_QUEUE_SIZE = int(os.getenv("HTTP_JOB_QUEUE_SIZE", "8"))
+HTTP_JOB_RETENTION = int(os.getenv("HTTP_JOB_RETENTION", "100"))
+
+# Batch /analyze: stems are analyzed in a pool of ANALYZE_BATCH_WORKERS
+# processes (librosa holds the GIL for much of a pass), at most
+# ANALYZE_BATCH_MAX_STEMS per request.
+ANALYZE_BATCH_WORKERS = int(os.getenv("ANALYZE_BATCH_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+ANALYZE_BATCH_MAX_STEMS = int(os.getenv("ANALYZE_BATCH_MAX_STEMS", "256"))
+
+STEM_NAMES = ("vocals", "drums", "bass", "other", "piano", "guitar")
+
+SCRATCH = ScratchSpace(
+    WORKER_SCRATCH_DIR or None,
+    min_free_bytes=WORKER_SCRATCH_MIN_FREE_MB * 2**20,
+    job_reserve_bytes=WORKER_SCRATCH_JOB_RESERVE_MB * 2**20,
+)
+
 # Lazy-loaded GCS client (only imported when needed)
 _gcs_client = None
 
+# Lazy-loaded fingerprint index (numpy is only imported when enabled)
+_fingerprint_index: Optional[FingerprintIndex] = None
+_fingerprint_index_lock = threading.Lock()
+_fingerprint_index_saver: Optional[threading.Timer] = None
+
+# Lazy-started process pool for batch /analyze (see analysis_pool)
+_analysis_pool: Optional[ProcessPoolExecutor] = None
+
+# Created on first use; it tracks the local store's size between writes.
+_feature_cache: Optional[FeatureCache] = None
+
+# Last expiry sweep of checkpoint manifests (see prune_job_checkpoints)
+_last_checkpoint_prune: Optional[float] = None
+
+# Trace id of the job running in this context (see process_pubsub_message)
+_trace_id: ContextVar[Optional[str]] = ContextVar("demucs_trace_id", default=None)
+
+# Profiler of the job running in this context (see profile_job/run_blocking)
+_job_profiler: ContextVar[Optional[SamplingProfiler]] = ContextVar("demucs_job_profiler", default=None)
+
+# Demucs progress sink of the job running in this context (see run_http_job)
+_progress_listener: ContextVar[Optional[Callable[[int], None]]] = ContextVar(
+    "demucs_progress_listener", default=None
+)
+
 
 def internal_service_headers() -> dict:
     internal_key = os.getenv("INTERNAL_SERVICE_KEY")
@@ -56,6 +240,52 @@ def internal_service_headers() -> dict:
     return {"x-internal-service-key": internal_key}
 
 
+def callback_headers() -> dict:
+    """Headers for backend callbacks: internal auth plus the job's trace id."""
+    headers = internal_service_headers()
+    trace_id = _trace_id.get()
+    if trace_id:
+        headers["x-trace-id"] = trace_id
+    return headers
+
+
+def with_usage_report(command: list[str], report_dir) -> Tuple[list[str], Optional[Path]]:
+    """Wrap a child command in the rusage launcher (see child_usage.py).
+
+    Unresolvable commands are left alone so callers still get the
+    FileNotFoundError they handle (e.g. a missing fpcalc).
+    """
+    if not CHILD_RESOURCE_USAGE or shutil.which(command[0]) is None:
+        return command, None
+    return child_usage.wrap(command, report_dir)
+
+
+def record_child_usage(report: Optional[Path], phase: str) -> None:
+    usage = child_usage.collect(report)
+    if usage:
+        record_child(usage, phase)
+
+
+def trace_id_from_attributes(attributes: Optional[dict], fallback: str) -> str:
+    """Trace id from Pub/Sub attributes: `traceId`, else a W3C `traceparent`."""
+    attributes = attributes or {}
+    if attributes.get("traceId"):
+        return str(attributes["traceId"])
+    parts = str(attributes.get("traceparent", "")).split("-")
+    if len(parts) == 4 and len(parts[1]) == 32:
+        return parts[1]
+    return fallback
+
+
+def queue_wait_seconds(publish_time: Optional[datetime]) -> Optional[float]:
+    """Seconds between Pub/Sub publish and now (None when unknown)."""
+    if publish_time is None:
+        return None
+    if publish_time.tzinfo is None:
+        publish_time = publish_time.replace(tzinfo=timezone.utc)
+    return max(0.0, (datetime.now(timezone.utc) - publish_time).total_seconds())
+
+
 def gpu_available() -> bool:
     """Return True when the runtime can use CUDA."""
     try:
@@ -76,6 +306,11 @@ def demucs_devices_to_try() -> list[str]:
     if DEMUCS_DEVICE == "cpu":
         return ["cpu"]
 
+    if DEMUCS_DEVICE == "onnx":
+        # ONNX Runtime on CPU, with the Torch CPU CLI as the rescue path
+        # (e.g. the exported graph is missing and torch cannot export it).
+        return ["onnx", "cpu"]
+
     if DEMUCS_DEVICE in ("cuda", "gpu"):
         if gpu_available():
             return ["cuda", "cpu"]
@@ -83,7 +318,7 @@ def demucs_devices_to_try() -> list[str]:
         return ["cpu"]
 
     if DEMUCS_DEVICE not in ("", "auto"):
-        logger.warning("Invalid DEMUCS_DEVICE=%s; expected auto, cpu, or cuda. Using auto.", DEMUCS_DEVICE)
+        logger.warning("Invalid DEMUCS_DEVICE=%s; expected auto, cpu, cuda, or onnx. Using auto.", DEMUCS_DEVICE)
 
     if gpu_available():
         return ["cuda", "cpu"]
@@ -91,20 +326,21 @@ def demucs_devices_to_try() -> list[str]:
 
 
 def should_retry_demucs_on_cpu(device: str, stderr: str) -> bool:
-    """Retry once on CPU when a CUDA Demucs attempt fails.
+    """Retry once on CPU when a CUDA or ONNX Runtime Demucs attempt fails.
 
     CUDA failures often surface as low-level cuFFT/cuDNN/cuBLAS errors, but
     Torch and Demucs do not guarantee stable wording across versions. Default
     to a CPU rescue attempt for any CUDA subprocess failure so a transient GPU
-    runtime fault does not permanently fail a release.
+    runtime fault does not permanently fail a release. The ONNX backend gets
+    the same treatment: the Torch CPU CLI is the reference implementation.
     """
-    return device == "cuda"
+    return device in ("cuda", "onnx")
 
 
 def demucs_attempt_env(device: str) -> dict:
     """Build a subprocess environment for a Demucs attempt."""
     env = os.environ.copy()
-    if device == "cpu":
+    if device in ("cpu", "onnx"):
         # Make the CPU rescue path independent from a broken CUDA runtime.
         # Demucs receives -d cpu, and hiding CUDA here prevents Torch/audio
         # helpers from touching GPU FFT libraries during model execution.
@@ -113,6 +349,28 @@ def demucs_attempt_env(device: str) -> dict:
     return env
 
 
+def demucs_command(device: str, attempt_output_dir: Path, input_path: Path) -> list[str]:
+    """Command line for one separation attempt.
+
+    The ONNX backend is a drop-in for the Demucs CLI: same output layout,
+    same `NN%|` progress lines on stderr.
+    """
+    if device == "onnx":
+        return [
+            sys.executable, str(Path(__file__).with_name("onnx_separator.py")),
+            "-n", DEMUCS_MODEL,
+            "--out", str(attempt_output_dir),
+            str(input_path),
+        ]
+    return [
+        "demucs",
+        "-n", DEMUCS_MODEL,
+        "-d", device,
+        "--out", str(attempt_output_dir),
+        str(input_path),
+    ]
+
+
 def save_upload_capped(upload_file, dest_path: Path) -> None:
     """Stream a multipart upload to disk, aborting past MAX_UPLOAD_BYTES."""
     written = 0
@@ -130,6 +388,51 @@ def save_upload_capped(upload_file, dest_path: Path) -> None:
             buffer.write(chunk)
 
 
+def audio_duration_seconds(path: Path) -> Optional[float]:
+    """Duration of a local audio file (soundfile, else ffprobe), or None."""
+    try:
+        import soundfile
+
+        return float(soundfile.info(str(path)).duration)
+    except Exception:
+        return probe_duration(str(path))
+
+
+def demucs_wall_budget(duration: Optional[float]) -> Optional[float]:
+    """Longest a separation attempt may run, or None when unbounded."""
+    if DEMUCS_TIMEOUT_FACTOR <= 0 or duration is None:
+        return None
+    return DEMUCS_TIMEOUT_BASE_SECONDS + DEMUCS_TIMEOUT_FACTOR * duration
+
+
+async def watch_demucs_attempt(process, progress: dict, budget: Optional[float]) -> Optional[str]:
+    """Kill the attempt's process group once it stalls or overruns.
+
+    Returns "stall" or "budget" when it killed the attempt. `progress["at"]`
+    is the monotonic time of the last progress change (initially the
+    start). The whole group goes, so a hung ffmpeg or Demucs under the
+    usage launcher does not outlive the attempt.
+    """
+    started = time.monotonic()
+    # Act within about a tenth of the stall window.
+    poll = min(5.0, DEMUCS_STALL_SECONDS / 10) if DEMUCS_STALL_SECONDS > 0 else 5.0
+    while process.returncode is None:
+        await asyncio.sleep(poll)
+        now = time.monotonic()
+        if DEMUCS_STALL_SECONDS > 0 and now - progress["at"] > DEMUCS_STALL_SECONDS:
+            reason = "stall"
+        elif budget is not None and now - started > budget:
+            reason = "budget"
+        else:
+            continue
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            return None
+        return reason
+    return None
+
+
 async def run_demucs_attempt(
     input_path: Path,
     temp_dir: str,
@@ -138,20 +441,28 @@ async def run_demucs_attempt(
     track_id: str,
     callback_url: Optional[str] = None,
 ) -> Tuple[int, str, Path]:
-    """Run one Demucs attempt on a specific device."""
+    """Run one Demucs attempt on a specific device.
+
+    A watchdog kills the attempt when it stalls or overruns its budget (see
+    DEMUCS_STALL_SECONDS); it then returns a failure like any other.
+    """
     attempt_output_dir = Path(temp_dir) / f"demucs-{device}"
     attempt_output_dir.mkdir(parents=True, exist_ok=True)
     logger.info(f"Running Demucs on {input_path} with device={device}")
+    budget = demucs_wall_budget(await run_blocking(audio_duration_seconds, input_path))
+    command, usage_report = with_usage_report(
+        demucs_command(device, attempt_output_dir, input_path), temp_dir
+    )
     process = await asyncio.create_subprocess_exec(
-        "demucs",
-        "-n", DEMUCS_MODEL,
-        "-d", device,
-        "--out", str(attempt_output_dir),
-        str(input_path),
+        *command,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE,
         env=demucs_attempt_env(device),
+        # Its own process group, so the watchdog can kill every descendant.
+        start_new_session=True,
     )
+    progress = {"at": time.monotonic()}
+    watchdog = asyncio.create_task(watch_demucs_attempt(process, progress, budget))
 
     # Results storage
     stdout_data = []
@@ -180,14 +491,18 @@ async def run_demucs_attempt(
                     percentage = int(matches[-1])
                     if percentage != last_progress:
                         last_progress = percentage
+                        progress["at"] = time.monotonic()
                         logger.info(f"Progress: {percentage}%")
+                        listener = _progress_listener.get()
+                        if listener is not None:
+                            listener(percentage)
                         if callback_url:
                             try:
                                 async with httpx.AsyncClient() as client:
                                     await client.post(
                                         f"{callback_url}/ingestion/progress/{release_id}/{track_id}",
                                         json={"progress": percentage},
-                                        headers=internal_service_headers(),
+                                        headers=callback_headers(),
                                     )
                             except Exception as cb_err:
                                 logger.debug(f"Failed to send progress callback: {cb_err}")
@@ -197,14 +512,30 @@ async def run_demucs_attempt(
             if len(buffer) > 1000:
                 buffer = buffer[-500:]
 
-    await asyncio.gather(
-        read_stdout(process.stdout),
-        read_stderr(process.stderr),
-        process.wait()
-    )
+    try:
+        await asyncio.gather(
+            read_stdout(process.stdout),
+            read_stderr(process.stderr),
+            process.wait()
+        )
+    finally:
+        watchdog.cancel()
+        try:
+            reason = await watchdog
+        except asyncio.CancelledError:
+            reason = None
+    record_child_usage(usage_report, "separation")
 
     stderr_str = "".join(stderr_data)
     combined_output = "".join(stdout_data) + stderr_str
+    if reason is not None:
+        SEPARATION_TIMEOUTS.inc(device=device, reason=reason)
+        if reason == "stall":
+            detail = f"no progress for {DEMUCS_STALL_SECONDS:g}s"
+        else:
+            detail = f"exceeded the {budget:.0f}s time budget"
+        logger.error(f"Demucs watchdog killed the {device} attempt: {detail}")
+        combined_output += f"\nwatchdog: killed after {detail}\n"
 
     return process.returncode, combined_output, attempt_output_dir
 
@@ -212,53 +543,162 @@ async def run_demucs_attempt(
 def generate_fingerprint(audio_path: Path) -> Tuple[float, str, str]:
     """Generate a Chromaprint fingerprint for an audio file.
 
-    Returns (duration, raw_fingerprint, fingerprint_hash).
-    The fingerprint_hash is a SHA-256 of the raw fingerprint for fast DB comparison.
+    Returns (duration, packed_fingerprint, fingerprint_hash). The fingerprint
+    is packed as base64 little-endian uint32 (FINGERPRINT_ENCODING). The hash
+    is a SHA-256 of the comma-joined decimal form, so it stays comparable
+    with hashes the backend stored before fingerprints were packed.
     """
+    command, usage_report = with_usage_report(
+        ["fpcalc", "-raw", "-json", str(audio_path)], audio_path.parent
+    )
     try:
-        result = subprocess.run(
-            ["fpcalc", "-raw", "-json", str(audio_path)],
-            capture_output=True, text=True, timeout=120
-        )
+        result = subprocess.run(command, capture_output=True, text=True, timeout=120)
         if result.returncode != 0:
             logger.error(f"fpcalc failed: {result.stderr}")
             raise RuntimeError(f"fpcalc failed with exit code {result.returncode}")
 
         data = json.loads(result.stdout)
         duration = data.get("duration", 0.0)
-        raw_fingerprint = ",".join(str(v) for v in data.get("fingerprint", []))
-        fingerprint_hash = hashlib.sha256(raw_fingerprint.encode()).hexdigest()
+        values = data.get("fingerprint", [])
+        if not values:
+            return duration, "", ""
+        fingerprint_hash = hashlib.sha256(",".join(str(v) for v in values).encode()).hexdigest()
+        packed_fingerprint = pack_fingerprint(values)
 
         logger.info(f"Fingerprint generated: duration={duration:.1f}s, hash={fingerprint_hash[:16]}...")
-        return duration, raw_fingerprint, fingerprint_hash
+        return duration, packed_fingerprint, fingerprint_hash
     except FileNotFoundError:
         logger.warning("fpcalc not found — skipping fingerprint generation")
         return 0.0, "", ""
     except subprocess.TimeoutExpired:
         logger.warning("fpcalc timed out — skipping fingerprint generation")
         return 0.0, "", ""
+    finally:
+        record_child_usage(usage_report, "fingerprint")
+
+
+def get_fingerprint_index() -> Optional[FingerprintIndex]:
+    """Load the local near-duplicate index once; None when disabled."""
+    global _fingerprint_index
+    if not FINGERPRINT_INDEX_PATH:
+        return None
+    with _fingerprint_index_lock:
+        if _fingerprint_index is None:
+            _fingerprint_index = FingerprintIndex(FINGERPRINT_INDEX_PATH)
+            logger.info(
+                f"[fingerprint-index] Loaded {len(_fingerprint_index)} entries "
+                f"from {FINGERPRINT_INDEX_PATH}"
+            )
+        return _fingerprint_index
+
+
+def find_near_duplicates(track_id: str, fingerprint: str) -> list:
+    """Near-duplicate candidates from the local index (best effort)."""
+    try:
+        index = get_fingerprint_index()
+        if index is None:
+            return []
+        lookup_start = time.monotonic()
+        matches = index.query(
+            fingerprint, min_similarity=FINGERPRINT_MATCH_SIMILARITY, exclude=track_id,
+        )
+        logger.info(
+            f"[fingerprint-index] {len(matches)} candidate(s) for {track_id} in "
+            f"{(time.monotonic() - lookup_start) * 1000:.1f}ms"
+        )
+        return matches
+    except Exception as e:
+        logger.warning(f"[fingerprint-index] Lookup failed for {track_id}: {e}")
+        return []
+
+
+def save_fingerprint_index() -> None:
+    """Write pending index entries to disk, if any (timer and shutdown)."""
+    global _fingerprint_index_saver
+    with _fingerprint_index_lock:
+        _fingerprint_index_saver = None
+        index = _fingerprint_index
+    if index is None or not index.dirty:
+        return
+    try:
+        save_start = time.monotonic()
+        index.save()
+        logger.info(
+            f"[fingerprint-index] Saved {len(index)} entries in "
+            f"{(time.monotonic() - save_start) * 1000:.0f}ms"
+        )
+    except Exception as e:
+        logger.warning(f"[fingerprint-index] Failed to save {FINGERPRINT_INDEX_PATH}: {e}")
+
+
+def schedule_fingerprint_index_save() -> None:
+    """Save within FINGERPRINT_INDEX_SAVE_SECONDS on a background timer.
+
+    Rewriting the whole `.npz` per job is O(catalog); batching keeps it off
+    the job path. A crash loses at most that window of additions, which
+    only weakens near-duplicate hints — the backend's hash check still runs.
+    """
+    global _fingerprint_index_saver
+    if FINGERPRINT_INDEX_SAVE_SECONDS <= 0:
+        save_fingerprint_index()
+        return
+    with _fingerprint_index_lock:
+        if _fingerprint_index_saver is not None:
+            return
+        _fingerprint_index_saver = threading.Timer(FINGERPRINT_INDEX_SAVE_SECONDS, save_fingerprint_index)
+        _fingerprint_index_saver.daemon = True
+        _fingerprint_index_saver.start()
+
+
+def remember_fingerprint(track_id: str, release_id: str, artist_id: str, fingerprint: str) -> None:
+    """Add an accepted track to the local index; persisted in batches (best effort)."""
+    try:
+        index = get_fingerprint_index()
+        if index is None:
+            return
+        index.add(track_id, fingerprint, {"releaseId": release_id, "artistId": artist_id})
+        schedule_fingerprint_index_save()
+    except Exception as e:
+        logger.warning(f"[fingerprint-index] Failed to index {track_id}: {e}")
 
 
 async def submit_fingerprint(callback_url: str, release_id: str, track_id: str,
-                              duration: float, fingerprint: str, fingerprint_hash: str) -> dict:
-    """Submit fingerprint to the backend and check for duplicate/quarantine."""
+                              duration: float, fingerprint: str, fingerprint_hash: str,
+                              near_duplicates: Optional[list] = None) -> Optional[dict]:
+    """Submit fingerprint to the backend and check for duplicate/quarantine.
+
+    `fingerprint` is sent packed (`fingerprintPacked`); the backend decodes
+    it to the decimal form it stores and hashes. FINGERPRINT_SEND_DECIMAL
+    adds that decimal form for older backends.
+    `near_duplicates` carries local index candidates (trackId, similarity,
+    offset) so the backend can rule on re-encodes and trimmed copies
+    without scanning every stored fingerprint.
+
+    Returns the backend's verdict, or None when there was none (error or
+    non-2xx). Callers must not block separation on None, but must not
+    record it as a verdict either.
+    """
     url = f"{callback_url}/ingestion/fingerprint/{release_id}/{track_id}"
     payload = {
         "duration": duration,
-        "fingerprint": fingerprint,
+        "fingerprintPacked": fingerprint,
+        "fingerprintEncoding": FINGERPRINT_ENCODING,
         "fingerprintHash": fingerprint_hash,
+        "nearDuplicates": near_duplicates or [],
     }
+    if FINGERPRINT_SEND_DECIMAL:
+        payload["fingerprint"] = ",".join(str(v) for v in unpack_fingerprint(fingerprint))
     try:
         async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, json=payload, headers=internal_service_headers())
+            response = await client.post(url, json=payload, headers=callback_headers())
             if response.status_code == 200 or response.status_code == 201:
                 return response.json()
             else:
                 logger.warning(f"Fingerprint submission returned {response.status_code}: {response.text}")
-                return {"quarantined": False}
+                return None
     except Exception as e:
         logger.warning(f"Failed to submit fingerprint: {e}")
-        return {"quarantined": False}  # Don't block separation on fingerprint failures
+        return None  # Don't block separation on fingerprint failures
 
 
 def get_gcs_client():
@@ -275,13 +715,207 @@ def ensure_output_base_dir() -> None:
         OUTPUT_BASE_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def upload_to_gcs(local_path: Path, gcs_key: str) -> str:
-    """Upload a file to GCS and return a public HTTPS URL."""
+def upload_to_gcs(local_path: Path, gcs_key: str, content_type: str = "audio/mpeg",
+                  immutable: bool = False) -> str:
+    """Upload a file to GCS and return a public HTTPS URL.
+
+    `immutable` keys are content-addressed: they get a year-long
+    Cache-Control, and an existing object is only touched (its `updated`
+    time marks it as the newest version, see stored_stem_location), not
+    uploaded again.
+    """
     client = get_gcs_client()
     bucket = client.bucket(GCS_BUCKET)
     blob = bucket.blob(gcs_key)
-    blob.upload_from_filename(str(local_path), content_type="audio/mpeg")
-    return f"https://storage.googleapis.com/{GCS_BUCKET}/{gcs_key}"
+    url = f"https://storage.googleapis.com/{GCS_BUCKET}/{gcs_key}"
+    if immutable:
+        blob.cache_control = IMMUTABLE_CACHE_CONTROL
+        exists = blob.exists()
+        CACHE_LOOKUPS.inc(cache="stem", result="hit" if exists else "miss")
+        if exists:
+            blob.patch()
+            return url
+    with observe_phase("upload"):
+        blob.upload_from_filename(str(local_path), content_type=content_type)
+    return url
+
+
+def content_addressed_name(name: str, sha256: str) -> str:
+    """`vocals.mp3` → `vocals.{first 16 hex of sha256}.mp3`."""
+    path = PurePosixPath(name)
+    return str(path.with_name(f"{path.stem}.{sha256[:16]}{path.suffix}"))
+
+
+def store_stem_file(local_path: Path, release_id: str, track_id: str,
+                    content_type: str = "audio/mpeg", name: Optional[str] = None) -> str:
+    """Publish one per-track artifact; returns the URI for the result message.
+
+    GCS mode uploads under stems/{release}/{track}/{name}, or its
+    content-addressed variant with STEM_CONTENT_KEYS; local mode files are
+    already in OUTPUT_BASE_DIR/{release}/{track}/ and get a relative path.
+    `name` defaults to the file name (HLS passes "vocals_hls/...").
+    """
+    name = name or local_path.name
+    if STORAGE_MODE == "gcs" and GCS_BUCKET:
+        if STEM_CONTENT_KEYS and "/" not in name:
+            name = content_addressed_name(name, file_sha256(local_path))
+            return upload_to_gcs(local_path, f"stems/{release_id}/{track_id}/{name}", content_type, immutable=True)
+        gcs_key = f"stems/{release_id}/{track_id}/{name}"
+        return upload_to_gcs(local_path, gcs_key, content_type=content_type)
+    return str(Path(release_id) / track_id / name)
+
+
+def archive_bucket_name() -> str:
+    return STEM_ARCHIVE_BUCKET or GCS_BUCKET
+
+
+def archive_object_name(sha256: str) -> str:
+    return f"{STEM_ARCHIVE_PREFIX}/{sha256}.flac"
+
+
+def archive_uri(sha256: str) -> str:
+    """The URI store_archive_file returns for this hash in the current storage mode."""
+    if STORAGE_MODE == "gcs" and GCS_BUCKET:
+        return f"gs://{archive_bucket_name()}/{archive_object_name(sha256)}"
+    return archive_object_name(sha256)
+
+
+def store_archive_file(local_path: Path, sha256: str) -> str:
+    """Store a FLAC under its content hash; identical stems are stored once.
+
+    GCS mode writes gs://{bucket}/{prefix}/{sha256}.flac (skipping the upload
+    when the object exists); local mode moves the file to
+    OUTPUT_BASE_DIR/{prefix}/ and returns the relative path.
+    """
+    name = archive_object_name(sha256)
+    if STORAGE_MODE == "gcs" and GCS_BUCKET:
+        blob = get_gcs_client().bucket(archive_bucket_name()).blob(name)
+        if not blob.exists():
+            with observe_phase("upload"):
+                blob.upload_from_filename(str(local_path), content_type="audio/flac")
+        return archive_uri(sha256)
+    target = OUTPUT_BASE_DIR / name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if not target.exists():
+        shutil.move(str(local_path), target)
+    return name
+
+
+def track_output_dir(release_id: str, track_id: str, temp_dir: str) -> Path:
+    """Where a track's published files are written before storing."""
+    if STORAGE_MODE == "local":
+        final_output_dir = OUTPUT_BASE_DIR / release_id / track_id
+    else:
+        final_output_dir = Path(temp_dir) / "final"
+    final_output_dir.mkdir(parents=True, exist_ok=True)
+    return final_output_dir
+
+
+def trim_local_outputs(release_id: str, track_id: str) -> None:
+    """Apply OUTPUT_MAX_MB to local track directories, sparing the one just written."""
+    if STORAGE_MODE != "local" or OUTPUT_MAX_MB <= 0:
+        return
+    try:
+        trim_outputs(
+            OUTPUT_BASE_DIR,
+            OUTPUT_MAX_MB * 2**20,
+            protected=(MIX_CACHE_PREFIX, STEM_ARCHIVE_PREFIX),
+            keep=(f"{release_id}/{track_id}",),
+        )
+    except OSError as exc:
+        logger.warning(f"[outputs] trimming {OUTPUT_BASE_DIR} failed: {exc}")
+
+
+def job_checkpoint_store():
+    if STORAGE_MODE == "gcs" and GCS_BUCKET:
+        return GcsCheckpointStore(get_gcs_client().bucket(GCS_BUCKET), JOB_CHECKPOINT_PREFIX)
+    return LocalCheckpointStore(OUTPUT_BASE_DIR / ".checkpoints")
+
+
+def prune_job_checkpoints(store) -> None:
+    """Expire manifests older than JOB_CHECKPOINT_TTL_HOURS, at most once an hour."""
+    global _last_checkpoint_prune
+    now = time.monotonic()
+    if _last_checkpoint_prune is not None and now - _last_checkpoint_prune < 3600:
+        return
+    _last_checkpoint_prune = now
+    try:
+        removed = store.prune(JOB_CHECKPOINT_TTL_HOURS * 3600)
+    except Exception as e:
+        logger.warning(f"[checkpoint] pruning expired manifests failed: {e}")
+        return
+    if removed:
+        logger.info(f"[checkpoint] Pruned {removed} expired manifests")
+
+
+def open_job_checkpoint(job_id: str, source_path: Path) -> Optional[JobCheckpoint]:
+    """Load (or start) the checkpoint for this job + source; None when disabled."""
+    if not JOB_CHECKPOINTS or job_id == "unknown":
+        return None
+    try:
+        store = job_checkpoint_store()
+        prune_job_checkpoints(store)
+        checkpoint = JobCheckpoint(job_id, file_sha256(source_path), store)
+    except Exception as e:
+        logger.warning(f"[checkpoint] disabled for job {job_id}: {e}")
+        return None
+    CACHE_LOOKUPS.inc(cache="checkpoint", result="hit" if checkpoint.resumed else "miss")
+    if checkpoint.resumed:
+        logger.info(
+            f"[checkpoint] Resuming job {job_id}: phases={sorted(checkpoint.manifest['phases'])}, "
+            f"stems={sorted(checkpoint.manifest['stems'])}"
+        )
+    return checkpoint
+
+
+@contextmanager
+def profile_job(release_id: str, track_id: str, shared_loop: bool = False) -> Iterator[None]:
+    """Sample the job's in-process work when JOB_PROFILE=1 (see job_profiler.py).
+
+    Blocking work the job hands to run_blocking is always sampled. The
+    calling (event loop) thread is sampled too unless `shared_loop`: with
+    several HTTP jobs on one loop its frames belong to all of them, so
+    those profiles cover only the job's worker threads.
+
+    The folded stacks are stored as profile.folded next to the stems.
+    Profiling problems are logged, never raised.
+    """
+    if not JOB_PROFILE:
+        yield
+        return
+    profiler = SamplingProfiler(
+        JOB_PROFILE_INTERVAL_MS / 1000.0, thread_ids=() if shared_loop else None
+    ).start()
+    profiler_token = _job_profiler.set(profiler)
+    try:
+        yield
+    finally:
+        _job_profiler.reset(profiler_token)
+        profiler.stop()
+        try:
+            with tempfile.TemporaryDirectory() as profile_dir:
+                profile_path = profiler.write_folded(Path(profile_dir) / "profile.folded")
+                if STORAGE_MODE == "local":
+                    local_dir = OUTPUT_BASE_DIR / release_id / track_id
+                    local_dir.mkdir(parents=True, exist_ok=True)
+                    shutil.copy2(profile_path, local_dir / profile_path.name)
+                uri = store_stem_file(profile_path, release_id, track_id, content_type="text/plain")
+            logger.info(f"[profile] {sum(profiler.samples.values())} samples written to {uri}")
+        except Exception as profile_error:
+            logger.warning(f"[profile] could not save profile for {track_id}: {profile_error}")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """asyncio.to_thread, with the worker thread sampled by the job's profiler."""
+    profiler = _job_profiler.get()
+    if profiler is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    def sampled():
+        with profiler.sampling():
+            return func(*args, **kwargs)
+
+    return await asyncio.to_thread(sampled)
 
 
 def download_from_gcs(gcs_uri: str, dest_path: Path) -> Path:
@@ -312,35 +946,46 @@ def download_from_gcs(gcs_uri: str, dest_path: Path) -> Path:
     return dest_path
 
 
-async def run_demucs_separation(input_path: Path, temp_dir: str, release_id: str, track_id: str, callback_url: Optional[str] = None) -> tuple[dict, dict]:
-    """Run Demucs separation; returns (stems uri map, stemFeatures map).
+async def run_demucs_separation(
+    input_path: Path,
+    temp_dir: str,
+    release_id: str,
+    track_id: str,
+    callback_url: Optional[str] = None,
+    checkpoint: Optional[JobCheckpoint] = None,
+) -> tuple[dict, dict, dict]:
+    """Run Demucs separation; returns (stems uri map, stemFeatures map, artifacts).
 
     Both maps are keyed by stem type. Feature extraction failure for one
     stem records None for that stem and never fails separation (#1184).
+    `artifacts` holds extra per-stem outputs keyed by result-message field
+    (e.g. "stemPeaks"); callers merge it into the result as-is.
+
+    With a `checkpoint`, a finished separation is returned from the
+    manifest without running Demucs, and stems stored by an earlier attempt
+    are reused instead of re-encoded and re-uploaded.
     """
-    ensure_output_base_dir()
+    if checkpoint is not None and checkpoint.get("separation"):
+        done = checkpoint.get("separation")
+        logger.info(f"[checkpoint] Reusing completed separation for track {track_id}")
+        return done["stems"], done["stemFeatures"], done["artifacts"]
 
-    # Output directory for this specific track
-    if STORAGE_MODE == "local":
-        final_output_dir = OUTPUT_BASE_DIR / release_id / track_id
-        final_output_dir.mkdir(parents=True, exist_ok=True)
-    else:
-        final_output_dir = Path(temp_dir) / "final"
-        final_output_dir.mkdir(parents=True, exist_ok=True)
+    ensure_output_base_dir()
 
     selected_output_dir: Optional[Path] = None
     selected_device: Optional[str] = None
     attempt_errors: list[str] = []
 
     for device in demucs_devices_to_try():
-        returncode, stderr_str, attempt_output_dir = await run_demucs_attempt(
-            input_path=input_path,
-            temp_dir=temp_dir,
-            device=device,
-            release_id=release_id,
-            track_id=track_id,
-            callback_url=callback_url,
-        )
+        with observe_phase("separation", device):
+            returncode, stderr_str, attempt_output_dir = await run_demucs_attempt(
+                input_path=input_path,
+                temp_dir=temp_dir,
+                device=device,
+                release_id=release_id,
+                track_id=track_id,
+                callback_url=callback_url,
+            )
 
         if returncode == 0:
             selected_output_dir = attempt_output_dir
@@ -349,9 +994,13 @@ async def run_demucs_separation(input_path: Path, temp_dir: str, release_id: str
 
         logger.error(f"Demucs failed with exit code {returncode} on device={device}")
         attempt_errors.append(f"{device}: {stderr_str}")
+        # Partial stems of a failed attempt are never used; free the space
+        # before the retry writes its own.
+        shutil.rmtree(attempt_output_dir, ignore_errors=True)
 
         if should_retry_demucs_on_cpu(device, stderr_str):
             logger.warning("Demucs GPU attempt failed, retrying once on CPU")
+            CPU_FALLBACKS.inc(from_device=device)
             continue
 
         raise RuntimeError(f"Demucs processing failed on {device}: {stderr_str}")
@@ -369,32 +1018,93 @@ async def run_demucs_separation(input_path: Path, temp_dir: str, release_id: str
     if not demucs_out_path.exists():
         raise RuntimeError(f"Demucs output directory {demucs_out_path} not found")
 
-    stems_list = ["vocals.wav", "drums.wav", "bass.wav", "other.wav", "piano.wav", "guitar.wav"]
+    sources = {name: demucs_out_path / f"{name}.wav" for name in STEM_NAMES}
+    results, stem_features, artifacts = await encode_and_store_stems(
+        sources, temp_dir, release_id, track_id, checkpoint=checkpoint, archive=STEM_ARCHIVE,
+    )
+    if checkpoint is not None:
+        checkpoint.complete("separation", {
+            "stems": results,
+            "stemFeatures": stem_features,
+            "artifacts": artifacts,
+        })
+    await run_blocking(trim_local_outputs, release_id, track_id)
+    return results, stem_features, artifacts
+
+
+async def encode_and_store_stems(
+    sources: dict,
+    temp_dir: str,
+    release_id: str,
+    track_id: str,
+    checkpoint: Optional[JobCheckpoint] = None,
+    archive: bool = False,
+) -> tuple[dict, dict, dict]:
+    """Encode, analyze and store lossless stems ({stem: WAV/FLAC path}).
+
+    Shared by separation and archive rebuilds; returns the same
+    (stems, stemFeatures, artifacts) triple as run_demucs_separation.
+    `archive` adds a content-addressed FLAC per stem (`stemArchive`).
+    """
+    final_output_dir = track_output_dir(release_id, track_id, temp_dir)
     results = {}
     stem_features = {}
-    for stem in stems_list:
-        stem_src = demucs_out_path / stem
+    stem_peaks = {}
+    stem_renditions = {}
+    stem_timelines = {}
+    stem_archive = {}
+    for stem_name, stem_src in sources.items():
+        done = checkpoint.stem(stem_name) if checkpoint is not None else None
+        if done is not None:
+            results[stem_name] = done["uri"]
+            stem_features[stem_name] = done["features"]
+            if done.get("peaks"):
+                stem_peaks[stem_name] = done["peaks"]
+            if done.get("renditions"):
+                stem_renditions[stem_name] = done["renditions"]
+            if done.get("timeline"):
+                stem_timelines[stem_name] = done["timeline"]
+            if done.get("archive"):
+                stem_archive[stem_name] = done["archive"]
+            logger.info(f"[checkpoint] Reusing stored {stem_name} stem")
+            continue
         if stem_src.exists():
-            mp3_filename = stem.replace(".wav", ".mp3")
-            stem_dest_mp3 = final_output_dir / mp3_filename
-
-            logger.info(f"Compressing {stem} to MP3...")
-            ffmpeg_proc = await asyncio.create_subprocess_exec(
-                "ffmpeg", "-y", "-i", str(stem_src),
-                "-b:a", "320k", str(stem_dest_mp3),
-                stdout=asyncio.subprocess.DEVNULL,
-                stderr=asyncio.subprocess.DEVNULL
-            )
-            await ffmpeg_proc.wait()
+            stem_dest_mp3 = final_output_dir / f"{stem_name}.mp3"
+            archive_dest = Path(temp_dir) / f"{stem_name}.archive.flac" if archive else None
+
+            logger.info(f"Compressing {stem_src.name} to MP3...")
+            renditions = rendition_paths(stem_dest_mp3, STEM_RENDITIONS)
+            for rendition_path in renditions.values():
+                rendition_path.parent.mkdir(parents=True, exist_ok=True)
+            with observe_phase("encode"):
+                command, usage_report = with_usage_report(
+                    build_encode_command(stem_src, stem_dest_mp3, STEM_RENDITIONS, archive_dest), temp_dir
+                )
+                ffmpeg_proc = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                _, ffmpeg_stderr = await ffmpeg_proc.communicate()
+            record_child_usage(usage_report, "encode")
 
             if ffmpeg_proc.returncode == 0 and stem_dest_mp3.exists():
-                stem_name = stem.replace(".wav", "")
-
+                # Analysis and uploads below block, so they run in worker
+                # threads: the event loop keeps serving HTTP job polls and
+                # SSE streams, and concurrent HTTP jobs overlap. Context
+                # (observe_phase, track_job) is copied into the thread.
                 # Measured musical features from the lossless WAV (#1184).
                 # Failure degrades to None for this stem only.
+                timeline_path = final_output_dir / f"{stem_name}.timeline" if STEM_TIMELINES else None
+                extract = extract_stem_features
+                if timeline_path is not None:
+                    extract = functools.partial(extract_stem_features, timeline_path=timeline_path)
                 try:
                     feature_start = time.monotonic()
-                    stem_features[stem_name] = extract_stem_features(stem_src)
+                    with observe_phase("features"):
+                        stem_features[stem_name] = await cached_features(
+                            stem_src, lambda path: run_blocking(extract, path), lookup=timeline_path is None,
+                        )
                     logger.info(
                         f"[features] {stem_name} extracted in "
                         f"{time.monotonic() - feature_start:.2f}s"
@@ -405,24 +1115,385 @@ async def run_demucs_separation(input_path: Path, temp_dir: str, release_id: str
                     )
                     stem_features[stem_name] = None
 
+                # Loudness/true peak were metered by the same ffmpeg pass.
+                if stem_features[stem_name] is not None:
+                    stem_features[stem_name].update(
+                        parse_loudness((ffmpeg_stderr or b"").decode(errors="ignore"))
+                    )
+
+                if timeline_path is not None and stem_features[stem_name] is not None:
+                    try:
+                        stem_timelines[stem_name] = await run_blocking(
+                            store_stem_file,
+                            timeline_path, release_id, track_id,
+                            content_type=feature_timeline.CONTENT_TYPE,
+                        )
+                    except Exception as timeline_error:
+                        logger.warning(f"[features] storing the {stem_name} timeline failed: {timeline_error}")
+
+                # Waveform peaks from the lossless WAV so the stem editor
+                # never downloads/decodes the MP3 just to draw it.
+                if WAVEFORM_PEAKS:
+                    try:
+                        peaks_path = await run_blocking(
+                            waveform_peaks.write_peaks,
+                            stem_src,
+                            final_output_dir / f"{stem_name}.peaks",
+                            bits=WAVEFORM_PEAKS_BITS,
+                        )
+                        stem_peaks[stem_name] = await run_blocking(
+                            store_stem_file,
+                            peaks_path, release_id, track_id,
+                            content_type=waveform_peaks.CONTENT_TYPE,
+                        )
+                    except Exception as peaks_error:
+                        logger.warning(f"[peaks] generation failed for {stem_name}: {peaks_error}")
+
+                for rendition, primary in renditions.items():
+                    if not primary.exists():
+                        logger.warning(f"[renditions] {rendition} missing for {stem_name}")
+                        continue
+                    for produced in rendition_files(rendition, primary):
+                        uri = await run_blocking(
+                            store_stem_file,
+                            produced, release_id, track_id,
+                            content_type=CONTENT_TYPES.get(produced.suffix, "application/octet-stream"),
+                            name=str(produced.relative_to(final_output_dir)),
+                        )
+                        if produced == primary:
+                            stem_renditions.setdefault(stem_name, {})[rendition] = uri
+
+                if archive_dest is not None and archive_dest.exists():
+                    try:
+                        sha256 = await run_blocking(file_sha256, archive_dest)
+                        stem_archive[stem_name] = {
+                            "uri": await run_blocking(store_archive_file, archive_dest, sha256),
+                            "sha256": sha256,
+                            "format": "flac",
+                        }
+                    except Exception as archive_error:
+                        logger.warning(f"[archive] storing {stem_name} failed: {archive_error}")
+
+                results[stem_name] = await run_blocking(store_stem_file, stem_dest_mp3, release_id, track_id)
                 if STORAGE_MODE == "gcs" and GCS_BUCKET:
-                    gcs_key = f"stems/{release_id}/{track_id}/{mp3_filename}"
-                    url = upload_to_gcs(stem_dest_mp3, gcs_key)
-                    results[stem_name] = url
-                    logger.info(f"Uploaded stem to GCS: {url}")
+                    logger.info(f"Uploaded stem to GCS: {results[stem_name]}")
                 else:
-                    results[stem_name] = str(Path(release_id) / track_id / mp3_filename)
                     logger.info(f"Generated stem: {stem_dest_mp3}")
+                if checkpoint is not None:
+                    await run_blocking(checkpoint.complete_stem, stem_name, {
+                        "uri": results[stem_name],
+                        "features": stem_features[stem_name],
+                        "peaks": stem_peaks.get(stem_name),
+                        "renditions": stem_renditions.get(stem_name),
+                        "timeline": stem_timelines.get(stem_name),
+                        "archive": stem_archive.get(stem_name),
+                    })
             else:
-                logger.warning(f"FFmpeg failed or MP3 missing for {stem}")
+                logger.warning(f"FFmpeg failed or MP3 missing for {stem_src.name}")
         else:
-            logger.warning(f"Stem {stem} not found in output")
+            logger.warning(f"Stem {stem_src.name} not found in output")
+
+    artifacts = {"stemPeaks": stem_peaks, "stemRenditions": stem_renditions}
+    if STEM_TIMELINES:
+        artifacts["stemTimelines"] = stem_timelines
+    if archive:
+        artifacts["stemArchive"] = stem_archive
+    return results, stem_features, artifacts
+
+
+async def rebuild_from_archive(
+    stem_archive: dict,
+    release_id: str,
+    track_id: str,
+    temp_dir: str,
+) -> tuple[dict, dict, dict]:
+    """Re-run the encode pass (MP3, renditions, features, peaks) from archived FLACs.
+
+    `stem_archive` is a result message's `stemArchive` map. Each FLAC is
+    checked against its sha256 before use; Demucs is never invoked.
+    """
+    ensure_output_base_dir()
+    archive_dir = Path(temp_dir) / "archive"
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    sources = {}
+    for stem_name, entry in stem_archive.items():
+        local_path = archive_dir / f"{stem_name}.flac"
+        with observe_phase("download"):
+            await download_audio(entry["uri"], local_path)
+        if entry.get("sha256") and await run_blocking(file_sha256, local_path) != entry["sha256"]:
+            raise ValueError(f"Archived {stem_name} stem does not match sha256 {entry['sha256']}")
+        sources[stem_name] = local_path
+    results, stem_features, artifacts = await encode_and_store_stems(
+        sources, temp_dir, release_id, track_id,
+    )
+    artifacts["stemArchive"] = stem_archive
+    return results, stem_features, artifacts
+
+
+def mix_cache() -> MixCache:
+    if STORAGE_MODE == "gcs" and GCS_BUCKET:
+        store = GcsMixStore(get_gcs_client().bucket(GCS_BUCKET), MIX_CACHE_PREFIX)
+    else:
+        store = LocalMixStore(OUTPUT_BASE_DIR / MIX_CACHE_PREFIX, uri_prefix=f"{MIX_CACHE_PREFIX}/")
+    return MixCache(store, MIX_CACHE_MAX_MB * 1024 * 1024)
+
+
+def feature_cache() -> Optional[FeatureCache]:
+    """The process-wide feature cache, or None when disabled."""
+    global _feature_cache
+    if FEATURE_CACHE_MAX_MB <= 0:
+        return None
+    if _feature_cache is None:
+        remote = None
+        if FEATURE_CACHE_GCS and GCS_BUCKET:
+            remote = GcsFeatureStore(get_gcs_client().bucket(GCS_BUCKET), FEATURE_CACHE_PREFIX)
+        _feature_cache = FeatureCache(
+            LocalFeatureStore(FEATURE_CACHE_DIR), FEATURE_CACHE_MAX_MB * 1024 * 1024, remote,
+        )
+    return _feature_cache
+
+
+async def cached_features(
+    path: Path,
+    extract: Callable[[Path], Awaitable[dict]],
+    lookup: bool = True,
+) -> dict:
+    """Features of `path` from the cache, or from `extract` (then cached).
+
+    Callers that add fields to the returned dict (loudness) do so after it
+    was cached, so entries hold exactly what the extractor produced.
+    `lookup=False` always extracts (e.g. for a timeline, which only an
+    extraction writes) and still refreshes the entry. Features with
+    `skippedFields` are returned but not cached.
+    """
+    cache = feature_cache()
+    if cache is None:
+        return await extract(path)
+    key = feature_key(await run_blocking(file_sha256, path))
+    if lookup:
+        features = await run_blocking(cache.get, key)
+        CACHE_LOOKUPS.inc(cache="features", result="hit" if features is not None else "miss")
+        if features is not None:
+            return features
+    features = await extract(path)
+    # A partial result (deadline reached) is not what a retry should get.
+    if not features.get("skippedFields"):
+        await run_blocking(cache.put, key, features)
+    return features
+
+
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+PATH_SEGMENT_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]*")
+
+
+def stored_stem_name(release_id: str, track_id: str, stem_name: str) -> str:
+    """Object key (GCS) or OUTPUT_DIR-relative path (local) of a stem's MP3."""
+    if STORAGE_MODE == "gcs" and GCS_BUCKET:
+        return f"stems/{release_id}/{track_id}/{stem_name}.mp3"
+    return f"{release_id}/{track_id}/{stem_name}.mp3"
+
+
+def locate_stored_object(name: str, bucket_name: str) -> Tuple[object, str]:
+    """(GCS blob or local Path, version) of a stored object; FileNotFoundError if absent.
+
+    The version (GCS generation, local size+mtime) changes whenever the
+    object is rewritten, so caches keyed on it never serve stale renders.
+    """
+    if STORAGE_MODE == "gcs" and GCS_BUCKET:
+        blob = get_gcs_client().bucket(bucket_name).get_blob(name)
+        if blob is None:
+            raise FileNotFoundError(f"gs://{bucket_name}/{name}")
+        return blob, f"gen-{blob.generation}"
+    path = OUTPUT_BASE_DIR / name
+    stat = path.stat()  # FileNotFoundError when absent
+    return path, f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def stored_stem_location(release_id: str, track_id: str, stem_name: str) -> Tuple[object, str]:
+    """locate_stored_object for a stem's current MP3.
+
+    With STEM_CONTENT_KEYS the most recently stored content-addressed
+    object wins and its hash is the version; tracks stored before the
+    option was enabled fall back to the plain key.
+    """
+    if STEM_CONTENT_KEYS and STORAGE_MODE == "gcs" and GCS_BUCKET:
+        prefix = f"stems/{release_id}/{track_id}/{stem_name}."
+        pattern = re.compile(re.escape(prefix) + r"([0-9a-f]{16})\.mp3")
+        candidates = [
+            (blob, match.group(1))
+            for blob in get_gcs_client().bucket(GCS_BUCKET).list_blobs(prefix=prefix)
+            if (match := pattern.fullmatch(blob.name))
+        ]
+        if candidates:
+            return max(candidates, key=lambda candidate: candidate[0].updated)
+    return locate_stored_object(stored_stem_name(release_id, track_id, stem_name), GCS_BUCKET)
+
+
+def mix_sources(release_id: str, track_id: str, gains: dict, stem_archive: dict) -> dict:
+    """{stem: (location, version, sha256 or None)} for everything in the mix.
+
+    Only the worker's own outputs are mixed: the stored MP3 of this track,
+    or an archive entry whose URI is exactly where store_archive_file puts
+    that hash. Anything else is a ValueError (400), so request bodies can
+    never point the worker at arbitrary URLs or files.
+    """
+    for part in (release_id, track_id):
+        if not PATH_SEGMENT_PATTERN.fullmatch(part):
+            raise ValueError(f"invalid id {part!r}")
+    sources = {}
+    for name in gains:
+        entry = stem_archive.get(name)
+        if entry is None:
+            location, version = stored_stem_location(release_id, track_id, name)
+            sources[name] = (location, version, None)
+            continue
+        sha256 = entry.get("sha256") if isinstance(entry, dict) else None
+        if not isinstance(sha256, str) or not SHA256_PATTERN.fullmatch(sha256):
+            raise ValueError(f"stemArchive.{name} needs a sha256")
+        if entry.get("uri") != archive_uri(sha256):
+            raise ValueError(f"stemArchive.{name} is not an archive of this worker")
+        location, _ = locate_stored_object(archive_object_name(sha256), archive_bucket_name())
+        # Archived objects are immutable: the hash is the version.
+        sources[name] = (location, sha256, sha256)
+    return sources
+
+
+async def run_ffmpeg(command: list[str], temp_dir: str, phase: str) -> None:
+    """Run one ffmpeg command to completion; RuntimeError with its log on failure."""
+    command, usage_report = with_usage_report(command, temp_dir)
+    proc = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await proc.communicate()
+    record_child_usage(usage_report, phase)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {(stderr or b'').decode(errors='ignore')[-500:]}")
 
-    return results, stem_features
+
+async def render_mix(
+    release_id: str,
+    track_id: str,
+    gains: dict,
+    stem_archive: Optional[dict] = None,
+) -> Tuple[str, bool]:
+    """Mix a track's stems with per-stem gains (dB); returns (uri, cached).
+
+    Stems come from `stem_archive` (lossless) when it has them, otherwise
+    from the stored MP3s (see mix_sources). The cache key includes every
+    source's version, so re-separated or rebuilt tracks get fresh mixes.
+    See stem_mixer.py for the mixing itself.
+    """
+    ensure_output_base_dir()
+    # Lookups and the cache are GCS round-trips in gcs mode: off the event loop.
+    sources = await run_blocking(mix_sources, release_id, track_id, gains, stem_archive or {})
+    cache = await run_blocking(mix_cache)
+    key = mix_key(release_id, track_id, gains, {name: version for name, (_, version, _) in sources.items()})
+    uri = await run_blocking(cache.get, key)
+    CACHE_LOOKUPS.inc(cache="mix", result="hit" if uri else "miss")
+    if uri:
+        return uri, True
+
+    with tempfile.TemporaryDirectory(dir=SCRATCH.root) as temp_dir:
+        raw_paths = {}
+        for name, (location, _, sha256) in sources.items():
+            if isinstance(location, Path):
+                local_path = location
+            else:
+                local_path = Path(temp_dir) / f"{name}{Path(location.name).suffix}"
+                with observe_phase("download"):
+                    await run_blocking(location.download_to_filename, str(local_path))
+            if sha256 is not None and await run_blocking(file_sha256, local_path) != sha256:
+                raise ValueError(f"Archived {name} stem does not match sha256 {sha256}")
+            raw_paths[name] = Path(temp_dir) / f"{name}.f32"
+            with observe_phase("decode"):
+                await run_ffmpeg(decode_command(local_path, raw_paths[name]), temp_dir, "decode")
+        mixed_raw = Path(temp_dir) / "mix.f32"
+        with observe_phase("mix"):
+            stats = await run_blocking(mix_raw, raw_paths, gains, mixed_raw)
+        mixed_mp3 = Path(temp_dir) / f"{key}.mp3"
+        with observe_phase("encode"):
+            await run_ffmpeg(encode_command(mixed_raw, mixed_mp3), temp_dir, "encode")
+        uri = await run_blocking(cache.put, key, mixed_mp3)
+    if stats["clippedSamples"]:
+        logger.warning(f"[mix] {track_id} {gains}: clipped {stats['clippedSamples']} samples (peak {stats['peak']})")
+    return uri, False
 
 
 # ─── HTTP endpoint (Phase 1 legacy) ───────────────────────────────────
 
+async def run_http_job(job: HttpJob) -> dict:
+    """Separate one queued upload; the queue worker records the outcome."""
+    payload = job.payload
+    progress_token = _progress_listener.set(job.set_progress)
+    try:
+        with (
+            JOBS_IN_FLIGHT.track_inprogress(source="http"),
+            track_job() as timings,
+            profile_job(job.release_id, job.track_id, shared_loop=HTTP_JOB_WORKERS > 1),
+        ):
+            results, stem_features, stem_artifacts = await run_demucs_separation(
+                payload["input_path"], payload["temp_dir"], job.release_id, job.track_id, payload["callback_url"]
+            )
+    except Exception:
+        JOBS_TOTAL.inc(source="http", status="failed")
+        raise
+    finally:
+        _progress_listener.reset(progress_token)
+        SCRATCH.release(payload["temp_dir"])
+    JOBS_TOTAL.inc(source="http", status="completed")
+    return {
+        "status": "success",
+        "release_id": job.release_id,
+        "track_id": job.track_id,
+        "storage_mode": STORAGE_MODE,
+        "stems": results,
+        "stemFeatures": stem_features,
+        **stem_artifacts,
+        "timings": timings.as_dict(),
+        "resourceUsage": timings.resource_usage(),
+    }
+
+
+HTTP_JOBS = JobQueue(
+    run_http_job,
+    workers=HTTP_JOB_WORKERS,
+    max_queued=HTTP_JOB_QUEUE_SIZE,
+    retention=HTTP_JOB_RETENTION,
+)
+
+
+def enqueue_upload(file: UploadFile, release_id: str, track_id: str, callback_url: Optional[str]) -> HttpJob:
+    """Save the upload to its own scratch dir and queue it.
+
+    503 when the queue is full or scratch space is low. The worker removes
+    the scratch dir once the job finishes.
+    """
+    try:
+        temp_dir = SCRATCH.mkdtemp(prefix="http-job-")
+    except ScratchSpaceFull as e:
+        SCRATCH_REFUSALS.inc(source="http")
+        logger.warning(f"[HTTP] Rejecting {release_id}/{track_id}: {e}")
+        raise HTTPException(status_code=503, detail=f"Scratch space is low: {e}", headers={"Retry-After": "60"})
+    try:
+        # Basename only: the multipart filename is client-controlled and a
+        # path like ../../x would escape the temp dir (#1184 review).
+        input_path = Path(temp_dir) / (Path(file.filename or "audio").name or "audio")
+        save_upload_capped(file, input_path)
+        job = HttpJob(release_id, track_id, {
+            "input_path": input_path,
+            "temp_dir": temp_dir,
+            "callback_url": callback_url,
+        })
+        return HTTP_JOBS.submit(job)
+    except QueueFull as e:
+        SCRATCH.release(temp_dir)
+        logger.warning(f"[HTTP] Rejecting {release_id}/{track_id}: {e}")
+        raise HTTPException(status_code=503, detail=f"Job queue is full: {e}", headers={"Retry-After": "30"})
+    except BaseException:
+        SCRATCH.release(temp_dir)
+        raise
+
+
 @app.post("/separate/{release_id}/{track_id}")
 async def separate_audio(
     release_id: str,
@@ -430,27 +1501,57 @@ async def separate_audio(
     file: UploadFile = File(...),
     callback_url: Optional[str] = Query(None, description="Backend URL for progress reporting"),
 ):
+    """Separate and wait for the result. Shares the bounded queue with /jobs."""
     logger.info(f"[HTTP] Processing separation for release={release_id}, track={track_id}")
+    job = enqueue_upload(file, release_id, track_id, callback_url)
+    await job.done.wait()
+    if job.status == FAILED:
+        logger.error(f"Unexpected error: {job.error}")
+        raise HTTPException(status_code=500, detail=job.error)
+    return job.result
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Basename only: the multipart filename is client-controlled and a
-        # path like ../../x would escape the temp dir (#1184 review).
-        input_path = Path(temp_dir) / (Path(file.filename or "audio").name or "audio")
-        save_upload_capped(file, input_path)
 
-        try:
-            results, stem_features = await run_demucs_separation(input_path, temp_dir, release_id, track_id, callback_url)
-            return {
-                "status": "success",
-                "release_id": release_id,
-                "track_id": track_id,
-                "storage_mode": STORAGE_MODE,
-                "stems": results,
-                "stemFeatures": stem_features,
-            }
-        except Exception as e:
-            logger.error(f"Unexpected error: {str(e)}")
-            raise HTTPException(status_code=500, detail=str(e))
+@app.post("/jobs/separate/{release_id}/{track_id}", status_code=202)
+async def submit_separation_job(
+    release_id: str,
+    track_id: str,
+    file: UploadFile = File(...),
+    callback_url: Optional[str] = Query(None, description="Backend URL for progress reporting"),
+):
+    """Queue a separation and return immediately; poll or stream its progress."""
+    job = enqueue_upload(file, release_id, track_id, callback_url)
+    logger.info(f"[HTTP] Queued job {job.id} for release={release_id}, track={track_id}")
+    return {
+        "jobId": job.id,
+        "status": job.status,
+        "queueDepth": HTTP_JOBS.depth(),
+        "statusUrl": f"/jobs/{job.id}",
+        "eventsUrl": f"/jobs/{job.id}/events",
+    }
+
+
+def get_http_job(job_id: str) -> HttpJob:
+    job = HTTP_JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """Status, Demucs progress and (once completed) the /separate result."""
+    return get_http_job(job_id).snapshot()
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events: `status` on every transition, `progress` per Demucs %."""
+    job = get_http_job(job_id)
+    return StreamingResponse(
+        sse_events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.post("/analyze")
@@ -461,18 +1562,186 @@ async def analyze_audio(file: UploadFile = File(...)):
     /separate: no in-app auth, the worker relies on deployment-level
     protection (Cloud Run IAM / private networking).
     """
-    with tempfile.TemporaryDirectory() as temp_dir:
+    with tempfile.TemporaryDirectory(dir=SCRATCH.root) as temp_dir:
         # Basename only: the multipart filename is client-controlled (#1184 review).
         input_path = Path(temp_dir) / (Path(file.filename or "audio").name or "audio")
         save_upload_capped(file, input_path)
         try:
-            features = extract_stem_features(input_path)
+            features = await cached_features(
+                input_path, lambda path: asyncio.to_thread(extract_stem_features, path),
+            )
         except Exception as e:
             logger.warning(f"[analyze] extraction failed: {e}")
             raise HTTPException(status_code=422, detail=f"Could not analyze audio: {e}")
         return {"status": "success", "features": features}
 
 
+def analysis_pool() -> ProcessPoolExecutor:
+    """Process pool for batch analysis, started on first use.
+
+    Spawned rather than forked: the server process runs threads (Pub/Sub,
+    event loop executors) that a fork would copy mid-operation.
+    """
+    global _analysis_pool
+    if _analysis_pool is None:
+        import multiprocessing
+
+        _analysis_pool = ProcessPoolExecutor(
+            max_workers=max(1, ANALYZE_BATCH_WORKERS),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _analysis_pool
+
+
+def reset_analysis_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next analysis starts a new one."""
+    global _analysis_pool
+    if _analysis_pool is pool:
+        _analysis_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def resolve_analysis_source(uri: str) -> Tuple[str, object]:
+    """("gcs", blob) or ("local", Path) for a stem URI the worker itself stored.
+
+    Accepts what result messages carry: gs:// or storage.googleapis.com
+    URLs in GCS_BUCKET or the archive bucket, and paths inside OUTPUT_DIR
+    (relative, or absolute under it). Anything else is a ValueError, so a
+    batch cannot point the worker at arbitrary hosts or files.
+    """
+    if not isinstance(uri, str) or not uri:
+        raise ValueError("uri must be a non-empty string")
+    for prefix in ("gs://", "https://storage.googleapis.com/"):
+        if uri.startswith(prefix):
+            bucket_name, _, name = uri[len(prefix):].partition("/")
+            buckets = {b for b in (GCS_BUCKET, archive_bucket_name()) if b}
+            if bucket_name not in buckets or not name or ".." in name.split("/"):
+                raise ValueError(f"{uri} is not in this worker's buckets")
+            return "gcs", get_gcs_client().bucket(bucket_name).blob(name)
+    if "://" in uri:
+        raise ValueError(f"unsupported URI {uri}")
+    root = OUTPUT_BASE_DIR.resolve()
+    path = (OUTPUT_BASE_DIR / uri).resolve()
+    if not path.is_relative_to(root):
+        raise ValueError(f"{uri} is outside {OUTPUT_BASE_DIR}")
+    if not path.is_file():
+        raise FileNotFoundError(f"{uri} not found")
+    return "local", path
+
+
+async def extract_in_analysis_pool(path: Path) -> dict:
+    pool = analysis_pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, extract_stem_features, path)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM on a huge stem): start a fresh pool for
+        # the next items; this one is reported as failed.
+        reset_analysis_pool(pool)
+        raise
+
+
+async def analyze_batch_item(index: int, item, temp_dir: Path, slots: asyncio.Semaphore) -> dict:
+    """One NDJSON record: the stem's features, or its error."""
+    if isinstance(item, dict):
+        uri, item_id = item.get("uri"), item.get("id")
+    else:
+        uri, item_id = item, None
+    record = {"index": index, "uri": uri}
+    if item_id is not None:
+        record["id"] = item_id
+    download = None
+    async with slots:
+        try:
+            kind, source = await asyncio.to_thread(resolve_analysis_source, uri)
+            if kind == "gcs":
+                download = temp_dir / f"{index}{Path(source.name).suffix}"
+                await asyncio.to_thread(source.download_to_filename, str(download))
+                source = download
+            features = await cached_features(source, extract_in_analysis_pool)
+            record.update(status="success", features=features)
+        except Exception as e:
+            logger.warning(f"[analyze] {uri}: {e}")
+            record.update(status="failed", error=str(e) or type(e).__name__)
+        finally:
+            if download is not None:
+                download.unlink(missing_ok=True)
+    return record
+
+
+async def analyze_batch_lines(items: list) -> AsyncIterator[str]:
+    """NDJSON, one line per stem in completion order.
+
+    At most twice the pool size is fetched or analyzed at once, so scratch
+    space stays bounded however long the batch is.
+    """
+    slots = asyncio.Semaphore(2 * max(1, ANALYZE_BATCH_WORKERS))
+    with tempfile.TemporaryDirectory(prefix="analyze-batch-", dir=SCRATCH.root) as temp_dir:
+        tasks = [
+            asyncio.ensure_future(analyze_batch_item(index, item, Path(temp_dir), slots))
+            for index, item in enumerate(items)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done, separators=(",", ":")) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(body: dict = Body(...)):
+    """Extract features for stored stems, streaming NDJSON as each finishes.
+
+    Body: `{"stems": ["gs://…/vocals.mp3", {"id": "trk_1/bass", "uri": "…"}]}`.
+    A stem that cannot be fetched or analyzed is a `failed` line, not a
+    failed request. Same auth posture as /analyze.
+    """
+    items = body.get("stems")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="stems must be a non-empty list")
+    if len(items) > ANALYZE_BATCH_MAX_STEMS:
+        raise HTTPException(
+            status_code=400, detail=f"at most {ANALYZE_BATCH_MAX_STEMS} stems per batch",
+        )
+    logger.info(f"[analyze] Batch of {len(items)} stems on {ANALYZE_BATCH_WORKERS} processes")
+    return StreamingResponse(analyze_batch_lines(items), media_type="application/x-ndjson")
+
+
+@app.post("/mix/{release_id}/{track_id}")
+async def mix_stems(release_id: str, track_id: str, body: dict = Body(...)):
+    """Render a mixdown of a track's stored stems and return its URI.
+
+    Body: `{"stems": {"drums": 0, "bass": -3}}` (gains in dB) or a list of
+    stems at 0 dB, plus an optional `stemArchive` map to mix the lossless
+    archive instead of the MP3s. Same auth posture as /separate.
+    """
+    try:
+        gains = parse_mix_spec(body.get("stems"), STEM_NAMES)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    stem_archive = body.get("stemArchive") or {}
+    if not isinstance(stem_archive, dict):
+        raise HTTPException(status_code=400, detail="stemArchive must be an object")
+    try:
+        uri, cached = await render_mix(release_id, track_id, gains, stem_archive)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=f"Stem not found: {e}")
+    except Exception as e:
+        logger.error(f"[mix] {release_id}/{track_id} failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "status": "success",
+        "release_id": release_id,
+        "track_id": track_id,
+        "stems": gains,
+        "uri": uri,
+        "cached": cached,
+    }
+
+
 # ─── Pub/Sub consumer (Phase 2 event-driven) ──────────────────────────
 
 
@@ -505,8 +1774,45 @@ async def download_audio(uri: str, dest_path: Path):
                 return
         raise FileNotFoundError(f"Could not find audio at any of: {[str(c) for c in local_candidates]}")
 
-async def process_pubsub_message(message_data: dict):
-    """Process a single Pub/Sub separation job."""
+async def process_pubsub_message(
+    message_data: dict,
+    attributes: Optional[dict] = None,
+    publish_time: Optional[datetime] = None,
+    subscription: Optional[str] = None,
+):
+    """Process a single Pub/Sub separation job.
+
+    `attributes` and `publish_time` come from the Pub/Sub envelope: the
+    trace id is forwarded on every backend callback and the publish time
+    becomes `timings.queueWaitSeconds` in the result message (and the
+    queue wait metric of `subscription`).
+    """
+    trace_id = trace_id_from_attributes(attributes, message_data.get("jobId", "unknown"))
+    trace_token = _trace_id.set(trace_id)
+    queue_wait = queue_wait_seconds(publish_time)
+    if queue_wait is not None:
+        QUEUE_WAIT_SECONDS.observe(queue_wait, subscription=subscription or SUBSCRIPTION_NAME)
+    try:
+        with (
+            JOBS_IN_FLIGHT.track_inprogress(source="pubsub"),
+            track_job(queue_wait) as timings,
+            profile_job(message_data.get("releaseId", ""), message_data.get("trackId", "")),
+        ):
+            try:
+                status = await _process_pubsub_message(message_data, timings)
+            except ScratchSpaceFull:
+                SCRATCH_REFUSALS.inc(source="pubsub")
+                raise
+            except Exception:
+                JOBS_TOTAL.inc(source="pubsub", status="failed")
+                raise
+        JOBS_TOTAL.inc(source="pubsub", status=status)
+    finally:
+        _trace_id.reset(trace_token)
+
+
+async def _process_pubsub_message(message_data: dict, timings: JobTimings) -> str:
+    """Run one job; returns the published status ("completed"/"quarantined")."""
     job_id = message_data.get("jobId", "unknown")
     release_id = message_data["releaseId"]
     track_id = message_data["trackId"]
@@ -518,35 +1824,59 @@ async def process_pubsub_message(message_data: dict):
 
     logger.info(f"[PubSub] Processing job {job_id}: release={release_id}, track={track_id}, callback={callback_url}")
 
-    with tempfile.TemporaryDirectory() as temp_dir:
+    with SCRATCH.job(prefix="pubsub-") as temp_dir:
         # Download original audio
         ext = ".mp3" if "mp3" in mime_type else ".wav"
         input_path = Path(temp_dir) / f"track_{track_id}{ext}"
         logger.info(f"[PubSub] Downloading audio from {original_stem_uri}")
-        await download_audio(original_stem_uri, input_path)
+        with observe_phase("download"):
+            await download_audio(original_stem_uri, input_path)
+
+        # A redelivered job resumes from its checkpoint manifest.
+        checkpoint = open_job_checkpoint(job_id, input_path)
 
         # ─── Fingerprint full track BEFORE separation ─────────────────
-        duration, fingerprint, fingerprint_hash = generate_fingerprint(input_path)
-        if fingerprint and callback_url:
-            logger.info(f"[PubSub] Submitting fingerprint for {track_id}")
-            fp_result = await submit_fingerprint(
-                callback_url, release_id, track_id,
-                duration, fingerprint, fingerprint_hash
-            )
-            if fp_result.get("quarantined"):
-                logger.warning(f"[PubSub] Track {track_id} QUARANTINED — skipping separation")
-                # Publish quarantine result instead of stems
-                from google.cloud import pubsub_v1
-                publisher = pubsub_v1.PublisherClient()
-                topic_path = publisher.topic_path(PUBSUB_PROJECT, RESULTS_TOPIC)
-                quarantine_msg = {
-                    "jobId": job_id,
-                    "releaseId": release_id,
-                    "artistId": artist_id,
-                    "trackId": track_id,
-                    "status": "quarantined",
-                    "reason": fp_result.get("reason", "Duplicate fingerprint detected"),
-                }
+        fp_done = checkpoint.get("fingerprint") if checkpoint is not None else None
+        if fp_done is not None:
+            fingerprint, fp_result = fp_done["fingerprint"], fp_done["result"]
+        else:
+            fp_result: dict = {}
+            verdict_received = not callback_url
+            with observe_phase("fingerprint"):
+                duration, fingerprint, fingerprint_hash = generate_fingerprint(input_path)
+                near_duplicates = find_near_duplicates(track_id, fingerprint) if fingerprint else []
+                if fingerprint and callback_url:
+                    logger.info(f"[PubSub] Submitting fingerprint for {track_id}")
+                    verdict = await submit_fingerprint(
+                        callback_url, release_id, track_id,
+                        duration, fingerprint, fingerprint_hash,
+                        near_duplicates=near_duplicates,
+                    )
+                    verdict_received = verdict is not None
+                    fp_result = verdict or {}
+            # Only a real verdict is final: a missing fingerprint (fpcalc
+            # absent or timed out) or a failed submission is retried on
+            # redelivery so the duplicate/quarantine gate is never skipped.
+            if checkpoint is not None and fingerprint and verdict_received:
+                checkpoint.complete("fingerprint", {"fingerprint": fingerprint, "result": fp_result})
+        if fp_result.get("quarantined"):
+            logger.warning(f"[PubSub] Track {track_id} QUARANTINED — skipping separation")
+            # Publish quarantine result instead of stems
+            from google.cloud import pubsub_v1
+            publisher = pubsub_v1.PublisherClient()
+            topic_path = publisher.topic_path(PUBSUB_PROJECT, RESULTS_TOPIC)
+            quarantine_msg = {
+                "jobId": job_id,
+                "releaseId": release_id,
+                "artistId": artist_id,
+                "trackId": track_id,
+                "status": "quarantined",
+                "reason": fp_result.get("reason", "Duplicate fingerprint detected"),
+                "traceId": _trace_id.get(),
+                "timings": timings.as_dict(),
+                "resourceUsage": timings.resource_usage(),
+            }
+            with observe_phase("publish"):
                 future = publisher.publish(
                     topic_path,
                     json.dumps(quarantine_msg).encode("utf-8"),
@@ -554,11 +1884,16 @@ async def process_pubsub_message(message_data: dict):
                     releaseId=release_id,
                 )
                 future.result()
-                logger.info(f"[PubSub] Published quarantine result for job {job_id}")
-                return  # Skip Demucs entirely
+            logger.info(f"[PubSub] Published quarantine result for job {job_id}")
+            return "quarantined"  # Skip Demucs entirely
+
+        if fingerprint:
+            remember_fingerprint(track_id, release_id, artist_id, fingerprint)
 
         # Run separation (with progress callbacks if callbackUrl provided)
-        results, stem_features = await run_demucs_separation(input_path, temp_dir, release_id, track_id, callback_url)
+        results, stem_features, stem_artifacts = await run_demucs_separation(
+            input_path, temp_dir, release_id, track_id, callback_url, checkpoint=checkpoint,
+        )
 
         # Publish result to stem-results topic
         from google.cloud import pubsub_v1
@@ -575,90 +1910,170 @@ async def process_pubsub_message(message_data: dict):
             "status": "completed",
             "stems": results,
             "stemFeatures": stem_features,
+            **stem_artifacts,
             "originalStemMeta": {
                 **original_stem_meta,
                 "uri": original_stem_uri,
             },
+            "traceId": _trace_id.get(),
+            "timings": timings.as_dict(),
+            "resourceUsage": timings.resource_usage(),
         }
 
-        future = publisher.publish(
-            topic_path,
-            json.dumps(result_message).encode("utf-8"),
-            jobId=job_id,
-            releaseId=release_id,
-        )
-        msg_id = future.result()
+        with observe_phase("publish"):
+            future = publisher.publish(
+                topic_path,
+                json.dumps(result_message).encode("utf-8"),
+                jobId=job_id,
+                releaseId=release_id,
+            )
+            msg_id = future.result()
         logger.info(f"[PubSub] Published result for job {job_id} (messageId={msg_id})")
+        if checkpoint is not None:
+            checkpoint.complete("published", {"messageId": msg_id})
+        return "completed"
 
 
-def pubsub_consumer_loop():
-    """Blocking consumer loop that runs in a background thread."""
-    from google.cloud import pubsub_v1
+def probe_duration(uri: str) -> Optional[float]:
+    """Duration of a local or HTTP(S) audio file from ffprobe, or None."""
+    if uri.startswith("gs://") or not shutil.which("ffprobe"):
+        return None
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=nw=1:nk=1", uri],
+            capture_output=True, text=True, timeout=10,
+        )
+        return float(result.stdout.strip())
+    except (subprocess.TimeoutExpired, ValueError):
+        return None
 
-    subscriber = pubsub_v1.SubscriberClient()
-    subscription_path = subscriber.subscription_path(PUBSUB_PROJECT, SUBSCRIPTION_NAME)
 
-    logger.info(f"[PubSub] Starting consumer on {subscription_path}")
+def estimate_job_seconds(message) -> Optional[float]:
+    """Track duration of a job message from originalStemMeta, or None.
 
-    def callback(message):
-        try:
-            data = json.loads(message.data.decode("utf-8"))
-            logger.info(f"[PubSub] Received message: jobId={data.get('jobId')}")
+    Runs in the Pub/Sub client's callback thread, so it never probes the
+    source: jobs without a duration get the scheduler's default estimate.
+    """
+    try:
+        data = json.loads(message.data.decode("utf-8"))
+        duration = float((data.get("originalStemMeta") or {}).get("durationSeconds") or 0)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return duration if duration > 0 else None
+
+
+def handle_pubsub_message(message, subscription: Optional[str] = None) -> None:
+    """Process one streaming-pull message and ack or nack it.
+
+    Successes are acked. A failed job publishes a failure result and is
+    acked, or nacked for redelivery when even that publish fails. Malformed
+    messages are acked so they are not retried.
+    """
+    from google.cloud import pubsub_v1
 
-            # Run async processing in the event loop
-            loop = asyncio.new_event_loop()
+    try:
+        data = json.loads(message.data.decode("utf-8"))
+        logger.info(f"[PubSub] Received message: jobId={data.get('jobId')}")
+
+        # Run async processing in the event loop
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(process_pubsub_message(
+                data,
+                attributes=dict(message.attributes or {}),
+                publish_time=message.publish_time,
+                subscription=subscription,
+            ))
+            message.ack()
+            logger.info(f"[PubSub] Acked message for job {data.get('jobId')}")
+        except ScratchSpaceFull as e:
+            # Not the job's fault: redeliver, possibly to another instance.
+            logger.warning(f"[PubSub] Refusing job {data.get('jobId')}: {e}")
+            message.nack()
+        except Exception as e:
+            logger.error(f"[PubSub] Processing failed for job {data.get('jobId')}: {e}")
+            # Publish failure result
+            published_failure = False
             try:
-                loop.run_until_complete(process_pubsub_message(data))
+                publisher = pubsub_v1.PublisherClient()
+                topic_path = publisher.topic_path(PUBSUB_PROJECT, RESULTS_TOPIC)
+                fail_msg = {
+                    "jobId": data.get("jobId", "unknown"),
+                    "releaseId": data.get("releaseId", ""),
+                    "artistId": data.get("artistId", ""),
+                    "trackId": data.get("trackId", ""),
+                    "status": "failed",
+                    "error": str(e),
+                    "traceId": trace_id_from_attributes(message.attributes, data.get("jobId", "unknown")),
+                }
+                publisher.publish(topic_path, json.dumps(fail_msg).encode("utf-8"))
+                published_failure = True
+            except Exception as pub_err:
+                logger.error(f"[PubSub] Failed to publish failure result: {pub_err}")
+            if published_failure:
                 message.ack()
-                logger.info(f"[PubSub] Acked message for job {data.get('jobId')}")
-            except Exception as e:
-                logger.error(f"[PubSub] Processing failed for job {data.get('jobId')}: {e}")
-                # Publish failure result
-                published_failure = False
-                try:
-                    publisher = pubsub_v1.PublisherClient()
-                    topic_path = publisher.topic_path(PUBSUB_PROJECT, RESULTS_TOPIC)
-                    fail_msg = {
-                        "jobId": data.get("jobId", "unknown"),
-                        "releaseId": data.get("releaseId", ""),
-                        "artistId": data.get("artistId", ""),
-                        "trackId": data.get("trackId", ""),
-                        "status": "failed",
-                        "error": str(e),
-                    }
-                    publisher.publish(topic_path, json.dumps(fail_msg).encode("utf-8"))
-                    published_failure = True
-                except Exception as pub_err:
-                    logger.error(f"[PubSub] Failed to publish failure result: {pub_err}")
-                if published_failure:
-                    message.ack()
-                    logger.info(f"[PubSub] Acked failed message for job {data.get('jobId')} after publishing failure result")
-                else:
-                    message.nack()  # Retry only when we couldn't publish the failure result
-            finally:
-                loop.close()
-        except Exception as e:
-            logger.error(f"[PubSub] Failed to parse message: {e}")
-            message.ack()  # Don't retry malformed messages
+                logger.info(f"[PubSub] Acked failed message for job {data.get('jobId')} after publishing failure result")
+            else:
+                message.nack()  # Retry only when we couldn't publish the failure result
+        finally:
+            loop.close()
+    except Exception as e:
+        logger.error(f"[PubSub] Failed to parse message: {e}")
+        message.ack()  # Don't retry malformed messages
+
+
+def pubsub_consumer_loop():
+    """Blocking consumer loop that runs in a background thread.
 
-    # Subscribe with flow control (1 message at a time for GPU memory safety)
+    Every subscription in JOB_CLASSES streams into one JobScheduler, and
+    this thread runs the scheduled jobs one at a time (GPU memory safety).
+    """
+    from google.cloud import pubsub_v1
     from google.cloud.pubsub_v1.types import FlowControl
-    flow_control = FlowControl(max_messages=1)
-    streaming_pull_future = subscriber.subscribe(
-        subscription_path, callback=callback, flow_control=flow_control
-    )
 
-    logger.info(f"[PubSub] Consumer listening on {subscription_path}")
+    subscriber = pubsub_v1.SubscriberClient()
+    scheduler = JobScheduler(JOB_CLASSES, shortest_first=PUBSUB_SHORTEST_FIRST, aging=PUBSUB_SJF_AGING)
+    # Leased but not yet running: the client keeps extending these leases.
+    flow_control = FlowControl(max_messages=PUBSUB_PREFETCH, max_lease_duration=PUBSUB_MAX_LEASE_SECONDS)
+    streaming_pull_futures = []
+
+    def enqueue(subscription: str, message) -> None:
+        estimate = estimate_job_seconds(message) if PUBSUB_SHORTEST_FIRST else None
+        scheduler.put(subscription, message, estimate)
+
+    for job_class in JOB_CLASSES:
+        subscription_path = subscriber.subscription_path(PUBSUB_PROJECT, job_class.subscription)
+        streaming_pull_futures.append(subscriber.subscribe(
+            subscription_path,
+            callback=functools.partial(enqueue, job_class.subscription),
+            flow_control=flow_control,
+        ))
+        logger.info(f"[PubSub] Consumer listening on {subscription_path} (weight {job_class.weight:g})")
 
     try:
-        streaming_pull_future.result()  # Blocks forever
+        while True:
+            for future in streaming_pull_futures:
+                if future.done():
+                    future.result()  # Raises the stream's error
+                    raise RuntimeError("Pub/Sub streaming pull stopped")
+            scheduled = scheduler.get(timeout=5)
+            if scheduled is None:
+                continue
+            subscription, message = scheduled
+            started = time.monotonic()
+            handle_pubsub_message(message, subscription)
+            scheduler.charge(subscription, time.monotonic() - started)
     except Exception as e:
         logger.error(f"[PubSub] Consumer error: {e}")
-        streaming_pull_future.cancel()
-        try:
-            streaming_pull_future.result(timeout=5)
-        except Exception:
-            pass
+        for future in streaming_pull_futures:
+            future.cancel()
+            try:
+                future.result(timeout=5)
+            except Exception:
+                pass
+        # Hand buffered messages back for prompt redelivery.
+        for _, message in scheduler.close():
+            message.nack()
         raise  # Re-raise so retry wrapper can catch and retry
 
 
@@ -677,8 +2092,11 @@ def pubsub_consumer_with_retry():
             time.sleep(wait)
 
 
-def publish_failure_result(message_data: dict, error: Exception) -> bool:
-    """Publish a failed result message. Returns True only after Pub/Sub accepts it."""
+def publish_failure_result(message_data: dict, error: Exception, attributes: Optional[dict] = None) -> bool:
+    """Publish a failed result message. Returns True only after Pub/Sub accepts it.
+
+    `attributes` are the job message's, for its trace id.
+    """
     try:
         from google.cloud import pubsub_v1
 
@@ -691,6 +2109,7 @@ def publish_failure_result(message_data: dict, error: Exception) -> bool:
             "trackId": message_data.get("trackId", ""),
             "status": "failed",
             "error": str(error),
+            "traceId": trace_id_from_attributes(attributes, message_data.get("jobId", "unknown")),
         }
         publisher.publish(topic_path, json.dumps(fail_msg).encode("utf-8")).result()
         return True
@@ -716,30 +2135,39 @@ def extend_ack_deadline_until_stopped(subscriber, subscription_path: str, ack_id
 
 
 def process_one_pubsub_message(wait_seconds: Optional[int] = None) -> bool:
-    """Pull, process, and ack one Pub/Sub message for Cloud Run Job execution."""
+    """Pull, process, and ack one Pub/Sub message for Cloud Run Job execution.
+
+    With several subscriptions, each round polls them in `lottery_order`,
+    so across many job instances every class gets its weighted share.
+    """
     from google.api_core import exceptions as google_exceptions
     from google.cloud import pubsub_v1
 
     wait_seconds = wait_seconds if wait_seconds is not None else int(os.getenv("PUBSUB_JOB_WAIT_SECONDS", "60"))
     subscriber = pubsub_v1.SubscriberClient()
-    subscription_path = subscriber.subscription_path(PUBSUB_PROJECT, SUBSCRIPTION_NAME)
     deadline = time.monotonic() + wait_seconds
+    pull_timeout = max(1, 10 // len(JOB_CLASSES))
 
-    logger.info(f"[PubSubJob] Waiting up to {wait_seconds}s for one message on {subscription_path}")
+    names = ", ".join(job_class.subscription for job_class in JOB_CLASSES)
+    logger.info(f"[PubSubJob] Waiting up to {wait_seconds}s for one message on {names}")
     received = None
     while time.monotonic() < deadline and not received:
-        remaining = max(1, int(deadline - time.monotonic()))
-        try:
-            response = subscriber.pull(
-                request={"subscription": subscription_path, "max_messages": 1},
-                timeout=min(10, remaining),
-            )
-        except google_exceptions.DeadlineExceeded:
-            continue
-        if response.received_messages:
-            received = response.received_messages[0]
-            break
-        time.sleep(1)
+        for job_class in lottery_order(JOB_CLASSES):
+            subscription = job_class.subscription
+            subscription_path = subscriber.subscription_path(PUBSUB_PROJECT, subscription)
+            remaining = max(1, int(deadline - time.monotonic()))
+            try:
+                response = subscriber.pull(
+                    request={"subscription": subscription_path, "max_messages": 1},
+                    timeout=min(pull_timeout, remaining),
+                )
+            except google_exceptions.DeadlineExceeded:
+                continue
+            if response.received_messages:
+                received = response.received_messages[0]
+                break
+        else:
+            time.sleep(1)
 
     if not received:
         logger.info("[PubSubJob] No message available; exiting cleanly")
@@ -756,7 +2184,12 @@ def process_one_pubsub_message(wait_seconds: Optional[int] = None) -> bool:
     try:
         data = json.loads(received.message.data.decode("utf-8"))
         logger.info(f"[PubSubJob] Processing message: jobId={data.get('jobId')}")
-        asyncio.run(process_pubsub_message(data))
+        asyncio.run(process_pubsub_message(
+            data,
+            attributes=dict(received.message.attributes or {}),
+            publish_time=received.message.publish_time,
+            subscription=subscription,
+        ))
         subscriber.acknowledge(request={"subscription": subscription_path, "ack_ids": [received.ack_id]})
         logger.info(f"[PubSubJob] Acked message for job {data.get('jobId')}")
         return True
@@ -764,10 +2197,16 @@ def process_one_pubsub_message(wait_seconds: Optional[int] = None) -> bool:
         logger.error(f"[PubSubJob] Failed to parse message: {exc}")
         subscriber.acknowledge(request={"subscription": subscription_path, "ack_ids": [received.ack_id]})
         return True
+    except ScratchSpaceFull as exc:
+        logger.warning(f"[PubSubJob] Refusing job {data.get('jobId')}: {exc}")
+        subscriber.modify_ack_deadline(
+            request={"subscription": subscription_path, "ack_ids": [received.ack_id], "ack_deadline_seconds": 0}
+        )
+        return False
     except Exception as exc:
         logger.error(f"[PubSubJob] Processing failed: {exc}")
         data = locals().get("data", {})
-        if publish_failure_result(data, exc):
+        if publish_failure_result(data, exc, dict(received.message.attributes or {})):
             subscriber.acknowledge(request={"subscription": subscription_path, "ack_ids": [received.ack_id]})
             logger.info(f"[PubSubJob] Acked failed message for job {data.get('jobId')} after publishing failure result")
             return True
@@ -791,6 +2230,22 @@ async def startup_event():
         logger.info("[HTTP] Running in HTTP-only mode (PROCESSING_MODE=http)")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush index entries still waiting for the save timer; stop the analysis pool."""
+    global _analysis_pool
+    await asyncio.to_thread(save_fingerprint_index)
+    if _analysis_pool is not None:
+        _analysis_pool.shutdown(cancel_futures=True)
+        _analysis_pool = None
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of job phase timings and counters."""
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/health")
 def health():
     return {
@@ -798,9 +2253,14 @@ def health():
         "storage_mode": STORAGE_MODE,
         "processing_mode": PROCESSING_MODE,
         "demucs_device": DEMUCS_DEVICE or "auto",
+        "http_jobs": {"workers": HTTP_JOBS.workers, "queued": HTTP_JOBS.depth()},
+        "scratch": SCRATCH.usage(),
     }
 
 
 if __name__ == "__main__":
     if PROCESSING_MODE in ("pubsub-once", "job"):
-        process_one_pubsub_message()
+        try:
+            process_one_pubsub_message()
+        finally:
+            save_fingerprint_index()
@@ -0,0 +1,374 @@
+"""ONNX Runtime CPU backend for htdemucs_6s stem separation.
+
+The `demucs` CLI pays a full Torch import and model unpickle on every job,
+which dominates cold starts on scale-to-zero CPU instances. This module
+exports htdemucs_6s to ONNX once (Torch + Demucs are only needed for the
+export, e.g. at image build time) and runs inference with ONNX Runtime's
+CPU execution provider, numpy for chunking and ffmpeg/soundfile for audio
+I/O.
+
+Run as `python -m onnx_separator --out DIR -n htdemucs_6s INPUT`: the output
+layout (`DIR/htdemucs_6s/<input stem>/<source>.wav`) and the `NN%|` progress
+lines on stderr match the Demucs CLI, so `main.run_demucs_attempt` treats it
+as just another separation device.
+
+Torch's STFT produces complex tensors, which the ONNX exporter cannot
+serialize. The export swaps HTDemucs' spectrogram helpers for real-valued
+DFT convolutions (complex values carried as a trailing dim of 2); the
+network weights and graph are otherwise untouched.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "htdemucs_6s"
+ONNX_OPSET = 17
+MODEL_DIR = Path(
+    os.getenv("DEMUCS_ONNX_MODEL_DIR", str(Path.home() / ".cache" / "resonate" / "onnx"))
+)
+# 0 lets ONNX Runtime size the intra-op pool to the physical cores. The
+# graph is a single sequential chain, so one inter-op thread is enough.
+INTRA_OP_THREADS = int(os.getenv("DEMUCS_ONNX_INTRA_OP_THREADS", "0"))
+INTER_OP_THREADS = int(os.getenv("DEMUCS_ONNX_INTER_OP_THREADS", "1"))
+# Same defaults as `demucs.apply.apply_model` (shifts aside: the ONNX path is
+# deterministic and runs a single pass).
+OVERLAP = float(os.getenv("DEMUCS_ONNX_OVERLAP", "0.25"))
+
+
+def model_paths(model_name: str = DEFAULT_MODEL) -> tuple[Path, Path]:
+    """Return (onnx graph path, JSON sidecar path) for a model name."""
+    onnx_path = MODEL_DIR / f"{model_name}.onnx"
+    return onnx_path, onnx_path.with_suffix(".json")
+
+
+# ─── Export (needs torch + demucs) ────────────────────────────────────
+
+
+def _real_spectro(x, n_fft: int, hop_length: int):
+    """torch.stft(normalized, center, reflect, hann) as a strided conv1d.
+
+    Returns (*other, freqs, frames, 2) with real/imag in the last dim.
+    """
+    import torch
+    import torch.nn.functional as F
+
+    *other, length = x.shape
+    x = x.reshape(-1, 1, length)
+    x = F.pad(x, (n_fft // 2, n_fft // 2), mode="reflect")
+
+    freqs = n_fft // 2 + 1
+    n = torch.arange(n_fft, dtype=torch.float32)
+    k = torch.arange(freqs, dtype=torch.float32)[:, None]
+    window = torch.hann_window(n_fft, dtype=torch.float32)
+    angle = 2 * math.pi * k * n / n_fft
+    scale = 1.0 / math.sqrt(n_fft)
+    kernel = torch.cat(
+        [torch.cos(angle) * window * scale, -torch.sin(angle) * window * scale]
+    )[:, None, :].to(x)
+
+    z = F.conv1d(x, kernel, stride=hop_length)
+    frames = z.shape[-1]
+    z = torch.stack([z[:, :freqs], z[:, freqs:]], dim=-1)
+    return z.view(*other, freqs, frames, 2)
+
+
+def _real_ispectro(z, hop_length: int, length: int):
+    """torch.istft(normalized, center, hann) over the real/imag layout."""
+    import torch
+    import torch.nn.functional as F
+
+    *other, freqs, frames, _ = z.shape
+    n_fft = 2 * freqs - 2
+    z = z.reshape(-1, freqs, frames, 2)
+    spec = torch.cat([z[..., 0], z[..., 1]], dim=1)
+
+    n = torch.arange(n_fft, dtype=torch.float32)
+    k = torch.arange(freqs, dtype=torch.float32)[:, None]
+    window = torch.hann_window(n_fft, dtype=torch.float32)
+    angle = 2 * math.pi * k * n / n_fft
+    # Hermitian weights: DC and Nyquist appear once, every other bin twice.
+    weights = torch.full((freqs, 1), 2.0)
+    weights[0] = 1.0
+    weights[-1] = 1.0
+    scale = math.sqrt(n_fft) / n_fft
+    kernel = torch.cat(
+        [weights * torch.cos(angle) * window * scale, -weights * torch.sin(angle) * window * scale]
+    )[:, None, :].to(spec)
+
+    x = F.conv_transpose1d(spec, kernel, stride=hop_length)
+    envelope = F.conv_transpose1d(
+        torch.ones(1, 1, frames).to(spec),
+        (window ** 2)[None, None, :].to(spec),
+        stride=hop_length,
+    )
+    x = x / envelope.clamp_min(1e-11)
+    x = x[..., n_fft // 2: n_fft // 2 + length]
+    return x.reshape(*other, length)
+
+
+def _make_exportable(model) -> None:
+    """Swap HTDemucs' complex spectrogram helpers for real-valued ones."""
+    import types
+
+    import torch.nn.functional as F
+
+    if not getattr(model, "cac", False):
+        raise ValueError("ONNX export requires a complex-as-channels HTDemucs model")
+
+    def _spec(self, x):
+        hl = self.hop_length
+        le = int(math.ceil(x.shape[-1] / hl))
+        pad = hl // 2 * 3
+        x = F.pad(x, (pad, pad + le * hl - x.shape[-1]), mode="reflect")
+        z = _real_spectro(x, self.nfft, hl)[..., :-1, :, :]
+        return z[..., 2: 2 + le, :]
+
+    def _magnitude(self, z):
+        B, C, Fr, T, _ = z.shape
+        return z.permute(0, 1, 4, 2, 3).reshape(B, C * 2, Fr, T)
+
+    def _mask(self, z, m):
+        B, S, C, Fr, T = m.shape
+        return m.view(B, S, -1, 2, Fr, T).permute(0, 1, 2, 4, 5, 3)
+
+    def _ispec(self, z, length=None, scale=0):
+        hl = self.hop_length // (4 ** scale)
+        z = F.pad(z, (0, 0, 0, 0, 0, 1))
+        z = F.pad(z, (0, 0, 2, 2))
+        pad = hl // 2 * 3
+        le = hl * int(math.ceil(length / hl)) + 2 * pad
+        x = _real_ispectro(z, hl, le)
+        return x[..., pad: pad + length]
+
+    for name, fn in (("_spec", _spec), ("_magnitude", _magnitude), ("_mask", _mask), ("_ispec", _ispec)):
+        setattr(model, name, types.MethodType(fn, model))
+
+
+def export_onnx_model(model_name: str = DEFAULT_MODEL, force: bool = False) -> Path:
+    """Export a single-model Demucs bag to ONNX plus a JSON sidecar.
+
+    Idempotent: an existing export is reused unless `force` is set.
+    """
+    onnx_path, meta_path = model_paths(model_name)
+    if onnx_path.exists() and meta_path.exists() and not force:
+        return onnx_path
+
+    import torch
+    from demucs.pretrained import get_model
+
+    bag = get_model(model_name)
+    models = getattr(bag, "models", [bag])
+    if len(models) != 1:
+        raise ValueError(f"{model_name} bags {len(models)} models; only single-model bags are exportable")
+    model = models[0].cpu().eval()
+    _make_exportable(model)
+
+    segment_samples = int(float(model.segment) * model.samplerate)
+    dummy = torch.zeros(1, model.audio_channels, segment_samples)
+
+    onnx_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = onnx_path.with_suffix(".onnx.tmp")
+    logger.info(f"[onnx] Exporting {model_name} ({segment_samples} samples/segment) to {onnx_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            dummy,
+            str(tmp_path),
+            input_names=["mix"],
+            output_names=["sources"],
+            opset_version=ONNX_OPSET,
+            do_constant_folding=True,
+        )
+    tmp_path.replace(onnx_path)
+    meta_path.write_text(json.dumps({
+        "model": model_name,
+        "sources": list(model.sources),
+        "samplerate": int(model.samplerate),
+        "audioChannels": int(model.audio_channels),
+        "segmentSamples": segment_samples,
+        "opset": ONNX_OPSET,
+    }, indent=2))
+    return onnx_path
+
+
+# ─── Inference (numpy + onnxruntime only) ─────────────────────────────
+
+
+def create_session(onnx_path: Union[str, Path]):
+    """ONNX Runtime CPU session with explicit thread pools."""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = INTRA_OP_THREADS
+    options.inter_op_num_threads = INTER_OP_THREADS
+    return ort.InferenceSession(
+        str(onnx_path), sess_options=options, providers=["CPUExecutionProvider"],
+    )
+
+
+def decode_audio(path: Union[str, Path], samplerate: int, channels: int):
+    """Decode any ffmpeg-readable file to float32 (channels, samples)."""
+    import numpy as np
+
+    result = subprocess.run(
+        [
+            "ffmpeg", "-v", "error", "-i", str(path),
+            "-f", "f32le", "-ac", str(channels), "-ar", str(samplerate), "-",
+        ],
+        capture_output=True, check=True,
+    )
+    audio = np.frombuffer(result.stdout, dtype=np.float32)
+    return audio.reshape(-1, channels).T.copy()
+
+
+def _transition_weight(segment: int):
+    """Triangular overlap-add weight, as in demucs.apply.apply_model."""
+    import numpy as np
+
+    weight = np.concatenate([
+        np.arange(1, segment // 2 + 1),
+        np.arange(segment - segment // 2, 0, -1),
+    ]).astype(np.float32)
+    return weight / weight.max()
+
+
+def _padded_chunk(mix, offset: int, segment: int):
+    """`segment` samples around mix[:, offset: offset + segment] → (chunk, valid, trim).
+
+    Same as demucs.apply's `TensorChunk.padded`: a short final chunk is
+    centred in the segment, so the model sees real audio before it as
+    context instead of only trailing zeros. The valid output is
+    `sources[..., trim: trim + valid]` (Demucs' `center_trim`).
+    """
+    import numpy as np
+
+    channels, length = mix.shape
+    valid = min(segment, length - offset)
+    delta = segment - valid
+    start = offset - delta // 2
+    end = start + segment
+    chunk = mix[:, max(0, start): min(length, end)]
+    pad_left, pad_right = max(0, start) - start, end - min(length, end)
+    if pad_left or pad_right:
+        chunk = np.pad(chunk, ((0, 0), (pad_left, pad_right)))
+    return chunk, valid, delta // 2
+
+
+def separate_array(
+    session,
+    mix,
+    segment: int,
+    overlap: float = OVERLAP,
+    progress: Optional[Callable[[int], None]] = None,
+):
+    """Separate a (channels, samples) mix into (sources, channels, samples).
+
+    Mirrors `demucs.separate`: normalize by the mono reference, split into
+    overlapping fixed-length segments (the last one centred with context,
+    see `_padded_chunk`), overlap-add with a triangular weight,
+    de-normalize.
+    """
+    import numpy as np
+
+    channels, length = mix.shape
+    ref = mix.mean(axis=0)
+    mean, std = float(ref.mean()), float(ref.std()) or 1.0
+    mix = (mix - mean) / std
+
+    input_name = session.get_inputs()[0].name
+    stride = max(1, int((1 - overlap) * segment))
+    offsets = list(range(0, length, stride))
+    weight = _transition_weight(segment)
+
+    out = None
+    sum_weight = np.zeros(length, dtype=np.float32)
+    for index, offset in enumerate(offsets):
+        chunk, valid, trim = _padded_chunk(mix, offset, segment)
+        sources = session.run(None, {input_name: chunk[None].astype(np.float32)})[0][0]
+        sources = sources[..., trim: trim + valid]
+        if out is None:
+            out = np.zeros((sources.shape[0], channels, length), dtype=np.float32)
+        out[..., offset: offset + valid] += weight[:valid] * sources[..., :valid]
+        sum_weight[offset: offset + valid] += weight[:valid]
+        if progress:
+            progress(int(100 * (index + 1) / len(offsets)))
+
+    out /= np.maximum(sum_weight, 1e-8)
+    return out * std + mean
+
+
+def write_stems(sources, names: list[str], samplerate: int, out_dir: Path) -> list[Path]:
+    """Write int16 WAVs with Demucs' default `rescale` clip handling."""
+    import numpy as np
+    import soundfile as sf
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+    for name, source in zip(names, sources):
+        peak = float(np.abs(source).max()) if source.size else 0.0
+        source = source / max(1.01 * peak, 1.0)
+        path = out_dir / f"{name}.wav"
+        sf.write(str(path), source.T, samplerate, subtype="PCM_16")
+        written.append(path)
+    return written
+
+
+def separate_file(
+    input_path: Union[str, Path],
+    out_root: Union[str, Path],
+    model_name: str = DEFAULT_MODEL,
+    session=None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> Path:
+    """Separate one file into `out_root/<model>/<input stem>/<source>.wav`."""
+    onnx_path, meta_path = model_paths(model_name)
+    if session is None:
+        onnx_path = export_onnx_model(model_name)
+        session = create_session(onnx_path)
+    meta = json.loads(meta_path.read_text())
+
+    mix = decode_audio(input_path, meta["samplerate"], meta["audioChannels"])
+    sources = separate_array(session, mix, meta["segmentSamples"], progress=progress)
+    out_dir = Path(out_root) / model_name / Path(input_path).stem
+    write_stems(sources, meta["sources"], meta["samplerate"], out_dir)
+    return out_dir
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="htdemucs separation on ONNX Runtime (CPU)")
+    parser.add_argument("input", nargs="?", help="audio file to separate")
+    parser.add_argument("-n", "--name", default=DEFAULT_MODEL)
+    parser.add_argument("--out", default="separated")
+    parser.add_argument("--export-only", action="store_true", help="export the ONNX graph and exit")
+    args = parser.parse_args(argv)
+
+    if args.export_only:
+        print(export_onnx_model(args.name))
+        return 0
+    if not args.input:
+        parser.error("input is required unless --export-only is set")
+
+    def report(percentage: int) -> None:
+        # Same `NN%|` shape as the Demucs CLI's tqdm bar, which the worker's
+        # progress parser already understands.
+        print(f"{percentage:3d}%|", file=sys.stderr, flush=True)
+
+    out_dir = separate_file(args.input, args.out, args.name, progress=report)
+    print(f"Separated tracks will be stored in {out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    raise SystemExit(main())
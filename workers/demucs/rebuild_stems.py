@@ -0,0 +1,89 @@
+"""Rebuild stem outputs from archived lossless FLACs, without Demucs.
+
+Input is JSONL, one track per line, in the shape of a stem-results message
+(extra fields are ignored):
+
+    {"releaseId": "rel_1", "trackId": "trk_1", "stemArchive": {"vocals": {"uri": "gs://...", "sha256": "..."}}}
+
+Every track goes through the worker's normal encode pass (MP3, renditions,
+loudness, features, peaks) and is stored with the worker's STORAGE_MODE /
+GCS_BUCKET settings. Output is JSONL with the rebuilt `stems`,
+`stemFeatures` and artifact maps, one line per input track:
+
+    STORAGE_MODE=gcs GCS_BUCKET=... python rebuild_stems.py tracks.jsonl --out rebuilt.jsonl
+    python rebuild_stems.py tracks.jsonl --renditions opus,hls
+
+A track that fails is reported with `"status": "failed"` and does not
+stop the run; the exit status is 1 if any track failed.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+async def rebuild_track(main, record: dict) -> dict:
+    release_id, track_id = record["releaseId"], record["trackId"]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results, stem_features, artifacts = await main.rebuild_from_archive(
+            record["stemArchive"], release_id, track_id, temp_dir,
+        )
+    return {
+        "releaseId": release_id,
+        "trackId": track_id,
+        "status": "completed",
+        "stems": results,
+        "stemFeatures": stem_features,
+        **artifacts,
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("input", type=Path, help="JSONL of {releaseId, trackId, stemArchive}")
+    parser.add_argument("--out", type=Path, help="Write result JSONL here (default: stdout)")
+    parser.add_argument("--renditions", help="Override STEM_RENDITIONS for this run (e.g. opus,hls)")
+    args = parser.parse_args(argv)
+
+    import main as worker
+    from stem_encoding import parse_renditions
+
+    if args.renditions is not None:
+        worker.STEM_RENDITIONS = parse_renditions(args.renditions)
+
+    failed = 0
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        for line in args.input.read_text().splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            try:
+                if not record.get("stemArchive"):
+                    raise ValueError("record has no stemArchive")
+                result = asyncio.run(rebuild_track(worker, record))
+            except Exception as exc:
+                failed += 1
+                worker.logger.error(f"[rebuild] {record.get('trackId')}: {exc}")
+                result = {
+                    "releaseId": record.get("releaseId"),
+                    "trackId": record.get("trackId"),
+                    "status": "failed",
+                    "error": str(exc),
+                }
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
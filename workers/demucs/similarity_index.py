@@ -0,0 +1,566 @@
+"""Catalog-wide similarity index over stem features.
+
+`stemFeatures` are published per track, so a question across the catalog
+("stems near 120 BPM in A minor with high energy") is a full scan in the
+backend. `SimilarityIndex` keeps one row per stem in numpy columns and
+answers two kinds of query in memory:
+
+- `find`: range filters on tempo, key, energy and onset density.
+- `nearest`: the stems closest to a feature dict, the basis for
+  compatible-stem recommendations.
+
+Tempo is stored as log2 BPM. Beat trackers often lock onto half or double
+the perceived tempo, so by default a tempo range also matches at half and
+double time, and tempo distance is measured modulo an octave. Rows are kept
+in tempo order as well, so a tempo range is a few `searchsorted` calls
+rather than a scan. Keys are (pitch class, mode) and compared on the circle
+of fifths, with relative major/minor one step apart as in harmonic mixing.
+
+Rows come from feature dicts (`add`), result messages (`add_result`) or
+JSONL files (`add_jsonl`: backfill shards, or one result message per line).
+As in `FingerprintIndex`, new rows go to a small pending table that queries
+scan alongside the merged columns and that is merged in past
+PENDING_MERGE_ROWS rows or on save; re-adding a stem replaces its row, and
+the index is saved as one uncompressed `.npz`:
+
+    python similarity_index.py build index.npz backfill/features-*.jsonl
+    python similarity_index.py query index.npz --tempo 118:122 --key "A minor"
+    python similarity_index.py query index.npz --like rel_1/trk_1/vocals
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+from audio_features import TONICS
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT_VERSION = 1
+MODES = ["major", "minor"]
+
+# One unit of `nearest` distance per dimension: a 4% tempo difference, one
+# step on the circle of fifths, a 1.4x energy or onset density ratio.
+TEMPO_STEP = math.log2(1.04)
+LOG_RATIO_STEP = 0.5
+# Distance of a dimension that is null on either side.
+MISSING_DISTANCE = 2.0
+# Floors before taking logs, so silent stems compare as "very quiet".
+ENERGY_FLOOR = 1e-4
+ONSET_DENSITY_FLOOR = 0.05
+DEFAULT_WEIGHTS = {"tempo": 1.0, "key": 1.0, "energy": 1.0, "onsetDensity": 1.0}
+# Rows kept in the pending table before it is merged into the columns.
+PENDING_MERGE_ROWS = 1024
+
+# Stored columns and their dtypes; missing values are NaN or -1.
+COLUMNS = {
+    "logTempo": "float32",
+    "pitchClass": "int8",
+    "mode": "int8",
+    "energy": "float32",
+    "onsetDensity": "float32",
+    "duration": "float32",
+}
+
+
+def parse_key(value) -> tuple:
+    """(pitch class, mode) of a features `key` dict or "A minor"-style string; -1 when unknown."""
+    if not value:
+        return -1, -1
+    if isinstance(value, dict):
+        tonic, mode = value.get("tonic"), value.get("mode")
+    else:
+        tonic, _, mode = str(value).strip().partition(" ")
+    if tonic not in TONICS:
+        raise ValueError(f"unknown tonic {tonic!r}")
+    if mode and mode not in MODES:
+        raise ValueError(f"unknown mode {mode!r}")
+    return TONICS.index(tonic), MODES.index(mode) if mode else -1
+
+
+def _fifths_position(pitch_class, mode):
+    """Circle-of-fifths position of the key, minor keys at their relative major."""
+    relative_major = (pitch_class + 3 * (mode == 1)) % 12
+    return (relative_major * 7) % 12
+
+
+def key_distance(pitch_class, mode, other_pitch_class, other_mode):
+    """Steps between keys: one per fifth, one between relative major and minor.
+
+    Works elementwise on numpy arrays. 0 is the same key; 1 is a
+    harmonically compatible neighbour.
+    """
+    import numpy as np
+
+    apart = np.abs(_fifths_position(pitch_class, mode) - _fifths_position(other_pitch_class, other_mode))
+    return np.minimum(apart, 12 - apart) + (mode != other_mode)
+
+
+def _encode(features: dict) -> dict:
+    """Column values of one feature dict."""
+    tempo = features.get("tempoBpm")
+    pitch_class, mode = parse_key(features.get("key"))
+    return {
+        "logTempo": math.log2(tempo) if tempo and tempo > 0 else math.nan,
+        "pitchClass": pitch_class,
+        "mode": mode,
+        "energy": _float(features.get("energyRms")),
+        "onsetDensity": _float(features.get("onsetDensity")),
+        "duration": _float(features.get("durationSeconds")),
+    }
+
+
+def _float(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _bounds(value_range, transform=float) -> tuple:
+    """(low, high) with open ends as ∓inf."""
+    low, high = value_range
+    return (
+        -math.inf if low is None else transform(low),
+        math.inf if high is None else transform(high),
+    )
+
+
+class SimilarityIndex:
+    """Columnar index of stem features, one row per stem id.
+
+    Thread-safe for the one-writer/many-reader use of `FingerprintIndex`.
+    Stem ids are `{releaseId}/{trackId}/{stem}`.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None):
+        import numpy as np
+
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._ids: list[str] = []
+        self._meta: list[dict] = []
+        self._live: list[bool] = []
+        self._by_id: dict[str, int] = {}
+        self._columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self._live_rows = np.zeros(0, dtype=bool)
+        # Row numbers in ascending tempo, rows without a tempo last.
+        self._tempo_order = np.zeros(0, dtype=np.int64)
+        self._pending: list[dict] = []
+        # Columns of the pending rows, rebuilt on the first query after an add.
+        self._pending_columns: Optional[dict] = None
+        self._dirty = False
+        if self.path and self.path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, stem_id: str) -> bool:
+        return stem_id in self._by_id
+
+    @property
+    def dirty(self) -> bool:
+        """True when stems were added since the last save or load."""
+        return self._dirty
+
+    # ─── ingestion ────────────────────────────────────────────────────
+
+    def add(self, stem_id: str, features: dict, meta: Optional[dict] = None) -> None:
+        """Index one stem's feature dict; replaces an earlier row for `stem_id`."""
+        row = _encode(features)
+        with self._lock:
+            previous = self._by_id.get(stem_id)
+            if previous is not None:
+                self._live[previous] = False
+                if previous < len(self._live_rows):
+                    self._live_rows[previous] = False
+            self._by_id[stem_id] = len(self._ids)
+            self._ids.append(stem_id)
+            self._meta.append(dict(meta or {}))
+            self._live.append(True)
+            self._pending.append(row)
+            self._pending_columns = None
+            self._dirty = True
+            if len(self._pending) >= PENDING_MERGE_ROWS:
+                self._merge_pending()
+
+    def add_result(self, message: dict) -> int:
+        """Index every stem of a result message; returns how many were added."""
+        release_id = message.get("releaseId") or message.get("release_id")
+        track_id = message.get("trackId") or message.get("track_id")
+        added = 0
+        for stem, features in (message.get("stemFeatures") or {}).items():
+            if features:
+                self.add(
+                    f"{release_id}/{track_id}/{stem}", features,
+                    {"releaseId": release_id, "trackId": track_id, "stem": stem},
+                )
+                added += 1
+        return added
+
+    def add_jsonl(self, path: Union[str, Path]) -> int:
+        """Index a JSONL file of backfill records or result messages.
+
+        Lines that do not parse or carry no features (failed backfill
+        stems) are skipped. Returns how many stems were added.
+        """
+        added = 0
+        with open(path) as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "stemFeatures" in record:
+                    added += self.add_result(record)
+                elif record.get("features"):
+                    meta = {name: record.get(name) for name in ("releaseId", "trackId", "stem")}
+                    self.add(f"{meta['releaseId']}/{meta['trackId']}/{meta['stem']}", record["features"], meta)
+                    added += 1
+        return added
+
+    def _pending_table(self) -> tuple:
+        """(columns, live mask) of the pending rows, numbered after the merged ones."""
+        import numpy as np
+
+        if self._pending_columns is None:
+            self._pending_columns = {
+                name: np.array([row[name] for row in self._pending], dtype=dtype)
+                for name, dtype in COLUMNS.items()
+            }
+        return self._pending_columns, np.array(self._live[len(self._live_rows):], dtype=bool)
+
+    def _merge_pending(self) -> None:
+        import numpy as np
+
+        if not self._pending:
+            return
+        merged = len(self._live_rows)
+        columns, live = self._pending_table()
+        ordered = self._columns["logTempo"][self._tempo_order]
+        added_order = np.argsort(columns["logTempo"], kind="stable")
+        # side="right" keeps older rows first among equal tempos.
+        at = np.searchsorted(ordered, columns["logTempo"][added_order], side="right")
+        self._tempo_order = np.insert(self._tempo_order, at, added_order + merged)
+        self._columns = {
+            name: np.concatenate([self._columns[name], columns[name]]) for name in COLUMNS
+        }
+        self._live_rows = np.concatenate([self._live_rows, live])
+        self._pending = []
+        self._pending_columns = None
+
+    # ─── queries ──────────────────────────────────────────────────────
+
+    def find(
+        self,
+        tempo: Optional[tuple] = None,
+        key=None,
+        compatible_keys: bool = False,
+        energy: Optional[tuple] = None,
+        onset_density: Optional[tuple] = None,
+        half_double: bool = True,
+        limit: Optional[int] = 100,
+    ) -> list[dict]:
+        """Stems inside every given range, in the order they were added.
+
+        Ranges are (low, high) with either end None for open: `tempo` in BPM,
+        `energy` as energyRms, `onset_density` in onsets per second. `key`
+        is a features key dict or "A minor" (a bare "A" matches both modes);
+        `compatible_keys` also accepts keys one step away.
+        """
+        import numpy as np
+
+        with self._lock:
+            merged = len(self._live_rows)
+            if tempo is not None:
+                rows = self._tempo_rows(tempo, half_double)
+            else:
+                rows = np.arange(merged)
+            parts = [(self._columns, self._live_rows, rows, 0)]
+            if self._pending:
+                columns, live = self._pending_table()
+                keep = np.ones(len(live), dtype=bool)
+                if tempo is not None:
+                    keep = self._in_tempo_range(columns["logTempo"], tempo, half_double)
+                parts.append((columns, live, np.flatnonzero(keep), merged))
+            matches = []
+            for columns, live, rows, first in parts:
+                rows = rows[live[rows]]
+                matches.append(first + rows[self._matching(
+                    {name: column[rows] for name, column in columns.items()},
+                    key, compatible_keys, energy, onset_density,
+                )])
+            rows = np.concatenate(matches)[:limit]
+            return [self._row(int(row)) for row in rows]
+
+    @staticmethod
+    def _matching(columns: dict, key, compatible_keys: bool, energy, onset_density):
+        """Mask of the rows in `columns` that pass the key and range filters."""
+        import numpy as np
+
+        keep = np.ones(len(columns["pitchClass"]), dtype=bool)
+        if key is not None:
+            pitch_class, mode = parse_key(key)
+            if compatible_keys and mode >= 0:
+                keep &= (columns["pitchClass"] >= 0) & (
+                    key_distance(columns["pitchClass"], columns["mode"], pitch_class, mode) <= 1
+                )
+            else:
+                keep &= columns["pitchClass"] == pitch_class
+                if mode >= 0:
+                    keep &= columns["mode"] == mode
+        for name, value_range in (("energy", energy), ("onsetDensity", onset_density)):
+            if value_range is not None:
+                low, high = _bounds(value_range)
+                keep &= (columns[name] >= low) & (columns[name] <= high)
+        return keep
+
+    def _tempo_rows(self, tempo: tuple, half_double: bool):
+        """Rows whose tempo is in range (also at half and double time), ascending."""
+        import numpy as np
+
+        low, high = _bounds(tempo, math.log2)
+        # NaN tempos sort last, so searchsorted never returns them.
+        ordered = self._columns["logTempo"][self._tempo_order]
+        slices = []
+        for shift in ((-1.0, 0.0, 1.0) if half_double else (0.0,)):
+            start = np.searchsorted(ordered, low + shift, side="left")
+            stop = np.searchsorted(ordered, high + shift, side="right")
+            slices.append(self._tempo_order[start:stop])
+        return np.unique(np.concatenate(slices))
+
+    @staticmethod
+    def _in_tempo_range(log_tempo, tempo: tuple, half_double: bool):
+        """Mask of `log_tempo` values in range; the unsorted form of `_tempo_rows`."""
+        import numpy as np
+
+        low, high = _bounds(tempo, math.log2)
+        keep = np.zeros(len(log_tempo), dtype=bool)
+        for shift in ((-1.0, 0.0, 1.0) if half_double else (0.0,)):
+            keep |= (log_tempo >= low + shift) & (log_tempo <= high + shift)
+        return keep
+
+    def nearest(
+        self,
+        features: dict,
+        limit: int = 10,
+        exclude: Optional[str] = None,
+        half_double: bool = True,
+        weights: Optional[dict] = None,
+    ) -> list[dict]:
+        """The `limit` stems closest to `features`, closest first.
+
+        `distance` is the weighted Euclidean norm of per-dimension
+        distances in units of TEMPO_STEP, circle-of-fifths steps and
+        LOG_RATIO_STEP; `weights` (DEFAULT_WEIGHTS keys, 0 to ignore a
+        dimension) rebalances them. `tempoRatio` is 0.5 or 2 when the stem
+        matched at half or double time.
+        """
+        import numpy as np
+
+        query = _encode(features)
+        weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        with self._lock:
+            tables = [(self._columns, self._live_rows)]
+            if self._pending:
+                tables.append(self._pending_table())
+            scored = [self._distances(columns, query, weights, half_double) for columns, _ in tables]
+            distance = np.concatenate([part[0] for part in scored])
+            shift = np.concatenate([part[1] for part in scored])
+            if not len(distance):
+                return []
+            distance[~np.concatenate([live for _, live in tables])] = np.inf
+            if exclude is not None and exclude in self._by_id:
+                distance[self._by_id[exclude]] = np.inf
+
+            count = min(limit, int(np.isfinite(distance).sum()))
+            if count <= 0:
+                return []
+            best = np.argpartition(distance, count - 1)[:count]
+            best = best[np.argsort(distance[best], kind="stable")]
+            ratios = 2.0 ** -shift
+            return [
+                {
+                    **self._row(int(row)),
+                    "distance": round(float(distance[row]), 4),
+                    "tempoRatio": float(ratios[row]),
+                }
+                for row in best
+            ]
+
+    @classmethod
+    def _distances(cls, columns: dict, query: dict, weights: dict, half_double: bool) -> tuple:
+        """(distance, tempo octave shift) of every row in `columns` to an encoded query."""
+        import numpy as np
+
+        rows = len(columns["logTempo"])
+        tempo_diff = columns["logTempo"] - np.float32(query["logTempo"])
+        shift = np.clip(np.round(np.nan_to_num(tempo_diff)), -1, 1) if half_double else np.zeros(rows)
+        parts = {
+            "tempo": np.abs(tempo_diff - shift) / TEMPO_STEP,
+            "key": (
+                key_distance(columns["pitchClass"], columns["mode"], query["pitchClass"], query["mode"])
+                .astype(np.float32)
+                if query["pitchClass"] >= 0 else np.full(rows, np.nan, dtype=np.float32)
+            ),
+            "energy": cls._log_ratio(columns["energy"], query["energy"], ENERGY_FLOOR),
+            "onsetDensity": cls._log_ratio(columns["onsetDensity"], query["onsetDensity"], ONSET_DENSITY_FLOOR),
+        }
+        parts["key"][columns["pitchClass"] < 0] = np.nan
+        squared = np.zeros(rows, dtype=np.float32)
+        for name, part in parts.items():
+            if weights[name]:
+                squared += weights[name] * np.square(np.nan_to_num(part, nan=MISSING_DISTANCE))
+        return np.sqrt(squared), shift
+
+    @staticmethod
+    def _log_ratio(column, value: float, floor: float):
+        import numpy as np
+
+        return np.abs(
+            np.log2(np.maximum(column, floor)) - np.log2(max(value, floor))
+        ) / LOG_RATIO_STEP
+
+    def features(self, stem_id: str) -> Optional[dict]:
+        """The indexed fields of `stem_id` as a features-shaped dict, or None."""
+        with self._lock:
+            row = self._by_id.get(stem_id)
+            return None if row is None else self._row(row)
+
+    def _row(self, row: int) -> dict:
+        merged = len(self._live_rows)
+        columns, index = (self._columns, row) if row < merged else (self._pending_table()[0], row - merged)
+        log_tempo = float(columns["logTempo"][index])
+        pitch_class, mode = int(columns["pitchClass"][index]), int(columns["mode"][index])
+
+        def optional(name: str, digits: int) -> Optional[float]:
+            value = float(columns[name][index])
+            return None if math.isnan(value) else round(value, digits)
+
+        return {
+            "stemId": self._ids[row],
+            **self._meta[row],
+            "tempoBpm": None if math.isnan(log_tempo) else round(2.0 ** log_tempo, 2),
+            "key": {"tonic": TONICS[pitch_class], "mode": MODES[mode]} if min(pitch_class, mode) >= 0 else None,
+            "energyRms": optional("energy", 6),
+            "onsetDensity": optional("onsetDensity", 4),
+            "durationSeconds": optional("duration", 3),
+        }
+
+    # ─── persistence ──────────────────────────────────────────────────
+
+    def _compact(self) -> None:
+        """Drop replaced rows and renumber the rest (pending merged first)."""
+        import numpy as np
+
+        if self._live_rows.all():
+            return
+        kept = np.flatnonzero(self._live_rows)
+        self._columns = {name: column[kept] for name, column in self._columns.items()}
+        self._ids = [self._ids[i] for i in kept]
+        self._meta = [self._meta[i] for i in kept]
+        self._live = [True] * len(kept)
+        self._live_rows = np.ones(len(kept), dtype=bool)
+        self._by_id = {stem_id: i for i, stem_id in enumerate(self._ids)}
+        self._tempo_order = np.argsort(self._columns["logTempo"], kind="stable")
+
+    def save(self, path: Optional[Union[str, Path]] = None) -> Path:
+        """Compact and atomically write the index to `path` (defaults to its own path)."""
+        import numpy as np
+
+        target = Path(path) if path else self.path
+        if target is None:
+            raise ValueError("SimilarityIndex has no path to save to")
+        with self._save_lock:
+            with self._lock:
+                self._merge_pending()
+                self._compact()
+                self._dirty = False
+                header = {"version": INDEX_FORMAT_VERSION, "ids": list(self._ids), "meta": list(self._meta)}
+                arrays = dict(self._columns)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(target.name + ".tmp")
+            with open(tmp, "wb") as handle:
+                np.savez(handle, header=np.array(json.dumps(header)), **arrays)
+            os.replace(tmp, target)
+        return target
+
+    def _load(self) -> None:
+        import numpy as np
+
+        with np.load(self.path, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            if header.get("version") != INDEX_FORMAT_VERSION:
+                logger.warning(
+                    f"[similarity-index] Ignoring {self.path}: format "
+                    f"{header.get('version')} != {INDEX_FORMAT_VERSION}"
+                )
+                return
+            self._columns = {name: data[name] for name in COLUMNS}
+        self._ids = list(header["ids"])
+        self._meta = list(header["meta"])
+        self._live = [True] * len(self._ids)
+        self._live_rows = np.ones(len(self._ids), dtype=bool)
+        self._by_id = {stem_id: i for i, stem_id in enumerate(self._ids)}
+        self._tempo_order = np.argsort(self._columns["logTempo"], kind="stable")
+
+
+def _range(text: str) -> tuple:
+    """"118:122", "0.1:" or ":4" → (low, high) with None for an open end."""
+    low, sep, high = text.partition(":")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected LOW:HIGH, got {text!r}")
+    return (float(low) if low else None, float(high) if high else None)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Add JSONL files to an index (created if missing)")
+    build.add_argument("index", type=Path)
+    build.add_argument("jsonl", type=Path, nargs="+", help="Backfill shards or result messages")
+
+    query = commands.add_parser("query", help="Range or nearest-neighbour query")
+    query.add_argument("index", type=Path)
+    query.add_argument("--tempo", type=_range, help="BPM range, e.g. 118:122")
+    query.add_argument("--key", help='e.g. "A minor"')
+    query.add_argument("--compatible-keys", action="store_true", help="Also match neighbouring keys")
+    query.add_argument("--energy", type=_range, help="energyRms range")
+    query.add_argument("--onset-density", type=_range, help="Onsets per second range")
+    query.add_argument("--strict-tempo", action="store_true", help="No half/double-time matches")
+    query.add_argument("--like", metavar="STEM_ID", help="Nearest neighbours of an indexed stem")
+    query.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        index = SimilarityIndex(args.index)
+        added = sum(index.add_jsonl(path) for path in args.jsonl)
+        index.save()
+        print(json.dumps({"added": added, "stems": len(index)}))
+        return 0
+
+    index = SimilarityIndex(args.index)
+    if args.like:
+        features = index.features(args.like)
+        if features is None:
+            print(f"{args.like} is not in the index", file=sys.stderr)
+            return 1
+        matches = index.nearest(features, limit=args.limit, exclude=args.like, half_double=not args.strict_tempo)
+    else:
+        matches = index.find(
+            tempo=args.tempo, key=args.key, compatible_keys=args.compatible_keys,
+            energy=args.energy, onset_density=args.onset_density,
+            half_double=not args.strict_tempo, limit=args.limit,
+        )
+    print(json.dumps(matches, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""ffmpeg encode pass for separated stems.
+
+One ffmpeg process per stem decodes the lossless Demucs WAV once and
+produces every derived artifact from that single decode. The decoded audio
+is `asplit` into a side branch metered by `ebur128` (then discarded), so
+integrated loudness (EBU R128), loudness range and true peak come out of
+the same pass as the 320k MP3 instead of a separate analysis run. The meter
+is kept off the encode path because it only works at 48 kHz and would
+resample every output.
+
+Optional streaming renditions (`STEM_RENDITIONS`) are extra outputs of the
+same process: the decoded audio is split once per output, so adding an
+Opus preview or an HLS ladder costs an encoder, not another decode.
+
+The optional lossless archive (`STEM_ARCHIVE`) is one more output mapped
+straight from the input, ahead of the meter, so the FLAC is bit-exact.
+"""
+
+import logging
+import math
+import re
+from pathlib import Path
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+MP3_BITRATE = "320k"
+
+# name → output extension and encoder args. "hls" is a directory of fMP4
+# segments plus a VOD playlist; the playlist is the rendition URI.
+RENDITIONS = {
+    "opus": {
+        "ext": ".opus",
+        "args": ["-c:a", "libopus", "-b:a", "96k", "-vbr", "on"],
+    },
+    "aac": {
+        "ext": ".m4a",
+        "args": ["-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart"],
+    },
+    "hls": {
+        "ext": ".m3u8",
+        "args": [
+            "-c:a", "aac", "-b:a", "128k",
+            "-f", "hls", "-hls_time", "6", "-hls_playlist_type", "vod",
+            "-hls_segment_type", "fmp4",
+        ],
+    },
+}
+
+CONTENT_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".opus": "audio/ogg",
+    ".m4a": "audio/mp4",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".mp4": "audio/mp4",
+    ".m4s": "audio/mp4",
+    ".flac": "audio/flac",
+}
+
+ARCHIVE_ARGS = ["-c:a", "flac", "-compression_level", "8"]
+
+# Per-frame meter lines would fill the captured stderr on long stems; the
+# summary is logged either way.
+METER_FILTER = "ebur128=peak=true:framelog=quiet"
+
+LOUDNESS_FIELDS = ("loudnessLufs", "loudnessRangeLu", "truePeakDbtp")
+
+# ebur128 prints its summary once, at the end of the run:
+#   Integrated loudness:  I: -19.6 LUFS
+#   Loudness range:       LRA: 5.1 LU
+#   True peak:            Peak: -0.4 dBFS
+_SUMMARY_PATTERNS = {
+    "loudnessLufs": re.compile(r"\bI:\s*(-?(?:\d+(?:\.\d+)?|inf))\s*LUFS"),
+    "loudnessRangeLu": re.compile(r"\bLRA:\s*(-?(?:\d+(?:\.\d+)?|inf))\s*LU\b"),
+    "truePeakDbtp": re.compile(r"\bPeak:\s*(-?(?:\d+(?:\.\d+)?|inf))\s*dBFS"),
+}
+
+# ebur128 reports digital silence as -70 LUFS (its absolute gate).
+SILENCE_LUFS = -70.0
+
+
+def parse_renditions(value: str) -> tuple[str, ...]:
+    """`STEM_RENDITIONS` ("opus,hls") → known rendition names, in order."""
+    names = []
+    for name in (part.strip().lower() for part in value.split(",")):
+        if not name:
+            continue
+        if name not in RENDITIONS:
+            logger.warning(f"Ignoring unknown stem rendition {name!r}; expected one of {sorted(RENDITIONS)}")
+            continue
+        if name not in names:
+            names.append(name)
+    return tuple(names)
+
+
+def rendition_paths(mp3_dest: Path, renditions: Iterable[str]) -> dict[str, Path]:
+    """Primary output path per rendition, next to the MP3.
+
+    HLS lives in its own `{stem}_hls/` directory (playlist + segments).
+    """
+    stem = mp3_dest.stem
+    paths = {}
+    for name in renditions:
+        if name == "hls":
+            paths[name] = mp3_dest.parent / f"{stem}_hls" / f"{stem}.m3u8"
+        else:
+            paths[name] = mp3_dest.with_suffix(RENDITIONS[name]["ext"])
+    return paths
+
+
+def rendition_files(name: str, primary: Path) -> list[Path]:
+    """Every file a rendition produced (HLS: playlist, init and segments)."""
+    if name == "hls":
+        return sorted(p for p in primary.parent.iterdir() if p.is_file())
+    return [primary]
+
+
+def build_encode_command(
+    stem_src: Path,
+    mp3_dest: Path,
+    renditions: Iterable[str] = (),
+    archive_dest: Optional[Path] = None,
+) -> list[str]:
+    """ffmpeg argv: one decode → MP3 (+ renditions, + FLAC archive), with R128 metering.
+
+    The MP3 is always the last argument. Callers create the HLS directory.
+    """
+    paths = rendition_paths(mp3_dest, renditions)
+    command = ["ffmpeg", "-y", "-hide_banner", "-nostats", "-i", str(stem_src)]
+    if archive_dest is not None:
+        command += ["-map", "0:a", *ARCHIVE_ARGS, str(archive_dest)]
+    labels = [f"[r{i}]" for i in range(len(paths))] + ["[mp3]"]
+    command += [
+        "-filter_complex",
+        f"[0:a]asplit={len(labels) + 1}[meter]{''.join(labels)};[meter]{METER_FILTER},anullsink",
+    ]
+    for label, (name, path) in zip(labels, paths.items()):
+        command += ["-map", label, *RENDITIONS[name]["args"]]
+        if name == "hls":
+            command += [
+                "-hls_fmp4_init_filename", f"{mp3_dest.stem}_init.mp4",
+                "-hls_segment_filename", str(path.parent / f"{mp3_dest.stem}_%03d.m4s"),
+            ]
+        command.append(str(path))
+    return command + ["-map", "[mp3]", "-b:a", MP3_BITRATE, str(mp3_dest)]
+
+
+def _number(text: str) -> Optional[float]:
+    value = float(text)
+    return round(value, 2) if math.isfinite(value) else None
+
+
+def parse_loudness(ffmpeg_stderr: str) -> dict:
+    """Pull the ebur128 summary out of ffmpeg's log.
+
+    Returns all LOUDNESS_FIELDS; values are None when the summary is
+    missing or non-finite (e.g. a -inf true peak on digital silence).
+    """
+    summary = ffmpeg_stderr.rsplit("Summary:", 1)
+    loudness: dict = {field: None for field in LOUDNESS_FIELDS}
+    if len(summary) < 2:
+        return loudness
+    for field, pattern in _SUMMARY_PATTERNS.items():
+        match = pattern.search(summary[1])
+        if match:
+            loudness[field] = _number(match.group(1))
+    if loudness["loudnessLufs"] is not None and loudness["loudnessLufs"] <= SILENCE_LUFS:
+        loudness["loudnessLufs"] = None
+    return loudness
@@ -0,0 +1,261 @@
+"""Server-side mixdowns of a track's stored stems, with a size-capped cache.
+
+Instrumentals and remix conditioning need a combination of stems ("all but
+vocals", "drums -6 dB + bass"). Rendering that here saves the caller from
+downloading six stems to produce one file.
+
+Each stem is decoded once by ffmpeg to raw float32 (interleaved stereo at
+`SAMPLE_RATE`) and memory-mapped, so the mix never holds whole tracks in
+memory: it walks the stems in `CHUNK_FRAMES` blocks, scales each block by
+its linear gain and accumulates into a memory-mapped output, which ffmpeg
+then encodes. Stems of slightly different length (MP3 padding) are treated
+as zero-padded to the longest.
+
+Rendered mixes are cached by `mix_key` (track + canonical mix spec + the
+sources it was rendered from). `MixCache` evicts least-recently-used
+entries once the cache exceeds its byte budget; stores only need
+lookup/save/list/delete.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from stem_encoding import MP3_BITRATE
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+CHUNK_FRAMES = 1 << 18
+MIN_GAIN_DB = -60.0
+MAX_GAIN_DB = 12.0
+CONTENT_TYPE = "audio/mpeg"
+
+
+def parse_mix_spec(stems: Union[dict, list], known: Iterable[str]) -> dict[str, float]:
+    """`{"drums": 0, "bass": -3}` or `["drums", "bass"]` (0 dB) → {stem: gain dB}.
+
+    Raises ValueError on unknown stems, non-numeric or out-of-range gains,
+    or an empty mix.
+    """
+    known = tuple(known)
+    if isinstance(stems, list):
+        stems = {name: 0.0 for name in stems}
+    if not isinstance(stems, dict) or not stems:
+        raise ValueError("mix needs at least one stem")
+    gains = {}
+    for name, gain in stems.items():
+        if name not in known:
+            raise ValueError(f"unknown stem {name!r}; expected one of {list(known)}")
+        if isinstance(gain, bool) or not isinstance(gain, (int, float)):
+            raise ValueError(f"gain for {name!r} must be a number of dB")
+        if not MIN_GAIN_DB <= gain <= MAX_GAIN_DB:
+            raise ValueError(f"gain for {name!r} must be within [{MIN_GAIN_DB}, {MAX_GAIN_DB}] dB")
+        gains[name] = round(float(gain), 2)
+    return dict(sorted(gains.items()))
+
+
+def mix_key(release_id: str, track_id: str, gains: dict[str, float], sources: Optional[dict] = None) -> str:
+    """Cache key: identical specs (in any order) over the same sources share a key.
+
+    `sources` identifies what was mixed (e.g. archived FLAC hashes), so a
+    rebuilt track does not reuse mixes of its previous stems.
+    """
+    canonical = json.dumps(
+        {"release": release_id, "track": track_id, "gains": gains, "sources": sources or {}},
+        sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+def decode_command(src: Path, raw_dest: Path) -> list[str]:
+    """ffmpeg argv: any stem file → raw interleaved float32 at SAMPLE_RATE."""
+    return [
+        "ffmpeg", "-y", "-hide_banner", "-nostats", "-v", "error", "-i", str(src),
+        "-f", "f32le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), str(raw_dest),
+    ]
+
+
+def encode_command(raw_src: Path, mp3_dest: Path) -> list[str]:
+    """ffmpeg argv: raw float32 mix → 320k MP3 (same bitrate as the stems)."""
+    return [
+        "ffmpeg", "-y", "-hide_banner", "-nostats", "-v", "error",
+        "-f", "f32le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), "-i", str(raw_src),
+        "-b:a", MP3_BITRATE, str(mp3_dest),
+    ]
+
+
+def mix_raw(sources: dict[str, Path], gains: dict[str, float], raw_dest: Path) -> dict:
+    """Mix raw float32 stems into `raw_dest`; returns {frames, peak, clippedSamples}.
+
+    Samples beyond full scale are hard-clipped (and counted) so boosted
+    mixes cannot wrap when encoded.
+    """
+    import numpy as np
+
+    inputs = []
+    for name, path in sources.items():
+        frames = os.path.getsize(path) // (4 * CHANNELS)
+        if frames:
+            data = np.memmap(path, dtype=np.float32, mode="r", shape=(frames, CHANNELS))
+            inputs.append((data, np.float32(10 ** (gains[name] / 20))))
+    total = max((len(data) for data, _ in inputs), default=0)
+    if not total:
+        raise ValueError("no audio in any of the mixed stems")
+
+    out = np.memmap(raw_dest, dtype=np.float32, mode="w+", shape=(total, CHANNELS))
+    scratch = np.empty((CHUNK_FRAMES, CHANNELS), dtype=np.float32)
+    peak, clipped = 0.0, 0
+    for start in range(0, total, CHUNK_FRAMES):
+        stop = min(start + CHUNK_FRAMES, total)
+        block = out[start:stop]
+        block[:] = 0.0
+        for data, gain in inputs:
+            end = min(stop, len(data))
+            if end <= start:
+                continue
+            part = scratch[: end - start]
+            np.multiply(data[start:end], gain, out=part)
+            block[: end - start] += part
+        magnitude = np.abs(block)
+        peak = max(peak, float(magnitude.max()))
+        clipped += int(np.count_nonzero(magnitude > 1.0))
+        np.clip(block, -1.0, 1.0, out=block)
+    out.flush()
+    del out
+    return {"frames": total, "peak": round(peak, 4), "clippedSamples": clipped}
+
+
+class LocalMixStore:
+    """Mixes as files under one directory; recency is the file's mtime."""
+
+    def __init__(self, directory: Union[str, Path], uri_prefix: str = ""):
+        self.directory = Path(directory)
+        self.uri_prefix = uri_prefix
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.mp3"
+
+    def _uri(self, key: str) -> str:
+        return f"{self.uri_prefix}{key}.mp3"
+
+    def lookup(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return self._uri(key)
+
+    def save(self, key: str, local_path: Path) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self._path(key).with_suffix(".mp3.tmp")
+        shutil.move(str(local_path), tmp)
+        os.replace(tmp, self._path(key))
+        return self._uri(key)
+
+    def entries(self) -> list[tuple[str, int, float]]:
+        """(key, bytes, last used) for every cached mix."""
+        entries = []
+        for path in self.directory.glob("*.mp3"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((path.stem, stat.st_size, stat.st_mtime))
+        return entries
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+
+class GcsMixStore:
+    """Mixes as objects under `prefix/`; recency is a `lastUsed` metadata field."""
+
+    def __init__(self, bucket, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+
+    def _name(self, key: str) -> str:
+        return f"{self.prefix}/{key}.mp3"
+
+    def _uri(self, key: str) -> str:
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self._name(key)}"
+
+    def lookup(self, key: str) -> Optional[str]:
+        blob = self.bucket.get_blob(self._name(key))
+        if blob is None:
+            return None
+        blob.metadata = {**(blob.metadata or {}), "lastUsed": str(time.time())}
+        try:
+            blob.patch()
+        except Exception as exc:
+            logger.debug(f"[mix] could not touch {key}: {exc}")
+        return self._uri(key)
+
+    def save(self, key: str, local_path: Path) -> str:
+        blob = self.bucket.blob(self._name(key))
+        blob.metadata = {"lastUsed": str(time.time())}
+        blob.upload_from_filename(str(local_path), content_type=CONTENT_TYPE)
+        return self._uri(key)
+
+    def entries(self) -> list[tuple[str, int, float]]:
+        entries = []
+        for blob in self.bucket.list_blobs(prefix=f"{self.prefix}/"):
+            if not blob.name.endswith(".mp3"):
+                continue
+            last_used = (blob.metadata or {}).get("lastUsed")
+            updated = blob.updated.timestamp() if blob.updated else 0.0
+            entries.append((Path(blob.name).stem, blob.size or 0, float(last_used or updated)))
+        return entries
+
+    def delete(self, key: str) -> None:
+        from google.api_core import exceptions as google_exceptions
+
+        try:
+            self.bucket.blob(self._name(key)).delete()
+        except google_exceptions.NotFound:
+            pass
+
+
+class MixCache:
+    """Rendered mixes by key, evicting least-recently-used past `max_bytes`."""
+
+    def __init__(self, store, max_bytes: int):
+        self.store = store
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> Optional[str]:
+        return self.store.lookup(key)
+
+    def put(self, key: str, local_path: Path) -> str:
+        uri = self.store.save(key, local_path)
+        try:
+            self.evict(keep=key)
+        except Exception as exc:
+            logger.warning(f"[mix] cache eviction failed: {exc}")
+        return uri
+
+    def evict(self, keep: Optional[str] = None) -> list[str]:
+        """Drop oldest mixes until the cache fits; never drops `keep`."""
+        entries = sorted(self.store.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self.store.delete(key)
+            total -= size
+            evicted.append(key)
+        if evicted:
+            logger.info(f"[mix] evicted {len(evicted)} cached mixes, {total} bytes remain")
+        return evicted
+
@@ -0,0 +1,174 @@
+"""Scratch-space admission and the local output volume's size cap.
+
+A separation writes the source, one or two Demucs attempt trees and the
+encoded stems into a scratch directory, so running out of disk halfway
+wastes the whole separation. `ScratchSpace` keeps job directories under
+one root (`WORKER_SCRATCH_DIR`, e.g. a tmpfs mount), reserves an expected
+size for each running job and refuses a new one up front (`ScratchSpaceFull`)
+when free space, less what running jobs may still write, would drop below
+a floor.
+
+In local storage mode OUTPUT_DIR otherwise grows forever: `trim_outputs`
+deletes the least recently written track directories once they pass a size
+cap. Caches and archives in the same volume are never touched; they have
+their own caps.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Trimming stops at this fraction of the cap, so a full volume is not
+# rescanned after every job.
+EVICT_TO_FRACTION = 0.9
+
+
+class ScratchSpaceFull(Exception):
+    """Admitting the job would leave too little free scratch space; retry later."""
+
+
+def tree_stats(path: Union[str, Path]) -> tuple[int, float]:
+    """(bytes, newest mtime) of the regular files under `path`."""
+    total = 0
+    newest = 0.0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            total += stat.st_size
+            newest = max(newest, stat.st_mtime)
+    return total, newest
+
+
+class ScratchSpace:
+    """Per-job scratch directories under `root`, admitted against free space.
+
+        temp_dir = scratch.mkdtemp(prefix="http-job-")  # may raise ScratchSpaceFull
+        ...
+        scratch.release(temp_dir)
+
+    Each job reserves `job_reserve_bytes`. A job is admitted only if the
+    root's free space, minus the part of every running job's reservation it
+    has not written yet, minus the new reservation, stays at or above
+    `min_free_bytes`.
+    """
+
+    def __init__(
+        self,
+        root: Optional[Union[str, Path]] = None,
+        min_free_bytes: int = 0,
+        job_reserve_bytes: int = 0,
+        disk_usage: Callable = shutil.disk_usage,
+    ):
+        self.root = Path(root or tempfile.gettempdir())
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.min_free_bytes = min_free_bytes
+        self.job_reserve_bytes = job_reserve_bytes
+        self._disk_usage = disk_usage
+        self._lock = threading.Lock()
+        self._jobs: dict[Path, int] = {}
+
+    def _outstanding(self) -> int:
+        return sum(max(0, reserve - tree_stats(path)[0]) for path, reserve in self._jobs.items())
+
+    def mkdtemp(self, prefix: str = "job-", reserve_bytes: Optional[int] = None) -> str:
+        """Admit a job and create its directory; `release` removes it."""
+        reserve = self.job_reserve_bytes if reserve_bytes is None else reserve_bytes
+        with self._lock:
+            free = self._disk_usage(self.root).free
+            outstanding = self._outstanding()
+            if free - outstanding - reserve < self.min_free_bytes:
+                raise ScratchSpaceFull(
+                    f"{free // 2**20} MB free in {self.root}, {(outstanding + reserve) // 2**20} MB "
+                    f"needed by running jobs, {self.min_free_bytes // 2**20} MB must stay free"
+                )
+            path = Path(tempfile.mkdtemp(prefix=prefix, dir=self.root))
+            self._jobs[path] = reserve
+        return str(path)
+
+    def release(self, path: Union[str, Path]) -> int:
+        """Delete a job directory and drop its reservation; returns the bytes it held."""
+        path = Path(path)
+        used = tree_stats(path)[0]
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._jobs.pop(path, None)
+        return used
+
+    @contextmanager
+    def job(self, prefix: str = "job-", reserve_bytes: Optional[int] = None) -> Iterator[str]:
+        """`mkdtemp` + `release` as a context manager, like TemporaryDirectory."""
+        path = self.mkdtemp(prefix, reserve_bytes)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+    def usage(self) -> dict:
+        """Root, free bytes, and bytes in use per running job directory."""
+        with self._lock:
+            jobs = dict(self._jobs)
+        return {
+            "root": str(self.root),
+            "freeBytes": self._disk_usage(self.root).free,
+            "jobs": {path.name: tree_stats(path)[0] for path in jobs},
+        }
+
+
+def trim_outputs(
+    root: Union[str, Path],
+    max_bytes: int,
+    protected: Iterable[str] = (),
+    keep: Iterable[str] = (),
+) -> list[str]:
+    """Delete the least recently written track directories past `max_bytes`.
+
+    Track directories are `root/{release}/{track}`. Top-level files, hidden
+    directories (`.checkpoints`, `.feature-cache`) and top-level names in
+    `protected` are never touched, nor are the `keep` tracks
+    ("release/track"). Returns the deleted "release/track" names.
+    """
+    root = Path(root)
+    protected = set(protected)
+    keep = set(keep)
+    tracks = []
+    for release in root.iterdir():
+        if release.name.startswith(".") or release.name in protected:
+            continue
+        if release.is_symlink() or not release.is_dir():
+            continue
+        for track in release.iterdir():
+            if track.is_symlink() or not track.is_dir():
+                continue
+            size, newest = tree_stats(track)
+            tracks.append((newest, size, track))
+    total = sum(size for _, size, _ in tracks)
+    if total <= max_bytes:
+        return []
+    target = max_bytes * EVICT_TO_FRACTION
+    evicted = []
+    for _, size, track in sorted(tracks, key=lambda entry: entry[0]):
+        if total <= target:
+            break
+        name = f"{track.parent.name}/{track.name}"
+        if name in keep:
+            continue
+        shutil.rmtree(track, ignore_errors=True)
+        total -= size
+        evicted.append(name)
+        try:
+            track.parent.rmdir()
+        except OSError:
+            pass  # Other tracks of the release remain
+    if evicted:
+        logger.info(f"[outputs] evicted {len(evicted)} track directories, {total} bytes remain")
+    return evicted
@@ -15,7 +15,10 @@ import soundfile as sf
 
 # main.py creates OUTPUT_DIR at import time; keep tests inside a tmp dir.
 os.environ.setdefault("OUTPUT_DIR", tempfile.mkdtemp(prefix="resonate-demucs-test-"))
+# Results must come from the extractor, not a feature cache left by other tests.
+os.environ.setdefault("FEATURE_CACHE_MAX_MB", "0")
 
+import audio_features
 from audio_features import SCHEMA_VERSION, extract_stem_features
 
 SR = 22050
@@ -48,6 +51,13 @@ def _pitched_tone(freq: float, seconds: float, sr: int = SR) -> np.ndarray:
     ).astype(np.float32)
 
 
+def _write_stereo_44k(path: Path, seconds: float = 10.0) -> Path:
+    """Click track over a tone, as 44.1 kHz stereo (the Demucs output format)."""
+    mono = _click_track(120.0, seconds, sr=44100) * 0.5 + _pitched_tone(220.0, seconds, sr=44100) * 0.3
+    sf.write(str(path), np.stack([mono, mono * 0.5], axis=1), 44100)
+    return path
+
+
 class ExtractStemFeaturesTest(unittest.TestCase):
     def test_click_track_tempo_within_tolerance(self):
         with tempfile.TemporaryDirectory() as tmp:
@@ -112,6 +122,138 @@ class ExtractStemFeaturesTest(unittest.TestCase):
                 self.assertTrue(math.isfinite(value), f"{key} not finite")
 
 
+class StreamingExtractionTest(unittest.TestCase):
+    """Block-wise extraction must agree with loading the whole stem."""
+
+    def assert_close(self, streamed: dict, loaded: dict):
+        self.assertEqual(streamed["schemaVersion"], SCHEMA_VERSION)
+        self.assertEqual(set(streamed), set(loaded))
+        self.assertEqual(streamed["sampleRate"], loaded["sampleRate"])
+        self.assertAlmostEqual(streamed["durationSeconds"], loaded["durationSeconds"], places=3)
+        self.assertAlmostEqual(streamed["energyRms"], loaded["energyRms"], delta=1e-4)
+        self.assertAlmostEqual(streamed["tempoBpm"], loaded["tempoBpm"], delta=1.0)
+        self.assertAlmostEqual(streamed["onsetDensity"], loaded["onsetDensity"], delta=0.05)
+        self.assertLessEqual(abs(streamed["beatCount"] - loaded["beatCount"]), 1)
+        self.assertEqual(
+            (streamed["key"] or {}).get("tonic"), (loaded["key"] or {}).get("tonic"),
+        )
+
+    def test_many_small_blocks_match_the_in_memory_path(self):
+        audio = _click_track(120.0, 12.0) * 0.5 + _pitched_tone(220.0, 12.0) * 0.3
+        with tempfile.TemporaryDirectory() as tmp:
+            path = _write_wav(Path(tmp) / "mix.wav", audio)
+            loaded = extract_stem_features(path, streaming=False)
+            # 37 frames per block: buffers never line up with beats or the end.
+            streamed = audio_features._extract_streaming(path, block_frames=37)
+
+        self.assert_close(streamed, loaded)
+
+    def test_resampled_blocks_match_the_in_memory_path(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = _write_stereo_44k(Path(tmp) / "stereo.wav")
+            loaded = extract_stem_features(path, streaming=False)
+            streamed = audio_features._extract_streaming(path, block_frames=37)
+
+        self.assert_close(streamed, loaded)
+
+    def test_long_stems_are_streamed_automatically(self):
+        from unittest.mock import patch
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = _write_wav(Path(tmp) / "click.wav", _click_track(96.0, 6.0))
+            with patch.object(audio_features, "STREAMING_MIN_SECONDS", 5.0), \
+                 patch.object(audio_features, "_extract_in_memory", side_effect=AssertionError("loaded")):
+                features = extract_stem_features(path)
+
+        self.assertIsNotNone(features["tempoBpm"])
+
+    def test_streamed_silence_returns_safe_defaults(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = _write_wav(Path(tmp) / "silence.wav", np.zeros(SR * 2, dtype=np.float32))
+            features = extract_stem_features(path, streaming=True)
+
+        self.assertAlmostEqual(features["durationSeconds"], 2.0, places=3)
+        self.assertIsNone(features["tempoBpm"])
+        self.assertIsNone(features["key"])
+
+
+class AnalysisSampleRateTest(unittest.TestCase):
+    """44.1 kHz stereo stems are analyzed as a 22.05 kHz mono downmix."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = _write_stereo_44k(Path(self.tmp.name) / "stereo.wav")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_reports_source_rate_and_duration(self):
+        from unittest.mock import patch
+
+        summarize = audio_features._summarize
+        with patch.object(audio_features, "_summarize", side_effect=summarize) as spy:
+            features = extract_stem_features(self.path)
+
+        self.assertEqual(spy.call_args.args[1], 22050)
+        self.assertEqual(features["sampleRate"], 44100)
+        self.assertAlmostEqual(features["durationSeconds"], 10.0, places=3)
+
+    def test_matches_full_rate_analysis(self):
+        from unittest.mock import patch
+
+        with patch.object(audio_features, "ANALYSIS_SAMPLE_RATE", 0):
+            full = extract_stem_features(self.path)
+        reduced = extract_stem_features(self.path)
+
+        self.assertEqual(reduced["tempoBpm"], full["tempoBpm"])
+        self.assertEqual(reduced["beatCount"], full["beatCount"])
+        self.assertEqual(reduced["key"]["tonic"], full["key"]["tonic"])
+        self.assertAlmostEqual(reduced["energyRms"], full["energyRms"], delta=0.005)
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = _write_wav(Path(self.tmp.name) / "click.wav", _click_track(120.0, 8.0))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_complete_extraction_skips_nothing(self):
+        features = extract_stem_features(self.path, deadline_seconds=60)
+
+        self.assertEqual(features["skippedFields"], [])
+        self.assertIsNotNone(features["key"])
+
+    def test_expired_deadline_skips_every_stage_but_keeps_the_duration(self):
+        for streaming in (False, True):
+            with self.subTest(streaming=streaming):
+                features = extract_stem_features(self.path, streaming=streaming, deadline_seconds=1e-9)
+
+                self.assertAlmostEqual(features["durationSeconds"], 8.0, places=3)
+                self.assertIsNone(features["energyRms"])
+                self.assertIsNone(features["tempoBpm"])
+                self.assertEqual(
+                    features["skippedFields"],
+                    [field for fields in audio_features.STAGE_FIELDS.values() for field in fields],
+                )
+
+    def test_deadline_inside_tempo_keeps_the_earlier_stages(self):
+        from unittest.mock import patch
+
+        with patch.object(audio_features, "_tempo", side_effect=audio_features.DeadlineExceeded):
+            features = extract_stem_features(self.path)
+
+        self.assertIsNotNone(features["energyRms"])
+        self.assertIsNotNone(features["onsetDensity"])
+        self.assertIsNone(features["tempoBpm"])
+        self.assertIsNone(features["key"])
+        self.assertEqual(
+            features["skippedFields"],
+            ["tempoBpm", "tempoConfidence", "beatCount", "firstBeatSec", "key"],
+        )
+
+
 class AnalyzeEndpointTest(unittest.TestCase):
     def test_analyze_returns_features_for_uploaded_audio(self):
         from fastapi.testclient import TestClient
@@ -0,0 +1,134 @@
+import json
+import os
+import sys
+import tempfile
+import types
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import audio_features
+import backfill_features
+
+
+def fake_extract(path, deadline_seconds=None):
+    # Backfills need every stage, so they run without a deadline.
+    assert deadline_seconds == 0
+    if Path(path).read_bytes() == b"corrupt":
+        raise ValueError("not audio")
+    return {"schemaVersion": audio_features.SCHEMA_VERSION, "durationSeconds": 2.0}
+
+
+class BackfillTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name) / "outputs"
+        self.out = Path(self.tmp.name) / "backfill"
+        for release, track, stem in (("rel_1", "trk_1", "vocals"), ("rel_1", "trk_1", "bass"), ("rel_2", "trk_2", "drums")):
+            (self.root / release / track).mkdir(parents=True, exist_ok=True)
+            (self.root / release / track / f"{stem}.mp3").write_bytes(b"mp3")
+        # Not stems: mix cache entries, archives, checkpoints, renditions.
+        (self.root / "mixes").mkdir()
+        (self.root / "mixes" / "abc.mp3").write_bytes(b"mp3")
+        (self.root / ".checkpoints" / "job" / "x").mkdir(parents=True)
+        (self.root / ".checkpoints" / "job" / "x" / "y.mp3").write_bytes(b"mp3")
+        (self.root / "rel_1" / "trk_1" / "vocals.opus").write_bytes(b"opus")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_backfill(self, **kwargs):
+        with patch.object(audio_features, "extract_stem_features", fake_extract):
+            return backfill_features.backfill(backfill_features.list_stems(str(self.root)), self.out, workers=0, **kwargs)
+
+    def lines(self):
+        return [json.loads(line) for shard in sorted(self.out.glob("features-*.jsonl")) for line in shard.read_text().splitlines()]
+
+    def test_lists_only_stored_stem_mp3s(self):
+        stems = list(backfill_features.list_stems(str(self.root)))
+        self.assertEqual(
+            [(s["releaseId"], s["trackId"], s["stem"]) for s in stems],
+            [("rel_1", "trk_1", "bass"), ("rel_1", "trk_1", "vocals"), ("rel_2", "trk_2", "drums")],
+        )
+
+    def test_lists_the_newest_content_addressed_version_of_each_stem(self):
+        track = self.root / "rel_1" / "trk_1"
+        for age, name in ((300, "vocals.0123456789abcdef.mp3"), (100, "vocals.fedcba9876543210.mp3"), (200, "bass.00000000000000aa.mp3")):
+            (track / name).write_bytes(b"mp3")
+            os.utime(track / name, (1_000_000 - age, 1_000_000 - age))
+        for name in ("bass.mp3", "vocals.mp3"):
+            os.utime(track / name, (1_000_000 - 1000, 1_000_000 - 1000))
+
+        stems = [s for s in backfill_features.list_stems(str(self.root)) if s["trackId"] == "trk_1"]
+
+        self.assertEqual([s["stem"] for s in stems], ["bass", "vocals"])
+        self.assertEqual([Path(s["uri"]).name for s in stems], ["bass.00000000000000aa.mp3", "vocals.fedcba9876543210.mp3"])
+
+    def test_lists_content_addressed_stems_in_gcs(self):
+        def blob(name, minute):
+            return types.SimpleNamespace(name=name, updated=datetime(2026, 1, 1, 0, minute, tzinfo=timezone.utc))
+
+        client = MagicMock()
+        client.list_blobs.return_value = [
+            blob("stems/rel_1/trk_1/drums.mp3", 0),
+            blob("stems/rel_1/trk_1/drums.0123456789abcdef.mp3", 5),
+            blob("stems/rel_1/trk_1/drums.fedcba9876543210.mp3", 3),
+            blob("stems/rel_1/trk_1/vocals_hls/index.m3u8", 5),
+            blob("stems/rel_1/trk_2/vocals.0123456789abcdef.mp3", 1),
+        ]
+        storage = types.SimpleNamespace(Client=lambda: client)
+        google = types.ModuleType("google")
+        google.cloud = types.SimpleNamespace(storage=storage)
+        with patch.dict(sys.modules, {"google": google, "google.cloud": google.cloud}):
+            stems = list(backfill_features.list_stems("gs://bucket/stems"))
+
+        client.list_blobs.assert_called_once_with("bucket", prefix="stems/")
+        self.assertEqual(
+            [(s["trackId"], s["stem"], s["uri"]) for s in stems],
+            [
+                ("trk_1", "drums", "gs://bucket/stems/rel_1/trk_1/drums.0123456789abcdef.mp3"),
+                ("trk_2", "vocals", "gs://bucket/stems/rel_1/trk_2/vocals.0123456789abcdef.mp3"),
+            ],
+        )
+
+    def test_shards_results_and_reports_throughput(self):
+        summary = self.run_backfill(shard_size=2)
+
+        self.assertEqual(len(list(self.out.glob("features-*.jsonl"))), 2)
+        self.assertEqual({line["stem"] for line in self.lines()}, {"bass", "vocals", "drums"})
+        self.assertEqual(summary["completed"], 3)
+        self.assertEqual(summary["remaining"], 0)
+        self.assertGreater(summary["audioSecondsPerSecond"], 0)
+        self.assertEqual(json.loads((self.out / "progress.json").read_text())["completed"], 3)
+
+    def test_resume_skips_done_stems_and_retries_failures(self):
+        (self.root / "rel_2" / "trk_2" / "drums.mp3").write_bytes(b"corrupt")
+        first = self.run_backfill()
+        # An interrupted write leaves a partial line behind.
+        with open(self.out / "features-00000.jsonl", "a") as handle:
+            handle.write('{"uri": "trunc')
+
+        (self.root / "rel_2" / "trk_2" / "drums.mp3").write_bytes(b"mp3")
+        second = self.run_backfill()
+
+        self.assertEqual((first["completed"], first["failed"]), (2, 1))
+        self.assertEqual((second["skipped"], second["completed"], second["failed"]), (2, 1, 0))
+        self.assertTrue((self.out / "features-00001.jsonl").exists())
+
+    def test_schema_bump_recomputes_everything(self):
+        self.run_backfill()
+        with patch.object(backfill_features, "SCHEMA_VERSION", "stem-audio-features/v3"):
+            summary = self.run_backfill()
+
+        self.assertEqual((summary["skipped"], summary["completed"]), (0, 3))
+        self.assertEqual(
+            sorted({line["schemaVersion"] for line in self.lines()}),
+            ["stem-audio-features/v2", "stem-audio-features/v3"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
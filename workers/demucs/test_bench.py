@@ -0,0 +1,82 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import bench
+
+
+class SyntheticCorpusTest(unittest.TestCase):
+    def test_corpus_is_deterministic_stereo_and_normalized(self):
+        first = bench.synth_track(3.0, seed=7)
+        second = bench.synth_track(3.0, seed=7)
+
+        self.assertEqual(first.shape, (3 * bench.SAMPLE_RATE, 2))
+        np.testing.assert_array_equal(first, second)
+        self.assertAlmostEqual(float(np.max(np.abs(first))), 0.9, places=5)
+        self.assertFalse(np.array_equal(first, bench.synth_track(3.0, seed=8)))
+
+    def test_write_corpus_names_tracks_by_duration(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            corpus = bench.write_corpus(Path(tmp), durations=(1.0, 2.0))
+            self.assertEqual([t["name"] for t in corpus], ["synth_1s", "synth_2s"])
+            self.assertTrue(all(Path(t["path"]).exists() for t in corpus))
+
+
+class CompareTest(unittest.TestCase):
+    @staticmethod
+    def report(wall, features):
+        return {"results": [{
+            "track": "synth_15s", "mode": "phases", "wallSeconds": wall,
+            "phases": {"features": features},
+        }]}
+
+    def test_flags_slowdowns_beyond_tolerance(self):
+        rows = bench.compare(self.report(10.0, 4.0), self.report(8.0, 4.1), tolerance=0.15)
+        by_metric = {row["metric"]: row for row in rows}
+
+        self.assertTrue(by_metric["wall"]["regressed"])
+        self.assertFalse(by_metric["phase:features"]["regressed"])
+
+    def test_ignores_sub_noise_slowdowns_and_skipped_runs(self):
+        rows = bench.compare(self.report(0.02, 0.01), self.report(0.01, 0.005))
+        self.assertFalse(any(row["regressed"] for row in rows))
+
+        skipped = {"results": [{"track": "synth_15s", "mode": "phases", "skipped": {"phases": "x"}}]}
+        self.assertEqual(bench.compare(skipped, self.report(1.0, 1.0)), [])
+
+    def test_flags_peak_rss_growth_only_when_measured_per_run(self):
+        def report(process_mb, child_mb, scope="run"):
+            result = self.report(1.0, 0.5)
+            result["results"][0].update(
+                processPeakRssMb=process_mb, childPeakRssMb=child_mb, processPeakRssScope=scope,
+            )
+            return result
+
+        rows = {row["metric"]: row for row in bench.compare(report(900.0, 410.0), report(600.0, 400.0))}
+        self.assertTrue(rows["rss:process"]["regressed"])
+        self.assertFalse(rows["rss:child"]["regressed"])
+
+        rows = {row["metric"] for row in bench.compare(report(900.0, 400.0, "process"), report(600.0, 400.0))}
+        self.assertNotIn("rss:process", rows)
+
+
+class PeakRssTest(unittest.TestCase):
+    @unittest.skipUnless(Path("/proc/self/clear_refs").exists(), "needs Linux /proc")
+    def test_reset_scopes_the_peak_to_what_follows(self):
+        if not bench.reset_peak_rss():
+            self.skipTest("kernel does not allow resetting VmHWM")
+        block = np.ones(64 * 1024 * 1024 // 8)
+        grown = bench.peak_rss_mb()
+        del block
+
+        self.assertTrue(bench.reset_peak_rss())
+        self.assertLess(bench.peak_rss_mb(), grown - 32)
+
+
+if __name__ == "__main__":
+    unittest.main()
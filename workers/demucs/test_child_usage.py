@@ -0,0 +1,45 @@
+import signal
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import child_usage
+
+
+class ChildUsageTest(unittest.TestCase):
+    def test_reports_cpu_and_peak_rss_and_keeps_exit_code(self):
+        script = "b = bytearray(64 * 1024 * 1024); sum(range(3_000_000)); print('ok'); raise SystemExit(3)"
+        with tempfile.TemporaryDirectory() as tmp:
+            command, report = child_usage.wrap([sys.executable, "-c", script], tmp)
+            result = subprocess.run(command, capture_output=True, text=True)
+            usage = child_usage.collect(report)
+
+            self.assertEqual(result.returncode, 3)
+            self.assertEqual(result.stdout, "ok\n")
+            self.assertFalse(report.exists())
+        self.assertEqual(usage["exitCode"], 3)
+        self.assertEqual(usage["command"], Path(sys.executable).name)
+        self.assertGreater(usage["cpuUserSeconds"] + usage["cpuSystemSeconds"], 0)
+        self.assertGreaterEqual(usage["maxRssMb"], 64)
+
+    def test_child_killed_by_signal_is_reported_as_signal(self):
+        script = "import os, signal; os.kill(os.getpid(), signal.SIGTERM)"
+        with tempfile.TemporaryDirectory() as tmp:
+            command, report = child_usage.wrap([sys.executable, "-c", script], tmp)
+            result = subprocess.run(command)
+            usage = child_usage.collect(report)
+
+        self.assertEqual(result.returncode, -signal.SIGTERM)
+        self.assertEqual(usage["exitCode"], -signal.SIGTERM)
+
+    def test_missing_report_collects_as_none(self):
+        self.assertIsNone(child_usage.collect(None))
+        self.assertIsNone(child_usage.collect(Path(tempfile.gettempdir()) / "no-such-usage.json"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import feature_cache
+from feature_cache import FeatureCache, LocalFeatureStore, feature_key
+
+FEATURES = {"schemaVersion": "stem-audio-features/v2", "tempoBpm": 120.0, "key": None}
+
+
+class DictStore:
+    """Stands in for GcsFeatureStore."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def lookup(self, key):
+        return self.entries.get(key)
+
+    def save(self, key, features):
+        self.entries[key] = features
+
+
+class FeatureKeyTest(unittest.TestCase):
+    def test_key_changes_with_content_schema_and_librosa(self):
+        key = feature_key("a" * 64)
+
+        self.assertEqual(key, feature_key("a" * 64))
+        self.assertNotEqual(key, feature_key("b" * 64))
+        with patch.object(feature_cache, "SCHEMA_VERSION", "stem-audio-features/v3"):
+            self.assertNotEqual(key, feature_key("a" * 64))
+        with patch.object(feature_cache.metadata, "version", return_value="99.0"):
+            self.assertNotEqual(key, feature_key("a" * 64))
+
+
+class FeatureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = LocalFeatureStore(Path(self.tmp.name) / "features")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip_and_miss(self):
+        cache = FeatureCache(self.store, max_bytes=1 << 20)
+
+        self.assertIsNone(cache.get("k1"))
+        cache.put("k1", FEATURES)
+        self.assertEqual(cache.get("k1"), FEATURES)
+
+    def test_evicts_least_recently_used_past_the_budget(self):
+        entry_size = len(json.dumps(FEATURES, separators=(",", ":")))
+        # Room for three entries, still three after trimming to 90%.
+        cache = FeatureCache(self.store, max_bytes=int(3.5 * entry_size))
+        for index, key in enumerate(("old", "used", "newer")):
+            cache.put(key, FEATURES)
+            os.utime(self.store._path(key), (1000 + index, 1000 + index))
+        # Reading "used" makes it the most recent entry.
+        cache.get("used")
+
+        cache.put("newest", FEATURES)
+
+        self.assertEqual(sorted(key for key, _, _ in self.store.entries()), ["newer", "newest", "used"])
+
+    def test_corrupt_entries_are_dropped(self):
+        cache = FeatureCache(self.store, max_bytes=1 << 20)
+        cache.put("k1", FEATURES)
+        self.store._path("k1").write_text('{"trunc')
+
+        self.assertIsNone(cache.get("k1"))
+        self.assertFalse(self.store._path("k1").exists())
+
+    def test_bucket_hits_are_copied_locally(self):
+        remote = DictStore()
+        FeatureCache(LocalFeatureStore(Path(self.tmp.name) / "other"), 1 << 20, remote).put("k1", FEATURES)
+        cache = FeatureCache(self.store, max_bytes=1 << 20, remote=remote)
+
+        self.assertEqual(cache.get("k1"), FEATURES)
+        self.assertEqual(self.store.lookup("k1"), FEATURES)
+
+    def test_store_failures_are_misses(self):
+        class BrokenStore(DictStore):
+            def lookup(self, key):
+                raise OSError("bucket unavailable")
+
+        cache = FeatureCache(self.store, max_bytes=1 << 20, remote=BrokenStore())
+
+        self.assertIsNone(cache.get("k1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""Tests for frame-level feature timelines. Requires numpy + soundfile + librosa."""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+import audio_features
+from feature_timeline import ALIGNMENT, MAGIC, TimelineReader, write_timeline
+from test_audio_features import SR, _click_track
+
+
+def _arrays(frames: int) -> dict:
+    rng = np.random.default_rng(44)
+    return {
+        "beatFrames": np.arange(0, frames, 43, dtype=np.int64),
+        "onsetEnvelope": rng.random(frames, dtype=np.float32),
+        "rms": rng.random(frames, dtype=np.float32),
+        "chroma": rng.random((12, frames), dtype=np.float32),
+    }
+
+
+class TimelineFileTest(unittest.TestCase):
+    def test_round_trip_is_memory_mapped_and_aligned(self):
+        arrays = _arrays(1001)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_timeline(Path(tmp) / "stem.timeline", arrays, 22050, 256, "stem-audio-features/v2")
+            timeline = TimelineReader(path)
+
+            self.assertEqual(path.read_bytes()[:4], MAGIC)
+            self.assertEqual(timeline.header["frames"], 1001)
+            self.assertAlmostEqual(timeline.header["frameRate"], 22050 / 256)
+            for name in timeline.names():
+                self.assertIsInstance(timeline[name], np.memmap)
+                self.assertEqual((timeline._data_offset + timeline.header["arrays"][name]["offset"]) % ALIGNMENT, 0)
+            self.assertEqual(timeline["beatFrames"].dtype, np.dtype("<i4"))
+            self.assertEqual(timeline["chroma"].shape, (12, 1001))
+            np.testing.assert_array_equal(timeline["beatFrames"], arrays["beatFrames"])
+            np.testing.assert_allclose(timeline["chroma"], arrays["chroma"], atol=1e-3)
+            np.testing.assert_allclose(timeline.beat_times(), arrays["beatFrames"] * 256 / 22050)
+
+    def test_rejects_other_files_and_incomplete_arrays(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            other = Path(tmp) / "stem.peaks"
+            other.write_bytes(b"RSPK\0\0\0\0")
+            with self.assertRaises(ValueError):
+                TimelineReader(other)
+            arrays = _arrays(10)
+            del arrays["chroma"]
+            with self.assertRaises(ValueError):
+                write_timeline(Path(tmp) / "x.timeline", arrays, 22050, 256, "stem-audio-features/v2")
+
+
+class ExtractedTimelineTest(unittest.TestCase):
+    def test_timeline_matches_the_summary_in_both_paths(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "click.wav"
+            sf.write(str(path), _click_track(120.0, 8.0), SR)
+            loaded = audio_features.extract_stem_features(path, streaming=False, timeline_path=Path(tmp) / "a.timeline")
+            streamed = audio_features._extract_streaming(path, block_frames=37, timeline_path=Path(tmp) / "b.timeline")
+            a, b = TimelineReader(Path(tmp) / "a.timeline"), TimelineReader(Path(tmp) / "b.timeline")
+
+            self.assertEqual(len(a["beatFrames"]), loaded["beatCount"])
+            self.assertAlmostEqual(float(a.beat_times()[0]), loaded["firstBeatSec"], places=3)
+            self.assertEqual(a.header["frames"], b.header["frames"])
+            self.assertEqual(len(b["beatFrames"]), streamed["beatCount"])
+            np.testing.assert_allclose(a["rms"], b["rms"], atol=1e-3)
+            # Streaming floors the onset dB at the running maximum, so a few
+            # early frames differ.
+            close = np.abs(a["onsetEnvelope"].astype(np.float32) - b["onsetEnvelope"]) < 0.05
+            self.assertGreater(close.mean(), 0.95)
+
+    def test_silence_has_frames_but_no_beats(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "silence.wav"
+            sf.write(str(path), np.zeros(SR * 2, dtype=np.float32), SR)
+            audio_features.extract_stem_features(path, timeline_path=Path(tmp) / "s.timeline")
+            timeline = TimelineReader(Path(tmp) / "s.timeline")
+
+            self.assertGreater(timeline.header["frames"], 0)
+            self.assertEqual(len(timeline["beatFrames"]), 0)
+            self.assertEqual(float(np.max(timeline["rms"])), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
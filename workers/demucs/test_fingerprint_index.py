@@ -0,0 +1,111 @@
+"""Tests for packed fingerprints and the near-duplicate index.
+
+Fingerprints are synthetic uint32 frame sequences; "re-encodes" flip a
+fraction of bits and "trimmed copies" drop leading frames. Requires numpy.
+"""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from fingerprint_index import PENDING_MERGE_ENTRIES, TABLES, FingerprintIndex, pack_fingerprint, unpack_fingerprint
+
+
+def _fingerprint(seed: int, frames: int = 1200) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 2**32, frames, dtype=np.uint64).astype(np.uint32)
+
+
+def _flip_bits(frames: np.ndarray, rate: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    mask = np.zeros(len(frames), dtype=np.uint32)
+    for bit in range(32):
+        mask |= (rng.random(len(frames)) < rate).astype(np.uint32) << np.uint32(bit)
+    return frames ^ mask
+
+
+class PackedFingerprintTest(unittest.TestCase):
+    def test_round_trip_accepts_signed_values(self):
+        values = [0, 1, 2**32 - 1, -1, -2**31]
+        unpacked = unpack_fingerprint(pack_fingerprint(values))
+        self.assertEqual(unpacked, [0, 1, 2**32 - 1, 2**32 - 1, 2**31])
+
+    def test_packed_is_smaller_than_decimal(self):
+        values = [int(v) for v in _fingerprint(1, 500)]
+        decimal = ",".join(str(v) for v in values)
+        self.assertLess(len(pack_fingerprint(values)) * 1.5, len(decimal))
+
+
+class FingerprintIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = FingerprintIndex()
+        for seed in range(20):
+            self.index.add(f"trk_{seed}", [int(v) for v in _fingerprint(seed)], {"artistId": f"art_{seed}"})
+
+    def test_reencode_matches_with_high_similarity(self):
+        noisy = _flip_bits(_fingerprint(7), rate=0.08)
+        matches = self.index.query([int(v) for v in noisy])
+        self.assertEqual(matches[0]["trackId"], "trk_7")
+        self.assertEqual(matches[0]["artistId"], "art_7")
+        self.assertGreater(matches[0]["similarity"], 0.85)
+
+    def test_trimmed_copy_matches_at_offset(self):
+        trimmed = _flip_bits(_fingerprint(3)[137:900], rate=0.05)
+        matches = self.index.query(pack_fingerprint(int(v) for v in trimmed))
+        self.assertEqual(matches[0]["trackId"], "trk_3")
+        self.assertAlmostEqual(matches[0]["offsetSeconds"], 137 * 4096 / 3 / 11025, places=1)
+
+    def test_unrelated_audio_and_excluded_track_do_not_match(self):
+        self.assertEqual(self.index.query([int(v) for v in _fingerprint(999)]), [])
+        self.assertEqual(self.index.query([int(v) for v in _fingerprint(5)], exclude="trk_5"), [])
+
+    def test_persisted_index_round_trips_and_replaces_entries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "fingerprints.npz"
+            self.index.add("trk_7", [int(v) for v in _fingerprint(1234)])
+            self.index.save(path)
+            reloaded = FingerprintIndex(path)
+
+        self.assertEqual(len(reloaded), 20)
+        self.assertEqual(reloaded.query([int(v) for v in _fingerprint(7)]), [])
+        self.assertEqual(reloaded.query([int(v) for v in _fingerprint(1234)])[0]["trackId"], "trk_7")
+
+    def test_save_compacts_replaced_entries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "fingerprints.npz"
+            self.index.save(path)
+            baseline = path.stat().st_size
+            for round_ in range(3):
+                self.index.add("trk_7", [int(v) for v in _fingerprint(2000 + round_)])
+            self.assertTrue(self.index.dirty)
+            self.index.save(path)
+            self.assertFalse(self.index.dirty)
+            reloaded = FingerprintIndex(path)
+
+            self.assertLessEqual(path.stat().st_size, baseline * 1.01)
+        self.assertEqual(len(reloaded._ids), 20)
+        self.assertTrue(all(reloaded._live))
+        for index in (self.index, reloaded):
+            self.assertEqual(index.query([int(v) for v in _fingerprint(2002)])[0]["trackId"], "trk_7")
+            self.assertEqual(index.query([int(v) for v in _fingerprint(2000)]), [])
+            self.assertEqual(index.query([int(v) for v in _fingerprint(12)])[0]["trackId"], "trk_12")
+
+    def test_queries_search_pending_entries_without_merging(self):
+        index = FingerprintIndex()
+        for seed in range(PENDING_MERGE_ENTRIES - 1):
+            index.add(f"trk_{seed}", [int(v) for v in _fingerprint(seed, 300)])
+            match = index.query([int(v) for v in _flip_bits(_fingerprint(seed, 300), rate=0.05)])
+            self.assertEqual(match[0]["trackId"], f"trk_{seed}")
+            self.assertEqual(len(index._keys[0]), 0)
+
+        index.add("trk_last", [int(v) for v in _fingerprint(999, 300)])
+        self.assertEqual(index._pending, [])
+        for t in range(TABLES):
+            self.assertTrue(np.all(np.diff(index._keys[t].astype(np.int64)) >= 0))
+        for seed in (0, 40):
+            self.assertEqual(index.query([int(v) for v in _fingerprint(seed, 300)])[0]["trackId"], f"trk_{seed}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import asyncio
+import unittest
+
+from http_jobs import COMPLETED, FAILED, QUEUED, RUNNING, HttpJob, JobQueue, QueueFull, sse_events
+
+
+class JobQueueTest(unittest.TestCase):
+    def test_pool_bounds_concurrency_and_queue_rejects_overflow(self):
+        async def scenario():
+            running, peak = 0, 0
+            release = asyncio.Event()
+
+            async def runner(job):
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+                await release.wait()
+                running -= 1
+                return {"track": job.track_id}
+
+            queue = JobQueue(runner, workers=2, max_queued=2)
+            jobs = [queue.submit(HttpJob("rel", f"trk{i}")) for i in range(2)]
+            await asyncio.sleep(0)  # both workers pick a job up
+            jobs += [queue.submit(HttpJob("rel", f"trk{i}")) for i in range(2, 4)]
+            with self.assertRaises(QueueFull):
+                queue.submit(HttpJob("rel", "overflow"))
+            self.assertEqual([job.status for job in jobs], [RUNNING, RUNNING, QUEUED, QUEUED])
+
+            release.set()
+            await asyncio.gather(*(job.done.wait() for job in jobs))
+            return jobs, peak
+
+        jobs, peak = asyncio.run(scenario())
+        self.assertEqual(peak, 2)
+        self.assertEqual([job.result for job in jobs], [{"track": f"trk{i}"} for i in range(4)])
+
+    def test_failed_job_keeps_error_and_worker_survives(self):
+        async def scenario():
+            async def runner(job):
+                if job.track_id == "bad":
+                    raise RuntimeError("demucs exploded")
+                return {}
+
+            queue = JobQueue(runner, workers=1, max_queued=4, retention=1)
+            bad, good = queue.submit(HttpJob("rel", "bad")), queue.submit(HttpJob("rel", "good"))
+            await good.done.wait()
+            return queue, bad, good
+
+        queue, bad, good = asyncio.run(scenario())
+        self.assertEqual((bad.status, bad.error), (FAILED, "demucs exploded"))
+        self.assertEqual(good.status, COMPLETED)
+        # Only the newest finished job is retained.
+        self.assertIsNone(queue.get(bad.id))
+        self.assertIs(queue.get(good.id), good)
+
+
+class SseEventsTest(unittest.TestCase):
+    def test_stream_reports_progress_then_terminal_status(self):
+        async def scenario():
+            async def runner(job):
+                job.set_progress(40)
+                await asyncio.sleep(0)
+                job.set_progress(40)  # unchanged: no event
+                job.set_progress(90)
+                return {"stems": {}}
+
+            queue = JobQueue(runner)
+            job = queue.submit(HttpJob("rel", "trk"))
+            return [chunk async for chunk in sse_events(job, heartbeat_seconds=5)]
+
+        chunks = asyncio.run(scenario())
+        events = [chunk.split("\n", 1)[0] for chunk in chunks]
+        self.assertEqual(events, [
+            "event: status", "event: status", "event: progress", "event: progress", "event: status",
+        ])
+        self.assertIn('"status":"queued"', chunks[0])
+        self.assertIn('"progress":90', chunks[3])
+        self.assertIn('"status":"completed"', chunks[-1])
+
+    def test_finished_job_stream_is_a_single_snapshot(self):
+        job = HttpJob("rel", "trk")
+        job.set_status(FAILED, error="boom")
+
+        async def collect():
+            return [chunk async for chunk in sse_events(job)]
+
+        chunks = asyncio.run(collect())
+        self.assertEqual(len(chunks), 1)
+        self.assertIn('"error":"boom"', chunks[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from job_checkpoint import JobCheckpoint, LocalCheckpointStore, checkpoint_key, file_sha256
+
+
+class JobCheckpointTest(unittest.TestCase):
+    def test_manifest_round_trips_and_is_keyed_by_source(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = LocalCheckpointStore(tmp)
+            first = JobCheckpoint("sep/rel 1", "a" * 64, store)
+            self.assertFalse(first.resumed)
+            first.complete("fingerprint", {"fingerprint": "AQAAAA==", "result": {"quarantined": False}})
+
+            again = JobCheckpoint("sep/rel 1", "a" * 64, store)
+            other_source = JobCheckpoint("sep/rel 1", "b" * 64, store)
+
+        self.assertTrue(again.resumed)
+        self.assertEqual(again.get("fingerprint")["fingerprint"], "AQAAAA==")
+        self.assertFalse(other_source.resumed)
+        self.assertIsNone(other_source.get("fingerprint"))
+        self.assertEqual(checkpoint_key("sep/rel 1", "a" * 64), "sep_rel_1-" + "a" * 16)
+
+    def test_unreadable_manifest_starts_fresh_and_failed_writes_do_not_raise(self):
+        class BrokenStore:
+            def read(self, key):
+                return "{not json"
+
+            def write(self, key, text):
+                raise OSError("bucket unavailable")
+
+        checkpoint = JobCheckpoint("job", "c" * 64, BrokenStore())
+        self.assertFalse(checkpoint.resumed)
+        checkpoint.complete_stem("vocals", {"uri": "x"})
+        self.assertEqual(checkpoint.stem("vocals"), {"uri": "x"})
+
+    def test_prune_drops_only_expired_manifests(self):
+        import os
+        import time
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = LocalCheckpointStore(tmp)
+            JobCheckpoint("old", "a" * 64, store).complete("published", {"messageId": "1"})
+            JobCheckpoint("new", "b" * 64, store).complete("fingerprint", {})
+            old_path = Path(tmp) / f"{checkpoint_key('old', 'a' * 64)}.json"
+            stale = time.time() - 4 * 86400
+            os.utime(old_path, (stale, stale))
+
+            self.assertEqual(store.prune(3 * 86400), 1)
+            self.assertFalse(old_path.exists())
+            self.assertTrue(JobCheckpoint("new", "b" * 64, store).resumed)
+
+    def test_file_sha256_streams_the_file(self):
+        import hashlib
+
+        with tempfile.NamedTemporaryFile() as handle:
+            handle.write(b"x" * 3000)
+            handle.flush()
+            self.assertEqual(file_sha256(handle.name, chunk_size=1024), hashlib.sha256(b"x" * 3000).hexdigest())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from job_profiler import SamplingProfiler
+
+
+def busy_loop(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sum(range(1000))
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    def test_writes_folded_stacks_of_the_profiled_thread(self):
+        with SamplingProfiler(interval_seconds=0.002) as profiler:
+            busy_loop(0.2)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            lines = profiler.write_folded(Path(tmp) / "profile.folded").read_text().splitlines()
+
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertTrue(any("test_job_profiler.py:busy_loop" in line for line in lines))
+        self.assertIn(";", stack)
+
+    def test_only_registered_threads_are_sampled(self):
+        def registered_work(profiler):
+            with profiler.sampling():
+                busy_loop(0.15)
+
+        def unrelated_work():
+            busy_loop(0.15)
+
+        with SamplingProfiler(interval_seconds=0.002, thread_ids=()) as profiler:
+            workers = [
+                threading.Thread(target=registered_work, args=(profiler,)),
+                threading.Thread(target=unrelated_work),
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+        stacks = list(profiler.samples)
+        self.assertTrue(any("registered_work" in stack for stack in stacks))
+        self.assertFalse(any("unrelated_work" in stack for stack in stacks))
+        self.assertEqual(profiler.thread_ids, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
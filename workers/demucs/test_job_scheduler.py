@@ -0,0 +1,124 @@
+import random
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from job_scheduler import JobClass, JobScheduler, lottery_order, parse_subscriptions
+
+INTERACTIVE = JobClass("interactive", 3.0)
+BULK = JobClass("bulk", 1.0)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def drain(scheduler: JobScheduler, count: int, seconds: float = 10.0) -> list:
+    picked = []
+    for _ in range(count):
+        subscription, item = scheduler.get(timeout=0)
+        scheduler.charge(subscription, seconds)
+        picked.append(item)
+    return picked
+
+
+class ParseSubscriptionsTest(unittest.TestCase):
+    def test_weights_and_default(self):
+        self.assertEqual(
+            parse_subscriptions("interactive:8, bulk:2,backfill", "default"),
+            [JobClass("interactive", 8.0), JobClass("bulk", 2.0), JobClass("backfill", 1.0)],
+        )
+        self.assertEqual(parse_subscriptions("", "stem-separate-worker"), [JobClass("stem-separate-worker")])
+
+    def test_rejects_bad_entries(self):
+        for spec in ("bulk:0", ":2", "bulk:1,bulk:2", "bulk:x"):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                parse_subscriptions(spec, "default")
+
+
+class JobSchedulerTest(unittest.TestCase):
+    def test_busy_classes_share_worker_time_by_weight(self):
+        scheduler = JobScheduler([INTERACTIVE, BULK])
+        for index in range(50):
+            scheduler.put("bulk", f"b{index}")
+            scheduler.put("interactive", f"i{index}")
+
+        picked = drain(scheduler, 40)
+
+        self.assertEqual(sum(item.startswith("i") for item in picked), 30)
+
+    def test_interactive_job_is_next_whatever_the_bulk_backlog(self):
+        scheduler = JobScheduler([JobClass("interactive"), JobClass("bulk")])
+        for index in range(1000):
+            scheduler.put("bulk", f"b{index}")
+        drain(scheduler, 20)
+
+        scheduler.put("interactive", "upload")
+
+        self.assertEqual(scheduler.get(timeout=0), ("interactive", "upload"))
+
+    def test_idle_class_does_not_bank_credit(self):
+        scheduler = JobScheduler([JobClass("interactive"), JobClass("bulk")])
+        for index in range(10):
+            scheduler.put("bulk", f"b{index}")
+        drain(scheduler, 5)
+        for index in range(5):
+            scheduler.put("interactive", f"i{index}")
+
+        picked = drain(scheduler, 6)
+
+        # Interactive rejoins at the start of the last bulk job, so after one
+        # catch-up job equal weights alternate instead of running all five.
+        self.assertEqual(picked, ["i0", "i1", "b5", "i2", "b6", "i3"])
+
+    def test_shortest_first_within_a_class_with_aging(self):
+        clock = FakeClock()
+        scheduler = JobScheduler([BULK], shortest_first=True, aging=1.0, default_estimate_seconds=240, clock=clock)
+        scheduler.put("bulk", "long", estimate_seconds=600)
+        clock.now = 10
+        scheduler.put("bulk", "short", estimate_seconds=60)
+        scheduler.put("bulk", "unknown")
+        clock.now = 1000
+        # Waited long enough to beat a fresh 120 s job.
+        scheduler.put("bulk", "fresh", estimate_seconds=120)
+
+        self.assertEqual(drain(scheduler, 4), ["short", "unknown", "long", "fresh"])
+
+    def test_arrival_order_without_shortest_first(self):
+        scheduler = JobScheduler([BULK])
+        for item, estimate in (("a", 600), ("b", 60), ("c", None)):
+            scheduler.put("bulk", item, estimate_seconds=estimate)
+
+        self.assertEqual(drain(scheduler, 3), ["a", "b", "c"])
+
+    def test_get_blocks_until_put_and_close_returns_leftovers(self):
+        scheduler = JobScheduler([INTERACTIVE, BULK])
+        self.assertIsNone(scheduler.get(timeout=0.01))
+
+        threading.Timer(0.05, scheduler.put, ("bulk", "late")).start()
+        self.assertEqual(scheduler.get(timeout=5), ("bulk", "late"))
+
+        scheduler.put("bulk", "b0")
+        scheduler.put("interactive", "i0")
+        self.assertEqual(scheduler.depth(), {"interactive": 1, "bulk": 1})
+        self.assertEqual(sorted(scheduler.close()), [("bulk", "b0"), ("interactive", "i0")])
+        self.assertIsNone(scheduler.get(timeout=0))
+
+
+class LotteryOrderTest(unittest.TestCase):
+    def test_first_class_frequency_follows_weights(self):
+        rng = random.Random(7)
+        firsts = [lottery_order([INTERACTIVE, BULK], rng)[0].subscription for _ in range(4000)]
+
+        self.assertAlmostEqual(firsts.count("interactive") / len(firsts), 0.75, delta=0.03)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 import asyncio
+import json
 import os
 import sys
 import tempfile
@@ -8,6 +9,12 @@ from pathlib import Path
 from unittest.mock import patch
 
 os.environ.setdefault("OUTPUT_DIR", tempfile.mkdtemp(prefix="resonate-demucs-test-"))
+# Extractors are patched per test; a shared feature cache would leak results
+# between tests. FeatureCacheEndpointTest turns it on explicitly.
+os.environ.setdefault("FEATURE_CACHE_MAX_MB", "0")
+# Admission is covered by ScratchSpaceTest; the host's free space is not.
+os.environ.setdefault("WORKER_SCRATCH_MIN_FREE_MB", "0")
+os.environ.setdefault("WORKER_SCRATCH_JOB_RESERVE_MB", "0")
 
 # Shim only when the real package is absent: faking it while the real one is
 # installed breaks starlette's `python_multipart.multipart` import.
@@ -20,6 +27,7 @@ except ModuleNotFoundError:
 sys.path.insert(0, str(Path(__file__).resolve().parent))
 
 import main
+import worker_metrics
 
 
 class DemucsCpuFallbackTest(unittest.TestCase):
@@ -62,6 +70,18 @@ class DemucsCpuFallbackTest(unittest.TestCase):
         with patch.object(main, "DEMUCS_DEVICE", "cpu"):
             self.assertEqual(main.demucs_devices_to_try(), ["cpu"])
 
+    def test_onnx_device_falls_back_to_torch_cpu(self):
+        with patch.object(main, "DEMUCS_DEVICE", "onnx"):
+            self.assertEqual(main.demucs_devices_to_try(), ["onnx", "cpu"])
+        self.assertTrue(main.should_retry_demucs_on_cpu("onnx", "onnxruntime error"))
+
+    def test_onnx_attempt_uses_drop_in_cli_layout(self):
+        command = main.demucs_command("onnx", Path("/tmp/demucs-onnx"), Path("/tmp/track.wav"))
+        self.assertTrue(command[1].endswith("onnx_separator.py"))
+        self.assertEqual(command[-3:], ["--out", "/tmp/demucs-onnx", "/tmp/track.wav"])
+        self.assertIn(main.DEMUCS_MODEL, command)
+        self.assertEqual(main.demucs_attempt_env("onnx")["CUDA_VISIBLE_DEVICES"], "")
+
     def test_run_demucs_separation_retries_cufft_failure_on_cpu(self):
         with tempfile.TemporaryDirectory() as temp_dir_name:
             temp_dir = Path(temp_dir_name)
@@ -81,6 +101,8 @@ class DemucsCpuFallbackTest(unittest.TestCase):
                 attempts.append(device)
                 attempt_output_dir = Path(temp_dir) / f"demucs-{device}"
                 if device == "cuda":
+                    (attempt_output_dir / main.DEMUCS_MODEL).mkdir(parents=True)
+                    (attempt_output_dir / main.DEMUCS_MODEL / "partial.wav").write_bytes(b"partial")
                     return 1, "RuntimeError: cuFFT error: CUFFT_INTERNAL_ERROR", attempt_output_dir
 
                 demucs_output = attempt_output_dir / main.DEMUCS_MODEL / input_path.stem
@@ -91,13 +113,15 @@ class DemucsCpuFallbackTest(unittest.TestCase):
             class FakeFfmpegProcess:
                 returncode = 0
 
-                async def wait(self):
-                    return None
+                async def communicate(self):
+                    return b"", b""
 
             async def fake_create_subprocess_exec(*args, **kwargs):
                 Path(args[-1]).write_bytes(b"fake mp3")
                 return FakeFfmpegProcess()
 
+            fallbacks_before = worker_metrics.CPU_FALLBACKS.get(from_device="cuda")
+            cpu_runs_before = worker_metrics.PHASE_SECONDS.count(phase="separation", device="cpu")
             with (
                 patch.object(main, "STORAGE_MODE", "local"),
                 patch.object(main, "OUTPUT_BASE_DIR", output_dir),
@@ -105,7 +129,7 @@ class DemucsCpuFallbackTest(unittest.TestCase):
                 patch.object(main, "run_demucs_attempt", fake_run_demucs_attempt),
                 patch.object(main.asyncio, "create_subprocess_exec", fake_create_subprocess_exec),
             ):
-                results, stem_features = asyncio.run(
+                results, stem_features, artifacts = asyncio.run(
                     main.run_demucs_separation(
                         input_path=input_path,
                         temp_dir=str(temp_dir),
@@ -115,10 +139,171 @@ class DemucsCpuFallbackTest(unittest.TestCase):
                 )
 
             self.assertEqual(attempts, ["cuda", "cpu"])
+            self.assertFalse((temp_dir / "demucs-cuda").exists())
             self.assertEqual(results, {"vocals": "rel_test/trk_test/vocals.mp3"})
             # The fake stem is not decodable audio: feature extraction must
             # degrade to None for that stem without failing separation (#1184).
             self.assertEqual(stem_features, {"vocals": None})
+            # Same for waveform peaks: no peaks entry, no failure.
+            self.assertEqual(artifacts, {"stemPeaks": {}, "stemRenditions": {}})
+            self.assertEqual(worker_metrics.CPU_FALLBACKS.get(from_device="cuda"), fallbacks_before + 1)
+            self.assertEqual(
+                worker_metrics.PHASE_SECONDS.count(phase="separation", device="cpu"), cpu_runs_before + 1
+            )
+
+    def test_encode_pass_adds_loudness_to_stem_features(self):
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            temp_dir = Path(temp_dir_name)
+            input_path = temp_dir / "track_test.wav"
+            input_path.write_bytes(b"fake wav")
+
+            async def fake_run_demucs_attempt(input_path, temp_dir, device, release_id, track_id, callback_url=None):
+                attempt_output_dir = Path(temp_dir) / f"demucs-{device}"
+                demucs_output = attempt_output_dir / main.DEMUCS_MODEL / input_path.stem
+                demucs_output.mkdir(parents=True)
+                (demucs_output / "drums.wav").write_bytes(b"fake separated stem")
+                return 0, "", attempt_output_dir
+
+            ebur128_log = (
+                b"[Parsed_ebur128_0 @ 0x1] Summary:\n\n"
+                b"  Integrated loudness:\n    I:         -14.2 LUFS\n"
+                b"  Loudness range:\n    LRA:         6.3 LU\n"
+                b"  True peak:\n    Peak:        -0.8 dBFS\n"
+            )
+            commands = []
+
+            class FakeFfmpegProcess:
+                returncode = 0
+
+                async def communicate(self):
+                    return b"", ebur128_log
+
+            async def fake_create_subprocess_exec(*args, **kwargs):
+                commands.append(args)
+                Path(args[-1]).write_bytes(b"fake mp3")
+                return FakeFfmpegProcess()
+
+            with (
+                patch.object(main, "STORAGE_MODE", "local"),
+                patch.object(main, "OUTPUT_BASE_DIR", temp_dir / "outputs"),
+                patch.object(main, "demucs_devices_to_try", return_value=["cpu"]),
+                patch.object(main, "run_demucs_attempt", fake_run_demucs_attempt),
+                patch.object(main, "extract_stem_features", return_value={"energyRms": 0.1}),
+                patch.object(main.asyncio, "create_subprocess_exec", fake_create_subprocess_exec),
+            ):
+                _, stem_features, _ = asyncio.run(
+                    main.run_demucs_separation(input_path, str(temp_dir), "rel_test", "trk_test")
+                )
+
+            self.assertEqual(len(commands), 1)
+            self.assertIn("ebur128=peak=true", commands[0][commands[0].index("-filter_complex") + 1])
+            self.assertEqual(
+                stem_features["drums"],
+                {"energyRms": 0.1, "loudnessLufs": -14.2, "loudnessRangeLu": 6.3, "truePeakDbtp": -0.8},
+            )
+
+    def test_renditions_come_from_the_same_ffmpeg_process(self):
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            temp_dir = Path(temp_dir_name)
+            input_path = temp_dir / "track_test.wav"
+            input_path.write_bytes(b"fake wav")
+
+            async def fake_run_demucs_attempt(input_path, temp_dir, device, release_id, track_id, callback_url=None):
+                attempt_output_dir = Path(temp_dir) / f"demucs-{device}"
+                demucs_output = attempt_output_dir / main.DEMUCS_MODEL / input_path.stem
+                demucs_output.mkdir(parents=True)
+                (demucs_output / "bass.wav").write_bytes(b"fake separated stem")
+                return 0, "", attempt_output_dir
+
+            commands = []
+
+            class FakeFfmpegProcess:
+                returncode = 0
+
+                async def communicate(self):
+                    return b"", b""
+
+            async def fake_create_subprocess_exec(*args, **kwargs):
+                commands.append(args)
+                for arg in args:
+                    if arg.endswith((".mp3", ".opus", ".m3u8")):
+                        Path(arg).write_bytes(b"encoded")
+                (Path(args[-1]).parent / "bass_hls" / "bass_000.m4s").write_bytes(b"segment")
+                return FakeFfmpegProcess()
+
+            with (
+                patch.object(main, "STORAGE_MODE", "local"),
+                patch.object(main, "OUTPUT_BASE_DIR", temp_dir / "outputs"),
+                patch.object(main, "STEM_RENDITIONS", ("opus", "hls")),
+                patch.object(main, "demucs_devices_to_try", return_value=["cpu"]),
+                patch.object(main, "run_demucs_attempt", fake_run_demucs_attempt),
+                patch.object(main.asyncio, "create_subprocess_exec", fake_create_subprocess_exec),
+            ):
+                results, _, artifacts = asyncio.run(
+                    main.run_demucs_separation(input_path, str(temp_dir), "rel_test", "trk_test")
+                )
+
+            self.assertEqual(len(commands), 1)
+            self.assertEqual(results, {"bass": "rel_test/trk_test/bass.mp3"})
+            self.assertEqual(
+                artifacts["stemRenditions"],
+                {"bass": {
+                    "opus": "rel_test/trk_test/bass.opus",
+                    "hls": "rel_test/trk_test/bass_hls/bass.m3u8",
+                }},
+            )
+
+    def test_timelines_are_written_by_the_extraction_and_stored(self):
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            temp_dir = Path(temp_dir_name)
+            input_path = temp_dir / "track_test.wav"
+            input_path.write_bytes(b"fake wav")
+
+            async def fake_run_demucs_attempt(input_path, temp_dir, device, release_id, track_id, callback_url=None):
+                attempt_output_dir = Path(temp_dir) / f"demucs-{device}"
+                demucs_output = attempt_output_dir / main.DEMUCS_MODEL / input_path.stem
+                demucs_output.mkdir(parents=True)
+                (demucs_output / "bass.wav").write_bytes(b"fake separated stem")
+                return 0, "", attempt_output_dir
+
+            class FakeFfmpegProcess:
+                returncode = 0
+
+                async def communicate(self):
+                    return b"", b""
+
+            async def fake_create_subprocess_exec(*args, **kwargs):
+                Path(args[-1]).write_bytes(b"fake mp3")
+                return FakeFfmpegProcess()
+
+            extractions = []
+
+            def fake_extract(path, timeline_path=None):
+                extractions.append(timeline_path)
+                Path(timeline_path).write_bytes(b"RSTL")
+                return {"energyRms": 0.1}
+
+            with (
+                patch.object(main, "STORAGE_MODE", "local"),
+                patch.object(main, "OUTPUT_BASE_DIR", temp_dir / "outputs"),
+                patch.object(main, "STEM_TIMELINES", True),
+                patch.object(main, "FEATURE_CACHE_MAX_MB", 1),
+                patch.object(main, "FEATURE_CACHE_DIR", temp_dir / "features"),
+                patch.object(main, "_feature_cache", None),
+                patch.object(main, "demucs_devices_to_try", return_value=["cpu"]),
+                patch.object(main, "run_demucs_attempt", fake_run_demucs_attempt),
+                patch.object(main, "extract_stem_features", fake_extract),
+                patch.object(main.asyncio, "create_subprocess_exec", fake_create_subprocess_exec),
+            ):
+                for attempt in ("first", "second"):
+                    _, _, artifacts = asyncio.run(
+                        main.run_demucs_separation(input_path, str(temp_dir / attempt), "rel_test", "trk_test")
+                    )
+
+            self.assertEqual(artifacts["stemTimelines"], {"bass": "rel_test/trk_test/bass.timeline"})
+            # Cached features cannot produce a timeline, so both runs extract.
+            self.assertEqual(len(extractions), 2)
+            self.assertTrue(str(extractions[0]).endswith("bass.timeline"))
 
     def test_run_demucs_separation_retries_any_cuda_failure_before_raising(self):
         with tempfile.TemporaryDirectory() as temp_dir_name:
@@ -157,5 +342,1127 @@ class DemucsCpuFallbackTest(unittest.TestCase):
             self.assertEqual(attempts, ["cuda", "cpu"])
 
 
+def _process_alive(pid: int) -> bool:
+    """True while `pid` exists and is not a zombie (Linux /proc)."""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except FileNotFoundError:
+        return False
+    return stat.rsplit(")", 1)[1].split()[0] != "Z"
+
+
+class DemucsWatchdogTest(unittest.TestCase):
+    def run_attempt(self, script: str, stall: float = 60.0, base: float = 600.0, duration=None):
+        """(returncode, output, seconds) of an attempt running `script` instead of Demucs."""
+        import time
+
+        with (
+            tempfile.TemporaryDirectory() as temp_dir,
+            patch.object(main, "demucs_command", lambda *args: [sys.executable, "-c", script]),
+            patch.object(main, "audio_duration_seconds", return_value=duration),
+            patch.object(main, "DEMUCS_STALL_SECONDS", stall),
+            patch.object(main, "DEMUCS_TIMEOUT_BASE_SECONDS", base),
+        ):
+            started = time.monotonic()
+            returncode, output, _ = asyncio.run(
+                main.run_demucs_attempt(Path(temp_dir) / "t.wav", temp_dir, "cuda", "rel", "trk")
+            )
+        return returncode, output, time.monotonic() - started
+
+    @unittest.skipUnless(Path("/proc/self/stat").exists(), "needs /proc")
+    def test_stalled_attempt_and_its_children_are_killed(self):
+        script = (
+            "import subprocess, sys, time\n"
+            "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+            "print(child.pid, flush=True)\n"
+            "sys.stderr.write(' 5%|#'); sys.stderr.flush()\n"
+            "time.sleep(60)\n"
+        )
+        before = worker_metrics.SEPARATION_TIMEOUTS.get(device="cuda", reason="stall")
+
+        returncode, output, seconds = self.run_attempt(script, stall=0.5)
+
+        self.assertNotEqual(returncode, 0)
+        self.assertLess(seconds, 10)
+        self.assertIn("watchdog: killed after no progress for 0.5s", output)
+        self.assertFalse(_process_alive(int(output.split()[0])))
+        self.assertEqual(worker_metrics.SEPARATION_TIMEOUTS.get(device="cuda", reason="stall"), before + 1)
+
+    def test_progressing_attempt_is_killed_past_its_budget(self):
+        script = (
+            "import sys, time\n"
+            "for i in range(600):\n"
+            "    sys.stderr.write(f' {i % 100}%|#'); sys.stderr.flush(); time.sleep(0.05)\n"
+        )
+
+        returncode, output, seconds = self.run_attempt(script, stall=1.0, base=0.5, duration=0.0)
+
+        self.assertNotEqual(returncode, 0)
+        self.assertLess(seconds, 10)
+        self.assertIn("time budget", output)
+
+    def test_budget_scales_with_duration(self):
+        with patch.object(main, "DEMUCS_TIMEOUT_BASE_SECONDS", 600), patch.object(main, "DEMUCS_TIMEOUT_FACTOR", 4):
+            self.assertEqual(main.demucs_wall_budget(300.0), 1800.0)
+            self.assertIsNone(main.demucs_wall_budget(None))
+        with patch.object(main, "DEMUCS_TIMEOUT_FACTOR", 0):
+            self.assertIsNone(main.demucs_wall_budget(300.0))
+
+    def test_finished_attempt_is_left_alone(self):
+        returncode, output, _ = self.run_attempt("import sys; sys.stderr.write('100%|#')", stall=0.5)
+
+        self.assertEqual(returncode, 0)
+        self.assertNotIn("watchdog", output)
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_fingerprint_is_packed_but_hash_keeps_decimal_form(self):
+        import hashlib
+        import subprocess
+
+        from fingerprint_index import unpack_fingerprint
+
+        fpcalc = subprocess.CompletedProcess(
+            args=[], returncode=0, stderr="",
+            stdout='{"duration": 12.5, "fingerprint": [1, 4294967295, 42]}',
+        )
+        with patch.object(main.subprocess, "run", return_value=fpcalc):
+            duration, fingerprint, fingerprint_hash = main.generate_fingerprint(Path("x.wav"))
+
+        self.assertEqual(duration, 12.5)
+        self.assertEqual(unpack_fingerprint(fingerprint), [1, 4294967295, 42])
+        self.assertEqual(
+            fingerprint_hash,
+            hashlib.sha256(b"1,4294967295,42").hexdigest(),
+        )
+
+    def test_submission_sends_only_the_packed_fingerprint(self):
+        from fingerprint_index import pack_fingerprint
+
+        posted = []
+
+        class FakeResponse:
+            status_code = 201
+
+            def json(self):
+                return {"quarantined": False}
+
+        class FakeClient:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            async def post(self, url, json=None, headers=None):
+                posted.append(json)
+                return FakeResponse()
+
+        packed = pack_fingerprint([1, 4294967295, 42])
+        near = [{"trackId": "trk_old", "similarity": 0.93}]
+        with patch.object(main.httpx, "AsyncClient", FakeClient):
+            verdict = asyncio.run(main.submit_fingerprint(
+                "http://backend", "rel", "trk", 12.5, packed, "h", near_duplicates=near,
+            ))
+            with patch.object(main, "FINGERPRINT_SEND_DECIMAL", True):
+                asyncio.run(main.submit_fingerprint("http://backend", "rel", "trk", 12.5, packed, "h"))
+
+        self.assertEqual(verdict, {"quarantined": False})
+        self.assertNotIn("fingerprint", posted[0])
+        self.assertEqual(posted[0]["fingerprintPacked"], packed)
+        self.assertEqual(posted[0]["fingerprintEncoding"], "chromaprint-u32le-base64")
+        self.assertEqual(posted[0]["nearDuplicates"], near)
+        # Older backends only read the decimal field.
+        self.assertEqual(posted[1]["fingerprint"], "1,4294967295,42")
+
+    def test_remembered_fingerprints_are_saved_in_one_batch(self):
+        class FakeIndex:
+            def __init__(self):
+                self.added, self.saves = [], 0
+                self.dirty = False
+
+            def __len__(self):
+                return len(self.added)
+
+            def add(self, track_id, fingerprint, meta):
+                self.added.append(track_id)
+                self.dirty = True
+
+            def save(self):
+                self.saves += 1
+                self.dirty = False
+
+        index = FakeIndex()
+        with patch.object(main, "FINGERPRINT_INDEX_PATH", "/tmp/index.npz"), \
+             patch.object(main, "_fingerprint_index", index), \
+             patch.object(main, "FINGERPRINT_INDEX_SAVE_SECONDS", 3600):
+            for track_id in ("trk_1", "trk_2", "trk_3"):
+                main.remember_fingerprint(track_id, "rel", "art", "AAAAAA==")
+            self.assertEqual(index.saves, 0)
+            saver = main._fingerprint_index_saver
+            self.assertIsNotNone(saver)
+            saver.cancel()
+
+            main.save_fingerprint_index()
+            main.save_fingerprint_index()
+
+        self.assertEqual(index.added, ["trk_1", "trk_2", "trk_3"])
+        self.assertEqual(index.saves, 1)
+        self.assertIsNone(main._fingerprint_index_saver)
+
+    def test_near_duplicate_lookup_is_disabled_without_index_path(self):
+        with patch.object(main, "FINGERPRINT_INDEX_PATH", ""):
+            self.assertEqual(main.find_near_duplicates("trk", "AAAAAA=="), [])
+
+
+def fake_pubsub_modules(published: list, fail_publishes: int = 0) -> dict:
+    """sys.modules entries for a google.cloud.pubsub_v1 that records publishes.
+
+    The first `fail_publishes` publishes raise, like a worker preempted
+    between separation and publish.
+    """
+    import json
+
+    failures = [fail_publishes]
+
+    class FakeFuture:
+        def result(self):
+            if failures[0] > 0:
+                failures[0] -= 1
+                published.pop()
+                raise RuntimeError("preempted before publish")
+            return f"msg-{len(published)}"
+
+    class FakePublisher:
+        def topic_path(self, project, topic):
+            return f"projects/{project}/topics/{topic}"
+
+        def publish(self, topic_path, data, **attributes):
+            published.append(json.loads(data))
+            return FakeFuture()
+
+    pubsub_v1 = types.ModuleType("google.cloud.pubsub_v1")
+    pubsub_v1.PublisherClient = FakePublisher
+    google = types.ModuleType("google")
+    google_cloud = types.ModuleType("google.cloud")
+    google_cloud.pubsub_v1 = pubsub_v1
+    google.cloud = google_cloud
+    return {"google": google, "google.cloud": google_cloud, "google.cloud.pubsub_v1": pubsub_v1}
+
+
+class FakeMessage:
+    def __init__(self, data: dict):
+        self.data = json.dumps(data).encode("utf-8")
+        self.attributes = {}
+        self.publish_time = None
+        self.outcome = None
+
+    def ack(self):
+        self.outcome = "ack"
+
+    def nack(self):
+        self.outcome = "nack"
+
+
+class PubSubConsumerTest(unittest.TestCase):
+    def test_weighted_subscriptions_share_one_dispatcher(self):
+        """Interactive jobs jump the bulk backlog; acks and failures are unchanged."""
+        import time
+
+        deliveries = {
+            "bulk": [FakeMessage({"jobId": f"b{i}"}) for i in range(6)],
+            "interactive": [FakeMessage({"jobId": "i0"}), FakeMessage({"jobId": "i1"})],
+        }
+        processed = []
+        subscribed = []
+
+        class StreamingPull:
+            def done(self):
+                return len(processed) == 8
+
+            def result(self, timeout=None):
+                return None
+
+            def cancel(self):
+                pass
+
+        class FakeSubscriber:
+            def subscription_path(self, project, name):
+                return name
+
+            def subscribe(self, path, callback, flow_control):
+                subscribed.append((path, flow_control))
+                for message in deliveries[path]:
+                    callback(message)
+                return StreamingPull()
+
+        async def fake_process(data, attributes=None, publish_time=None, subscription=None):
+            processed.append((data["jobId"], subscription))
+            time.sleep(0.01)
+            if data["jobId"] == "b1":
+                raise RuntimeError("separation failed")
+
+        published = []
+        modules = fake_pubsub_modules(published)
+        modules["google.cloud.pubsub_v1"].SubscriberClient = FakeSubscriber
+        modules["google.cloud.pubsub_v1.types"] = types.ModuleType("google.cloud.pubsub_v1.types")
+        modules["google.cloud.pubsub_v1.types"].FlowControl = lambda **kwargs: kwargs
+        classes = main.parse_subscriptions("interactive:4,bulk:1", "unused")
+        with (
+            patch.dict(sys.modules, modules),
+            patch.object(main, "JOB_CLASSES", classes),
+            patch.object(main, "PUBSUB_PREFETCH", 8),
+            patch.object(main, "process_pubsub_message", fake_process),
+        ):
+            with self.assertRaises(RuntimeError):
+                main.pubsub_consumer_loop()
+
+        self.assertEqual([path for path, _ in subscribed], ["interactive", "bulk"])
+        self.assertEqual(subscribed[0][1]["max_messages"], 8)
+        order = [job_id for job_id, _ in processed]
+        self.assertEqual(sorted(order[:3]), ["b0", "i0", "i1"])
+        self.assertEqual(processed[0], ("i0", "interactive"))
+        self.assertEqual([m.outcome for m in deliveries["bulk"] + deliveries["interactive"]], ["ack"] * 8)
+        self.assertEqual([(r["jobId"], r["status"]) for r in published], [("b1", "failed")])
+
+    def test_failure_results_carry_the_trace_id(self):
+        async def failing_process(data, attributes=None, publish_time=None, subscription=None):
+            raise RuntimeError("separation failed")
+
+        published = []
+        message = FakeMessage({"jobId": "j1", "releaseId": "rel", "trackId": "trk"})
+        message.attributes = {"traceId": "trace-1"}
+        with (
+            patch.dict(sys.modules, fake_pubsub_modules(published)),
+            patch.object(main, "process_pubsub_message", failing_process),
+        ):
+            main.handle_pubsub_message(message, "bulk")
+            self.assertTrue(main.publish_failure_result({"jobId": "j2"}, RuntimeError("x"), {"traceId": "trace-2"}))
+            self.assertTrue(main.publish_failure_result({"jobId": "j3"}, RuntimeError("x")))
+
+        self.assertEqual(message.outcome, "ack")
+        self.assertEqual([(r["jobId"], r["traceId"]) for r in published], [("j1", "trace-1"), ("j2", "trace-2"), ("j3", "j3")])
+
+    def test_job_estimate_uses_message_metadata_only(self):
+        with patch.object(main, "probe_duration", side_effect=AssertionError("probed in the callback")):
+            estimates = [
+                main.estimate_job_seconds(FakeMessage(data))
+                for data in (
+                    {"originalStemMeta": {"durationSeconds": 212.5}, "originalStemUri": "https://x/a.mp3"},
+                    {"originalStemUri": "https://x/a.mp3"},
+                    {"originalStemMeta": {"durationSeconds": "n/a"}},
+                )
+            ]
+
+        self.assertEqual(estimates, [212.5, None, None])
+
+    def test_low_scratch_space_nacks_without_a_failure_result(self):
+        published = []
+        message = FakeMessage({"jobId": "j1", "releaseId": "rel", "trackId": "trk", "originalStemUri": "x"})
+        with tempfile.TemporaryDirectory() as tmp:
+            with (
+                patch.dict(sys.modules, fake_pubsub_modules(published)),
+                patch.object(main, "SCRATCH", main.ScratchSpace(tmp, min_free_bytes=1 << 60)),
+            ):
+                main.handle_pubsub_message(message, "bulk")
+
+        self.assertEqual(message.outcome, "nack")
+        self.assertEqual(published, [])
+
+
+class JobTimingsTest(unittest.TestCase):
+    def test_result_carries_timings_and_trace_id_from_attributes(self):
+        from datetime import datetime, timedelta, timezone
+
+        published = []
+        callback_headers = []
+
+        async def fake_download(uri, dest):
+            pass
+
+        async def fake_submit(*args, **kwargs):
+            callback_headers.append(main.callback_headers())
+            return {"quarantined": False}
+
+        async def fake_separation(input_path, temp_dir, release_id, track_id, callback_url=None, checkpoint=None):
+            with worker_metrics.observe_phase("separation", "cpu"):
+                pass
+            return {"vocals": "rel/trk/vocals.mp3"}, {"vocals": None}, {}
+
+        trace = "0af7651916cd43dd8448eb211c80319c"
+        with (
+            patch.dict(sys.modules, fake_pubsub_modules(published)),
+            patch.object(main, "download_audio", fake_download),
+            patch.object(main, "JOB_CHECKPOINTS", False),
+            patch.object(main, "generate_fingerprint", return_value=(1.0, "AQAAAA==", "h")),
+            patch.object(main, "submit_fingerprint", fake_submit),
+            patch.object(main, "run_demucs_separation", fake_separation),
+            patch.object(main, "FINGERPRINT_INDEX_PATH", ""),
+        ):
+            asyncio.run(main.process_pubsub_message(
+                {
+                    "jobId": "job_1", "releaseId": "rel", "trackId": "trk",
+                    "originalStemUri": "x.mp3", "callbackUrl": "http://backend",
+                },
+                attributes={"traceparent": f"00-{trace}-b7ad6b7169203331-01"},
+                publish_time=datetime.now(timezone.utc) - timedelta(seconds=30),
+            ))
+
+        self.assertEqual(callback_headers[0]["x-trace-id"], trace)
+        self.assertIsNone(main.callback_headers().get("x-trace-id"))
+        result = published[0]
+        self.assertEqual(result["traceId"], trace)
+        timings = result["timings"]
+        self.assertGreaterEqual(timings["queueWaitSeconds"], 30)
+        self.assertEqual(
+            set(timings["phases"]), {"download", "fingerprint", "separation"}
+        )
+        self.assertEqual([a["device"] for a in timings["separationAttempts"]], ["cpu"])
+        self.assertEqual(result["resourceUsage"]["children"], [])
+
+    def test_child_usage_is_reported_per_job(self):
+        import subprocess
+
+        with tempfile.TemporaryDirectory() as tmp, worker_metrics.track_job() as timings:
+            command, report = main.with_usage_report([sys.executable, "-c", "pass"], tmp)
+            subprocess.run(command, check=True)
+            main.record_child_usage(report, "encode")
+            # Unresolvable commands stay unwrapped so FileNotFoundError still surfaces.
+            self.assertEqual(main.with_usage_report(["no-such-binary"], tmp), (["no-such-binary"], None))
+
+        usage = timings.resource_usage()
+        self.assertEqual([child["phase"] for child in usage["children"]], ["encode"])
+        self.assertEqual(usage["childPeakRssMb"], usage["children"][0]["maxRssMb"])
+        self.assertGreater(usage["childPeakRssMb"], 0)
+
+    def test_profiles_on_a_shared_loop_only_sample_the_jobs_threads(self):
+        import time
+
+        def spin(seconds):
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                sum(range(1000))
+
+        def job_blocking_work():
+            spin(0.15)
+
+        def other_jobs_loop_work():
+            spin(0.15)
+
+        async def run():
+            with main.profile_job("rel", "trk", shared_loop=True):
+                await main.run_blocking(job_blocking_work)
+                other_jobs_loop_work()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with (
+                patch.object(main, "JOB_PROFILE", True),
+                patch.object(main, "JOB_PROFILE_INTERVAL_MS", 2),
+                patch.object(main, "STORAGE_MODE", "local"),
+                patch.object(main, "OUTPUT_BASE_DIR", Path(tmp)),
+            ):
+                asyncio.run(run())
+            profile = (Path(tmp) / "rel" / "trk" / "profile.folded").read_text()
+
+        self.assertIn("job_blocking_work", profile)
+        self.assertNotIn("other_jobs_loop_work", profile)
+
+    def test_trace_id_falls_back_to_job_id(self):
+        self.assertEqual(main.trace_id_from_attributes({"traceId": "t-1"}, "job"), "t-1")
+        self.assertEqual(main.trace_id_from_attributes({"traceparent": "bogus"}, "job"), "job")
+        self.assertEqual(main.trace_id_from_attributes(None, "job"), "job")
+
+
+class JobCheckpointTest(unittest.TestCase):
+    def test_redelivered_job_resumes_without_fingerprint_or_demucs(self):
+        published = []
+        attempts = []
+
+        async def fake_download(uri, dest):
+            Path(dest).write_bytes(b"same source audio")
+
+        async def fake_run_demucs_attempt(input_path, temp_dir, device, release_id, track_id, callback_url=None):
+            attempts.append(device)
+            attempt_output_dir = Path(temp_dir) / f"demucs-{device}"
+            demucs_output = attempt_output_dir / main.DEMUCS_MODEL / input_path.stem
+            demucs_output.mkdir(parents=True)
+            (demucs_output / "vocals.wav").write_bytes(b"fake separated stem")
+            return 0, "", attempt_output_dir
+
+        class FakeFfmpegProcess:
+            returncode = 0
+
+            async def communicate(self):
+                return b"", b""
+
+        async def fake_create_subprocess_exec(*args, **kwargs):
+            Path(args[-1]).write_bytes(b"fake mp3")
+            return FakeFfmpegProcess()
+
+        message = {"jobId": "job_resume", "releaseId": "rel", "trackId": "trk", "originalStemUri": "x.wav"}
+        with (
+            tempfile.TemporaryDirectory() as output_dir,
+            patch.dict(sys.modules, fake_pubsub_modules(published, fail_publishes=1)),
+            patch.object(main, "STORAGE_MODE", "local"),
+            patch.object(main, "OUTPUT_BASE_DIR", Path(output_dir)),
+            patch.object(main, "JOB_CHECKPOINTS", True),
+            patch.object(main, "WAVEFORM_PEAKS", False),
+            patch.object(main, "FINGERPRINT_INDEX_PATH", ""),
+            patch.object(main, "download_audio", fake_download),
+            patch.object(main, "generate_fingerprint", return_value=(1.0, "AQAAAA==", "h")) as fingerprint,
+            patch.object(main, "demucs_devices_to_try", return_value=["cpu"]),
+            patch.object(main, "run_demucs_attempt", fake_run_demucs_attempt),
+            patch.object(main.asyncio, "create_subprocess_exec", fake_create_subprocess_exec),
+        ):
+            with self.assertRaises(RuntimeError):
+                asyncio.run(main.process_pubsub_message(dict(message)))
+            asyncio.run(main.process_pubsub_message(dict(message)))
+
+        self.assertEqual(attempts, ["cpu"])
+        self.assertEqual(fingerprint.call_count, 1)
+        self.assertEqual(len(published), 1)
+        self.assertEqual(published[0]["status"], "completed")
+        self.assertEqual(published[0]["stems"], {"vocals": "rel/trk/vocals.mp3"})
+
+    def test_failed_fingerprint_submission_is_retried_on_redelivery(self):
+        published = []
+        verdicts = [None, {"quarantined": True, "reason": "duplicate"}]
+        submissions = []
+
+        async def fake_download(uri, dest):
+            Path(dest).write_bytes(b"same source audio")
+
+        async def fake_submit(*args, **kwargs):
+            submissions.append(args[2])
+            return verdicts[len(submissions) - 1]
+
+        async def fake_separation(input_path, temp_dir, release_id, track_id, callback_url=None, checkpoint=None):
+            return {"vocals": "rel/trk/vocals.mp3"}, {"vocals": None}, {}
+
+        message = {
+            "jobId": "job_fp", "releaseId": "rel", "trackId": "trk",
+            "originalStemUri": "x.wav", "callbackUrl": "http://backend",
+        }
+        with (
+            tempfile.TemporaryDirectory() as output_dir,
+            patch.dict(sys.modules, fake_pubsub_modules(published, fail_publishes=1)),
+            patch.object(main, "STORAGE_MODE", "local"),
+            patch.object(main, "OUTPUT_BASE_DIR", Path(output_dir)),
+            patch.object(main, "JOB_CHECKPOINTS", True),
+            patch.object(main, "FINGERPRINT_INDEX_PATH", ""),
+            patch.object(main, "download_audio", fake_download),
+            patch.object(main, "generate_fingerprint", return_value=(1.0, "AQAAAA==", "h")),
+            patch.object(main, "submit_fingerprint", fake_submit),
+            patch.object(main, "run_demucs_separation", fake_separation),
+        ):
+            # Backend down: separation goes ahead, but the publish fails too.
+            with self.assertRaises(RuntimeError):
+                asyncio.run(main.process_pubsub_message(dict(message)))
+            # Redelivery asks the backend again instead of trusting the fallback.
+            status = asyncio.run(main._process_pubsub_message(dict(message), worker_metrics.JobTimings()))
+
+        self.assertEqual(submissions, ["trk", "trk"])
+        self.assertEqual(status, "quarantined")
+        self.assertEqual(published[-1]["status"], "quarantined")
+
+    def test_stems_stored_before_a_crash_are_not_re_encoded(self):
+        from job_checkpoint import JobCheckpoint, LocalCheckpointStore
+
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = JobCheckpoint("job", "ab" * 32, LocalCheckpointStore(Path(tmp) / "ck"))
+            checkpoint.complete_stem("vocals", {
+                "uri": "rel/trk/vocals.mp3", "features": None, "peaks": "rel/trk/vocals.peaks", "renditions": None,
+            })
+            encoded = []
+
+            async def fake_run_demucs_attempt(input_path, temp_dir, device, release_id, track_id, callback_url=None):
+                attempt_output_dir = Path(temp_dir) / f"demucs-{device}"
+                demucs_output = attempt_output_dir / main.DEMUCS_MODEL / input_path.stem
+                demucs_output.mkdir(parents=True)
+                for stem in ("vocals.wav", "drums.wav"):
+                    (demucs_output / stem).write_bytes(b"fake separated stem")
+                return 0, "", attempt_output_dir
+
+            class FakeFfmpegProcess:
+                returncode = 0
+
+                async def communicate(self):
+                    return b"", b""
+
+            async def fake_create_subprocess_exec(*args, **kwargs):
+                encoded.append(Path(args[-1]).name)
+                Path(args[-1]).write_bytes(b"fake mp3")
+                return FakeFfmpegProcess()
+
+            input_path = Path(tmp) / "track.wav"
+            input_path.write_bytes(b"fake wav")
+            with (
+                patch.object(main, "STORAGE_MODE", "local"),
+                patch.object(main, "OUTPUT_BASE_DIR", Path(tmp) / "outputs"),
+                patch.object(main, "WAVEFORM_PEAKS", False),
+                patch.object(main, "demucs_devices_to_try", return_value=["cpu"]),
+                patch.object(main, "run_demucs_attempt", fake_run_demucs_attempt),
+                patch.object(main.asyncio, "create_subprocess_exec", fake_create_subprocess_exec),
+            ):
+                results, _, artifacts = asyncio.run(main.run_demucs_separation(
+                    input_path, tmp, "rel", "trk", checkpoint=checkpoint,
+                ))
+
+            self.assertEqual(encoded, ["drums.mp3"])
+            self.assertEqual(results, {"vocals": "rel/trk/vocals.mp3", "drums": "rel/trk/drums.mp3"})
+            self.assertEqual(artifacts["stemPeaks"], {"vocals": "rel/trk/vocals.peaks"})
+            reloaded = JobCheckpoint("job", "ab" * 32, LocalCheckpointStore(Path(tmp) / "ck"))
+            self.assertTrue(reloaded.resumed)
+            self.assertEqual(reloaded.get("separation")["stems"], results)
+
+
+class StemArchiveTest(unittest.TestCase):
+    def test_archived_flacs_rebuild_stems_without_demucs(self):
+        import hashlib
+
+        encoded = []
+
+        async def fake_run_demucs_attempt(input_path, temp_dir, device, release_id, track_id, callback_url=None):
+            attempt_output_dir = Path(temp_dir) / f"demucs-{device}"
+            demucs_output = attempt_output_dir / main.DEMUCS_MODEL / input_path.stem
+            demucs_output.mkdir(parents=True)
+            (demucs_output / "vocals.wav").write_bytes(b"fake separated stem")
+            return 0, "", attempt_output_dir
+
+        class FakeFfmpegProcess:
+            returncode = 0
+
+            async def communicate(self):
+                return b"", b""
+
+        async def fake_create_subprocess_exec(*args, **kwargs):
+            encoded.append(args)
+            for arg in args:
+                if str(arg).endswith(".flac") and arg != args[args.index("-i") + 1]:
+                    Path(arg).write_bytes(b"lossless vocals")
+            Path(args[-1]).write_bytes(b"fake mp3")
+            return FakeFfmpegProcess()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = Path(tmp) / "track.wav"
+            input_path.write_bytes(b"fake wav")
+            with (
+                patch.object(main, "STORAGE_MODE", "local"),
+                patch.object(main, "OUTPUT_BASE_DIR", Path(tmp) / "outputs"),
+                patch.object(main, "WAVEFORM_PEAKS", False),
+                patch.object(main, "STEM_ARCHIVE", True),
+                patch.object(main, "demucs_devices_to_try", return_value=["cpu"]),
+                patch.object(main, "run_demucs_attempt", fake_run_demucs_attempt),
+                patch.object(main.asyncio, "create_subprocess_exec", fake_create_subprocess_exec),
+            ):
+                _, _, artifacts = asyncio.run(main.run_demucs_separation(input_path, tmp, "rel", "trk"))
+                archive = artifacts["stemArchive"]
+
+                sha256 = hashlib.sha256(b"lossless vocals").hexdigest()
+                self.assertEqual(archive, {
+                    "vocals": {"uri": f"archive/{sha256}.flac", "sha256": sha256, "format": "flac"},
+                })
+                self.assertTrue((Path(tmp) / "outputs" / "archive" / f"{sha256}.flac").exists())
+
+                with (
+                    patch.object(main, "run_demucs_attempt", side_effect=AssertionError("no Demucs")),
+                    tempfile.TemporaryDirectory() as rebuild_dir,
+                ):
+                    results, _, rebuilt = asyncio.run(
+                        main.rebuild_from_archive(archive, "rel", "trk", rebuild_dir)
+                    )
+                self.assertEqual(results, {"vocals": "rel/trk/vocals.mp3"})
+                self.assertEqual(rebuilt["stemArchive"], archive)
+                # The rebuild encodes from the FLAC and does not archive it again.
+                self.assertTrue(str(encoded[-1][encoded[-1].index("-i") + 1]).endswith("vocals.flac"))
+                self.assertNotIn("flac", encoded[-1][encoded[-1].index("-i") + 2:])
+
+                tampered = {"vocals": {**archive["vocals"], "sha256": "0" * 64}}
+                with tempfile.TemporaryDirectory() as rebuild_dir, self.assertRaises(ValueError):
+                    asyncio.run(main.rebuild_from_archive(tampered, "rel", "trk", rebuild_dir))
+
+
+class FakeBucket:
+    """In-memory stand-in for a google.cloud.storage bucket."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = []
+        self.clock = 0
+
+    def blob(self, name):
+        return self.objects.get(name) or FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return self.objects.get(name)
+
+    def list_blobs(self, prefix=""):
+        return [blob for name, blob in sorted(self.objects.items()) if name.startswith(prefix)]
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.cache_control = None
+        self.generation = 0
+        self.updated = 0
+
+    def exists(self):
+        return self.name in self.bucket.objects
+
+    def _touch(self):
+        self.bucket.clock += 1
+        self.updated = self.bucket.clock
+
+    def upload_from_filename(self, filename, content_type=None):
+        self.bucket.uploads.append((self.name, content_type, self.cache_control))
+        self.bucket.objects[self.name] = self
+        self.generation += 1
+        self._touch()
+
+    def patch(self):
+        self._touch()
+
+
+class ContentKeyedStemsTest(unittest.TestCase):
+    def setUp(self):
+        self.bucket = FakeBucket()
+        client = types.SimpleNamespace(bucket=lambda name: self.bucket)
+        self.patches = [
+            patch.object(main, "STORAGE_MODE", "gcs"),
+            patch.object(main, "GCS_BUCKET", "stems-bucket"),
+            patch.object(main, "STEM_CONTENT_KEYS", True),
+            patch.object(main, "get_gcs_client", return_value=client),
+        ]
+        for active in self.patches:
+            active.start()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        for active in reversed(self.patches):
+            active.stop()
+        self.tmp.cleanup()
+
+    def stem(self, content: bytes, name: str = "vocals.mp3") -> Path:
+        path = Path(self.tmp.name) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        return path
+
+    def test_unchanged_stems_are_not_uploaded_again(self):
+        import hashlib
+
+        digest = hashlib.sha256(b"take 1").hexdigest()[:16]
+        hits = worker_metrics.CACHE_LOOKUPS.get(cache="stem", result="hit")
+
+        first = main.store_stem_file(self.stem(b"take 1"), "rel", "trk")
+        again = main.store_stem_file(self.stem(b"take 1"), "rel", "trk")
+        changed = main.store_stem_file(self.stem(b"take 2"), "rel", "trk")
+
+        self.assertEqual(first, f"https://storage.googleapis.com/stems-bucket/stems/rel/trk/vocals.{digest}.mp3")
+        self.assertEqual(again, first)
+        self.assertNotEqual(changed, first)
+        self.assertEqual(
+            [(name, cache_control) for name, _, cache_control in self.bucket.uploads],
+            [(f"stems/rel/trk/vocals.{digest}.mp3", main.IMMUTABLE_CACHE_CONTROL),
+             (changed.split("stems-bucket/")[1], main.IMMUTABLE_CACHE_CONTROL)],
+        )
+        self.assertEqual(worker_metrics.CACHE_LOOKUPS.get(cache="stem", result="hit"), hits + 1)
+
+    def test_hls_renditions_keep_plain_keys(self):
+        uri = main.store_stem_file(
+            self.stem(b"#EXTM3U", "vocals_hls/index.m3u8"), "rel", "trk",
+            content_type="application/vnd.apple.mpegurl", name="vocals_hls/index.m3u8",
+        )
+
+        self.assertTrue(uri.endswith("stems/rel/trk/vocals_hls/index.m3u8"))
+        self.assertEqual(self.bucket.uploads[0][2], None)
+
+    def test_mixes_use_the_most_recently_stored_stem(self):
+        take_1 = main.store_stem_file(self.stem(b"take 1"), "rel", "trk")
+        main.store_stem_file(self.stem(b"take 2"), "rel", "trk")
+        # Re-separating back to take 1 makes it current again without an upload.
+        main.store_stem_file(self.stem(b"take 1"), "rel", "trk")
+        with patch.object(main, "STEM_CONTENT_KEYS", False):
+            main.store_stem_file(self.stem(b"legacy"), "rel", "trk", name="bass.mp3")
+
+        sources = main.mix_sources("rel", "trk", {"vocals": 0, "bass": 0}, {})
+
+        self.assertEqual(len(self.bucket.uploads), 3)
+        self.assertEqual(sources["vocals"][0].name, take_1.split("stems-bucket/")[1])
+        self.assertEqual(sources["vocals"][1], take_1.rsplit(".", 2)[1])
+        self.assertEqual(sources["bass"][0].name, "stems/rel/trk/bass.mp3")
+        with self.assertRaises(FileNotFoundError):
+            main.mix_sources("rel", "trk", {"drums": 0}, {})
+
+
+class MixEndpointTest(unittest.TestCase):
+    def test_mix_is_rendered_once_then_served_from_cache(self):
+        from fastapi.testclient import TestClient
+
+        commands = []
+
+        class FakeFfmpegProcess:
+            returncode = 0
+
+            async def communicate(self):
+                return b"", b""
+
+        async def fake_create_subprocess_exec(*args, **kwargs):
+            commands.append(args)
+            Path(args[-1]).write_bytes(b"decoded or encoded audio")
+            return FakeFfmpegProcess()
+
+        def fake_mix_raw(sources, gains, raw_dest):
+            self.assertEqual(sorted(sources), ["bass", "drums"])
+            raw_dest.write_bytes(b"mixed")
+            return {"frames": 1, "peak": 0.5, "clippedSamples": 0}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            outputs = Path(tmp) / "outputs"
+            (outputs / "rel" / "trk").mkdir(parents=True)
+            for stem in ("drums", "bass"):
+                (outputs / "rel" / "trk" / f"{stem}.mp3").write_bytes(b"stored mp3")
+            with (
+                patch.object(main, "STORAGE_MODE", "local"),
+                patch.object(main, "OUTPUT_BASE_DIR", outputs),
+                patch.object(main, "mix_raw", fake_mix_raw),
+                patch.object(main.asyncio, "create_subprocess_exec", fake_create_subprocess_exec),
+            ):
+                client = TestClient(main.app)
+                first = client.post("/mix/rel/trk", json={"stems": {"drums": 0, "bass": -3}})
+                again = client.post("/mix/rel/trk", json={"stems": {"bass": -3.0, "drums": 0.0}})
+                unknown = client.post("/mix/rel/trk", json={"stems": ["kazoo"]})
+                # No basename fallback: another track's drums.mp3 is not this one's.
+                (outputs / "drums.mp3").write_bytes(b"unrelated")
+                missing = client.post("/mix/rel/other", json={"stems": ["drums"]})
+                # A re-separated stem invalidates mixes rendered from the old one.
+                (outputs / "rel" / "trk" / "bass.mp3").write_bytes(b"re-separated mp3")
+                stale = client.post("/mix/rel/trk", json={"stems": {"drums": 0, "bass": -3}})
+                renders_before_rejections = len(commands)
+                outside = client.post("/mix/rel/trk", json={
+                    "stems": ["vocals"],
+                    "stemArchive": {"vocals": {"uri": "/etc/passwd", "sha256": "0" * 64}},
+                })
+                ssrf = client.post("/mix/rel/trk", json={
+                    "stems": ["vocals"],
+                    "stemArchive": {"vocals": {"uri": "http://169.254.169.254/", "sha256": "0" * 64}},
+                })
+                escaped = client.post("/mix/../trk", json={"stems": ["drums"]})
+                dotdot = client.post("/mix/%2E%2E/trk", json={"stems": ["drums"]})
+
+            self.assertEqual(first.status_code, 200)
+            self.assertFalse(first.json()["cached"])
+            self.assertTrue(first.json()["uri"].startswith("mixes/"))
+            self.assertTrue((outputs / first.json()["uri"]).exists())
+            self.assertEqual(again.json()["uri"], first.json()["uri"])
+            self.assertTrue(again.json()["cached"])
+            self.assertEqual(unknown.status_code, 400)
+            self.assertEqual(missing.status_code, 404)
+            self.assertFalse(stale.json()["cached"])
+            self.assertNotEqual(stale.json()["uri"], first.json()["uri"])
+            # Two decodes and one encode per render; nothing for rejected requests.
+            self.assertEqual(len(commands), 6)
+            self.assertEqual(renders_before_rejections, 6)
+            self.assertEqual(outside.status_code, 400)
+            self.assertEqual(ssrf.status_code, 400)
+            self.assertNotEqual(escaped.status_code, 200)
+            self.assertEqual(dotdot.status_code, 400)
+
+    def test_archived_sources_must_match_their_hash(self):
+        import hashlib
+
+        async def fake_create_subprocess_exec(*args, **kwargs):
+            raise AssertionError("a tampered archive must not be decoded")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            outputs = Path(tmp) / "outputs"
+            claimed = hashlib.sha256(b"original flac").hexdigest()
+            (outputs / "archive").mkdir(parents=True)
+            (outputs / "archive" / f"{claimed}.flac").write_bytes(b"tampered flac")
+            with (
+                patch.object(main, "STORAGE_MODE", "local"),
+                patch.object(main, "OUTPUT_BASE_DIR", outputs),
+                patch.object(main.asyncio, "create_subprocess_exec", fake_create_subprocess_exec),
+            ):
+                from fastapi.testclient import TestClient
+
+                response = TestClient(main.app).post("/mix/rel/trk", json={
+                    "stems": ["vocals"],
+                    "stemArchive": {"vocals": {"uri": f"archive/{claimed}.flac", "sha256": claimed}},
+                })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("does not match", response.json()["detail"])
+
+    def test_storage_round_trips_run_off_the_event_loop(self):
+        import threading
+
+        threads = {}
+
+        def fake_sources(release_id, track_id, gains, stem_archive):
+            threads["sources"] = threading.get_ident()
+            return {"drums": (Path("drums.mp3"), "v1", None)}
+
+        class FakeCache:
+            def get(self, key):
+                threads["get"] = threading.get_ident()
+                return "mixes/cached.mp3"
+
+        def fake_mix_cache():
+            threads["cache"] = threading.get_ident()
+            return FakeCache()
+
+        async def run():
+            threads["loop"] = threading.get_ident()
+            return await main.render_mix("rel", "trk", {"drums": 0.0})
+
+        with patch.object(main, "mix_sources", fake_sources), patch.object(main, "mix_cache", fake_mix_cache):
+            self.assertEqual(asyncio.run(run()), ("mixes/cached.mp3", True))
+
+        for step in ("sources", "cache", "get"):
+            self.assertNotEqual(threads[step], threads["loop"], step)
+
+
+class AnalyzeBatchTest(unittest.TestCase):
+    def test_streams_one_line_per_stem_with_per_item_errors(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        from fastapi.testclient import TestClient
+
+        def fake_extract(path):
+            if Path(path).read_bytes() == b"corrupt":
+                raise ValueError("not audio")
+            return {"schemaVersion": "stem-audio-features/v2", "source": Path(path).name}
+
+        with tempfile.TemporaryDirectory() as tmp, ThreadPoolExecutor(2) as pool:
+            outputs = Path(tmp) / "outputs"
+            (outputs / "rel" / "trk").mkdir(parents=True)
+            (outputs / "rel" / "trk" / "vocals.mp3").write_bytes(b"mp3")
+            (outputs / "rel" / "trk" / "bass.mp3").write_bytes(b"corrupt")
+            (Path(tmp) / "secret.mp3").write_bytes(b"mp3")
+            with (
+                patch.object(main, "OUTPUT_BASE_DIR", outputs),
+                patch.object(main, "GCS_BUCKET", "stems-bucket"),
+                patch.object(main, "analysis_pool", return_value=pool),
+                patch.object(main, "extract_stem_features", fake_extract),
+            ):
+                client = TestClient(main.app)
+                response = client.post("/analyze/batch", json={"stems": [
+                    "rel/trk/vocals.mp3",
+                    {"id": "trk/bass", "uri": "rel/trk/bass.mp3"},
+                    str(outputs / "rel" / "trk" / "vocals.mp3"),
+                    "../secret.mp3",
+                    "rel/trk/missing.mp3",
+                    "https://attacker.example/vocals.mp3",
+                    "gs://someone-elses-bucket/vocals.mp3",
+                ]})
+                empty = client.post("/analyze/batch", json={"stems": []})
+                with patch.object(main, "ANALYZE_BATCH_MAX_STEMS", 1):
+                    too_many = client.post("/analyze/batch", json={"stems": ["a", "b"]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+        records = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda r: r["index"])
+        self.assertEqual([r["index"] for r in records], list(range(7)))
+        self.assertEqual(
+            [r["status"] for r in records],
+            ["success", "failed", "success", "failed", "failed", "failed", "failed"],
+        )
+        self.assertEqual(records[0]["features"]["source"], "vocals.mp3")
+        self.assertEqual(records[1]["id"], "trk/bass")
+        self.assertIn("not audio", records[1]["error"])
+        self.assertIn("outside", records[3]["error"])
+        self.assertIn("unsupported", records[5]["error"])
+        self.assertIn("buckets", records[6]["error"])
+        self.assertEqual(empty.status_code, 400)
+        self.assertEqual(too_many.status_code, 400)
+
+
+class FeatureCacheEndpointTest(unittest.TestCase):
+    def test_repeated_analysis_of_the_same_audio_costs_one_extraction(self):
+        from fastapi.testclient import TestClient
+
+        calls = []
+
+        def fake_extract(path):
+            calls.append(Path(path).read_bytes())
+            return {"schemaVersion": "stem-audio-features/v2", "tempoBpm": 100.0 + len(calls)}
+
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            patch.object(main, "FEATURE_CACHE_MAX_MB", 1),
+            patch.object(main, "FEATURE_CACHE_DIR", Path(tmp) / "features"),
+            patch.object(main, "_feature_cache", None),
+            patch.object(main, "extract_stem_features", fake_extract),
+        ):
+            client = TestClient(main.app)
+            hits_before = worker_metrics.CACHE_LOOKUPS.get(cache="features", result="hit")
+            bodies = [
+                client.post("/analyze", files={"file": (name, content, "audio/wav")}).json()
+                for name, content in (("a.wav", b"take one"), ("retry.wav", b"take one"), ("b.wav", b"take two"))
+            ]
+
+        self.assertEqual(calls, [b"take one", b"take two"])
+        self.assertEqual([b["features"]["tempoBpm"] for b in bodies], [101.0, 101.0, 102.0])
+        self.assertEqual(worker_metrics.CACHE_LOOKUPS.get(cache="features", result="hit"), hits_before + 1)
+
+    def test_features_cut_short_by_the_deadline_are_not_cached(self):
+        from fastapi.testclient import TestClient
+
+        calls = []
+
+        def fake_extract(path):
+            calls.append(path)
+            return {"schemaVersion": "stem-audio-features/v2", "tempoBpm": None, "skippedFields": ["tempoBpm"]}
+
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            patch.object(main, "FEATURE_CACHE_MAX_MB", 1),
+            patch.object(main, "FEATURE_CACHE_DIR", Path(tmp) / "features"),
+            patch.object(main, "_feature_cache", None),
+            patch.object(main, "extract_stem_features", fake_extract),
+        ):
+            client = TestClient(main.app)
+            for _ in range(2):
+                body = client.post("/analyze", files={"file": ("a.wav", b"slow", "audio/wav")}).json()
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(body["features"]["skippedFields"], ["tempoBpm"])
+
+
+class HttpJobsEndpointTest(unittest.TestCase):
+    def test_job_is_accepted_then_streams_progress_and_result(self):
+        from fastapi.testclient import TestClient
+
+        async def fake_separation(input_path, temp_dir, release_id, track_id, callback_url=None):
+            self.assertEqual(input_path.read_bytes(), b"fake audio")
+            # Hold the job until the first events client is listening.
+            while len(queue.jobs) == 1 and not next(iter(queue.jobs.values()))._subscribers:
+                await asyncio.sleep(0.01)
+            main._progress_listener.get()(55)
+            return {"vocals": "rel/trk/vocals.mp3"}, {"vocals": None}, {}
+
+        queue = main.JobQueue(main.run_http_job, workers=1, max_queued=2)
+        with (
+            patch.object(main, "PROCESSING_MODE", "http"),
+            patch.object(main, "HTTP_JOBS", queue),
+            patch.object(main, "run_demucs_separation", fake_separation),
+            TestClient(main.app) as client,
+        ):
+            accepted = client.post("/jobs/separate/rel/trk", files={"file": ("t.wav", b"fake audio")})
+            self.assertEqual(accepted.status_code, 202)
+            job_id = accepted.json()["jobId"]
+
+            with client.stream("GET", f"/jobs/{job_id}/events") as events:
+                self.assertTrue(events.headers["content-type"].startswith("text/event-stream"))
+                body = "".join(events.iter_text())
+            status = client.get(f"/jobs/{job_id}").json()
+            sync = client.post("/separate/rel/trk", files={"file": ("t.wav", b"fake audio")})
+            unknown = client.get("/jobs/nope")
+
+        self.assertIn('event: progress\ndata: {"jobId":"%s","progress":55}' % job_id, body)
+        self.assertIn('"status":"completed"', body)
+        self.assertEqual(status["status"], "completed")
+        self.assertEqual(status["result"]["stems"], {"vocals": "rel/trk/vocals.mp3"})
+        self.assertEqual(sync.status_code, 200)
+        self.assertEqual(sync.json()["stems"], {"vocals": "rel/trk/vocals.mp3"})
+        self.assertEqual(unknown.status_code, 404)
+
+    def test_full_queue_is_rejected_with_retry_after(self):
+        from fastapi.testclient import TestClient
+
+        queue = main.JobQueue(main.run_http_job, workers=1, max_queued=1)
+        with (
+            patch.object(main, "PROCESSING_MODE", "http"),
+            patch.object(main, "HTTP_JOBS", queue),
+            patch.object(queue, "submit", side_effect=main.QueueFull("1 jobs already waiting")),
+            TestClient(main.app) as client,
+        ):
+            response = client.post("/jobs/separate/rel/trk", files={"file": ("t.wav", b"fake audio")})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["retry-after"], "30")
+
+    def test_low_scratch_space_is_rejected_before_saving_the_upload(self):
+        from fastapi.testclient import TestClient
+
+        with tempfile.TemporaryDirectory() as tmp:
+            scratch = main.ScratchSpace(tmp, min_free_bytes=1 << 60)
+            refusals = worker_metrics.SCRATCH_REFUSALS.get(source="http")
+            with (
+                patch.object(main, "PROCESSING_MODE", "http"),
+                patch.object(main, "SCRATCH", scratch),
+                TestClient(main.app) as client,
+            ):
+                response = client.post("/jobs/separate/rel/trk", files={"file": ("t.wav", b"fake audio")})
+
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers["retry-after"], "60")
+            self.assertEqual(os.listdir(tmp), [])
+            self.assertEqual(worker_metrics.SCRATCH_REFUSALS.get(source="http"), refusals + 1)
+
+    def test_blocking_stem_work_runs_off_the_event_loop(self):
+        import threading
+
+        threads = {}
+
+        class FakeFfmpegProcess:
+            returncode = 0
+
+            async def communicate(self):
+                return b"", b""
+
+        async def fake_create_subprocess_exec(*args, **kwargs):
+            Path(args[-1]).write_bytes(b"fake mp3")
+            return FakeFfmpegProcess()
+
+        def fake_features(path):
+            threads["features"] = threading.get_ident()
+            return {}
+
+        def fake_store(local_path, release_id, track_id, content_type="audio/mpeg", name=None):
+            threads["store"] = threading.get_ident()
+            return f"{release_id}/{track_id}/{local_path.name}"
+
+        async def run():
+            threads["loop"] = threading.get_ident()
+            with tempfile.TemporaryDirectory() as tmp:
+                wav = Path(tmp) / "vocals.wav"
+                wav.write_bytes(b"fake wav")
+                return await main.encode_and_store_stems({"vocals": wav}, tmp, "rel", "trk")
+
+        with (
+            patch.object(main, "STORAGE_MODE", "gcs"),
+            patch.object(main, "WAVEFORM_PEAKS", False),
+            patch.object(main, "extract_stem_features", fake_features),
+            patch.object(main, "store_stem_file", fake_store),
+            patch.object(main.asyncio, "create_subprocess_exec", fake_create_subprocess_exec),
+        ):
+            results, _, _ = asyncio.run(run())
+
+        self.assertEqual(results, {"vocals": "rel/trk/vocals.mp3"})
+        self.assertNotEqual(threads["features"], threads["loop"])
+        self.assertNotEqual(threads["store"], threads["loop"])
+
+
+class MetricsEndpointTest(unittest.TestCase):
+    def test_metrics_endpoint_serves_prometheus_text(self):
+        from fastapi.testclient import TestClient
+
+        worker_metrics.CPU_FALLBACKS.inc(from_device="cuda")
+        response = TestClient(main.app).get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertIn("# TYPE demucs_worker_phase_seconds histogram", response.text)
+        self.assertIn('demucs_worker_cpu_fallbacks_total{from_device="cuda"}', response.text)
+        self.assertIn("# TYPE demucs_worker_jobs_in_flight gauge", response.text)
+
+
 if __name__ == "__main__":
     unittest.main()
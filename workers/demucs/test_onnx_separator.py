@@ -0,0 +1,174 @@
+"""Tests for the ONNX Runtime separation backend.
+
+The ONNX session is faked, so these cover chunking, overlap-add and the
+Demucs-compatible output layout without Torch, a model export or ffmpeg.
+Requires numpy + soundfile from the worker requirements. The export
+helpers are checked against Torch and HTDemucs when those are installed.
+"""
+
+import copy
+import importlib.util
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import soundfile as sf
+
+import onnx_separator
+
+HAS_TORCH = importlib.util.find_spec("torch") is not None
+HAS_DEMUCS = HAS_TORCH and importlib.util.find_spec("demucs") is not None
+
+
+class _Input:
+    name = "mix"
+
+
+class FakeSession:
+    """Splits the mix into two equal 'sources' per segment."""
+
+    def __init__(self, segment: int):
+        self.segment = segment
+        self.calls = 0
+        self.chunks = []
+
+    def get_inputs(self):
+        return [_Input()]
+
+    def run(self, output_names, feeds):
+        chunk = feeds["mix"]
+        assert chunk.shape[-1] == self.segment
+        self.calls += 1
+        self.chunks.append(chunk[0].copy())
+        return [np.stack([chunk * 0.5, chunk * 0.5], axis=1)]
+
+
+class SeparateArrayTest(unittest.TestCase):
+    def test_overlap_add_reconstructs_mix(self):
+        rng = np.random.default_rng(26)
+        mix = rng.standard_normal((2, 10_000)).astype(np.float32) * 0.1 + 0.02
+        session = FakeSession(segment=4_000)
+        progress = []
+
+        sources = onnx_separator.separate_array(session, mix, 4_000, progress=progress.append)
+
+        self.assertEqual(sources.shape, (2, 2, 10_000))
+        # Each source is de-normalized independently, as in demucs.separate.
+        mean = mix.mean(axis=0).mean()
+        np.testing.assert_allclose(sources[0], 0.5 * (mix - mean) + mean, atol=1e-4)
+        # stride = 0.75 * segment → offsets 0, 3000, 6000, 9000
+        self.assertEqual(session.calls, 4)
+        self.assertEqual(progress[-1], 100)
+
+    def test_short_input_is_zero_padded_to_one_segment(self):
+        mix = np.ones((2, 100), dtype=np.float32)
+        sources = onnx_separator.separate_array(FakeSession(segment=1_000), mix, 1_000)
+        self.assertEqual(sources.shape, (2, 2, 100))
+
+
+    def test_last_chunk_is_centred_with_context_like_demucs_apply(self):
+        mix = np.arange(1, 2 * 5_000 + 1, dtype=np.float32).reshape(2, 5_000)
+        session = FakeSession(segment=2_000)
+        onnx_separator.separate_array(session, mix, 2_000)
+
+        # offsets 0, 1500, 3000, 4500: the last has 500 valid samples, so it
+        # starts 750 samples early and only its tail is zero-padded.
+        last = session.chunks[-1]
+        normalized = (mix - mix.mean(axis=0).mean()) / mix.mean(axis=0).std()
+        np.testing.assert_allclose(last[:, :1_250], normalized[:, 3_750:], rtol=1e-6)
+        self.assertTrue((last[:, 1_250:] == 0).all())
+
+        chunk, valid, trim = onnx_separator._padded_chunk(mix, 4_500, 2_000)
+        self.assertEqual((valid, trim), (500, 750))
+        np.testing.assert_array_equal(chunk[:, trim: trim + valid], mix[:, 4_500:])
+
+
+@unittest.skipUnless(HAS_TORCH, "torch is only installed where the ONNX graph is exported")
+class ExportParityTest(unittest.TestCase):
+    """The real-valued DFT helpers must match Torch's complex STFT."""
+
+    def setUp(self):
+        import torch
+
+        torch.manual_seed(26)
+        self.torch = torch
+
+    def test_real_spectro_matches_torch_stft(self):
+        torch = self.torch
+        x = torch.randn(2, 3, 8_192)
+        n_fft, hop = 1_024, 256
+        expected = torch.stft(
+            x.reshape(-1, 8_192), n_fft, hop, window=torch.hann_window(n_fft), win_length=n_fft,
+            normalized=True, center=True, return_complex=True, pad_mode="reflect",
+        )
+        actual = onnx_separator._real_spectro(x, n_fft, hop)
+        torch.testing.assert_close(
+            actual, torch.view_as_real(expected).reshape(2, 3, *expected.shape[1:], 2),
+            atol=1e-4, rtol=1e-4,
+        )
+
+    def test_real_ispectro_matches_torch_istft(self):
+        torch = self.torch
+        n_fft, hop, length = 1_024, 256, 8_000
+        z = torch.stft(
+            torch.randn(4, length), n_fft, hop, window=torch.hann_window(n_fft), win_length=n_fft,
+            normalized=True, center=True, return_complex=True, pad_mode="reflect",
+        )
+        expected = torch.istft(
+            z, n_fft, hop, window=torch.hann_window(n_fft), win_length=n_fft,
+            normalized=True, center=True, length=length,
+        )
+        actual = onnx_separator._real_ispectro(torch.view_as_real(z), hop, length)
+        torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+
+    @unittest.skipUnless(HAS_DEMUCS, "demucs is only installed where the ONNX graph is exported")
+    def test_exportable_model_matches_htdemucs(self):
+        torch = self.torch
+        from demucs.htdemucs import HTDemucs
+
+        model = HTDemucs(["drums", "bass"], channels=8, segment=1, samplerate=8_000).eval()
+        exportable = copy.deepcopy(model)
+        onnx_separator._make_exportable(exportable)
+        x = torch.randn(1, 2, 8_000)
+
+        with torch.no_grad():
+            z = HTDemucs._spec(model, x)
+            torch.testing.assert_close(exportable._spec(x), torch.view_as_real(z), atol=1e-4, rtol=1e-4)
+            torch.testing.assert_close(
+                exportable._ispec(torch.view_as_real(z), 8_000),
+                HTDemucs._ispec(model, z, 8_000),
+                atol=1e-4, rtol=1e-4,
+            )
+            torch.testing.assert_close(exportable(x), model(x), atol=1e-4, rtol=1e-4)
+
+
+class SeparateFileTest(unittest.TestCase):
+    def test_writes_demucs_cli_layout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_path = Path(tmp)
+            with patch.object(onnx_separator, "MODEL_DIR", tmp_path / "models"):
+                _, meta_path = onnx_separator.model_paths("htdemucs_6s")
+                meta_path.parent.mkdir(parents=True)
+                meta_path.write_text(
+                    '{"sources": ["vocals", "other"], "samplerate": 8000,'
+                    ' "audioChannels": 2, "segmentSamples": 2000}'
+                )
+                mix = np.full((2, 5_000), 0.25, dtype=np.float32)
+                with patch.object(onnx_separator, "decode_audio", return_value=mix):
+                    out_dir = onnx_separator.separate_file(
+                        tmp_path / "track_abc.mp3",
+                        tmp_path / "demucs-onnx",
+                        session=FakeSession(segment=2_000),
+                    )
+
+            self.assertEqual(out_dir, tmp_path / "demucs-onnx" / "htdemucs_6s" / "track_abc")
+            vocals, sr = sf.read(str(out_dir / "vocals.wav"))
+            self.assertEqual(sr, 8000)
+            self.assertEqual(vocals.shape, (5_000, 2))
+            self.assertTrue((out_dir / "other.wav").exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
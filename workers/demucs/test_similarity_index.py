@@ -0,0 +1,159 @@
+"""Tests for the catalog similarity index. Requires numpy."""
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import similarity_index
+from similarity_index import SimilarityIndex, key_distance, parse_key
+
+
+def _features(tempo, tonic=None, mode="minor", energy=0.1, onsets=3.0) -> dict:
+    return {
+        "schemaVersion": "stem-audio-features/v2",
+        "durationSeconds": 180.0,
+        "tempoBpm": tempo,
+        "key": {"tonic": tonic, "mode": mode, "confidence": 0.5} if tonic else None,
+        "energyRms": energy,
+        "onsetDensity": onsets,
+    }
+
+
+class KeyEncodingTest(unittest.TestCase):
+    def test_parses_dicts_and_strings(self):
+        self.assertEqual(parse_key({"tonic": "A", "mode": "minor"}), (9, 1))
+        self.assertEqual(parse_key("C# major"), (1, 0))
+        self.assertEqual(parse_key("A"), (9, -1))
+        self.assertEqual(parse_key(None), (-1, -1))
+        with self.assertRaises(ValueError):
+            parse_key("H minor")
+
+    def test_distance_on_the_circle_of_fifths(self):
+        a_minor, c_major, e_minor, g_major, f_sharp_major = (
+            parse_key(k) for k in ("A minor", "C major", "E minor", "G major", "F# major")
+        )
+        self.assertEqual(key_distance(*a_minor, *a_minor), 0)
+        self.assertEqual(key_distance(*a_minor, *c_major), 1)
+        self.assertEqual(key_distance(*a_minor, *e_minor), 1)
+        self.assertEqual(key_distance(*c_major, *g_major), 1)
+        self.assertEqual(key_distance(*c_major, *f_sharp_major), 6)
+
+
+class SimilarityIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SimilarityIndex()
+        self.index.add("r/t1/drums", _features(120.0, "A", energy=0.2))
+        self.index.add("r/t2/drums", _features(60.5, "A", energy=0.2))
+        self.index.add("r/t3/bass", _features(121.0, "C", "major", energy=0.15))
+        self.index.add("r/t4/vocals", _features(90.0, "F#", "major"))
+        self.index.add("r/t5/other", _features(None))
+
+    def test_tempo_range_includes_half_and_double_time(self):
+        ids = [row["stemId"] for row in self.index.find(tempo=(118, 122))]
+        strict = [row["stemId"] for row in self.index.find(tempo=(118, 122), half_double=False)]
+
+        self.assertEqual(sorted(ids), ["r/t1/drums", "r/t2/drums", "r/t3/bass"])
+        self.assertEqual(sorted(strict), ["r/t1/drums", "r/t3/bass"])
+
+    def test_key_and_energy_filters(self):
+        exact = self.index.find(tempo=(118, 122), key="A minor", energy=(0.1, None))
+        compatible = self.index.find(key="A minor", compatible_keys=True)
+
+        self.assertEqual([row["stemId"] for row in exact], ["r/t1/drums", "r/t2/drums"])
+        self.assertEqual(exact[0]["key"], {"tonic": "A", "mode": "minor"})
+        self.assertEqual([row["stemId"] for row in compatible], ["r/t1/drums", "r/t2/drums", "r/t3/bass"])
+
+    def test_nearest_ranks_by_tempo_key_and_energy(self):
+        matches = self.index.nearest(_features(119.0, "A", energy=0.2), exclude="r/t1/drums")
+
+        # Unknown tempo and key rank behind close matches, ahead of clear mismatches.
+        self.assertEqual(
+            [m["stemId"] for m in matches], ["r/t2/drums", "r/t3/bass", "r/t5/other", "r/t4/vocals"],
+        )
+        self.assertEqual(matches[0]["tempoRatio"], 2.0)
+
+    def test_weights_can_ignore_a_dimension(self):
+        matches = self.index.nearest(_features(90.0, "A", energy=0.2), weights={"tempo": 0}, limit=2)
+
+        self.assertEqual(sorted(m["stemId"] for m in matches), ["r/t1/drums", "r/t2/drums"])
+
+    def test_re_adding_replaces_the_row(self):
+        self.index.find()
+        self.index.add("r/t1/drums", _features(140.0, "A"))
+
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.features("r/t1/drums")["tempoBpm"], 140.0)
+        self.assertEqual(self.index.find(tempo=(118, 122), half_double=False)[0]["stemId"], "r/t3/bass")
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "similarity.npz"
+            self.index.add("r/t1/drums", _features(120.0, "A", energy=0.2))
+            self.index.save(path)
+            loaded = SimilarityIndex(path)
+
+            self.assertEqual(len(loaded), 5)
+            self.assertFalse(loaded.dirty)
+            self.assertEqual(loaded.find(key="A minor"), self.index.find(key="A minor"))
+            self.assertEqual(loaded.nearest(_features(120.0, "A")), self.index.nearest(_features(120.0, "A")))
+
+    def test_pending_rows_are_searched_until_merged(self):
+        with mock.patch.object(similarity_index, "PENDING_MERGE_ROWS", 3):
+            mixed = SimilarityIndex()
+            for stem_id in self.index._ids:
+                mixed.add(stem_id, self.index.features(stem_id))
+            self.assertEqual((len(mixed._live_rows), len(mixed._pending)), (3, 2))
+            self.assertEqual(len(self.index._live_rows), 0)
+            mixed.add("r/t1/drums", _features(140.0, "A"))
+            self.index.add("r/t1/drums", _features(140.0, "A"))
+
+        self.assertEqual(len(mixed._pending), 0)
+        for index in (self.index, mixed):
+            self.assertEqual(
+                [row["stemId"] for row in index.find(tempo=(118, 145), half_double=False)],
+                ["r/t3/bass", "r/t1/drums"],
+            )
+            self.assertEqual(index.nearest(_features(90.0, "F#", "major"))[0]["stemId"], "r/t4/vocals")
+        # The replaced row 0 stays in tempo order until save compacts it.
+        self.assertEqual(list(mixed._tempo_order), [1, 3, 0, 2, 5, 4])
+
+
+class IngestionTest(unittest.TestCase):
+    def test_result_messages_and_backfill_shards(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            shard = Path(tmp) / "features-00000.jsonl"
+            lines = [
+                {"releaseId": "rel", "trackId": "trk", "stem": "bass", "status": "success",
+                 "features": _features(100.0, "D")},
+                {"releaseId": "rel", "trackId": "trk", "stem": "drums", "status": "failed", "error": "not audio"},
+                {"releaseId": "rel", "trackId": "trk2", "stemFeatures": {
+                    "vocals": _features(128.0, "G", "major"), "other": None,
+                }},
+            ]
+            shard.write_text("\n".join(json.dumps(line) for line in lines) + "\n{\"trunc")
+            index = SimilarityIndex()
+
+            self.assertEqual(index.add_jsonl(shard), 2)
+            self.assertEqual(index.features("rel/trk/bass")["stem"], "bass")
+            self.assertEqual(index.features("rel/trk2/vocals")["key"], {"tonic": "G", "mode": "major"})
+
+    def test_cli_builds_and_queries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            shard = Path(tmp) / "features-00000.jsonl"
+            shard.write_text(json.dumps({
+                "releaseId": "rel", "trackId": "trk", "stemFeatures": {
+                    "bass": _features(100.0, "D"), "drums": _features(100.0, "D", energy=0.3),
+                },
+            }) + "\n")
+            index_path = Path(tmp) / "index.npz"
+
+            self.assertEqual(similarity_index.main(["build", str(index_path), str(shard)]), 0)
+            self.assertEqual(similarity_index.main(["query", str(index_path), "--like", "rel/trk/bass"]), 0)
+            self.assertEqual(similarity_index.main(["query", str(index_path), "--like", "rel/trk/none"]), 1)
+            self.assertEqual(len(SimilarityIndex(index_path)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Tests for the stem encode pass helpers (stdlib only)."""
+
+import math
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import unittest
+import wave
+from pathlib import Path
+
+from stem_encoding import (
+    LOUDNESS_FIELDS,
+    build_encode_command,
+    parse_loudness,
+    parse_renditions,
+)
+
+EBUR128_LOG = """\
+[Parsed_ebur128_0 @ 0x55d0] t: 2.9 TARGET:-23 LUFS M: -15.1 S: -16.0 I: -15.3 LUFS LRA: 0.0 LU
+[Parsed_ebur128_0 @ 0x55d0] Summary:
+
+  Integrated loudness:
+    I:         -16.4 LUFS
+    Threshold: -26.7 LUFS
+
+  Loudness range:
+    LRA:         4.7 LU
+    Threshold: -36.8 LUFS
+    LRA low:   -19.6 LUFS
+    LRA high:  -14.9 LUFS
+
+  True peak:
+    Peak:        0.3 dBFS
+"""
+
+
+class ParseLoudnessTest(unittest.TestCase):
+    def test_reads_the_final_summary_not_progress_lines(self):
+        self.assertEqual(
+            parse_loudness(EBUR128_LOG),
+            {"loudnessLufs": -16.4, "loudnessRangeLu": 4.7, "truePeakDbtp": 0.3},
+        )
+
+    def test_silence_and_missing_summary_degrade_to_none(self):
+        silence = EBUR128_LOG.replace("-16.4 LUFS", "-70.0 LUFS").replace("0.3 dBFS", "-inf dBFS")
+        loudness = parse_loudness(silence)
+        self.assertIsNone(loudness["loudnessLufs"])
+        self.assertIsNone(loudness["truePeakDbtp"])
+        self.assertEqual(parse_loudness("ffmpeg crashed"), dict.fromkeys(LOUDNESS_FIELDS))
+
+    def test_encode_command_meters_and_encodes_in_one_process(self):
+        command = build_encode_command(Path("vocals.wav"), Path("vocals.mp3"))
+        self.assertEqual(command[0], "ffmpeg")
+        graph = command[command.index("-filter_complex") + 1]
+        self.assertEqual(graph, "[0:a]asplit=2[meter][mp3];[meter]ebur128=peak=true:framelog=quiet,anullsink")
+        self.assertEqual(command[-4:], ["[mp3]", "-b:a", "320k", "vocals.mp3"])
+
+
+class RenditionCommandTest(unittest.TestCase):
+    def test_renditions_share_one_decode_and_metered_split(self):
+        command = build_encode_command(Path("out/vocals.wav"), Path("out/vocals.mp3"), ("opus", "hls"))
+        self.assertEqual(command.count("-i"), 1)
+        graph = command[command.index("-filter_complex") + 1]
+        # The meter is a side branch: the encoders get the audio at its source rate.
+        self.assertEqual(
+            graph, "[0:a]asplit=4[meter][r0][r1][mp3];[meter]ebur128=peak=true:framelog=quiet,anullsink",
+        )
+        self.assertIn("libopus", command)
+        self.assertIn("out/vocals.opus", command)
+        self.assertIn("out/vocals_hls/vocals.m3u8", command)
+        self.assertIn("out/vocals_hls/vocals_%03d.m4s", command)
+        self.assertEqual(command[-3:], ["-b:a", "320k", "out/vocals.mp3"])
+
+    def test_archive_is_mapped_from_the_unfiltered_input(self):
+        for renditions in ((), ("opus",)):
+            command = build_encode_command(
+                Path("out/vocals.wav"), Path("out/vocals.mp3"), renditions, Path("tmp/vocals.flac")
+            )
+            flac = command.index("tmp/vocals.flac")
+            self.assertEqual(command[flac - 6: flac], ["-map", "0:a", "-c:a", "flac", "-compression_level", "8"])
+            self.assertEqual(command.count("-i"), 1)
+            self.assertEqual(command[-1], "out/vocals.mp3")
+
+    def test_parse_renditions_drops_unknown_and_duplicates(self):
+        with self.assertLogs("stem_encoding", level="WARNING"):
+            self.assertEqual(parse_renditions(" Opus, flac ,hls,opus,"), ("opus", "hls"))
+
+
+def write_tone(path: Path, seconds: float = 3.0, rate: int = 44100, amplitude: float = 0.5) -> None:
+    """A stereo 16-bit 440 Hz sine, like a short Demucs stem."""
+    frames = bytearray()
+    for n in range(int(seconds * rate)):
+        sample = int(amplitude * 32767 * math.sin(2 * math.pi * 440 * n / rate))
+        frames += struct.pack("<hh", sample, sample)
+    with wave.open(str(path), "wb") as out:
+        out.setnchannels(2)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        out.writeframes(bytes(frames))
+
+
+def sample_rate(path: Path) -> int:
+    """Sample rate of the first audio stream, from ffmpeg's input summary."""
+    probe = subprocess.run(["ffmpeg", "-hide_banner", "-i", str(path)], capture_output=True, text=True)
+    return int(re.search(r"Audio: .*?, (\d+) Hz", probe.stderr).group(1))
+
+
+@unittest.skipUnless(shutil.which("ffmpeg"), "needs ffmpeg")
+class EncodeWithFfmpegTest(unittest.TestCase):
+    def test_outputs_keep_the_source_rate_and_loudness_is_metered(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "vocals.wav"
+            write_tone(source)
+            mp3 = Path(tmp) / "vocals.mp3"
+
+            result = subprocess.run(
+                build_encode_command(source, mp3, ("aac",)), capture_output=True, text=True,
+            )
+
+            self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+            self.assertEqual(sample_rate(mp3), 44100)
+            self.assertEqual(sample_rate(mp3.with_suffix(".m4a")), 44100)
+            loudness = parse_loudness(result.stderr)
+            # A -6 dBFS sine in both channels: about -6.7 LUFS, true peak -6 dBTP.
+            self.assertAlmostEqual(loudness["loudnessLufs"], -6.7, delta=1.0)
+            self.assertAlmostEqual(loudness["truePeakDbtp"], -6.0, delta=1.0)
+            self.assertIsNotNone(loudness["loudnessRangeLu"])
+            self.assertNotIn("TARGET:", result.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+import stem_mixer
+from stem_mixer import LocalMixStore, MixCache, mix_key, mix_raw, parse_mix_spec
+
+
+def write_raw(path: Path, samples) -> Path:
+    np.asarray(samples, dtype=np.float32).reshape(-1, stem_mixer.CHANNELS).tofile(path)
+    return path
+
+
+def read_raw(path: Path):
+    return np.fromfile(path, dtype=np.float32).reshape(-1, stem_mixer.CHANNELS)
+
+
+class MixSpecTest(unittest.TestCase):
+    STEMS = ("vocals", "drums", "bass")
+
+    def test_list_means_unity_gain_and_order_is_canonical(self):
+        self.assertEqual(parse_mix_spec(["drums", "bass"], self.STEMS), {"bass": 0.0, "drums": 0.0})
+        self.assertEqual(
+            mix_key("r", "t", parse_mix_spec({"drums": 0, "bass": -3}, self.STEMS)),
+            mix_key("r", "t", parse_mix_spec({"bass": -3.0, "drums": 0.0}, self.STEMS)),
+        )
+
+    def test_key_changes_with_gains_track_and_sources(self):
+        base = mix_key("r", "t", {"bass": 0.0})
+        self.assertNotEqual(base, mix_key("r", "t", {"bass": -1.0}))
+        self.assertNotEqual(base, mix_key("r", "t2", {"bass": 0.0}))
+        self.assertNotEqual(base, mix_key("r", "t", {"bass": 0.0}, {"bass": "abc"}))
+
+    def test_rejects_unknown_stems_bad_gains_and_empty_mixes(self):
+        for spec in ({"piano": 0}, {"bass": "loud"}, {"bass": True}, {"bass": 40}, [], {}, None):
+            with self.assertRaises(ValueError):
+                parse_mix_spec(spec, self.STEMS)
+
+
+class MixRawTest(unittest.TestCase):
+    def test_applies_db_gains_and_zero_pads_shorter_stems(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            sources = {
+                "drums": write_raw(tmp / "drums.f32", [0.25] * 8),
+                "bass": write_raw(tmp / "bass.f32", [0.5] * 4),
+            }
+            stats = mix_raw(sources, {"drums": 0.0, "bass": -6.0206}, tmp / "mix.f32")
+            mixed = read_raw(tmp / "mix.f32")
+
+        self.assertEqual(stats["frames"], 4)
+        np.testing.assert_allclose(mixed[:2], 0.5, atol=1e-4)
+        np.testing.assert_allclose(mixed[2:], 0.25, atol=1e-6)
+        self.assertEqual(stats["clippedSamples"], 0)
+
+    def test_mixes_across_chunk_boundaries_and_clips_overs(self):
+        frames = 10
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            ramp = np.linspace(0, 0.9, frames * 2)
+            sources = {"a": write_raw(tmp / "a.f32", ramp), "b": write_raw(tmp / "b.f32", ramp)}
+            original = stem_mixer.CHUNK_FRAMES
+            stem_mixer.CHUNK_FRAMES = 3
+            try:
+                stats = mix_raw(sources, {"a": 0.0, "b": 0.0}, tmp / "mix.f32")
+            finally:
+                stem_mixer.CHUNK_FRAMES = original
+            mixed = read_raw(tmp / "mix.f32").ravel()
+
+        np.testing.assert_allclose(mixed, np.clip(ramp * 2, -1, 1), atol=1e-6)
+        self.assertEqual(stats["clippedSamples"], int(np.count_nonzero(ramp * 2 > 1)))
+        self.assertAlmostEqual(stats["peak"], 1.8, places=4)
+
+
+class MixCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used_past_the_byte_budget(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            cache = MixCache(LocalMixStore(tmp / "mixes", uri_prefix="mixes/"), max_bytes=250)
+            now = time.time()
+            for age, key in ((30, "old"), (20, "used")):
+                src = tmp / f"{key}.mp3"
+                src.write_bytes(b"x" * 100)
+                cache.put(key, src)
+                os.utime(tmp / "mixes" / f"{key}.mp3", (now - age, now - age))
+            self.assertEqual(cache.get("used"), "mixes/used.mp3")  # refreshes recency
+
+            (tmp / "recent.mp3").write_bytes(b"x" * 100)
+            self.assertEqual(cache.put("recent", tmp / "recent.mp3"), "mixes/recent.mp3")
+
+            self.assertIsNone(cache.get("old"))
+            self.assertEqual(sorted(p.stem for p in (tmp / "mixes").glob("*.mp3")), ["recent", "used"])
+
+    def test_newest_entry_is_kept_even_when_larger_than_the_budget(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            cache = MixCache(LocalMixStore(tmp / "mixes"), max_bytes=10)
+            src = tmp / "big.mp3"
+            src.write_bytes(b"x" * 100)
+            cache.put("big", src)
+            self.assertEqual(cache.get("big"), "big.mp3")
+
+
+if __name__ == "__main__":
+    unittest.main()
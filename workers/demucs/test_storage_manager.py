@@ -0,0 +1,136 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from collections import namedtuple
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from storage_manager import ScratchSpace, ScratchSpaceFull, trim_outputs
+
+MB = 2**20
+DiskUsage = namedtuple("DiskUsage", "total used free")
+
+
+class FakeDisk:
+    """shutil.disk_usage stand-in whose free space the test controls."""
+
+    def __init__(self, free: int):
+        self.free = free
+
+    def __call__(self, path):
+        return DiskUsage(10 * self.free, 0, self.free)
+
+
+def write(path: Path, size: int, mtime: float = None) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"\0" * size)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+class ScratchSpaceTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name) / "scratch"
+        self.disk = FakeDisk(free=1000 * MB)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_job_directory_lives_under_root_and_is_removed(self):
+        scratch = ScratchSpace(self.root, disk_usage=self.disk)
+
+        with scratch.job(prefix="pubsub-") as temp_dir:
+            write(Path(temp_dir) / "track.wav", 1000)
+            self.assertEqual(Path(temp_dir).parent, self.root)
+            self.assertEqual(scratch.usage()["jobs"], {Path(temp_dir).name: 1000})
+
+        self.assertEqual(list(self.root.iterdir()), [])
+        self.assertEqual(scratch.usage()["jobs"], {})
+
+    def test_refuses_jobs_that_would_cross_the_free_space_floor(self):
+        scratch = ScratchSpace(self.root, min_free_bytes=200 * MB, job_reserve_bytes=300 * MB, disk_usage=self.disk)
+
+        first = scratch.mkdtemp()
+        second = scratch.mkdtemp()
+        # 1000 free - 2 x 300 reserved leaves 400: a third job would leave 100.
+        with self.assertRaises(ScratchSpaceFull):
+            scratch.mkdtemp()
+
+        scratch.release(first)
+        scratch.mkdtemp()
+        self.assertFalse(Path(first).exists())
+        self.assertTrue(Path(second).exists())
+
+    def test_written_bytes_count_against_the_reservation_once(self):
+        scratch = ScratchSpace(self.root, min_free_bytes=0, job_reserve_bytes=600, disk_usage=self.disk)
+        self.disk.free = 1000
+        running = scratch.mkdtemp()
+        write(Path(running) / "stems.wav", 500)
+        # The 500 written bytes already left free space; 100 are still owed.
+        self.disk.free = 500
+
+        scratch.mkdtemp(reserve_bytes=400)
+        with self.assertRaises(ScratchSpaceFull):
+            scratch.mkdtemp(reserve_bytes=1)
+
+    def test_concurrent_admission_does_not_overcommit(self):
+        scratch = ScratchSpace(self.root, job_reserve_bytes=100 * MB, disk_usage=self.disk)
+        admitted = []
+
+        def admit():
+            try:
+                admitted.append(scratch.mkdtemp())
+            except ScratchSpaceFull:
+                pass
+
+        threads = [threading.Thread(target=admit) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(admitted), 10)
+
+
+class TrimOutputsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_evicts_least_recently_written_tracks_past_the_cap(self):
+        for index, track in enumerate(("rel1/trk1", "rel1/trk2", "rel2/trk3", "rel2/trk4")):
+            write(self.root / track / "vocals.mp3", 1000, mtime=1000 + index)
+
+        evicted = trim_outputs(self.root, max_bytes=3000)
+
+        # Trimmed to 90% of the cap: two tracks go, oldest first.
+        self.assertEqual(evicted, ["rel1/trk1", "rel1/trk2"])
+        self.assertFalse((self.root / "rel1").exists())
+        self.assertTrue((self.root / "rel2" / "trk3" / "vocals.mp3").exists())
+        self.assertEqual(trim_outputs(self.root, max_bytes=3000), [])
+
+    def test_caches_archives_and_kept_tracks_are_never_evicted(self):
+        write(self.root / ".feature-cache" / "k.json", 5000, mtime=1)
+        write(self.root / ".checkpoints" / "job.json", 5000, mtime=1)
+        write(self.root / "mixes" / "m.mp3", 5000, mtime=1)
+        write(self.root / "archive" / "a.flac", 5000, mtime=1)
+        write(self.root / "fingerprints.npz", 5000, mtime=1)
+        write(self.root / "rel" / "old" / "vocals.mp3", 1000, mtime=2)
+        write(self.root / "rel" / "new" / "vocals.mp3", 1000, mtime=3)
+
+        evicted = trim_outputs(self.root, max_bytes=500, protected=("mixes", "archive"), keep=("rel/old",))
+
+        self.assertEqual(evicted, ["rel/new"])
+        for kept in (".feature-cache", ".checkpoints", "mixes", "archive", "fingerprints.npz", "rel/old"):
+            self.assertTrue((self.root / kept).exists(), kept)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Tests for multi-resolution waveform peak files. Requires numpy + soundfile."""
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import soundfile as sf
+
+import waveform_peaks
+from waveform_peaks import BASE_SAMPLES_PER_PIXEL, read_peaks, write_peaks
+
+SR = 22050
+
+
+class WaveformPeaksTest(unittest.TestCase):
+    def _write(self, tmp: str, samples: np.ndarray) -> Path:
+        path = Path(tmp) / "stem.wav"
+        sf.write(str(path), samples, SR)
+        return path
+
+    def test_levels_halve_and_track_extremes(self):
+        samples = np.zeros((SR * 2, 2), dtype=np.float32)
+        samples[1000, 0] = 0.5
+        samples[30000, 1] = -1.0
+        with tempfile.TemporaryDirectory() as tmp:
+            peaks_path = write_peaks(self._write(tmp, samples), Path(tmp) / "stem.peaks", bits=16)
+            header, base = read_peaks(peaks_path)
+            _, coarse = read_peaks(peaks_path, samples_per_pixel=4096)
+
+        self.assertEqual(header["sampleRate"], SR)
+        self.assertEqual(header["frames"], SR * 2)
+        self.assertEqual(len(base), int(np.ceil(SR * 2 / BASE_SAMPLES_PER_PIXEL)))
+        spps = [level["samplesPerPixel"] for level in header["levels"]]
+        self.assertEqual(spps[:3], [256, 512, 1024])
+        self.assertEqual(base[1000 // 256, 1], round(0.5 * 32767))
+        self.assertEqual(base[30000 // 256, 0], -32767)
+        self.assertEqual(len(coarse), int(np.ceil(len(base) / 16)))
+        self.assertEqual(coarse[:, 0].min(), -32767)
+
+    def test_streaming_blocks_match_single_block(self):
+        rng = np.random.default_rng(29)
+        samples = (rng.standard_normal(SR * 3) * 0.2).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            src = self._write(tmp, samples)
+            whole = waveform_peaks.compute_peaks(src)[1][0]
+            with patch.object(waveform_peaks, "BLOCK_FRAMES", 1000):
+                streamed = waveform_peaks.compute_peaks(src)[1][0]
+
+        np.testing.assert_array_equal(whole, streamed)
+
+    def test_eight_bit_file_is_compact(self):
+        samples = np.zeros(SR * 60, dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            peaks_path = write_peaks(self._write(tmp, samples), Path(tmp) / "stem.peaks")
+            size = peaks_path.stat().st_size
+        # 60 s at 22.05 kHz: ~5.2k base pixels x 2 bytes, plus halving levels.
+        self.assertLess(size, 25_000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from worker_metrics import Counter, Gauge, Histogram, Registry
+
+
+class WorkerMetricsTest(unittest.TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = Histogram("phase_seconds", "Phase time.", ("phase",), buckets=(1.0, 5.0))
+        histogram.observe(0.5, phase="download")
+        histogram.observe(3.0, phase="download")
+        registry = Registry()
+        registry.register(histogram)
+
+        text = registry.render()
+
+        self.assertIn('phase_seconds_bucket{phase="download",le="1"} 1', text)
+        self.assertIn('phase_seconds_bucket{phase="download",le="5"} 2', text)
+        self.assertIn('phase_seconds_bucket{phase="download",le="+Inf"} 2', text)
+        self.assertIn('phase_seconds_sum{phase="download"} 3.5', text)
+        self.assertIn('phase_seconds_count{phase="download"} 2', text)
+
+    def test_counter_rejects_unknown_labels_and_decrements(self):
+        counter = Counter("jobs_total", "Jobs.", ("status",))
+        counter.inc(status="completed")
+        with self.assertRaises(ValueError):
+            counter.inc(device="cpu")
+        with self.assertRaises(ValueError):
+            counter.inc(-1, status="completed")
+        self.assertEqual(counter.get(status="completed"), 1)
+
+    def test_gauge_tracks_in_progress_work_through_failures(self):
+        gauge = Gauge("in_flight", "In flight.", ("source",))
+        with self.assertRaises(RuntimeError):
+            with gauge.track_inprogress(source="pubsub"):
+                self.assertEqual(gauge.get(source="pubsub"), 1)
+                raise RuntimeError("boom")
+        self.assertEqual(gauge.get(source="pubsub"), 0)
+
+    def test_label_values_are_escaped(self):
+        counter = Counter("errors_total", "Errors.", ("reason",))
+        counter.inc(reason='bad "quote"\n')
+        registry = Registry()
+        registry.register(counter)
+        self.assertIn('errors_total{reason="bad \\"quote\\"\\n"} 1', registry.render())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""Multi-resolution waveform peak files for stems.
+
+The stem editor draws waveforms; without precomputed peaks the browser has
+to download and decode every MP3 first. The worker already holds each
+decoded stem WAV, so it writes a small peaks file next to the MP3 instead.
+
+File layout (little-endian):
+
+    b"RSPK"                 magic
+    uint32                  header length in bytes
+    header                  UTF-8 JSON (see `write_peaks`)
+    level 0 data            interleaved (min, max) pairs, int8 or int16
+    level 1 data ...
+
+Each level halves the resolution of the previous one, so a client picks the
+level closest to its pixels-per-second and never touches the audio. Values
+are mono (min/max across channels) scaled to the full int range.
+"""
+
+import json
+import struct
+from pathlib import Path
+from typing import Optional, Union
+
+MAGIC = b"RSPK"
+FORMAT_VERSION = 1
+BASE_SAMPLES_PER_PIXEL = 256
+LEVELS = 6  # 256 … 8192 samples per pixel
+BLOCK_FRAMES = BASE_SAMPLES_PER_PIXEL * 4096
+CONTENT_TYPE = "application/octet-stream"
+
+
+def _base_level(path: Union[str, Path]):
+    """Stream the file in blocks → (mins, maxs, sample_rate, frames)."""
+    import numpy as np
+    import soundfile as sf
+
+    mins, maxs = [], []
+    carry_min = carry_max = np.zeros(0, dtype=np.float32)
+    with sf.SoundFile(str(path)) as audio:
+        sample_rate, frames = audio.samplerate, audio.frames
+        for block in audio.blocks(blocksize=BLOCK_FRAMES, dtype="float32", always_2d=True):
+            lo = np.concatenate([carry_min, block.min(axis=1)])
+            hi = np.concatenate([carry_max, block.max(axis=1)])
+            whole = len(lo) // BASE_SAMPLES_PER_PIXEL * BASE_SAMPLES_PER_PIXEL
+            if whole:
+                mins.append(lo[:whole].reshape(-1, BASE_SAMPLES_PER_PIXEL).min(axis=1))
+                maxs.append(hi[:whole].reshape(-1, BASE_SAMPLES_PER_PIXEL).max(axis=1))
+            carry_min, carry_max = lo[whole:], hi[whole:]
+        if carry_min.size:
+            mins.append(carry_min.min(keepdims=True))
+            maxs.append(carry_max.max(keepdims=True))
+
+    if not mins:
+        empty = np.zeros(0, dtype=np.float32)
+        return empty, empty, sample_rate, frames
+    return np.concatenate(mins), np.concatenate(maxs), sample_rate, frames
+
+
+def _halve(mins, maxs):
+    import numpy as np
+
+    if len(mins) % 2:
+        mins = np.append(mins, mins[-1])
+        maxs = np.append(maxs, maxs[-1])
+    return mins.reshape(-1, 2).min(axis=1), maxs.reshape(-1, 2).max(axis=1)
+
+
+def compute_peaks(path: Union[str, Path], bits: int = 8, levels: int = LEVELS):
+    """Return (header, [interleaved min/max arrays per level])."""
+    import numpy as np
+
+    if bits not in (8, 16):
+        raise ValueError(f"bits must be 8 or 16, got {bits}")
+    dtype = np.int8 if bits == 8 else np.int16
+    scale = float(np.iinfo(dtype).max)
+
+    mins, maxs, sample_rate, frames = _base_level(path)
+    header = {
+        "version": FORMAT_VERSION,
+        "sampleRate": int(sample_rate),
+        "frames": int(frames),
+        "bits": bits,
+        "levels": [],
+    }
+    data = []
+    offset = 0
+    for level in range(levels):
+        pairs = np.empty(len(mins) * 2, dtype=dtype)
+        pairs[0::2] = np.round(np.clip(mins, -1.0, 1.0) * scale)
+        pairs[1::2] = np.round(np.clip(maxs, -1.0, 1.0) * scale)
+        header["levels"].append({
+            "samplesPerPixel": BASE_SAMPLES_PER_PIXEL << level,
+            "length": int(len(mins)),
+            "offset": offset,
+        })
+        data.append(pairs)
+        offset += pairs.nbytes
+        if len(mins) <= 1:
+            break
+        mins, maxs = _halve(mins, maxs)
+    return header, data
+
+
+def write_peaks(src: Union[str, Path], dest: Union[str, Path], bits: int = 8) -> Path:
+    """Compute peaks for `src` and write the binary peaks file to `dest`.
+
+    Level offsets in the header are relative to the end of the header.
+    """
+    header, data = compute_peaks(src, bits=bits)
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    dest = Path(dest)
+    with open(dest, "wb") as handle:
+        handle.write(MAGIC)
+        handle.write(struct.pack("<I", len(encoded)))
+        handle.write(encoded)
+        for pairs in data:
+            handle.write(pairs.astype(pairs.dtype.newbyteorder("<")).tobytes())
+    return dest
+
+
+def read_peaks(path: Union[str, Path], samples_per_pixel: Optional[int] = None):
+    """Return (header, (length, 2) min/max array) for the closest level."""
+    import numpy as np
+
+    raw = Path(path).read_bytes()
+    if raw[:4] != MAGIC:
+        raise ValueError(f"{path} is not a peaks file")
+    (header_len,) = struct.unpack("<I", raw[4:8])
+    header = json.loads(raw[8: 8 + header_len])
+    levels = header["levels"]
+    if samples_per_pixel is None:
+        level = levels[0]
+    else:
+        level = min(levels, key=lambda lv: abs(lv["samplesPerPixel"] - samples_per_pixel))
+    dtype = np.dtype("<i1" if header["bits"] == 8 else "<i2")
+    start = 8 + header_len + level["offset"]
+    pairs = np.frombuffer(raw, dtype=dtype, count=level["length"] * 2, offset=start)
+    return header, pairs.reshape(-1, 2)
@@ -0,0 +1,294 @@
+"""Prometheus-style metrics for the Demucs worker.
+
+A deliberately small, dependency-free registry (counters, gauges,
+histograms with fixed label names) rendered in the Prometheus text
+exposition format by `GET /metrics`. Job phases are timed with
+`observe_phase`, so a throughput drop can be pinned to download,
+fingerprint, separation (per device), encode, features, upload or publish.
+
+Inside `track_job`, the same `observe_phase` calls also accumulate a
+per-job breakdown (`JobTimings`) that the worker ships in its result
+message, so latency can be attributed per track and not just in aggregate.
+Child-process rusage (`record_child`, see child_usage.py) lands in the same
+job record and in the child CPU/RSS metrics.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+PHASE_BUCKETS = (
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+    120.0, 300.0, 600.0, 1200.0, 1800.0, 3600.0,
+)
+RSS_MB_BUCKETS = (64.0, 128.0, 256.0, 512.0, 1024.0, 2048.0, 4096.0, 8192.0, 16384.0)
+QUEUE_WAIT_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0, 7200.0, 14400.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict = {}
+
+    def _key(self, labels: dict) -> tuple:
+        unknown = set(labels) - set(self.labelnames)
+        if unknown:
+            raise ValueError(f"{self.name}: unknown labels {sorted(unknown)}")
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    @contextmanager
+    def track_inprogress(self, **labels) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = PHASE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+        return entry[0][-1] if entry else 0
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self._header()
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+PHASE_SECONDS = REGISTRY.register(Histogram(
+    "demucs_worker_phase_seconds",
+    "Wall-clock seconds spent per job phase.",
+    ("phase", "device"),
+))
+JOBS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "demucs_worker_jobs_in_flight",
+    "Jobs currently being processed.",
+    ("source",),
+))
+JOBS_TOTAL = REGISTRY.register(Counter(
+    "demucs_worker_jobs_total",
+    "Finished jobs by outcome (completed, quarantined, failed).",
+    ("source", "status"),
+))
+CPU_FALLBACKS = REGISTRY.register(Counter(
+    "demucs_worker_cpu_fallbacks_total",
+    "Separation attempts retried on CPU after a failure.",
+    ("from_device",),
+))
+SEPARATION_TIMEOUTS = REGISTRY.register(Counter(
+    "demucs_worker_separation_timeouts_total",
+    "Separation attempts killed by the watchdog, by reason (stall, budget).",
+    ("device", "reason"),
+))
+SCRATCH_REFUSALS = REGISTRY.register(Counter(
+    "demucs_worker_scratch_refusals_total",
+    "Jobs refused because scratch space was low, by source (http, pubsub).",
+    ("source",),
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "demucs_worker_cache_lookups_total",
+    "Cache lookups by cache and result (hit, miss).",
+    ("cache", "result"),
+))
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "demucs_worker_queue_wait_seconds",
+    "Seconds from publish to the start of processing, per Pub/Sub job.",
+    ("subscription",),
+    buckets=QUEUE_WAIT_BUCKETS,
+))
+CHILD_CPU_SECONDS = REGISTRY.register(Counter(
+    "demucs_worker_child_cpu_seconds_total",
+    "User+system CPU seconds used by child processes.",
+    ("command", "phase"),
+))
+CHILD_PEAK_RSS_MB = REGISTRY.register(Histogram(
+    "demucs_worker_child_peak_rss_mb",
+    "Peak resident set size of each child process, in MiB.",
+    ("command", "phase"),
+    buckets=RSS_MB_BUCKETS,
+))
+
+
+class JobTimings:
+    """Phase-timing breakdown for one job, as published in `timings`."""
+
+    def __init__(self, queue_wait_seconds: Optional[float] = None):
+        self.started = time.monotonic()
+        self.queue_wait_seconds = queue_wait_seconds
+        self.phases: dict[str, float] = {}
+        self.separation_attempts: list[dict] = []
+        self.children: list[dict] = []
+
+    def record(self, phase: str, device: Optional[str], seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        if phase == "separation":
+            self.separation_attempts.append({"device": device, "seconds": round(seconds, 3)})
+
+    def as_dict(self) -> dict:
+        queue_wait = self.queue_wait_seconds
+        return {
+            "queueWaitSeconds": round(queue_wait, 3) if queue_wait is not None else None,
+            "totalSeconds": round(time.monotonic() - self.started, 3),
+            "phases": {phase: round(seconds, 3) for phase, seconds in self.phases.items()},
+            "separationAttempts": list(self.separation_attempts),
+        }
+
+    def resource_usage(self) -> dict:
+        """Child-process CPU/peak RSS, as published in `resourceUsage`."""
+        return {
+            "childCpuSeconds": round(sum(
+                child["cpuUserSeconds"] + child["cpuSystemSeconds"] for child in self.children
+            ), 3),
+            "childPeakRssMb": max((child["maxRssMb"] for child in self.children), default=None),
+            "children": list(self.children),
+        }
+
+
+_current_job: ContextVar[Optional[JobTimings]] = ContextVar("demucs_job_timings", default=None)
+
+
+@contextmanager
+def track_job(queue_wait_seconds: Optional[float] = None) -> Iterator[JobTimings]:
+    """Collect `observe_phase` timings for the job running in this context."""
+    timings = JobTimings(queue_wait_seconds)
+    token = _current_job.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_job.reset(token)
+
+
+def record_child(usage: dict, phase: str) -> None:
+    """Account one child_usage report to the metrics and the current job."""
+    command = usage.get("command", "")
+    cpu = usage.get("cpuUserSeconds", 0.0) + usage.get("cpuSystemSeconds", 0.0)
+    CHILD_CPU_SECONDS.inc(cpu, command=command, phase=phase)
+    CHILD_PEAK_RSS_MB.observe(usage.get("maxRssMb", 0.0), command=command, phase=phase)
+    job = _current_job.get()
+    if job is not None:
+        job.children.append({"phase": phase, **usage})
+
+
+@contextmanager
+def observe_phase(phase: str, device: Optional[str] = None) -> Iterator[None]:
+    """Time a job phase into PHASE_SECONDS (recorded on success or failure)."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        PHASE_SECONDS.observe(elapsed, phase=phase, device=device or "")
+        job = _current_job.get()
+        if job is not None:
+            job.record(phase, device, elapsed)